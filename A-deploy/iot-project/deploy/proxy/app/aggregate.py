@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+边缘预聚合 - Gateway Proxy 按 metric 计算滚动窗口（tumbling window）聚合，发布到 env/agg/<interval>/<metric>
+
+UI 和慢速订阅端不需要每个原始点，订阅 1 小时（或 1 分钟、1 天）的聚合即可：
+
+- 窗口按 ts 划分：[k × interval, (k + 1) × interval)，从 1970-01-01 起对齐（ts 不带时区时按 UTC）
+- 每个窗口只保存一个累加器：点数、非空值个数、最小、最大、总和、ts 最大的点的值（last），
+  每个点对每个 interval 只做一次字典查找和几次比较 / 加法，O(1)，不保存原始点
+- 窗口由 ts 水位线关闭：水位线 = 该 metric 已见过的最大 ts - AGG_MAX_LATENESS（秒，按 ts 计），
+  窗口结束时间不晚于水位线时发布并丢弃累加器；之后才到、落在已关闭窗口中的点只计入 late，不再改变已发布的聚合
+- 停止时仍未关闭的窗口带 "partial": true 发布
+
+payload：{"ts": 窗口开始, "end": 窗口结束, "count": 点数, "min", "max", "mean", "last"}，
+value 为 null 的点计入 count，不参与 min / max / mean；窗口内没有非空值时这几项为 null。
+publish 回调在不持有锁时调用；同一次 add 关闭的窗口按开始时间顺序发布。
+"""
+
+import re
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from reorder import ts_seconds
+
+_EPOCH = datetime(1970, 1, 1)
+_INTERVAL_PATTERN = re.compile(r"(\d+)([smhd])")
+_UNIT_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def parse_intervals(spec: str) -> Dict[str, int]:
+    """"1m,1h" → {"1m": 60, "1h": 3600}（按长度排序）；格式不对的项抛出 ValueError"""
+    intervals = {}
+    for label in (part.strip().lower() for part in spec.split(",")):
+        if not label:
+            continue
+        match = _INTERVAL_PATTERN.fullmatch(label)
+        if match is None or int(match.group(1)) == 0:
+            raise ValueError(f"Invalid aggregation interval '{label}' (expected e.g. 30s, 1m, 1h, 1d)")
+        intervals[label] = int(match.group(1)) * _UNIT_SECONDS[match.group(2)]
+    return dict(sorted(intervals.items(), key=lambda item: item[1]))
+
+
+def format_ts(seconds: float) -> str:
+    return (_EPOCH + timedelta(seconds=seconds)).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+class _Window:
+    """一个窗口的累加器"""
+
+    __slots__ = ("count", "values", "min", "max", "sum", "last_key", "last")
+
+    def __init__(self):
+        self.count = 0
+        self.values = 0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self.sum = 0.0
+        self.last_key = float("-inf")
+        self.last: Any = None
+
+    def add(self, key: float, value) -> None:
+        self.count += 1
+        if key >= self.last_key:
+            self.last_key = key
+            self.last = value
+        if value is None:
+            return
+        self.values += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def payload(self, start: float, seconds: int, partial: bool = False) -> Dict[str, Any]:
+        payload = {
+            "ts": format_ts(start),
+            "end": format_ts(start + seconds),
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "mean": round(self.sum / self.values, 6) if self.values else None,
+            "last": self.last,
+        }
+        if partial:
+            payload["partial"] = True
+        return payload
+
+
+class _Series:
+    """一个 (metric, interval) 的未关闭窗口"""
+
+    __slots__ = ("windows", "next_close")
+
+    def __init__(self):
+        # 窗口开始（秒）→ 累加器
+        self.windows: Dict[float, _Window] = {}
+        # 未关闭窗口中最早的结束时间（水位线越过它时才需要查找要关闭的窗口）
+        self.next_close = float("inf")
+
+
+class WindowAggregator:
+    """
+    按 metric 的滚动窗口聚合
+
+    intervals: {标签: 秒数}，见 parse_intervals
+    max_lateness: 水位线落后已见最大 ts 的秒数
+    publish: publish(label, metric, payload) 发布一个窗口的聚合
+    """
+
+    def __init__(self, intervals: Dict[str, int], max_lateness: float, publish: Callable[[str, str, dict], None]):
+        self.intervals = dict(intervals)
+        self.max_lateness = max(0.0, max_lateness)
+        self.publish = publish
+        self._lock = threading.Lock()
+        self._series: Dict[str, List[Tuple[str, int, _Series]]] = {}
+        self._max_key: Dict[str, float] = {}
+
+        # 统计（按 interval 标签）
+        self.published = dict.fromkeys(self.intervals, 0)
+        self.late = dict.fromkeys(self.intervals, 0)
+
+    def add(self, metric: str, ts: str, value) -> None:
+        key = ts_seconds(ts)
+        if key is None:
+            return
+        closed = []
+        with self._lock:
+            series = self._series.get(metric)
+            if series is None:
+                series = self._series[metric] = [
+                    (label, seconds, _Series()) for label, seconds in self.intervals.items()
+                ]
+            max_key = self._max_key.get(metric)
+            if max_key is None or key > max_key:
+                max_key = self._max_key[metric] = key
+            watermark = max_key - self.max_lateness
+            for label, seconds, state in series:
+                start = key - key % seconds
+                window = state.windows.get(start)
+                if window is None:
+                    if start + seconds <= watermark:
+                        # 所在窗口已经关闭（已发布或本来就在水位线之后才出现）
+                        self.late[label] += 1
+                        continue
+                    window = state.windows[start] = _Window()
+                    if start + seconds < state.next_close:
+                        state.next_close = start + seconds
+                window.add(key, value)
+                if state.next_close <= watermark:
+                    closed += self._close(label, seconds, state, watermark)
+        for label, payload in closed:
+            self.publish(label, metric, payload)
+
+    def _close(self, label: str, seconds: int, state: _Series, watermark: float):
+        """关闭结束时间不晚于水位线的窗口（调用方持有锁），返回 [(标签, payload)]"""
+        closed = []
+        for start in sorted(start for start in state.windows if start + seconds <= watermark):
+            closed.append((label, state.windows.pop(start).payload(start, seconds)))
+        self.published[label] += len(closed)
+        state.next_close = min(state.windows, default=float("inf")) + seconds
+        return closed
+
+    def flush(self) -> None:
+        """发布所有未关闭的窗口（带 "partial": true）"""
+        closed = []
+        with self._lock:
+            for metric, series in self._series.items():
+                for label, seconds, state in series:
+                    for start in sorted(state.windows):
+                        closed.append((metric, label, state.windows[start].payload(start, seconds, partial=True)))
+                    self.published[label] += len(state.windows)
+                    state.windows.clear()
+                    state.next_close = float("inf")
+        for metric, label, payload in closed:
+            self.publish(label, metric, payload)
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        """interval 标签 → 已发布窗口数、迟到点数、当前未关闭的窗口数"""
+        with self._lock:
+            return {
+                label: {
+                    "published": self.published[label],
+                    "late": self.late[label],
+                    "open": sum(
+                        len(state.windows)
+                        for series in self._series.values()
+                        for series_label, _, state in series
+                        if series_label == label
+                    ),
+                }
+                for label in self.intervals
+            }
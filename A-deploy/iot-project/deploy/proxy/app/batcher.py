@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+输出微批 - Gateway Proxy 按 metric 攒批后发布到 env/batch/<metric>
+
+每个 metric 一个缓冲区，满足任一条件即发布：
+1. 缓冲区中的点数达到 BATCH_MAX_SIZE（在收消息的线程里直接发布）
+2. 缓冲区中最早的点已等待 BATCH_LINGER_MS（由后台线程按最近的截止时间唤醒发布）
+
+所以每个点在代理内最多多等 BATCH_LINGER_MS；流量大时批次由大小触发，几乎不增加延迟。
+缓冲区中的元素由调用方决定（main.py 中是 (清洗后的点, 接收时间)），publish 回调收到按到达顺序排列的列表，
+由它编码成批次 payload（清洗后的点组成的 JSON 数组 [{"ts": ..., "value": ...}, ...]）。
+
+publish 回调可能在收消息线程或后台线程中被调用（paho 的 publish 是线程安全的），
+调用时不持有锁；同一 metric 的两个批次可能乱序到达，collector 按 (metric, ts) 写入，不受影响。
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class MicroBatcher:
+    """
+    按 metric 攒批
+
+    max_size: 每批最多的点数
+    linger_ms: 一批中最早的点最多等待的毫秒数
+    publish: publish(metric, items) 发布一批
+    """
+
+    def __init__(self, max_size: int, linger_ms: float, publish: Callable[[str, List[Any]], None]):
+        self.max_size = max(1, max_size)
+        self.linger = max(0.0, linger_ms) / 1000
+        self.publish = publish
+        self._cond = threading.Condition()
+        self._pending: Dict[str, List[Any]] = {}
+        # metric → 该批的发布截止时间（time.monotonic()）
+        self._deadlines: Dict[str, float] = {}
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+        # 统计：发布的批次数、点数，以及其中因大小 / 等待时间触发的批次数
+        self.batches = 0
+        self.points = 0
+        self.size_flushes = 0
+        self.linger_flushes = 0
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="batch-linger", daemon=True)
+        self._thread.start()
+
+    def add(self, metric: str, point: Any) -> None:
+        with self._cond:
+            batch = self._pending.get(metric)
+            if batch is None:
+                batch = self._pending[metric] = []
+                self._deadlines[metric] = time.monotonic() + self.linger
+                self._cond.notify()
+            batch.append(point)
+            if len(batch) < self.max_size:
+                return
+            ready = self._take(metric)
+            self.size_flushes += 1
+        self.publish(metric, ready)
+
+    def flush(self) -> None:
+        """立即发布所有未满的批次"""
+        with self._cond:
+            ready = [(metric, self._take(metric)) for metric in list(self._pending)]
+        for metric, points in ready:
+            self.publish(metric, points)
+
+    def close(self) -> None:
+        """停止后台线程并发布剩余的点"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def _take(self, metric: str) -> List[Any]:
+        """取出一批（调用方持有锁）"""
+        self._deadlines.pop(metric, None)
+        points = self._pending.pop(metric)
+        self.batches += 1
+        self.points += len(points)
+        return points
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                ready: List[Tuple[str, List[Any]]] = []
+                while not self._stopping:
+                    now = time.monotonic()
+                    due = [metric for metric, deadline in self._deadlines.items() if deadline <= now]
+                    if due:
+                        ready = [(metric, self._take(metric)) for metric in due]
+                        self.linger_flushes += len(ready)
+                        break
+                    timeout = min(self._deadlines.values()) - now if self._deadlines else None
+                    self._cond.wait(timeout)
+                if not ready:
+                    return
+            for metric, points in ready:
+                self.publish(metric, points)
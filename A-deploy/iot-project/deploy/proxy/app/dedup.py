@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+去重存储 - Gateway Proxy 的 (metric, ts) 去重
+
+三层结构（后两层可选）：
+1. 精确层：OrderedDict[key → 首次出现时间]，按插入顺序即时间顺序排列。
+   过期清理只从头部弹出已过期的条目，遇到第一个未过期的就停止，
+   每条消息的摊还代价为 O(1)，与 DEDUP_CACHE_SIZE 无关
+2. Bloom 层（DEDUP_BLOOM_CAPACITY > 0 时开启）：按时间分代轮转的 Bloom 过滤器，
+   记住 TTL 窗口内出现过的全部 key（包括因容量被精确层挤出的），用于百万级 key 的重放窗口。
+   代价是误判：一条新消息被误判为重复（从而被丢弃）的概率不超过 DEDUP_BLOOM_FP_RATE
+   （前提是每个 TTL 窗口内的 key 数不超过 DEDUP_BLOOM_CAPACITY）；不会漏判
+3. 持久化（DEDUP_PERSIST_PATH 非空时开启）：每个新 key 追加一行到日志文件，
+   代理重启时重放日志中未过期的 key，去重窗口不因重启而清空。
+   写入带缓冲，每 DEDUP_PERSIST_FLUSH_INTERVAL 秒刷一次盘（崩溃时最多丢这么久的 key）；
+   日志行数超过上次压缩后存活行数的两倍时重写一次，只保留未过期的行（摊还 O(1)）
+4. 共享层（DEDUP_SHARED_PATH，多个代理实例以 $share 共享订阅同一 topic 时开启）：同一台机器上的
+   SQLite 表，所有实例共用。本实例前几层都没见过的 key 再到共享表里原子地“检查并写入”，
+   同一个 key 无论被 broker 分给哪个实例，都只有第一个写入的实例转发
+
+时间使用 time.time()（持久化后跨进程仍有意义）。系统时钟回拨时个别条目会晚一点过期，不影响正确性。
+"""
+
+import hashlib
+import math
+import os
+import sqlite3
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Iterator, Optional, Tuple
+
+# 日志压缩的最小行数（行数很少时不值得重写）
+_MIN_COMPACT_LINES = 10000
+
+
+class BloomFilter:
+    """定长 Bloom 过滤器（bytearray 位图 + blake2b 双重哈希）"""
+
+    def __init__(self, capacity: int, fp_rate: float):
+        capacity = max(int(capacity), 1)
+        self.size = max(8, math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key: str):
+        digest = int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest(), "little")
+        h1 = digest & 0xFFFFFFFFFFFFFFFF
+        h2 = (digest >> 64) | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, key: str, positions=None) -> None:
+        bits = self.bits
+        for pos in positions or self.positions(key):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return self.contains_positions(self.positions(key))
+
+    def contains_positions(self, positions) -> bool:
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in positions)
+
+
+class GenerationalBloom:
+    """
+    按时间分代的 Bloom 过滤器
+
+    保留 generations 代，每代覆盖 ttl / (generations - 1) 秒；最旧一代被丢弃时，
+    其中的 key 至少已经存在了 ttl 秒。查询要检查所有代，所以每代的误判率取
+    fp_rate / generations，总误判率不超过 fp_rate。各代参数相同，每个 key 只哈希一次。
+    """
+
+    def __init__(self, ttl: float, capacity: int, fp_rate: float, generations: int = 4):
+        self.generations = max(2, generations)
+        self.span = ttl / (self.generations - 1)
+        # capacity 是一个 TTL 窗口内的 key 数，每代只需容纳其中一段
+        self.capacity = math.ceil(capacity / (self.generations - 1))
+        self.fp_rate = fp_rate / self.generations
+        self.filters: Deque[Tuple[float, BloomFilter]] = deque()
+
+    def _rotate(self, now: float) -> None:
+        if self.filters and now - self.filters[-1][0] >= self.span * self.generations:
+            # 空闲太久，所有代都已过期
+            self.filters.clear()
+        while not self.filters or now - self.filters[-1][0] >= self.span:
+            start = now if not self.filters else self.filters[-1][0] + self.span
+            self.filters.append((start, BloomFilter(self.capacity, self.fp_rate)))
+            if len(self.filters) > self.generations:
+                self.filters.popleft()
+
+    def add(self, key: str, now: float) -> None:
+        self._rotate(now)
+        self.filters[-1][1].add(key)
+
+    def contains(self, key: str, now: float) -> bool:
+        self._rotate(now)
+        positions = self.filters[-1][1].positions(key)
+        return any(bloom.contains_positions(positions) for _, bloom in self.filters)
+
+    def check_and_add(self, key: str, now: float) -> bool:
+        """key 已存在（可能是误判）时返回 True；否则加入当前代并返回 False"""
+        self._rotate(now)
+        current = self.filters[-1][1]
+        positions = current.positions(key)
+        if any(bloom.contains_positions(positions) for _, bloom in self.filters):
+            return True
+        current.add(key, positions)
+        return False
+
+    @property
+    def saturated(self) -> bool:
+        """当前这一代的 key 数已超过设计容量（误判率会高于预算）"""
+        return bool(self.filters) and self.filters[-1][1].count > self.capacity
+
+
+class DedupJournal:
+    """追加写的去重日志，每行 "<首次出现时间>\\t<key>"，按时间顺序"""
+
+    def __init__(self, path: str, ttl: float, flush_interval: float = 1.0):
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.lines = 0
+        self.live_lines = 0
+        self._file = None
+        self._last_flush = 0.0
+
+    def load(self, now: float) -> Iterator[Tuple[float, str]]:
+        """读出未过期的记录（文件不存在时为空）"""
+        if not os.path.exists(self.path):
+            return
+        cutoff = now - self.ttl
+        with open(self.path, "r", encoding="utf-8", errors="ignore") as f:
+            for line in f:
+                stamp, sep, key = line.rstrip("\n").partition("\t")
+                if not sep:
+                    continue
+                try:
+                    seen_at = float(stamp)
+                except ValueError:
+                    continue
+                if seen_at >= cutoff:
+                    yield seen_at, key
+
+    def open(self, now: float) -> None:
+        """压缩现有日志并以追加方式打开"""
+        self.compact(now)
+
+    def append(self, seen_at: float, key: str) -> None:
+        self._file.write(f"{seen_at:.3f}\t{key}\n")
+        self.lines += 1
+        if seen_at - self._last_flush >= self.flush_interval:
+            self._file.flush()
+            self._last_flush = seen_at
+        if self.lines > max(2 * self.live_lines, _MIN_COMPACT_LINES):
+            self.compact(seen_at)
+
+    def compact(self, now: float) -> None:
+        """重写日志，只保留未过期的行"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        kept = 0
+        with open(tmp_path, "w", encoding="utf-8") as out:
+            for seen_at, key in self.load(now):
+                out.write(f"{seen_at:.3f}\t{key}\n")
+                kept += 1
+        os.replace(tmp_path, self.path)
+        self.lines = self.live_lines = kept
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._last_flush = now
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class SharedDedupStore:
+    """
+    多个代理实例共用的去重表（SQLite 文件，WAL 模式，各实例须在同一台机器上）
+
+    每个 key 一条 UPSERT：新 key 插入、已过期的 key 刷新时间，两者都算首次出现；未过期的 key
+    不改动（rowcount == 0）即为重复。SQLite 写锁保证两个实例同时写同一个 key 时只有一个算首次出现。
+    过期的行每 ttl / 4 秒由当时写入的实例顺带删除一次。
+    """
+
+    def __init__(self, path: str, ttl: float, busy_timeout: float = 5.0):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        # 自动提交：每条 UPSERT 是一个独立事务；调用方负责串行化同一实例内的调用
+        self.conn = sqlite3.connect(path, timeout=busy_timeout, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # WAL 下 NORMAL 只在检查点时 fsync；断电最多丢最近的 key，与 DEDUP_PERSIST_FLUSH_INTERVAL 的取舍相同
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS dedup (key TEXT PRIMARY KEY, seen_at REAL NOT NULL) WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_dedup_seen_at ON dedup(seen_at)")
+        self._next_purge = 0.0
+
+    def check_and_add(self, key: str, now: float) -> bool:
+        """key 在 TTL 内已被任一实例记录时返回 True；否则记录下来并返回 False"""
+        cursor = self.conn.execute(
+            """
+            INSERT INTO dedup (key, seen_at) VALUES (?, ?)
+            ON CONFLICT (key) DO UPDATE SET seen_at = excluded.seen_at WHERE dedup.seen_at < ?
+            """,
+            (key, now, now - self.ttl),
+        )
+        duplicate = cursor.rowcount == 0
+        if now >= self._next_purge:
+            self.conn.execute("DELETE FROM dedup WHERE seen_at < ?", (now - self.ttl,))
+            self._next_purge = now + self.ttl / 4
+        return duplicate
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class DedupCache:
+    """
+    (metric, ts) 去重缓存
+
+    max_size: 精确层最多保存的 key 数（超出时挤掉最旧的；开启 Bloom 层时被挤掉的 key 仍能去重）
+    ttl: 去重窗口（秒）
+    bloom_capacity: 一个 TTL 窗口内预计的 key 数，> 0 时开启 Bloom 层
+    bloom_fp_rate: Bloom 层误判率预算（新消息被误判为重复的概率上限）
+    persist_path: 去重日志路径，非空时开启持久化
+    shared_path: 多实例共用的去重表路径，非空时开启共享层
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: int,
+        bloom_capacity: int = 0,
+        bloom_fp_rate: float = 0.001,
+        persist_path: Optional[str] = None,
+        flush_interval: float = 1.0,
+        shared_path: Optional[str] = None,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cache: "OrderedDict[str, float]" = OrderedDict()
+        self.bloom = GenerationalBloom(ttl, bloom_capacity, bloom_fp_rate) if bloom_capacity > 0 else None
+        # Bloom 层判为重复的次数（其中可能包含误判）
+        self.bloom_hits = 0
+        self.shared = SharedDedupStore(shared_path, ttl) if shared_path else None
+        # 本实例没见过、但其他实例已转发过的次数
+        self.shared_hits = 0
+
+        self.journal = None
+        if persist_path:
+            self.journal = DedupJournal(persist_path, ttl, flush_interval)
+            now = time.time()
+            for seen_at, key in self.journal.load(now):
+                self._remember(key, seen_at)
+            self.journal.open(now)
+
+    def __len__(self) -> int:
+        return len(self.cache)
+
+    def is_duplicate(self, metric: str, ts: str) -> bool:
+        """检查是否重复；不重复时记录下来"""
+        key = f"{metric}:{ts}"
+        current_time = time.time()
+
+        # 清理过期条目
+        self._evict_expired(current_time)
+
+        # 检查是否存在
+        if key in self.cache:
+            return True
+        if self.bloom is not None and self.bloom.check_and_add(key, current_time):
+            self.bloom_hits += 1
+            return True
+        if self.shared is not None and self.shared.check_and_add(key, current_time):
+            self.shared_hits += 1
+            # 记在本地，同一个 key 再来时不必再查共享表
+            self._remember(key, current_time, add_to_bloom=False)
+            return True
+
+        self._remember(key, current_time, add_to_bloom=False)
+        if self.journal is not None:
+            self.journal.append(current_time, key)
+        return False
+
+    def _remember(self, key: str, seen_at: float, add_to_bloom: bool = True) -> None:
+        cache = self.cache
+        if key in cache:
+            return
+        cache[key] = seen_at
+        if add_to_bloom and self.bloom is not None:
+            self.bloom.add(key, seen_at)
+
+        # 限制缓存大小
+        if len(cache) > self.max_size:
+            cache.popitem(last=False)  # 删除最旧的
+
+    def _evict_expired(self, current_time: float) -> None:
+        """从头部（最旧）开始弹出过期条目，遇到未过期的即停止"""
+        cache = self.cache
+        cutoff = current_time - self.ttl
+        while cache:
+            seen_at = cache[next(iter(cache))]
+            if seen_at >= cutoff:
+                break
+            cache.popitem(last=False)
+
+    def close(self) -> None:
+        """刷盘并关闭去重日志与共享表"""
+        if self.journal is not None:
+            self.journal.close()
+        if self.shared is not None:
+            self.shared.close()
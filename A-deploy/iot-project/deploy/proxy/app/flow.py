@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+出站流控 - Gateway Proxy 发布到 broker 的在途窗口与字节上限
+
+paho 的 QoS 0 publish 只是把报文追加到内部的发送队列，由网络线程写入 socket，队列没有上限；
+broker 变慢或网络卡住时，这个队列会一直增长。OutboundWindow 放在 client.publish 之前：
+
+- 在途（in-flight）：已交给 paho、还没写进 socket 的报文（MQTTMessageInfo.is_published() 为 False）。
+  QoS 0 报文按交给 paho 的顺序写出，所以从队头按顺序回收即可，不需要 on_publish 回调
+- 在途数达到 OUTBOUND_MAX_INFLIGHT 时，新消息先在本地的等待队列里排队，在途报文写出后按顺序补发
+- 等待队列 + 在途报文的 payload 总字节数不超过 OUTBOUND_MAX_QUEUED_BYTES，超出时按策略处理：
+  - drop_oldest：丢弃等待队列中最早的消息，直到放得下新消息（保留最新的数据）
+  - drop_newest：丢弃新消息
+  - block：不丢弃，由接收阶段在 wait_for_space() 中等待（paho 网络线程暂停读 socket，
+    压力经 TCP 传回 broker）。等待期间由等待的线程自己调用 client.loop_write() 写出报文，
+    否则网络线程停在回调里，没有人写 socket。已经在流水线队列里的消息仍会进入等待队列，
+    所以字节数最多超出流水线队列中的那部分
+- 断开连接时 paho 会清空发送队列，在途报文随之丢失（计入 lost）；断开期间的新消息留在等待队列中
+  （同样受字节上限约束），重连后按顺序发出
+
+任何时候只有一个线程在调用 client.publish（_draining），等待队列中的消息按到达顺序发出。
+回调 on_sent(tag) / on_dropped(tag, reason) 在不持有锁时调用。
+"""
+
+import collections
+import logging
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+import paho.mqtt.client as mqtt
+
+logger = logging.getLogger("MQTTProxy")
+
+POLICIES = ("drop_oldest", "drop_newest", "block")
+
+# 等待队列非空时回收在途报文、补发的间隔（秒）
+PUMP_INTERVAL = 0.005
+
+
+class OutboundWindow:
+    """
+    出站窗口
+
+    send: send(topic, payload) 调用 client.publish，返回 MQTTMessageInfo
+    max_inflight: 在途报文数上限（0 表示不限）
+    max_bytes: 等待 + 在途的 payload 字节数上限（0 表示不限）
+    policy: 超出字节上限时的策略，见 POLICIES
+    on_sent(tag): 消息交给 paho 后调用
+    on_dropped(tag, reason): 消息被丢弃时调用，reason 为 "backpressure" 或 "publish_error"
+    write: 无参数，写出 paho 发送队列中的报文（client.loop_write），供 wait_for_space / flush 使用
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str, bytes], Any],
+        max_inflight: int = 0,
+        max_bytes: int = 0,
+        policy: str = "drop_oldest",
+        on_sent: Optional[Callable[[Any], None]] = None,
+        on_dropped: Optional[Callable[[Any, str], None]] = None,
+        write: Optional[Callable[[], Any]] = None,
+    ):
+        self.send = send
+        self.max_inflight = max(0, max_inflight)
+        self.max_bytes = max(0, max_bytes)
+        self.policy = policy
+        self.on_sent = on_sent
+        self.on_dropped = on_dropped
+        self.write = write
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # 等待队列：(topic, payload, size, tag)
+        self._pending: Deque[Tuple[str, bytes, int, Any]] = collections.deque()
+        # 在途报文：(MQTTMessageInfo, size)，按交给 paho 的顺序
+        self._inflight: Deque[Tuple[Any, int]] = collections.deque()
+        self._bytes = 0
+        self._draining = False
+        self._paused = False
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+        # 统计
+        self.sent = 0
+        self.queued = 0            # 因在途窗口满或断开而先进入等待队列的消息数
+        self.dropped_oldest = 0
+        self.dropped_newest = 0
+        self.publish_errors = 0
+        self.lost = 0              # 断开连接时丢失的在途报文
+        self.blocked = 0           # 接收阶段因字节上限而等待的次数
+        self.blocked_seconds = 0.0
+        self.peak_bytes = 0
+        self.peak_inflight = 0
+
+    @property
+    def limited(self) -> bool:
+        return bool(self.max_inflight or self.max_bytes)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._pump_loop, name="outbound-pump", daemon=True)
+        self._thread.start()
+
+    def submit(self, topic: str, payload: bytes, tag: Any = None) -> None:
+        """发布一条消息：窗口有空位时立即交给 paho，否则排队或按策略丢弃"""
+        size = len(payload)
+        dropped = []
+        item = None
+        accept = True
+        with self._lock:
+            self._reap()
+            if self.max_bytes and self.policy != "block" and self._bytes + size > self.max_bytes:
+                if self.policy == "drop_oldest":
+                    while self._pending and self._bytes + size > self.max_bytes:
+                        _, _, old_size, old_tag = self._pending.popleft()
+                        self._bytes -= old_size
+                        self.dropped_oldest += 1
+                        dropped.append(old_tag)
+                if self._bytes + size > self.max_bytes:
+                    # drop_newest，或等待队列已空、只剩在途报文
+                    self.dropped_newest += 1
+                    dropped.append(tag)
+                    accept = False
+            if accept:
+                self._bytes += size
+                if self._bytes > self.peak_bytes:
+                    self.peak_bytes = self._bytes
+                if self._pending or self._paused or self._window_full():
+                    self.queued += 1
+                    self._pending.append((topic, payload, size, tag))
+                    self._wakeup.notify()
+                elif self._draining:
+                    # 另一个线程正在发，排在它后面
+                    self._pending.append((topic, payload, size, tag))
+                else:
+                    # 常见情况：窗口有空位，直接发
+                    self._draining = True
+                    item = (topic, payload, size, tag)
+        self._dropped(dropped, "backpressure")
+        if accept:
+            self._drain(item)
+
+    def _window_full(self) -> bool:
+        return bool(self.max_inflight) and len(self._inflight) >= self.max_inflight
+
+    def _reap(self) -> None:
+        """回收已写进 socket 的在途报文（调用方持有锁）"""
+        inflight = self._inflight
+        while inflight and inflight[0][0].is_published():
+            self._bytes -= inflight.popleft()[1]
+
+    def _drain(self, item=None) -> None:
+        """
+        按顺序把等待队列中的消息交给 paho，直到队列为空、窗口满或已有线程在发
+        item 不为空时调用方已置 _draining，先发 item
+        """
+        while True:
+            if item is None:
+                with self._lock:
+                    if self._draining:
+                        return
+                    self._reap()
+                    if self._paused or not self._pending or self._window_full():
+                        return
+                    item = self._pending.popleft()
+                    self._draining = True
+            topic, payload, size, tag = item
+            item = None
+            try:
+                info = self.send(topic, payload)
+                rc = info.rc
+            except Exception as e:
+                logger.error("Failed to publish to %s: %s", topic, e)
+                info, rc = None, None
+            with self._lock:
+                self._draining = False
+                if rc == mqtt.MQTT_ERR_SUCCESS:
+                    self.sent += 1
+                    self._inflight.append((info, size))
+                    if len(self._inflight) > self.peak_inflight:
+                        self.peak_inflight = len(self._inflight)
+                elif rc == mqtt.MQTT_ERR_NO_CONN:
+                    # 未连接：放回队头，等重连后再发
+                    self._pending.appendleft((topic, payload, size, tag))
+                    self._paused = True
+                    return
+                else:
+                    self._bytes -= size
+                    self.publish_errors += 1
+                done = not self._pending
+            if rc == mqtt.MQTT_ERR_SUCCESS:
+                if self.on_sent is not None:
+                    self.on_sent(tag)
+            else:
+                if rc is not None:
+                    logger.error("Failed to publish to %s: %s", topic, mqtt.error_string(rc))
+                self._dropped([tag], "publish_error")
+            if done:
+                return
+
+    def _dropped(self, tags, reason: str) -> None:
+        if self.on_dropped is not None:
+            for tag in tags:
+                self.on_dropped(tag, reason)
+
+    def wait_for_space(self) -> None:
+        """
+        block 策略：字节数超过上限时等待（在接收阶段调用）
+        调用线程须是唯一写 socket 的线程（paho 网络线程在 on_message 回调中），等待期间由它写出报文
+        """
+        if self.policy != "block" or not self.max_bytes:
+            return
+        with self._lock:
+            if self._bytes < self.max_bytes or self._paused:
+                return
+            self.blocked += 1
+        started = time.perf_counter()
+        while not self._stopping:
+            if self.write is not None:
+                self.write()
+            self._drain()
+            with self._lock:
+                self._reap()
+                if self._bytes < self.max_bytes or self._paused:
+                    break
+            time.sleep(PUMP_INTERVAL)
+        self.blocked_seconds += time.perf_counter() - started
+
+    def pause(self) -> None:
+        """连接断开：paho 已丢弃的在途报文计入 lost，新消息留在等待队列"""
+        with self._lock:
+            self._paused = True
+            self._reap()
+            lost = len(self._inflight)
+            if lost:
+                self.lost += lost
+                self._bytes -= sum(size for _, size in self._inflight)
+                self._inflight.clear()
+        if lost:
+            logger.warning("Connection lost with %d outbound messages not yet written", lost)
+
+    def resume(self) -> None:
+        """连接恢复：发出断开期间排队的消息"""
+        with self._lock:
+            self._paused = False
+            pending = len(self._pending)
+            self._wakeup.notify()
+        if pending:
+            logger.info("Resuming %d queued outbound messages", pending)
+        self._drain()
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """停止前尽量发出等待队列中的消息（最多 timeout 秒）"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not self._pending or self._paused:
+                    break
+            if self.write is not None:
+                self.write()
+            self._drain()
+            time.sleep(PUMP_INTERVAL)
+        self._stopping = True
+        with self._lock:
+            self._wakeup.notify()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._reap()
+            return {
+                "pending": len(self._pending),
+                "inflight": len(self._inflight),
+                "bytes": self._bytes,
+                "peak_bytes": self.peak_bytes,
+                "peak_inflight": self.peak_inflight,
+                "sent": self.sent,
+                "queued": self.queued,
+                "dropped_oldest": self.dropped_oldest,
+                "dropped_newest": self.dropped_newest,
+                "publish_errors": self.publish_errors,
+                "lost": self.lost,
+                "blocked": self.blocked,
+                "blocked_seconds": round(self.blocked_seconds, 3),
+            }
+
+    def _pump_loop(self) -> None:
+        """等待队列非空时定期回收在途报文并补发（没有新消息到来时也能继续发出）"""
+        while not self._stopping:
+            with self._lock:
+                if not self._pending or self._paused:
+                    self._wakeup.wait()
+                    continue
+            self._drain()
+            time.sleep(PUMP_INTERVAL)
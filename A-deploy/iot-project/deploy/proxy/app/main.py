@@ -9,20 +9,50 @@ IoT Project - Group A
 3. 日志记录每条消息
 4. 防循环（只订阅 ingest 前缀）
 5. 可选：去重（同一 metric 同一 ts）
+6. 批量 ingest：payload 可以是点的 JSON 数组（INGEST_NDJSON=true 时也可以每行一个点），逐个元素验证、计数
+7. 可选：按 metric 攒批发布到 env/batch/<metric>（OUTPUT_MODE=batch|both，见 batcher.py）
+8. 接收、校验 / 去重、发布分为三个阶段，由有界队列连接（PIPELINE_WORKERS，见 pipeline.py）
+9. 可选：多实例部署（SHARE_MODE=shared|partition），以 $share 共享订阅分摊 ingest 流量
+10. 实时指标：按 metric 的计数、丢弃原因、延迟直方图与速率，定期发布到 STATS_TOPIC，
+    并由 HTTP /metrics（Prometheus）与 /stats（JSON）提供（见 metrics.py）
+11. 出站流控：在途报文数与排队字节数有上限，超出时按策略丢弃或让接收阶段等待（见 flow.py）
+12. 可选：按 metric 乱序重排，按 ts 顺序发出，迟到点单独计数（REORDER_ENABLED，见 reorder.py）
+13. 可选：按 metric 的滚动窗口聚合，发布到 env/agg/<interval>/<metric>（AGG_INTERVALS，见 aggregate.py）
+14. 可选：声明式规则文件（RULES_PATH），启动时编译成按 metric 的 value 处理链：
+    类型转换、null 映射、范围检查、单位换算、尖峰过滤、取整（见 rules.py）
+
+每条消息只解析一次、只编码一次：是否被修正由清洗过程直接给出，不再靠重新编码后比较；
+ts 先用预编译的正则检查固定格式 YYYY-MM-DDTHH:MM:SS，不符合时才走完整的 ISO8601 解析；
+安装了 orjson 时默认用它编解码（JSON_BACKEND=json 可关闭）。
 """
 
 import os
+import re
 import sys
 import json
 import time
 import logging
 import signal
+import threading
 from datetime import datetime
-from collections import OrderedDict
-from typing import Optional, Dict, Any, Tuple
+from typing import Optional, Dict, Any, List, Tuple
 
 import paho.mqtt.client as mqtt
 
+from aggregate import WindowAggregator, parse_intervals
+from batcher import MicroBatcher
+from dedup import DedupCache
+from flow import POLICIES, OutboundWindow
+from metrics import OTHER_METRIC, GatewayMetrics, MetricsServer, reason_code
+from pipeline import GatewayPipeline, format_snapshot
+from reorder import LATE_POLICIES, ReorderBuffer
+from rules import RuleError, RuleRejected, RuleSet, load_rules
+
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
 
 # ============================================================
 # 配置类
@@ -36,18 +66,92 @@ class Config:
     USERNAME = os.getenv("MQTT_USERNAME", "proxy")
     PASSWORD = os.getenv("MQTT_PASSWORD", "proxy123")
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    # JSON 编解码：auto（安装了 orjson 就用）/ orjson / json
+    JSON_BACKEND = os.getenv("JSON_BACKEND", "auto").lower()
     
     # 去重配置
     DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
     DEDUP_CACHE_SIZE = int(os.getenv("DEDUP_CACHE_SIZE", "1000"))
     DEDUP_CACHE_TTL = int(os.getenv("DEDUP_CACHE_TTL", "300"))
+    # Bloom 层：一个 TTL 窗口内预计的 key 数（0 表示不开启）与误判率预算，见 dedup.py
+    DEDUP_BLOOM_CAPACITY = int(os.getenv("DEDUP_BLOOM_CAPACITY", "0"))
+    DEDUP_BLOOM_FP_RATE = float(os.getenv("DEDUP_BLOOM_FP_RATE", "0.001"))
+    # 去重日志路径（为空表示不持久化），以及刷盘间隔（秒）
+    DEDUP_PERSIST_PATH = os.getenv("DEDUP_PERSIST_PATH", "")
+    DEDUP_PERSIST_FLUSH_INTERVAL = float(os.getenv("DEDUP_PERSIST_FLUSH_INTERVAL", "1"))
+    
+    # 多实例部署：
+    # - none：单实例，订阅 ingest/env/#
+    # - shared：N 个实例都订阅 $share/<SHARE_GROUP>/ingest/env/#，broker 把每条消息交给其中一个；
+    #   同一 (metric, ts) 可能落到不同实例，去重依赖 DEDUP_SHARED_PATH 共享表（各实例须在同一台机器上）
+    # - partition：按 metric 分区，第 i 个 metric 只由 i % PROXY_INSTANCES == PROXY_INSTANCE_ID 的实例订阅
+    #   （$share/<SHARE_GROUP>/ingest/env/<metric>），本地去重即可保证正确，并行度不超过 metric 数
+    SHARE_MODE = os.getenv("SHARE_MODE", "none").lower()
+    SHARE_GROUP = os.getenv("SHARE_GROUP", "proxy")
+    PROXY_INSTANCES = int(os.getenv("PROXY_INSTANCES", "1"))
+    PROXY_INSTANCE_ID = int(os.getenv("PROXY_INSTANCE_ID", "0"))
+    DEDUP_SHARED_PATH = os.getenv("DEDUP_SHARED_PATH", "/tmp/iot-proxy-dedup.db")
+    
+    # 批量 ingest：接受 JSON 数组 payload；INGEST_NDJSON=true 时也接受每行一个 JSON 对象；
+    # 单条消息最多的元素数（超过时整条丢弃）
+    INGEST_BATCH_ENABLED = os.getenv("INGEST_BATCH_ENABLED", "true").lower() == "true"
+    INGEST_NDJSON = os.getenv("INGEST_NDJSON", "false").lower() == "true"
+    INGEST_MAX_BATCH = int(os.getenv("INGEST_MAX_BATCH", "1000"))
+    
+    # 输出方式：stream（每个点一条 env/<metric>）/ batch（攒批发布到 env/batch/<metric>）/ both
+    OUTPUT_MODE = os.getenv("OUTPUT_MODE", "stream").lower()
+    # 每批最多的点数，以及一批中最早的点最多等待的毫秒数
+    BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "100"))
+    BATCH_LINGER_MS = float(os.getenv("BATCH_LINGER_MS", "200"))
+    
+    # 处理流水线：校验 / 去重 worker 数（0 表示在 paho 回调中直接处理，不使用流水线）、
+    # 每个队列的上限、输入队列满时的策略（block / drop），以及队列与耗时统计的日志间隔（秒，0 表示不记录）
+    PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "2"))
+    PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "10000"))
+    PIPELINE_FULL_POLICY = os.getenv("PIPELINE_FULL_POLICY", "block").lower()
+    PIPELINE_STATS_INTERVAL = float(os.getenv("PIPELINE_STATS_INTERVAL", "60"))
+    
+    # 出站流控：已交给 paho 但还没写进 socket 的报文数上限、等待 + 在途的 payload 字节数上限（0 表示不限），
+    # 超出字节上限时的策略（drop_oldest / drop_newest / block）
+    OUTBOUND_MAX_INFLIGHT = int(os.getenv("OUTBOUND_MAX_INFLIGHT", "1000"))
+    OUTBOUND_MAX_QUEUED_BYTES = int(os.getenv("OUTBOUND_MAX_QUEUED_BYTES", str(8 * 1024 * 1024)))
+    OUTBOUND_FULL_POLICY = os.getenv("OUTBOUND_FULL_POLICY", "drop_oldest").lower()
+    
+    # 乱序重排：按 metric 缓存点、按 ts 顺序发出。水位线 = 已见过的最大 ts - REORDER_MAX_LATENESS（秒，按 ts 计）；
+    # 每个点最多停留 REORDER_MAX_WAIT_MS 毫秒，每个 metric 最多缓存 REORDER_MAX_HELD 个点（0 表示不限）；
+    # 早于已发出的点的迟到点按 REORDER_LATE_POLICY 处理（forward：立即发出 / drop：丢弃）
+    REORDER_ENABLED = os.getenv("REORDER_ENABLED", "false").lower() == "true"
+    REORDER_MAX_LATENESS = float(os.getenv("REORDER_MAX_LATENESS", "600"))
+    REORDER_MAX_WAIT_MS = float(os.getenv("REORDER_MAX_WAIT_MS", "2000"))
+    REORDER_MAX_HELD = int(os.getenv("REORDER_MAX_HELD", "10000"))
+    REORDER_LATE_POLICY = os.getenv("REORDER_LATE_POLICY", "forward").lower()
+    
+    # 边缘预聚合：逗号分隔的窗口长度（如 1m,1h，为空表示不开启），每个窗口发布一次
+    # count / min / max / mean / last 到 env/agg/<interval>/<metric>；窗口在 ts 水位线
+    # （已见过的最大 ts - AGG_MAX_LATENESS 秒）越过窗口结束时关闭
+    AGG_INTERVALS = os.getenv("AGG_INTERVALS", "")
+    AGG_MAX_LATENESS = float(os.getenv("AGG_MAX_LATENESS", "600"))
+    
+    # 实时指标：发布间隔（秒，0 表示不发布）与 topic（实际为 <STATS_TOPIC>/<PROXY_INSTANCE_ID>，不能在 env/ 下，
+    # 否则会被 collector 当作数据写入）；HTTP 端点（端口 0 表示不开启，多实例时各实例用 端口 + PROXY_INSTANCE_ID）；
+    # 速率的统计窗口（秒）
+    STATS_PUBLISH_INTERVAL = float(os.getenv("STATS_PUBLISH_INTERVAL", "10"))
+    STATS_TOPIC = os.getenv("STATS_TOPIC", "proxy/stats")
+    METRICS_HTTP_HOST = os.getenv("METRICS_HTTP_HOST", "127.0.0.1")
+    METRICS_HTTP_PORT = int(os.getenv("METRICS_HTTP_PORT", "9108"))
+    METRICS_RATE_WINDOW = int(os.getenv("METRICS_RATE_WINDOW", "10"))
     
     # Topic 映射规则
     INGEST_PREFIX = "ingest/env/"
     OUTPUT_PREFIX = "env/"
+    BATCH_PREFIX = "env/batch/"
+    AGG_PREFIX = "env/agg/"
     
-    # 支持的 metrics
+    # 支持的 metrics（RULES_PATH 的规则文件列出了 metrics 时以规则文件为准）
     ALLOWED_METRICS = ["temperature", "humidity", "pressure"]
+    
+    # 规则文件（JSON，见 rules.py 与 rules.example.json）；为空时使用内置的清洗规则
+    RULES_PATH = os.getenv("RULES_PATH", "")
 
 
 # ============================================================
@@ -79,57 +183,54 @@ logger = setup_logging()
 
 
 # ============================================================
-# 去重缓存（可选功能）
+# JSON 编解码
 # ============================================================
 
-class DedupCache:
-    """LRU 缓存，用于去重"""
-    
-    def __init__(self, max_size: int, ttl: int):
-        self.max_size = max_size
-        self.ttl = ttl
-        self.cache: OrderedDict[str, float] = OrderedDict()
-    
-    def is_duplicate(self, metric: str, ts: str) -> bool:
-        """检查是否重复"""
-        key = f"{metric}:{ts}"
-        current_time = time.time()
-        
-        # 清理过期条目
-        self._evict_expired(current_time)
-        
-        # 检查是否存在
-        if key in self.cache:
-            return True
-        
-        # 添加到缓存
-        self.cache[key] = current_time
-        
-        # 限制缓存大小
-        if len(self.cache) > self.max_size:
-            self.cache.popitem(last=False)  # 删除最旧的
-        
-        return False
-    
-    def _evict_expired(self, current_time: float):
-        """清理过期条目"""
-        keys_to_remove = [
-            key for key, timestamp in self.cache.items()
-            if current_time - timestamp > self.ttl
-        ]
-        for key in keys_to_remove:
-            del self.cache[key]
+class JsonCodec:
+    """payload 编解码：loads 接受 bytes / str，dumps 返回紧凑格式的 bytes"""
+
+    def __init__(self, backend: str = "auto"):
+        if backend == "orjson" and orjson is None:
+            logger.warning("JSON_BACKEND=orjson but orjson is not installed, falling back to json")
+        if backend in ("auto", "orjson") and orjson is not None:
+            self.name = "orjson"
+            self.loads = orjson.loads
+            self.dumps = orjson.dumps
+        else:
+            self.name = "json"
+            self.loads = self._json_loads
+            self.dumps = self._json_dumps
+
+    @staticmethod
+    def _json_loads(payload):
+        # json.loads 直接处理 bytes 时要先探测编码，按 UTF-8 解码后再解析更快
+        if isinstance(payload, bytes):
+            payload = payload.decode("utf-8")
+        return json.loads(payload)
+
+    @staticmethod
+    def _json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj, separators=(',', ':')).encode("utf-8")
+
+
+codec = JsonCodec(Config.JSON_BACKEND)
 
 
 # ============================================================
 # Payload 验证与清洗
 # ============================================================
 
+# 固定格式 YYYY-MM-DDTHH:MM:SS（各字段取值范围也在正则里检查）
+_TS_PATTERN = re.compile(
+    r"[0-9]{4}-(?:0[1-9]|1[0-2])-(?:0[1-9]|[12][0-9]|3[01])T(?:[01][0-9]|2[0-3]):[0-5][0-9]:[0-5][0-9]"
+)
+
+
 class PayloadValidator:
     """Payload 验证与清洗器"""
     
     @staticmethod
-    def validate_and_clean(payload_str: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    def validate_and_clean(payload_str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
         """
         验证并清洗 payload
         
@@ -137,34 +238,127 @@ class PayloadValidator:
         如果验证失败，返回 (None, reason)
         如果验证成功，返回 (cleaned_payload, None)
         """
+        cleaned_payload, _, error_reason = PayloadValidator.clean(payload_str)
+        return cleaned_payload, error_reason
+    
+    @staticmethod
+    def clean(payload, loads=None, clean_value=None) -> Tuple[Optional[Dict[str, Any]], bool, Optional[str]]:
+        """
+        单次解析完成验证与清洗（payload 可以是 bytes 或 str）
         
+        返回: (cleaned_payload, was_modified, error_reason)
+        was_modified 表示清洗改动了内容：value 被转换，或去掉了多余字段
+        （只是空格、字段顺序不同不算修正）
+        clean_value: 代替 _clean_value 的 value 处理链（规则文件编译而成，见 rules.py）
+        """
         # 1. 必须是合法 JSON
+        data, error_reason = PayloadValidator._parse(payload, loads or codec.loads)
+        if error_reason is not None:
+            return None, False, error_reason
+        return PayloadValidator._clean_object(data, clean_value)
+    
+    @staticmethod
+    def is_batch(payload, ndjson: bool = False) -> bool:
+        """payload 是否为批量格式：JSON 数组，或（ndjson=True 时）多行"""
+        stripped = payload.strip()
+        if stripped[:1] in (b"[", "["):
+            return True
+        return ndjson and (b"\n" in stripped if isinstance(stripped, bytes) else "\n" in stripped)
+    
+    @staticmethod
+    def clean_batch(
+        payload, loads=None, ndjson: bool = False, max_items: Optional[int] = None, clean_value=None
+    ) -> Tuple[Optional[List[Tuple[Optional[Dict[str, Any]], bool, Optional[str]]]], Optional[str]]:
+        """
+        验证并清洗批量 payload：JSON 数组 [{...}, {...}]，或（ndjson=True 时）每行一个 JSON 对象
+        
+        整条消息只解析一次（NDJSON 先拼成一个数组再解析，有坏行时才逐行解析），
+        之后一趟循环逐个元素验证与清洗，每个元素单独给出结果，坏元素不影响其他元素。
+        
+        返回: (results, error_reason)
+        results 与元素一一对应，每项为 clean() 的返回值 (cleaned_payload, was_modified, error_reason)，
+        clean_value 同 clean()；
+        整条消息无法处理（非法 JSON、不是数组、为空、超过 max_items）时返回 (None, reason)
+        """
+        loads = loads or codec.loads
+        stripped = payload.strip()
+        if isinstance(stripped, str):
+            stripped = stripped.encode("utf-8")
+        
+        if stripped[:1] == b"[":
+            data, error_reason = PayloadValidator._parse(stripped, loads)
+            if error_reason is not None:
+                return None, error_reason
+            if not isinstance(data, list):
+                return None, "Batch payload must be a JSON array"
+            parsed = None
+        else:
+            lines = [line for line in stripped.split(b"\n") if line.strip()]
+            data, error_reason = PayloadValidator._parse(b"[" + b",".join(lines) + b"]", loads)
+            # 有坏行时（包括跨行拼出的元素数与行数不符）逐行解析，坏行单独计为丢弃
+            parsed = None
+            if error_reason is not None or len(data) != len(lines):
+                parsed = [PayloadValidator._parse(line, loads) for line in lines]
+            if parsed is not None:
+                data = lines
+        
+        if not data:
+            return None, "Empty batch"
+        if max_items is not None and len(data) > max_items:
+            return None, f"Batch too large: {len(data)} elements (max {max_items})"
+        
+        clean_object = PayloadValidator._clean_object
+        if parsed is None:
+            return [clean_object(element, clean_value) for element in data], None
+        return [
+            (None, False, error_reason) if error_reason is not None else clean_object(element, clean_value)
+            for element, error_reason in parsed
+        ], None
+    
+    @staticmethod
+    def _parse(payload, loads) -> Tuple[Any, Optional[str]]:
+        """解析 JSON，返回 (data, error_reason)"""
+        try:
+            return loads(payload), None
+        except ValueError as e:
+            if not isinstance(payload, bytes) or PayloadValidator._is_utf8(payload):
+                return None, f"Invalid JSON: {str(e)}"
+        # 非法 UTF-8 字节：与之前一样忽略后再解析
         try:
-            data = json.loads(payload_str)
-        except json.JSONDecodeError as e:
+            return loads(payload.decode('utf-8', errors='ignore')), None
+        except ValueError as e:
             return None, f"Invalid JSON: {str(e)}"
-        
+    
+    @staticmethod
+    def _clean_object(data, clean_value=None) -> Tuple[Optional[Dict[str, Any]], bool, Optional[str]]:
+        """验证并清洗一个已解析的点，返回值同 clean()"""
         if not isinstance(data, dict):
-            return None, "Payload must be a JSON object"
+            return None, False, "Payload must be a JSON object"
         
         # 2. 必须有 ts 和 value 字段
         if "ts" not in data:
-            return None, "Missing required field: ts"
+            return None, False, "Missing required field: ts"
         if "value" not in data:
-            return None, "Missing required field: value"
+            return None, False, "Missing required field: value"
         
         ts = data["ts"]
         value = data["value"]
         
         # 3. 验证 ts 格式（基本 ISO8601 校验）
         if not isinstance(ts, str):
-            return None, f"Field 'ts' must be string, got {type(ts).__name__}"
+            return None, False, f"Field 'ts' must be string, got {type(ts).__name__}"
         
         if not PayloadValidator._is_valid_iso8601(ts):
-            return None, f"Field 'ts' is not valid ISO8601 format: {ts}"
+            return None, False, f"Field 'ts' is not valid ISO8601 format: {ts}"
         
-        # 4. 清洗 value
-        cleaned_value, modified = PayloadValidator._clean_value(value)
+        # 4. 清洗 value（有规则文件时为该 metric 编译好的处理链，可能拒绝这个点）
+        if clean_value is None:
+            cleaned_value, modified = PayloadValidator._clean_value(value)
+        else:
+            try:
+                cleaned_value, modified = clean_value(value)
+            except RuleRejected as e:
+                return None, False, str(e)
         
         # 构造清洗后的 payload
         cleaned_payload = {
@@ -172,14 +366,26 @@ class PayloadValidator:
             "value": cleaned_value
         }
         
-        return cleaned_payload, None
+        return cleaned_payload, modified or len(data) != 2, None
+    
+    @staticmethod
+    def _is_utf8(payload: bytes) -> bool:
+        try:
+            payload.decode('utf-8')
+            return True
+        except UnicodeDecodeError:
+            return False
     
     @staticmethod
     def _is_valid_iso8601(ts_str: str) -> bool:
         """
         基本 ISO8601 格式验证
         接受格式：YYYY-MM-DDTHH:MM:SS
+        
+        先用正则检查固定格式（日期不超过 28 号时一定合法）；其他情况交给 fromisoformat
         """
+        if _TS_PATTERN.fullmatch(ts_str) and ts_str[8:10] <= "28":
+            return True
         try:
             # 尝试解析（支持多种格式）
             datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
@@ -232,6 +438,30 @@ class PayloadValidator:
         return None, True
 
 
+# ============================================================
+# 多实例订阅
+# ============================================================
+
+def owned_metrics(instances: int, instance_id: int):
+    """partition 模式下本实例负责的 metric（按 ALLOWED_METRICS 的顺序轮流分配）"""
+    return [
+        metric for index, metric in enumerate(Config.ALLOWED_METRICS)
+        if index % max(instances, 1) == instance_id
+    ]
+
+
+def subscription_topics():
+    """本实例要订阅的 topic（防止循环：只订阅 ingest 前缀，不订阅 env/#）"""
+    if Config.SHARE_MODE == "shared":
+        return [f"$share/{Config.SHARE_GROUP}/{Config.INGEST_PREFIX}#"]
+    if Config.SHARE_MODE == "partition":
+        return [
+            f"$share/{Config.SHARE_GROUP}/{Config.INGEST_PREFIX}{metric}"
+            for metric in owned_metrics(Config.PROXY_INSTANCES, Config.PROXY_INSTANCE_ID)
+        ]
+    return [f"{Config.INGEST_PREFIX}#"]
+
+
 # ============================================================
 # MQTT 代理网关
 # ============================================================
@@ -250,19 +480,161 @@ class MQTTGateway:
             "forwarded": 0,
             "dropped": 0,
             "duplicated": 0,
-            "modified": 0
+            "modified": 0,
+            "ingest_batches": 0
         }
+        self._stats_lock = threading.Lock()
+        
+        # 规则文件（在用到 ALLOWED_METRICS 之前加载）
+        self.rules: Optional[RuleSet] = None
+        if Config.RULES_PATH:
+            try:
+                self.rules = load_rules(Config.RULES_PATH)
+            except (OSError, RuleError) as e:
+                logger.error(f"Cannot load rules from {Config.RULES_PATH}: {e}")
+                raise SystemExit(1)
+            if self.rules.metrics:
+                Config.ALLOWED_METRICS = self.rules.metrics
+            logger.info(
+                f"Rules loaded from {Config.RULES_PATH}: "
+                + ", ".join(f"{metric} ({n} rules)" for metric, n in self.rules.describe().items())
+            )
+        
+        # 按 metric 的实时指标（与 stats 共用一把锁）
+        self.metrics = GatewayMetrics(Config.ALLOWED_METRICS, Config.METRICS_RATE_WINDOW, lock=self._stats_lock)
+        self.metrics_server: Optional[MetricsServer] = None
+        # 多个 worker 共用一个去重缓存
+        self._dedup_lock = threading.Lock()
+        
+        logger.info(f"JSON backend: {codec.name}")
+        
+        # 多实例部署
+        if Config.SHARE_MODE not in ("none", "shared", "partition"):
+            logger.warning(f"Unknown SHARE_MODE '{Config.SHARE_MODE}', using none")
+            Config.SHARE_MODE = "none"
+        if Config.SHARE_MODE != "none":
+            logger.info(
+                f"Instance {Config.PROXY_INSTANCE_ID} of {Config.PROXY_INSTANCES} "
+                f"(share mode: {Config.SHARE_MODE}, group: {Config.SHARE_GROUP})"
+            )
+            if Config.SHARE_MODE == "shared" and not Config.DEDUP_ENABLED:
+                logger.warning("SHARE_MODE=shared without DEDUP_ENABLED: duplicates are not filtered")
+            if Config.SHARE_MODE == "partition" and not subscription_topics():
+                logger.warning(
+                    f"No metric assigned to instance {Config.PROXY_INSTANCE_ID} "
+                    f"({len(Config.ALLOWED_METRICS)} metrics, {Config.PROXY_INSTANCES} instances)"
+                )
         
         # 去重缓存
         if Config.DEDUP_ENABLED:
             self.dedup_cache = DedupCache(
                 Config.DEDUP_CACHE_SIZE,
-                Config.DEDUP_CACHE_TTL
+                Config.DEDUP_CACHE_TTL,
+                bloom_capacity=Config.DEDUP_BLOOM_CAPACITY,
+                bloom_fp_rate=Config.DEDUP_BLOOM_FP_RATE,
+                persist_path=Config.DEDUP_PERSIST_PATH or None,
+                flush_interval=Config.DEDUP_PERSIST_FLUSH_INTERVAL,
+                shared_path=Config.DEDUP_SHARED_PATH if Config.SHARE_MODE == "shared" else None,
             )
             logger.info(f"Deduplication enabled (cache size: {Config.DEDUP_CACHE_SIZE}, TTL: {Config.DEDUP_CACHE_TTL}s)")
+            if Config.DEDUP_BLOOM_CAPACITY > 0:
+                logger.info(
+                    f"Dedup Bloom tier enabled (capacity: {Config.DEDUP_BLOOM_CAPACITY} keys per TTL, "
+                    f"false-positive budget: {Config.DEDUP_BLOOM_FP_RATE})"
+                )
+            if self.dedup_cache.shared is not None:
+                logger.info(f"Dedup shared store: {Config.DEDUP_SHARED_PATH}")
+            if Config.DEDUP_PERSIST_PATH:
+                logger.info(
+                    f"Dedup journal: {Config.DEDUP_PERSIST_PATH} "
+                    f"({len(self.dedup_cache)} keys restored)"
+                )
         else:
             self.dedup_cache = None
             logger.info("Deduplication disabled")
+        
+        # 输出方式
+        if Config.OUTPUT_MODE not in ("stream", "batch", "both"):
+            logger.warning(f"Unknown OUTPUT_MODE '{Config.OUTPUT_MODE}', using stream")
+            Config.OUTPUT_MODE = "stream"
+        self.stream_output = Config.OUTPUT_MODE in ("stream", "both")
+        self.batcher: Optional[MicroBatcher] = None
+        if Config.OUTPUT_MODE in ("batch", "both"):
+            self.batcher = MicroBatcher(Config.BATCH_MAX_SIZE, Config.BATCH_LINGER_MS, self.publish_batch)
+            logger.info(
+                f"Batch output enabled: {Config.BATCH_PREFIX}<metric> "
+                f"(max size: {Config.BATCH_MAX_SIZE}, linger: {Config.BATCH_LINGER_MS:g} ms)"
+            )
+        
+        # 乱序重排（去重之后、发布之前）
+        self.reorder: Optional[ReorderBuffer] = None
+        if Config.REORDER_ENABLED:
+            if Config.REORDER_LATE_POLICY not in LATE_POLICIES:
+                logger.warning(f"Unknown REORDER_LATE_POLICY '{Config.REORDER_LATE_POLICY}', using forward")
+                Config.REORDER_LATE_POLICY = "forward"
+            self.reorder = ReorderBuffer(
+                Config.REORDER_MAX_LATENESS,
+                Config.REORDER_MAX_WAIT_MS,
+                Config.REORDER_MAX_HELD,
+                late_policy=Config.REORDER_LATE_POLICY,
+                on_late=self._on_late,
+            )
+            logger.info(
+                f"Reorder buffer enabled (max lateness: {Config.REORDER_MAX_LATENESS:g}s of ts, "
+                f"max wait: {Config.REORDER_MAX_WAIT_MS:g} ms, max held: {Config.REORDER_MAX_HELD or 'unlimited'}, "
+                f"late points: {Config.REORDER_LATE_POLICY})"
+            )
+        
+        # 边缘预聚合（在发布阶段，每个转发的点计入一次）
+        self.aggregator: Optional[WindowAggregator] = None
+        try:
+            intervals = parse_intervals(Config.AGG_INTERVALS)
+        except ValueError as e:
+            logger.warning(f"{e}, aggregation disabled")
+            intervals = {}
+        if intervals:
+            self.aggregator = WindowAggregator(intervals, Config.AGG_MAX_LATENESS, self.publish_aggregate)
+            logger.info(
+                f"Aggregation enabled: {Config.AGG_PREFIX}<{'|'.join(intervals)}>/<metric> "
+                f"(max lateness: {Config.AGG_MAX_LATENESS:g}s of ts)"
+            )
+        
+        # 处理流水线
+        self.pipeline: Optional[GatewayPipeline] = None
+        if Config.PIPELINE_WORKERS > 0:
+            self.pipeline = GatewayPipeline(
+                Config.PIPELINE_WORKERS,
+                Config.PIPELINE_QUEUE_SIZE,
+                self._process,
+                self._emit,
+                full_policy=Config.PIPELINE_FULL_POLICY,
+            )
+            logger.info(
+                f"Pipeline enabled ({Config.PIPELINE_WORKERS} workers, queue size: {Config.PIPELINE_QUEUE_SIZE}, "
+                f"when full: {Config.PIPELINE_FULL_POLICY})"
+            )
+        else:
+            logger.info("Pipeline disabled, processing messages in the network loop")
+        
+        # 出站流控（所有 publish 都经过它）
+        if Config.OUTBOUND_FULL_POLICY not in POLICIES:
+            logger.warning(f"Unknown OUTBOUND_FULL_POLICY '{Config.OUTBOUND_FULL_POLICY}', using drop_oldest")
+            Config.OUTBOUND_FULL_POLICY = "drop_oldest"
+        self.outbound = OutboundWindow(
+            self._publish,
+            max_inflight=Config.OUTBOUND_MAX_INFLIGHT,
+            max_bytes=Config.OUTBOUND_MAX_QUEUED_BYTES,
+            policy=Config.OUTBOUND_FULL_POLICY,
+            on_sent=self._on_sent,
+            on_dropped=self._on_dropped,
+            write=lambda: self.client.loop_write(),
+        )
+        if self.outbound.limited:
+            logger.info(
+                f"Outbound flow control: max in-flight {Config.OUTBOUND_MAX_INFLIGHT or 'unlimited'}, "
+                f"max queued bytes {Config.OUTBOUND_MAX_QUEUED_BYTES or 'unlimited'}, "
+                f"when full: {Config.OUTBOUND_FULL_POLICY}"
+            )
     
     def setup(self):
         """设置 MQTT 客户端"""
@@ -270,7 +642,7 @@ class MQTTGateway:
         
         # 创建客户端
         self.client = mqtt.Client(
-            client_id=f"proxy-gateway-{int(time.time())}",
+            client_id=f"proxy-gateway-{Config.PROXY_INSTANCE_ID}-{os.getpid()}-{int(time.time())}",
             clean_session=True,
             protocol=mqtt.MQTTv311
         )
@@ -285,6 +657,34 @@ class MQTTGateway:
         
         logger.info(f"Broker: {Config.BROKER_HOST}:{Config.BROKER_PORT}")
         logger.info(f"Username: {Config.USERNAME}")
+        
+        self.outbound.start()
+        if self.batcher is not None:
+            self.batcher.start()
+        if self.reorder is not None:
+            self.reorder.start()
+        if self.pipeline is not None:
+            self.pipeline.start()
+            if Config.PIPELINE_STATS_INTERVAL > 0:
+                threading.Thread(target=self._report_loop, name="pipeline-report", daemon=True).start()
+        
+        # 实时指标
+        if Config.METRICS_HTTP_PORT > 0:
+            port = Config.METRICS_HTTP_PORT + Config.PROXY_INSTANCE_ID
+            try:
+                self.metrics_server = MetricsServer(
+                    Config.METRICS_HTTP_HOST, port, self.render_metrics, self.render_stats
+                )
+                self.metrics_server.start()
+                logger.info(f"Metrics endpoint: http://{Config.METRICS_HTTP_HOST}:{port}/metrics (JSON: /stats)")
+            except OSError as e:
+                logger.warning(f"Metrics endpoint disabled, cannot listen on {Config.METRICS_HTTP_HOST}:{port}: {e}")
+        if Config.STATS_PUBLISH_INTERVAL > 0:
+            threading.Thread(target=self._stats_loop, name="stats-publisher", daemon=True).start()
+            logger.info(
+                f"Stats topic: {Config.STATS_TOPIC}/{Config.PROXY_INSTANCE_ID} "
+                f"(every {Config.STATS_PUBLISH_INTERVAL:g}s)"
+            )
     
     def connect(self):
         """连接到 Broker"""
@@ -312,13 +712,21 @@ class MQTTGateway:
             self.connected = True
             logger.info("✓ Connected to MQTT Broker successfully")
             
-            # 订阅 ingest/env/# (防止循环：不订阅 env/#)
-            subscribe_topic = f"{Config.INGEST_PREFIX}#"
-            client.subscribe(subscribe_topic, qos=0)
-            logger.info(f"✓ Subscribed to: {subscribe_topic}")
+            # 订阅 ingest/env/#（多实例时为共享订阅，防止循环：不订阅 env/#）
+            for subscribe_topic in subscription_topics():
+                client.subscribe(subscribe_topic, qos=0)
+                logger.info(f"✓ Subscribed to: {subscribe_topic}")
             
             logger.info("Gateway is ready to forward messages")
-            logger.info(f"Mapping: {Config.INGEST_PREFIX}* → {Config.OUTPUT_PREFIX}*")
+            if self.stream_output:
+                logger.info(f"Mapping: {Config.INGEST_PREFIX}* → {Config.OUTPUT_PREFIX}*")
+            if self.batcher is not None:
+                logger.info(f"Mapping: {Config.INGEST_PREFIX}* → {Config.BATCH_PREFIX}* (batched)")
+            if self.aggregator is not None:
+                logger.info(f"Mapping: {Config.INGEST_PREFIX}* → {Config.AGG_PREFIX}<interval>/* (aggregated)")
+            
+            # 发出断开期间排队的消息
+            self.outbound.resume()
             
         else:
             error_messages = {
@@ -335,100 +743,401 @@ class MQTTGateway:
     def on_disconnect(self, client, userdata, rc):
         """断开连接回调"""
         self.connected = False
+        self.outbound.pause()
         if rc != 0:
             logger.warning(f"Unexpected disconnection (code: {rc}). Will attempt to reconnect...")
         else:
             logger.info("Disconnected from MQTT Broker")
     
     def on_message(self, client, userdata, msg):
-        """收到消息回调"""
-        self.stats["received"] += 1
-        
+        """收到消息回调（接收阶段：只检查 topic，其余交给流水线）"""
+        received_at = time.perf_counter()
         topic = msg.topic
-        payload = msg.payload.decode('utf-8', errors='ignore')
+        payload = msg.payload
+        
+        # OUTBOUND_FULL_POLICY=block：出站字节数超限时先在这里等待（暂停读 socket）
+        self.outbound.wait_for_space()
         
         # 提取 metric（temperature, humidity, pressure）
         if not topic.startswith(Config.INGEST_PREFIX):
-            logger.warning(f"Received message from unexpected topic: {topic}")
+            self._count("received", metric=OTHER_METRIC)
+            logger.warning("Received message from unexpected topic: %s", topic)
             return
         
         metric = topic[len(Config.INGEST_PREFIX):]
         
         # 检查是否是允许的 metric
         if metric not in Config.ALLOWED_METRICS:
-            logger.warning(f"Unknown metric '{metric}', dropping message | topic={topic}")
-            self.stats["dropped"] += 1
+            self._count("received", metric=OTHER_METRIC)
+            logger.warning("Unknown metric '%s', dropping message | topic=%s", metric, topic)
+            self._count("dropped", metric=OTHER_METRIC, reason="unknown_metric")
             return
         
-        # 验证和清洗 payload
-        cleaned_payload, error_reason = PayloadValidator.validate_and_clean(payload)
+        self._count("received", metric=metric)
+        item = (topic, metric, payload, received_at)
+        if self.pipeline is None:
+            self._process(item, self._emit)
+        elif not self.pipeline.submit(metric, item):
+            # PIPELINE_FULL_POLICY=drop 且队列已满
+            logger.debug("SHED | topic=%s | pipeline queue full", topic)
+            self._count("dropped", metric=metric, reason="queue_full")
+    
+    def _process(self, item, emit):
+        """校验 / 去重阶段：每个通过的点调用一次 emit(topic, metric, cleaned_payload, was_modified, received_at)"""
+        topic, metric, payload, received_at = item
+        clean_value = self.rules.chain_for(metric) if self.rules is not None else None
+        
+        # 批量 payload：逐个元素验证、清洗、转发
+        if Config.INGEST_BATCH_ENABLED and PayloadValidator.is_batch(payload, Config.INGEST_NDJSON):
+            self._handle_batch(topic, metric, payload, received_at, emit, clean_value)
+            return
+        
+        # 验证和清洗 payload（同时给出是否修正过）
+        cleaned_payload, was_modified, error_reason = PayloadValidator.clean(payload, clean_value=clean_value)
         
         if cleaned_payload is None:
             # 验证失败，丢弃
             logger.warning(
-                f"DROP | topic={topic} | reason={error_reason} | "
-                f"raw_payload={payload[:100]}"
+                "DROP | topic=%s | reason=%s | raw_payload=%s",
+                topic, error_reason, payload[:100].decode('utf-8', errors='ignore')
             )
-            self.stats["dropped"] += 1
+            self._count("dropped", metric=metric, reason=reason_code(error_reason))
             return
         
-        # 检查是否修正过
-        was_modified = (json.dumps(cleaned_payload, separators=(',', ':')) != payload)
         if was_modified:
-            self.stats["modified"] += 1
+            self._count("modified", metric=metric)
+        
+        self._forward(topic, metric, cleaned_payload, was_modified, received_at, emit)
+    
+    def _handle_batch(self, topic: str, metric: str, payload, received_at: float, emit, clean_value=None):
+        """批量 payload：每个元素计一次接收，坏元素单独丢弃，其余逐个去重、转发"""
+        self._count("ingest_batches")
+        results, error_reason = PayloadValidator.clean_batch(
+            payload, ndjson=Config.INGEST_NDJSON, max_items=Config.INGEST_MAX_BATCH, clean_value=clean_value
+        )
+        if results is None:
+            logger.warning(
+                "DROP | topic=%s | reason=%s | raw_payload=%s",
+                topic, error_reason, payload[:100].decode('utf-8', errors='ignore')
+            )
+            self._count("dropped", metric=metric, reason=reason_code(error_reason))
+            return
+        
+        # on_message 已为这条消息计过一次
+        self._count("received", len(results) - 1, metric=metric)
+        dropped = modified = 0
+        reasons: Dict[str, int] = {}
+        for index, (cleaned_payload, was_modified, error_reason) in enumerate(results):
+            if cleaned_payload is None:
+                logger.warning("DROP | topic=%s[%d] | reason=%s", topic, index, error_reason)
+                dropped += 1
+                code = reason_code(error_reason)
+                reasons[code] = reasons.get(code, 0) + 1
+                continue
+            if was_modified:
+                modified += 1
+            self._forward(topic, metric, cleaned_payload, was_modified, received_at, emit)
         
+        for code, n in reasons.items():
+            self._count("dropped", n, metric=metric, reason=code)
+        self._count("modified", modified, metric=metric)
+        logger.info("INGEST BATCH | topic=%s | elements=%d | dropped=%d", topic, len(results), dropped)
+    
+    def _forward(
+        self, topic: str, metric: str, cleaned_payload: Dict[str, Any], was_modified: bool, received_at: float, emit
+    ):
+        """去重后把一个清洗过的点交给发布阶段"""
         # 去重检查（可选）
-        if self.dedup_cache:
+        if self.dedup_cache is not None:
             ts = cleaned_payload["ts"]
-            if self.dedup_cache.is_duplicate(metric, ts):
+            with self._dedup_lock:
+                duplicate = self.dedup_cache.is_duplicate(metric, ts)
+            if duplicate:
                 logger.info(
-                    f"DUPLICATE | topic={topic} | ts={ts} | "
-                    f"value={cleaned_payload['value']} | dropped"
+                    "DUPLICATE | topic=%s | ts=%s | value=%s | dropped",
+                    topic, ts, cleaned_payload["value"]
                 )
-                self.stats["duplicated"] += 1
+                self._count("duplicated", metric=metric)
                 return
         
-        # 转发到输出 topic
-        output_topic = f"{Config.OUTPUT_PREFIX}{metric}"
-        output_payload = json.dumps(cleaned_payload, separators=(',', ':'))
+        # 乱序重排：按 ts 顺序调用 emit
+        if self.reorder is not None:
+            out = (topic, metric, cleaned_payload, was_modified, received_at)
+            self.reorder.add(metric, cleaned_payload["ts"], out, emit)
+            return
         
-        try:
-            client.publish(
-                output_topic,
-                output_payload,
-                qos=0,
-                retain=False
-            )
-            
-            self.stats["forwarded"] += 1
-            
-            # 记录日志
+        emit(topic, metric, cleaned_payload, was_modified, received_at)
+    
+    def _on_late(self, out, forwarded: bool):
+        """重排缓冲区遇到迟到点（ts 早于已发出的点）：立即发出（乱序）或丢弃"""
+        topic, metric, cleaned_payload, _, _ = out
+        logger.info(
+            "LATE | topic=%s | ts=%s | value=%s | %s",
+            topic, cleaned_payload["ts"], cleaned_payload["value"], "forwarded out of order" if forwarded else "dropped"
+        )
+        if not forwarded:
+            self._count("dropped", metric=metric, reason="late")
+    
+    def _emit(self, topic: str, metric: str, cleaned_payload: Dict[str, Any], was_modified: bool, received_at: float):
+        """发布阶段：发布一个点（或交给攒批器）并记录日志"""
+        if self.aggregator is not None:
+            self.aggregator.add(metric, cleaned_payload["ts"], cleaned_payload["value"])
+        
+        # 攒批输出（批次由 publish_batch 发布；只有批量输出时，批次交给 paho 后由 _on_sent 计数并统计延迟）
+        if self.batcher is not None:
+            self.batcher.add(metric, (cleaned_payload, received_at))
+            if not self.stream_output:
+                logger.debug(
+                    "BATCH | %s → %s%s | ts=%s | value=%s",
+                    topic, Config.BATCH_PREFIX, metric, cleaned_payload["ts"], cleaned_payload["value"]
+                )
+                return
+        
+        # 转发到输出 topic（经出站窗口，交给 paho 后由 _on_sent 计数并记录日志）
+        self.outbound.submit(
+            f"{Config.OUTPUT_PREFIX}{metric}",
+            codec.dumps(cleaned_payload),
+            ("point", metric, received_at, topic, cleaned_payload, was_modified),
+        )
+    
+    def _publish(self, topic: str, payload: bytes):
+        """出站窗口调用：交给 paho，返回 MQTTMessageInfo"""
+        return self.client.publish(topic, payload, qos=0, retain=False)
+    
+    def _on_sent(self, tag):
+        """一条消息已交给 paho：计数并记录日志（tag 见 _emit / publish_batch / publish_aggregate，统计消息为 None）"""
+        if tag is None:
+            return
+        if tag[0] == "point":
+            _, metric, received_at, topic, cleaned_payload, was_modified = tag
+            self._count_forwarded(metric, received_at)
             status = "MODIFIED" if was_modified else "FORWARD"
             logger.info(
-                f"{status} | {topic} → {output_topic} | "
-                f"ts={cleaned_payload['ts']} | value={cleaned_payload['value']}"
+                "%s | %s → %s%s | ts=%s | value=%s",
+                status, topic, Config.OUTPUT_PREFIX, metric, cleaned_payload["ts"], cleaned_payload["value"]
             )
-            
-        except Exception as e:
-            logger.error(f"Failed to publish to {output_topic}: {e}")
-            self.stats["dropped"] += 1
+        elif tag[0] == "batch":
+            _, metric, received = tag
+            if not self.stream_output:
+                # 同时有逐点输出时这些点已在 env/<metric> 发出时计过
+                self._count_forwarded_many(metric, received)
+            logger.info("BATCH | → %s%s | points=%d", Config.BATCH_PREFIX, metric, len(received))
+        else:
+            _, metric, label, payload = tag
+            logger.info(
+                "AGG | → %s%s/%s | ts=%s | count=%d | mean=%s",
+                Config.AGG_PREFIX, label, metric, payload["ts"], payload["count"], payload["mean"]
+            )
+    
+    def _on_dropped(self, tag, reason: str):
+        """一条消息被出站窗口丢弃（backpressure）或 publish 失败（publish_error）"""
+        if tag is None:
+            return
+        if tag[0] == "point":
+            _, metric, _, topic, cleaned_payload, _ = tag
+            logger.debug("DROP | topic=%s | reason=%s | ts=%s", topic, reason, cleaned_payload["ts"])
+            self._count("dropped", metric=metric, reason=reason)
+        elif tag[0] == "batch":
+            _, metric, received = tag
+            logger.warning(
+                "DROP | → %s%s | reason=%s | points=%d", Config.BATCH_PREFIX, metric, reason, len(received)
+            )
+            if not self.stream_output:
+                # 同时有逐点输出时这些点已经（或将会）按 env/<metric> 的结果计数
+                self._count("dropped", len(received), metric=metric, reason=reason)
+        else:
+            # 聚合不是点，不计入 dropped
+            _, metric, label, payload = tag
+            logger.warning(
+                "DROP | → %s%s/%s | reason=%s | ts=%s", Config.AGG_PREFIX, label, metric, reason, payload["ts"]
+            )
+    
+    def _count(self, key: str, n: int = 1, metric: Optional[str] = None, reason: Optional[str] = None):
+        """更新统计（接收、校验、发布可能在不同线程中）；给出 metric 时同时更新按 metric 的指标"""
+        if n:
+            with self._stats_lock:
+                self.stats[key] += n
+                if metric is not None:
+                    self.metrics.add(metric, key, n, reason)
+    
+    def _count_forwarded(self, metric: str, received_at: float):
+        """记一次转发，以及该点从接收到发布的耗时"""
+        latency = time.perf_counter() - received_at
+        with self._stats_lock:
+            self.stats["forwarded"] += 1
+            self.metrics.add(metric, "forwarded")
+            self.metrics.observe(metric, latency)
+    
+    def _count_forwarded_many(self, metric: str, received: Tuple[float, ...]):
+        """记一批点的转发和各自从接收到发布的耗时（批次交给 paho 时）"""
+        now = time.perf_counter()
+        with self._stats_lock:
+            self.stats["forwarded"] += len(received)
+            self.metrics.add(metric, "forwarded", len(received))
+            for received_at in received:
+                self.metrics.observe(metric, now - received_at)
+    
+    def stats_snapshot(self) -> Dict[str, Any]:
+        """实时指标（发布到 STATS_TOPIC、HTTP /stats 返回的内容）"""
+        with self._stats_lock:
+            totals = dict(self.stats)
+        metrics = self.metrics.snapshot()
+        snapshot = {
+            "ts": datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+            "instance": Config.PROXY_INSTANCE_ID,
+            "uptime_s": round(time.time() - self.metrics.started),
+            "totals": totals,
+            "rate": {
+                key: round(sum(m["rate"][key] for m in metrics.values()), 2) for key in ("received", "forwarded")
+            },
+            "metrics": metrics,
+        }
+        if self.pipeline is not None:
+            snapshot["queues"] = self.pipeline.depths()
+            snapshot["shed"] = self.pipeline.shed
+        if self.batcher is not None:
+            snapshot["batches"] = self.batcher.batches
+        if self.aggregator is not None:
+            snapshot["aggregates"] = self.aggregator.snapshot()
+        snapshot["outbound"] = self.outbound.snapshot()
+        if self.reorder is not None:
+            snapshot["reorder"] = self.reorder.snapshot()
+        return snapshot
+    
+    def render_stats(self) -> bytes:
+        return codec.dumps(self.stats_snapshot())
+    
+    def render_metrics(self) -> str:
+        gauges = {}
+        if self.pipeline is not None:
+            gauges["iot_proxy_queue_depth"] = {
+                f'queue="{name}"': depth for name, depth in self.pipeline.depths().items()
+            }
+            gauges["iot_proxy_queue_capacity"] = {"": self.pipeline.queue_size}
+        gauges["iot_proxy_outbound"] = {f'stat="{name}"': value for name, value in self.outbound.snapshot().items()}
+        if self.aggregator is not None:
+            gauges["iot_proxy_aggregates"] = {
+                f'interval="{label}",stat="{name}"': value
+                for label, stats in self.aggregator.snapshot().items()
+                for name, value in stats.items()
+            }
+        if self.reorder is not None:
+            gauges["iot_proxy_reorder"] = {
+                f'metric="{metric}",stat="{name}"': value
+                for metric, stats in self.reorder.snapshot().items()
+                for name, value in stats.items()
+            }
+        return self.metrics.render_prometheus(gauges)
+    
+    def _stats_loop(self):
+        """每 STATS_PUBLISH_INTERVAL 秒把实时指标发布到 <STATS_TOPIC>/<PROXY_INSTANCE_ID>"""
+        topic = f"{Config.STATS_TOPIC}/{Config.PROXY_INSTANCE_ID}"
+        while not self.should_stop:
+            time.sleep(Config.STATS_PUBLISH_INTERVAL)
+            if self.should_stop:
+                return
+            if not self.connected:
+                continue
+            self.outbound.submit(topic, self.render_stats())
+    
+    def _report_loop(self):
+        """每 PIPELINE_STATS_INTERVAL 秒记录一次队列深度与各阶段耗时"""
+        while not self.should_stop:
+            time.sleep(Config.PIPELINE_STATS_INTERVAL)
+            if self.pipeline is None or self.should_stop:
+                return
+            queues, stages = format_snapshot(self.pipeline.snapshot())
+            logger.info("PIPELINE | queues(depth/peak/capacity): %s", queues)
+            logger.info("PIPELINE | stages: %s", stages)
+    
+    
+    def publish_batch(self, metric: str, items):
+        """发布一批 (清洗后的点, 接收时间)（由 MicroBatcher 调用，可能在后台线程中）"""
+        points = [point for point, _ in items]
+        received = tuple(received_at for _, received_at in items)
+        self.outbound.submit(f"{Config.BATCH_PREFIX}{metric}", codec.dumps(points), ("batch", metric, received))
+    
+    def publish_aggregate(self, label: str, metric: str, payload: Dict[str, Any]):
+        """发布一个窗口的聚合（由 WindowAggregator 调用）"""
+        self.outbound.submit(
+            f"{Config.AGG_PREFIX}{label}/{metric}", codec.dumps(payload), ("agg", metric, label, payload)
+        )
     
     def stop(self):
         """停止网关"""
         logger.info("Stopping MQTT Gateway...")
         self.should_stop = True
         
+        # 断开前处理完流水线中的消息，发出重排缓冲区中的点，并发布未满的批次
+        if self.pipeline is not None:
+            self.pipeline.stop()
+        if self.reorder is not None:
+            # 流水线已停止，直接在这里发布
+            self.reorder.close(self._emit)
+        if self.batcher is not None:
+            self.batcher.close()
+        if self.aggregator is not None:
+            # 未关闭的窗口带 partial 标记发布
+            self.aggregator.flush()
+        self.outbound.flush()
+        
         if self.client and self.connected:
             self.client.disconnect()
+
+        if self.dedup_cache is not None:
+            self.dedup_cache.close()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
         
         # 打印统计信息
         logger.info("=" * 60)
         logger.info("Gateway Statistics:")
         logger.info(f"  Total received:  {self.stats['received']}")
+        if self.stats["ingest_batches"]:
+            logger.info(f"    (in batches:   {self.stats['ingest_batches']} messages)")
         logger.info(f"  Forwarded:       {self.stats['forwarded']}")
         logger.info(f"  Modified:        {self.stats['modified']}")
         logger.info(f"  Duplicated:      {self.stats['duplicated']}")
+        if self.dedup_cache is not None and self.dedup_cache.bloom is not None:
+            logger.info(f"    (Bloom tier:   {self.dedup_cache.bloom_hits})")
+        if self.dedup_cache is not None and self.dedup_cache.shared is not None:
+            logger.info(f"    (other instances: {self.dedup_cache.shared_hits})")
         logger.info(f"  Dropped:         {self.stats['dropped']}")
+        logger.info("  By metric:")
+        for metric, m in self.metrics.snapshot().items():
+            reasons = ", ".join(f"{reason}: {n}" for reason, n in sorted(m["drop_reasons"].items()))
+            logger.info(
+                f"    {metric:<12} received {m['received']}, forwarded {m['forwarded']}, "
+                f"duplicated {m['duplicated']}, dropped {m['dropped']}" + (f" ({reasons})" if reasons else "")
+            )
+        if self.batcher is not None and self.batcher.batches:
+            logger.info(
+                f"  Batches:         {self.batcher.batches} "
+                f"(avg {self.batcher.points / self.batcher.batches:.1f} points, "
+                f"{self.batcher.size_flushes} full / {self.batcher.linger_flushes} by linger)"
+            )
+        if self.reorder is not None:
+            reorder = self.reorder.snapshot().values()
+            logger.info(
+                f"  Reordered:       late {sum(r['late'] for r in reorder)} "
+                f"({sum(r['late_dropped'] for r in reorder)} dropped), "
+                f"released by max wait {sum(r['expired'] for r in reorder)}, "
+                f"by max held {sum(r['overflow'] for r in reorder)}, "
+                f"peak held {max((r['peak_held'] for r in reorder), default=0)}"
+            )
+        if self.aggregator is not None:
+            logger.info("  Aggregates:      " + ", ".join(
+                f"{label} {stats['published']} windows ({stats['late']} late points)"
+                for label, stats in self.aggregator.snapshot().items()
+            ))
+        outbound = self.outbound
+        if outbound.queued or outbound.dropped_oldest or outbound.dropped_newest or outbound.blocked or outbound.lost:
+            logger.info(
+                f"  Outbound:        queued {outbound.queued}, dropped {outbound.dropped_oldest} oldest / "
+                f"{outbound.dropped_newest} newest, blocked {outbound.blocked}x ({outbound.blocked_seconds:.1f}s), "
+                f"lost on disconnect {outbound.lost}, peak {outbound.peak_bytes} bytes / {outbound.peak_inflight} in flight"
+            )
         logger.info("=" * 60)
     
     def run(self):
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+实时指标 - Gateway Proxy 按 metric 的计数、接收到发布的延迟直方图与当前速率
+
+- 计数：每个 metric 的 received / forwarded / modified / duplicated / dropped，dropped 再按原因细分
+  （invalid_json、missing_field、invalid_ts 等固定的几类，见 reason_code）。
+  topic 不合法或 metric 未知的消息计入 "_other"，不把任意 topic 名变成标签
+- 延迟：从 paho 回调收到消息到 client.publish 返回（攒批输出为交给攒批器）的时间，
+  固定桶的直方图，与 Prometheus histogram 的桶语义相同（le，累计）
+- 速率：不在每条消息上计时，而是每次读取时记下各计数，与约 METRICS_RATE_WINDOW 秒前的那次读取相比
+  （没有更早的读取时从启动算起）。STATS_TOPIC 定期发布会保证至少每 STATS_PUBLISH_INTERVAL 秒读取一次
+
+导出两种格式：snapshot() 给出 JSON 可序列化的 dict（定期发布到 STATS_TOPIC，也由 HTTP /stats 返回），
+render_prometheus() 给出 Prometheus 文本格式（HTTP /metrics）。计数只增不减，读取不会清零，
+多个读取方互不影响。
+
+add / observe 由网关在持有 lock 时调用（与 MQTTGateway.stats 的更新共用一把锁，每条消息只加一次锁）。
+"""
+
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger("MQTTProxy")
+
+# topic 不合法或 metric 未知的消息使用的标签
+OTHER_METRIC = "_other"
+
+# 按 metric 统计的计数
+COUNTERS = ("received", "forwarded", "modified", "duplicated", "dropped")
+# 统计速率的计数
+RATE_COUNTERS = ("received", "forwarded")
+
+# 延迟直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# 校验失败原因（PayloadValidator 返回的文字）→ 丢弃原因标签，按前缀匹配
+_REASON_PREFIXES = (
+    ("Invalid JSON", "invalid_json"),
+    ("Payload must be", "not_object"),
+    ("Missing required field", "missing_field"),
+    ("Field 'ts'", "invalid_ts"),
+    ("Batch", "invalid_batch"),
+    ("Empty batch", "invalid_batch"),
+    # 规则文件（rules.py）拒绝的点
+    ("Rule 'coerce'", "invalid_value"),
+    ("Rule 'require'", "null_value"),
+    ("Rule 'range'", "out_of_range"),
+    ("Rule 'spike'", "spike"),
+)
+
+
+def reason_code(error_reason: Optional[str]) -> str:
+    """校验失败原因 → 固定的丢弃原因标签"""
+    if error_reason:
+        for prefix, code in _REASON_PREFIXES:
+            if error_reason.startswith(prefix):
+                return code
+    return "invalid"
+
+
+class LatencyHistogram:
+    """固定桶的延迟直方图（秒）"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # 最后一个桶为 +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def cumulative(self) -> List[int]:
+        total, out = 0, []
+        for n in self.counts:
+            total += n
+            out.append(total)
+        return out
+
+    def quantile(self, q: float) -> Optional[float]:
+        """q 分位数的估计：所在桶的上限（秒）；落在 +Inf 桶时返回最后一个有限上限"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        for bound, total in zip(self.buckets, self.cumulative()):
+            if total >= rank:
+                return bound
+        return self.buckets[-1]
+
+
+class GatewayMetrics:
+    """
+    按 metric 的实时指标
+
+    metrics: 已知的 metric（ALLOWED_METRICS），其余的按 OTHER_METRIC 统计
+    rate_window: 速率的统计窗口（秒）
+    lock: 与调用方共用的锁；add / observe 须在持有它时调用
+    """
+
+    def __init__(self, metrics: Iterable[str], rate_window: int = 10, lock: Optional[threading.Lock] = None):
+        self.lock = lock or threading.Lock()
+        self.rate_window = max(1, int(rate_window))
+        self.started = time.time()
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self.drop_reasons: Dict[str, Dict[str, int]] = {}
+        self.latency: Dict[str, LatencyHistogram] = {}
+        for metric in list(metrics) + [OTHER_METRIC]:
+            self.counters[metric] = dict.fromkeys(COUNTERS, 0)
+            self.drop_reasons[metric] = {}
+            self.latency[metric] = LatencyHistogram()
+        # 历次读取时的 (time.monotonic(), {metric: 各 RATE_COUNTERS 的值})，用于计算速率
+        self._samples = deque([(time.monotonic(), {metric: (0,) * len(RATE_COUNTERS) for metric in self.counters})])
+
+    def add(self, metric: str, key: str, n: int = 1, reason: Optional[str] = None) -> None:
+        """计数（调用方持有 lock）；key 为 dropped 时 reason 为丢弃原因标签"""
+        counters = self.counters.get(metric)
+        if counters is None:
+            metric = OTHER_METRIC
+            counters = self.counters[metric]
+        counters[key] += n
+        if reason is not None:
+            reasons = self.drop_reasons[metric]
+            reasons[reason] = reasons.get(reason, 0) + n
+
+    def observe(self, metric: str, seconds: float) -> None:
+        """记录一个点从接收到发布的耗时（调用方持有 lock）"""
+        histogram = self.latency.get(metric)
+        if histogram is not None:
+            histogram.observe(seconds)
+
+    def _rates(self) -> Dict[str, Dict[str, float]]:
+        """metric → {计数: 条/秒}，与约 rate_window 秒前的读取相比（调用方持有 lock）"""
+        now = time.monotonic()
+        current = {
+            metric: tuple(counters[key] for key in RATE_COUNTERS) for metric, counters in self.counters.items()
+        }
+        samples = self._samples
+        # 保留最后一个不晚于 now - rate_window 的读取作为基准
+        while len(samples) >= 2 and samples[1][0] <= now - self.rate_window:
+            samples.popleft()
+        since, base = samples[0]
+        samples.append((now, current))
+        elapsed = now - since
+        return {
+            metric: {
+                key: (values[i] - base[metric][i]) / elapsed if elapsed > 0 else 0.0
+                for i, key in enumerate(RATE_COUNTERS)
+            }
+            for metric, values in current.items()
+        }
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """metric → 计数、丢弃原因、速率（条/秒）与延迟摘要（毫秒）；没有任何消息的 _other 省略"""
+        out = {}
+        with self.lock:
+            rates = self._rates()
+            for metric, counters in self.counters.items():
+                if metric == OTHER_METRIC and not counters["received"]:
+                    continue
+                histogram = self.latency[metric]
+                latency = {"count": histogram.count}
+                if histogram.count:
+                    latency["avg_ms"] = round(histogram.sum / histogram.count * 1000, 3)
+                    for name, q in (("p50_ms", 0.5), ("p90_ms", 0.9), ("p99_ms", 0.99)):
+                        latency[name] = histogram.quantile(q) * 1000
+                out[metric] = dict(
+                    counters,
+                    drop_reasons=dict(self.drop_reasons[metric]),
+                    rate={key: round(value, 2) for key, value in rates[metric].items()},
+                    latency=latency,
+                )
+        return out
+
+    def render_prometheus(self, gauges: Optional[Dict[str, float]] = None) -> str:
+        """Prometheus 文本格式；gauges 为额外的 {名称: {标签串: 值}}（如队列深度，无标签时标签串为空）"""
+        lines = [
+            "# HELP iot_proxy_points_total Points seen by the gateway, by metric and outcome",
+            "# TYPE iot_proxy_points_total counter",
+        ]
+        with self.lock:
+            for metric, counters in self.counters.items():
+                for key, value in counters.items():
+                    lines.append(f'iot_proxy_points_total{{metric="{metric}",outcome="{key}"}} {value}')
+
+            lines += [
+                "# HELP iot_proxy_dropped_total Dropped points, by metric and reason",
+                "# TYPE iot_proxy_dropped_total counter",
+            ]
+            for metric, reasons in self.drop_reasons.items():
+                for reason, value in sorted(reasons.items()):
+                    lines.append(f'iot_proxy_dropped_total{{metric="{metric}",reason="{reason}"}} {value}')
+
+            lines += [
+                f"# HELP iot_proxy_rate Points per second over about the last {self.rate_window} seconds",
+                "# TYPE iot_proxy_rate gauge",
+            ]
+            for metric, values in self._rates().items():
+                for key, value in values.items():
+                    lines.append(f'iot_proxy_rate{{metric="{metric}",outcome="{key}"}} {value:.6g}')
+
+            lines += [
+                "# HELP iot_proxy_publish_latency_seconds Time from receiving a message to publishing the point",
+                "# TYPE iot_proxy_publish_latency_seconds histogram",
+            ]
+            for metric, histogram in self.latency.items():
+                if metric == OTHER_METRIC:
+                    continue
+                bounds = [f"{bound:g}" for bound in histogram.buckets] + ["+Inf"]
+                for bound, total in zip(bounds, histogram.cumulative()):
+                    lines.append(
+                        f'iot_proxy_publish_latency_seconds_bucket{{metric="{metric}",le="{bound}"}} {total}'
+                    )
+                lines.append(f'iot_proxy_publish_latency_seconds_sum{{metric="{metric}"}} {histogram.sum:.6f}')
+                lines.append(f'iot_proxy_publish_latency_seconds_count{{metric="{metric}"}} {histogram.count}')
+
+        lines += [
+            "# HELP iot_proxy_uptime_seconds Seconds since the gateway started",
+            "# TYPE iot_proxy_uptime_seconds gauge",
+            f"iot_proxy_uptime_seconds {time.time() - self.started:.0f}",
+        ]
+        for name, series in (gauges or {}).items():
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in series.items():
+                lines.append(f"{name}{{{labels}}} {value:g}" if labels else f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """
+    HTTP 指标端点（标准库 http.server，后台线程）
+
+    GET /metrics：Prometheus 文本格式；GET /stats：JSON（与 STATS_TOPIC 上发布的内容相同）
+    """
+
+    def __init__(self, host: str, port: int, render_text: Callable[[], str], render_json: Callable[[], bytes]):
+        routes = {
+            "/metrics": ("text/plain; version=0.0.4; charset=utf-8", lambda: render_text().encode("utf-8")),
+            "/stats": ("application/json", render_json),
+        }
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                route = routes.get(self.path.split("?", 1)[0])
+                if route is None:
+                    self.send_error(404)
+                    return
+                content_type, render = route
+                body = render()
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("METRICS HTTP | " + format, *args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.address = self.server.server_address
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self.server.shutdown()
+            self._thread = None
+        self.server.server_close()
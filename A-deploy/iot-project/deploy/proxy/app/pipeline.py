@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+处理流水线 - 把 Gateway Proxy 的接收、校验 / 去重、发布拆成三个阶段
+
+    paho 网络线程（接收）──▶ 输入队列 × N ──▶ 校验 / 去重 worker × N ──▶ 输出队列 ──▶ 发布线程
+
+- 接收：paho 回调只检查 topic 就把 (metric, payload) 放入队列，立即返回继续读 socket
+- 校验 / 去重：PIPELINE_WORKERS 个线程，每个线程一个输入队列；同一 metric 总是进入同一个 worker，
+  输出队列与发布线程都是单一 FIFO，所以同一 metric 的点保持到达顺序
+- 发布：单个线程调用 client.publish（或交给攒批器）并写转发日志
+
+队列都有上限（PIPELINE_QUEUE_SIZE）。队列满时默认阻塞上游：输出队列满会卡住 worker，
+输入队列满会卡住 paho 网络线程，压力最终传回 broker（broker 按自己的队列上限处理）；
+PIPELINE_FULL_POLICY=drop 时输入队列满直接丢弃新消息并计数。
+
+每个阶段统计上次 snapshot() 以来的处理次数、平均 / 最大耗时，连同各队列当前深度与最大深度
+一起导出：队列持续接近上限、某阶段耗时上升，即说明该阶段饱和。
+CPython 有 GIL，多个 worker 不会让纯 Python 的校验并行执行；拆分的目的是让慢步骤不再拖住 socket 读取。
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("MQTTProxy")
+
+
+class StageTimer:
+    """某个阶段的耗时统计（秒），snapshot 后清零"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            count, total, peak = self.count, self.total, self.max
+            self.count, self.total, self.max = 0, 0.0, 0.0
+        return {
+            "count": count,
+            "avg_ms": round(total / count * 1000, 3) if count else 0.0,
+            "max_ms": round(peak * 1000, 3),
+        }
+
+
+class GatewayPipeline:
+    """
+    三阶段流水线
+
+    workers: 校验 / 去重 worker 数
+    queue_size: 每个队列的上限
+    handle: handle(item, emit) 在 worker 中处理一条输入，每产出一个结果调用一次 emit(*out)
+    publish: publish(*out) 在发布线程中发布一个结果
+    full_policy: 输入队列满时 "block"（阻塞接收线程）或 "drop"（丢弃并计数）
+    """
+
+    # 阶段名（snapshot 中的键）
+    STAGES = ("queue_wait", "validate", "publish_wait", "publish")
+
+    def __init__(
+        self,
+        workers: int,
+        queue_size: int,
+        handle: Callable[[Any, Callable[..., None]], None],
+        publish: Callable[..., None],
+        full_policy: str = "block",
+    ):
+        self.workers = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.handle = handle
+        self.publish = publish
+        self.full_policy = full_policy
+        self.inputs: List[queue.Queue] = [queue.Queue(self.queue_size) for _ in range(self.workers)]
+        self.output: queue.Queue = queue.Queue(self.queue_size)
+        self.timers = {stage: StageTimer() for stage in self.STAGES}
+        # 自上次 snapshot 以来各队列的最大深度
+        self._peaks = [0] * (self.workers + 1)
+        # key → worker 编号（只在接收线程中读写）
+        self._shards: Dict[str, int] = {}
+        self.shed = 0
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        for index in range(self.workers):
+            self._threads.append(threading.Thread(
+                target=self._work, args=(index,), name=f"pipeline-worker-{index}", daemon=True
+            ))
+        self._threads.append(threading.Thread(target=self._publish_loop, name="pipeline-publisher", daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def shard(self, key: str) -> int:
+        """key（metric）→ worker 编号：新 key 按首次出现的顺序轮流分配，之后固定不变"""
+        index = self._shards.get(key)
+        if index is None:
+            index = self._shards[key] = len(self._shards) % self.workers
+        return index
+
+    def submit(self, key: str, item: Any) -> bool:
+        """接收阶段：放入 key 对应 worker 的输入队列；按 drop 策略丢弃时返回 False"""
+        index = self.shard(key)
+        entry = (time.perf_counter(), item)
+        target = self.inputs[index]
+        if self.full_policy == "drop":
+            try:
+                target.put_nowait(entry)
+            except queue.Full:
+                self.shed += 1
+                return False
+        else:
+            self._put(target, entry)
+        depth = target.qsize()
+        if depth > self._peaks[index]:
+            self._peaks[index] = depth
+        return True
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """处理完已入队的消息后停止（最多等 timeout 秒）"""
+        if not self._threads:
+            return
+        deadline = time.monotonic() + timeout
+        for target in self.inputs:
+            self._put(target, None, deadline)
+        for thread in self._threads[:-1]:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._put(self.output, None, deadline)
+        self._threads[-1].join(max(0.0, deadline - time.monotonic()))
+        self._stopping.set()
+        self._threads = []
+
+    def snapshot(self) -> Dict[str, Any]:
+        """各队列深度（当前 / 最大 / 上限）与各阶段耗时，最大深度与耗时在读取后清零"""
+        peaks, self._peaks = self._peaks, [0] * (self.workers + 1)
+        queues = {
+            f"input_{index}": {"depth": target.qsize(), "peak": peaks[index], "capacity": self.queue_size}
+            for index, target in enumerate(self.inputs)
+        }
+        queues["output"] = {"depth": self.output.qsize(), "peak": peaks[-1], "capacity": self.queue_size}
+        return {
+            "workers": self.workers,
+            "queues": queues,
+            "stages": {stage: timer.snapshot() for stage, timer in self.timers.items()},
+            "shed": self.shed,
+        }
+
+    def depths(self) -> Dict[str, int]:
+        """各队列当前深度（不影响 snapshot 的最大深度与耗时统计）"""
+        depths = {f"input_{index}": target.qsize() for index, target in enumerate(self.inputs)}
+        depths["output"] = self.output.qsize()
+        return depths
+
+    def _put(self, target: queue.Queue, entry, deadline: Optional[float] = None) -> None:
+        """阻塞放入；停止后或超过 deadline 时放弃"""
+        while not self._stopping.is_set():
+            try:
+                target.put(entry, timeout=0.5)
+                return
+            except queue.Full:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return
+
+    def _emit(self, *out) -> None:
+        self._put(self.output, (time.perf_counter(), out))
+        depth = self.output.qsize()
+        if depth > self._peaks[-1]:
+            self._peaks[-1] = depth
+
+    def _work(self, index: int) -> None:
+        source = self.inputs[index]
+        queue_wait = self.timers["queue_wait"]
+        validate = self.timers["validate"]
+        while True:
+            entry = source.get()
+            if entry is None:
+                return
+            enqueued_at, item = entry
+            started = time.perf_counter()
+            queue_wait.record(started - enqueued_at)
+            try:
+                self.handle(item, self._emit)
+            except Exception:
+                logger.exception("Pipeline worker %d failed to process a message", index)
+            finally:
+                validate.record(time.perf_counter() - started)
+
+    def _publish_loop(self) -> None:
+        publish_wait = self.timers["publish_wait"]
+        publish = self.timers["publish"]
+        while True:
+            entry = self.output.get()
+            if entry is None:
+                return
+            enqueued_at, out = entry
+            started = time.perf_counter()
+            publish_wait.record(started - enqueued_at)
+            try:
+                self.publish(*out)
+            except Exception:
+                logger.exception("Pipeline publisher failed")
+            finally:
+                publish.record(time.perf_counter() - started)
+
+
+def format_snapshot(snapshot: Dict[str, Any]) -> Tuple[str, str]:
+    """snapshot → (队列行, 阶段行)，用于日志"""
+    queues = " ".join(
+        f"{name}={q['depth']}/{q['peak']}/{q['capacity']}" for name, q in snapshot["queues"].items()
+    )
+    stages = " ".join(
+        f"{name}={s['count']}x avg {s['avg_ms']:.2f}ms max {s['max_ms']:.2f}ms"
+        for name, s in snapshot["stages"].items()
+    )
+    return queues, stages
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+乱序重排 - Gateway Proxy 按 metric 缓存点，按 ts 顺序发出
+
+并行的发布者、回放脚本会让同一 metric 的点不按 ts 顺序到达，collector 和每个实时图表都得自己排序
+（如 D-ui 的 SubscriptionWidget.redraw_chart）。ReorderBuffer 放在去重之后、发布之前：
+
+- 每个 metric 一个小顶堆，按 (ts, 到达序号) 排序
+- 水位线 = 该 metric 已见过的最大 ts - REORDER_MAX_LATENESS（秒，按 ts 计，不是墙钟）；
+  ts 不晚于水位线的点按 ts 顺序发出。同一时刻的点按到达顺序发出
+- 迟到：ts 早于该 metric 已发出的最后一个点（已经越过水位线），单独计数（late），
+  按 REORDER_LATE_POLICY 立即发出（forward，该点与前后的点乱序）或丢弃（drop）
+- 实时流中下一个点可能要很久才来，所以每个点最多在缓冲区中停留 REORDER_MAX_WAIT_MS 毫秒（墙钟）：
+  最早到达的点超时后，发出它以及 ts 不晚于它的所有点（expired）
+- 每个 metric 最多缓存 REORDER_MAX_HELD 个点，超出时发出 ts 最小的点（overflow）
+
+发出的点仍然有序：水位线、超时、超出上限都只从堆顶取点。emit 在持有锁时调用，
+这样工作线程与后台超时线程发出的点不会交错；emit 应尽快返回（流水线的输出队列满时会阻塞其他 metric 的 add）。
+"""
+
+import collections
+import heapq
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+LATE_POLICIES = ("forward", "drop")
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def ts_seconds(ts: str) -> Optional[float]:
+    """ts → 自 1970-01-01 起的秒数（带时区的先换算到 UTC，不带时区的按 UTC 处理）；无法解析时返回 None"""
+    try:
+        dt = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return (dt - _EPOCH).total_seconds()
+
+
+class _MetricBuffer:
+    """一个 metric 的缓冲区与统计"""
+
+    __slots__ = (
+        "heap", "arrivals", "seq", "max_key", "last_key", "emit",
+        "peak_held", "released", "late", "late_dropped", "expired", "overflow", "hold_total", "hold_max",
+    )
+
+    def __init__(self):
+        # 堆中的元素：[ts 秒数, 到达序号, 到达时间, out]；发出后 out 置为 None
+        self.heap: List[list] = []
+        # 同样的元素，按到达顺序（找最早到达、还没发出的点）
+        self.arrivals: Deque[list] = collections.deque()
+        self.seq = 0
+        self.max_key: Optional[float] = None
+        self.last_key: Optional[float] = None
+        self.emit: Optional[Callable[..., None]] = None
+        self.peak_held = 0
+        self.released = 0
+        self.late = 0
+        self.late_dropped = 0
+        self.expired = 0
+        self.overflow = 0
+        self.hold_total = 0.0
+        self.hold_max = 0.0
+
+
+class ReorderBuffer:
+    """
+    按 metric 的乱序重排缓冲区
+
+    max_lateness: 水位线落后已见最大 ts 的秒数
+    max_wait_ms: 每个点最多停留的毫秒数（0 表示不限，只由水位线和 max_held 发出）
+    max_held: 每个 metric 最多缓存的点数（0 表示不限）
+    late_policy: 迟到点的处理方式，见 LATE_POLICIES
+    on_late: on_late(out, forwarded) 在迟到点被发出或丢弃前调用（不持有锁）
+    """
+
+    def __init__(
+        self,
+        max_lateness: float,
+        max_wait_ms: float = 0,
+        max_held: int = 0,
+        late_policy: str = "forward",
+        on_late: Optional[Callable[[Any, bool], None]] = None,
+    ):
+        self.max_lateness = max(0.0, max_lateness)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.max_held = max(0, max_held)
+        self.late_policy = late_policy
+        self.on_late = on_late
+        self._cond = threading.Condition()
+        self._buffers: Dict[str, _MetricBuffer] = {}
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self.max_wait:
+            self._thread = threading.Thread(target=self._run, name="reorder-expire", daemon=True)
+            self._thread.start()
+
+    def add(self, metric: str, ts: str, out: tuple, emit: Callable[..., None]) -> None:
+        """加入一个点；可以发出的点（按 ts 顺序）调用 emit(*out)"""
+        key = ts_seconds(ts)
+        now = time.perf_counter()
+        with self._cond:
+            buffer = self._buffers.get(metric)
+            if buffer is None:
+                buffer = self._buffers[metric] = _MetricBuffer()
+            buffer.emit = emit
+            if key is None:
+                # 校验过的 ts 都能解析，这里只是兜底：不参与排序，直接发出
+                emit(*out)
+                return
+            late = buffer.last_key is not None and key < buffer.last_key
+            if late:
+                buffer.late += 1
+                forwarded = self.late_policy != "drop"
+                if not forwarded:
+                    buffer.late_dropped += 1
+            else:
+                entry = [key, buffer.seq, now, out]
+                buffer.seq += 1
+                if not buffer.heap and self.max_wait:
+                    # 新的超时截止时间
+                    self._cond.notify()
+                heapq.heappush(buffer.heap, entry)
+                buffer.arrivals.append(entry)
+                if len(buffer.heap) > buffer.peak_held:
+                    buffer.peak_held = len(buffer.heap)
+                if buffer.max_key is None or key > buffer.max_key:
+                    buffer.max_key = key
+                watermark = buffer.max_key - self.max_lateness
+                heap = buffer.heap
+                while heap and heap[0][0] <= watermark:
+                    self._release(buffer, now)
+                while self.max_held and len(heap) > self.max_held:
+                    buffer.overflow += 1
+                    self._release(buffer, now)
+                self._trim(buffer)
+                return
+        if self.on_late is not None:
+            self.on_late(out, forwarded)
+        if forwarded:
+            # 迟到点不进缓冲区，也不改变 last_key（后面的点仍按已发出的顺序判断）
+            with self._cond:
+                emit(*out)
+
+    def flush(self, emit: Optional[Callable[..., None]] = None) -> None:
+        """按 ts 顺序发出所有缓存的点；给出 emit 时用它代替各 metric 最近一次 add 的 emit"""
+        now = time.perf_counter()
+        with self._cond:
+            for buffer in self._buffers.values():
+                while buffer.heap:
+                    self._release(buffer, now, emit)
+                buffer.arrivals.clear()
+
+    def close(self, emit: Optional[Callable[..., None]] = None) -> None:
+        """停止后台线程并发出剩余的点"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush(emit)
+
+    def held(self) -> int:
+        with self._cond:
+            return sum(len(buffer.heap) for buffer in self._buffers.values())
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """metric → 当前 / 最大缓存点数、发出与迟到计数、停留时间（毫秒）"""
+        out = {}
+        with self._cond:
+            for metric, buffer in self._buffers.items():
+                out[metric] = {
+                    "held": len(buffer.heap),
+                    "peak_held": buffer.peak_held,
+                    "released": buffer.released,
+                    "late": buffer.late,
+                    "late_dropped": buffer.late_dropped,
+                    "expired": buffer.expired,
+                    "overflow": buffer.overflow,
+                    "avg_hold_ms": round(buffer.hold_total / buffer.released * 1000, 3) if buffer.released else 0.0,
+                    "max_hold_ms": round(buffer.hold_max * 1000, 3),
+                }
+        return out
+
+    def _release(self, buffer: _MetricBuffer, now: float, emit: Optional[Callable[..., None]] = None) -> None:
+        """发出堆顶的点（调用方持有锁）"""
+        entry = heapq.heappop(buffer.heap)
+        key, _, arrived, out = entry
+        entry[3] = None
+        buffer.last_key = key
+        buffer.released += 1
+        hold = now - arrived
+        buffer.hold_total += hold
+        if hold > buffer.hold_max:
+            buffer.hold_max = hold
+        (emit or buffer.emit)(*out)
+
+    @staticmethod
+    def _trim(buffer: _MetricBuffer) -> None:
+        """去掉 arrivals 队头已发出的点（调用方持有锁）"""
+        arrivals = buffer.arrivals
+        while arrivals and arrivals[0][3] is None:
+            arrivals.popleft()
+
+    def _run(self) -> None:
+        """最早到达的点超过 max_wait 时，发出它以及 ts 不晚于它的点"""
+        with self._cond:
+            while not self._stopping:
+                now = time.perf_counter()
+                next_due = None
+                for buffer in self._buffers.values():
+                    arrivals = buffer.arrivals
+                    self._trim(buffer)
+                    while arrivals and arrivals[0][2] + self.max_wait <= now:
+                        key = arrivals[0][0]
+                        heap = buffer.heap
+                        while heap and heap[0][0] <= key:
+                            buffer.expired += 1
+                            self._release(buffer, now)
+                        self._trim(buffer)
+                    if arrivals:
+                        due = arrivals[0][2] + self.max_wait
+                        if next_due is None or due < next_due:
+                            next_due = due
+                self._cond.wait(None if next_due is None else max(0.0, next_due - now))
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+转换与校验规则 - Gateway Proxy 从声明式规则文件编译出按 metric 的 value 处理链
+
+规则文件（RULES_PATH，JSON）：
+
+    {
+      "metrics": {
+        "temperature": [
+          {"type": "coerce"},
+          {"type": "unit", "from": "F", "to": "C"},
+          {"type": "range", "min": -40, "max": 60, "action": "drop"},
+          {"type": "spike", "max_delta": 8, "action": "drop"},
+          {"type": "round", "digits": 1}
+        ],
+        "humidity": [...]
+      },
+      "default": [...]
+    }
+
+- "metrics" 的键就是允许的 metric（代替 ALLOWED_METRICS）；没有列出规则的 metric 用 "default"，
+  都没有时用内置的清洗（与 PayloadValidator._clean_value 相同）。"default" 为每个 metric 单独编译一份
+  （第一次用到时），spike 这类带状态的规则不会在 metric 之间共享上一个值
+- 启动时每条规则编译成一个闭包（参数在编译时绑定），每个 metric 的链是这些闭包的元组；
+  每条消息只是依次调用，不再查字典、解释规则
+- 链的第一条不是 coerce 时自动在最前面加一条默认的 coerce，后面的规则只会看到数字或 null
+- 规则拒绝一个点时抛出 RuleRejected，原因以 "Rule '<type>'" 开头（metrics.reason_code 据此给出丢弃原因）
+
+规则类型（value 为 null 时除 require 外都原样通过）：
+
+- coerce：字符串数字转为数字；null_strings 中的字符串（默认 [""]）转为 null；
+  无法转换的字符串和其他类型按 invalid 处理："null"（默认，转为 null）或 "drop"
+- require：value 为 null 时丢弃
+- range：min / max（可只给一个），超出时 action 为 "drop"（默认）、"null" 或 "clamp"
+- linear：value × scale + offset
+- unit：from / to 单位换算（见 UNITS，同一类单位之间），编译成一次乘加
+- spike：与基准值（该 metric 上一个通过的值）相差超过 max_delta 时，action 为 "drop"（默认）、"null"
+  或 "hold"（用基准值代替）；按处理顺序比较（开启乱序重排时仍是到达顺序）。
+  连续 reanchor 个（默认 3）被拒绝的值彼此相差都不超过 max_delta 时视为真实的跳变：
+  第 reanchor 个值通过并成为新的基准，之后按新水平比较（单个离群点不会改变基准，
+  真实的水平变化最多被拒绝 reanchor - 1 个点，不会让过滤器永远卡在旧值上）
+- round：保留 digits 位小数（默认 0）
+"""
+
+import json
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 单位 → (类别, a, b)：基准单位的值 = value × a + b
+UNITS = {
+    "K": ("temperature", 1.0, 0.0),
+    "C": ("temperature", 1.0, 273.15),
+    "F": ("temperature", 5 / 9, 459.67 * 5 / 9),
+    "Pa": ("pressure", 1.0, 0.0),
+    "hPa": ("pressure", 100.0, 0.0),
+    "mbar": ("pressure", 100.0, 0.0),
+    "kPa": ("pressure", 1000.0, 0.0),
+    "mmHg": ("pressure", 133.322387415, 0.0),
+    "fraction": ("ratio", 1.0, 0.0),
+    "%": ("ratio", 0.01, 0.0),
+}
+
+ACTIONS = {
+    "range": ("drop", "null", "clamp"),
+    "spike": ("drop", "null", "hold"),
+}
+
+
+class RuleRejected(Exception):
+    """规则拒绝了一个点（消息为丢弃原因）"""
+
+
+class RuleError(ValueError):
+    """规则文件不合法"""
+
+
+Step = Callable[[Any], Any]
+Chain = Callable[[Any], Tuple[Any, bool]]
+
+
+# ==================== 各类规则 ====================
+def _number(name: str, value) -> None:
+    if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+        raise RuleError(f"{name} must be a number, got {value!r}")
+
+
+def _coerce(null_strings=("",), invalid="null") -> Step:
+    if not isinstance(null_strings, (list, tuple)) or not all(isinstance(s, str) for s in null_strings):
+        raise RuleError("coerce null_strings must be a list of strings")
+    if invalid not in ("null", "drop"):
+        raise RuleError(f"unknown invalid '{invalid}' for coerce (known: null, drop)")
+    null_strings = frozenset(null_strings)
+    drop = invalid == "drop"
+
+    def coerce(value):
+        if value is None or value.__class__ in (int, float):
+            return value
+        if isinstance(value, str):
+            if value in null_strings:
+                return None
+            try:
+                return int(value) if "." not in value else float(value)
+            except ValueError:
+                pass
+        elif isinstance(value, (int, float)):
+            # bool 等 int / float 的子类，与内置清洗一样当作数字
+            return value
+        if drop:
+            raise RuleRejected(f"Rule 'coerce' rejected value: {value!r}")
+        return None
+
+    return coerce
+
+
+def _require() -> Step:
+    def require(value):
+        if value is None:
+            raise RuleRejected("Rule 'require' rejected value: null")
+        return value
+
+    return require
+
+
+def _range(min=None, max=None, action="drop") -> Step:
+    if min is None and max is None:
+        raise RuleError("range needs min or max")
+    _number("min", min)
+    _number("max", max)
+    low = float("-inf") if min is None else min
+    high = float("inf") if max is None else max
+    if low > high:
+        raise RuleError(f"range min {min} is greater than max {max}")
+
+    def check(value):
+        if value is None or low <= value <= high:
+            return value
+        if action == "clamp":
+            return low if value < low else high
+        if action == "null":
+            return None
+        raise RuleRejected(f"Rule 'range' rejected value: {value} (outside [{min}, {max}])")
+
+    return check
+
+
+def _linear(scale=1.0, offset=0.0) -> Step:
+    _number("scale", scale)
+    _number("offset", offset)
+
+    def linear(value):
+        return value if value is None else value * scale + offset
+
+    return linear
+
+
+def _unit(**params) -> Step:
+    source, target = params.get("from"), params.get("to")
+    for unit in (source, target):
+        if unit not in UNITS:
+            raise RuleError(f"unknown unit '{unit}' (known: {', '.join(UNITS)})")
+    kind_from, a_from, b_from = UNITS[source]
+    kind_to, a_to, b_to = UNITS[target]
+    if kind_from != kind_to:
+        raise RuleError(f"cannot convert {source} ({kind_from}) to {target} ({kind_to})")
+    # value → 基准单位 → 目标单位，合并成一次乘加
+    return _linear(a_from / a_to, (b_from - b_to) / a_to)
+
+
+def _spike(max_delta=None, action="drop", reanchor=3) -> Step:
+    _number("max_delta", max_delta)
+    if max_delta is None or max_delta < 0:
+        raise RuleError("spike needs a non-negative max_delta")
+    if isinstance(reanchor, bool) or not isinstance(reanchor, int) or reanchor < 1:
+        raise RuleError("spike reanchor must be a positive integer")
+    last = None
+    # 连续被拒绝、彼此相差不超过 max_delta 的值：最近一个和个数
+    pending = None
+    rejected = 0
+
+    def spike(value):
+        nonlocal last, pending, rejected
+        if value is None:
+            return value
+        if last is not None and abs(value - last) > max_delta:
+            if pending is not None and abs(value - pending) <= max_delta:
+                rejected += 1
+            else:
+                rejected = 1
+            pending = value
+            if rejected < reanchor:
+                if action == "hold":
+                    return last
+                if action == "null":
+                    return None
+                raise RuleRejected(f"Rule 'spike' rejected value: {value} (previous {last}, max delta {max_delta})")
+        last = value
+        pending = None
+        rejected = 0
+        return value
+
+    return spike
+
+
+def _round(digits=0) -> Step:
+    if not isinstance(digits, int):
+        raise RuleError("round digits must be an integer")
+
+    def round_value(value):
+        return value if value is None else round(value, digits)
+
+    return round_value
+
+
+BUILDERS: Dict[str, Callable[..., Step]] = {
+    "coerce": _coerce,
+    "require": _require,
+    "range": _range,
+    "linear": _linear,
+    "unit": _unit,
+    "spike": _spike,
+    "round": _round,
+}
+
+
+# ==================== 编译 ====================
+def compile_step(spec: Dict[str, Any]) -> Step:
+    """一条规则 → 闭包；参数不合法时抛出 RuleError"""
+    if not isinstance(spec, dict) or "type" not in spec:
+        raise RuleError(f"rule must be an object with a 'type': {spec!r}")
+    params = dict(spec)
+    kind = params.pop("type")
+    builder = BUILDERS.get(kind)
+    if builder is None:
+        raise RuleError(f"unknown rule type '{kind}' (known: {', '.join(BUILDERS)})")
+    action = params.get("action")
+    if action is not None and action not in ACTIONS.get(kind, ()):
+        raise RuleError(f"unknown action '{action}' for {kind} (known: {', '.join(ACTIONS.get(kind, ()))})")
+    try:
+        return builder(**params)
+    except TypeError as e:
+        raise RuleError(f"bad parameters for {kind}: {e}") from None
+
+
+def compile_chain(specs: List[Dict[str, Any]]) -> Chain:
+    """
+    一个 metric 的规则列表 → chain(value) -> (cleaned_value, was_modified)，
+    签名与 PayloadValidator._clean_value 相同，被拒绝时抛出 RuleRejected
+    """
+    if not isinstance(specs, list):
+        raise RuleError("rules must be a list")
+    steps = []
+    for index, spec in enumerate(specs):
+        try:
+            steps.append(compile_step(spec))
+        except RuleError as e:
+            raise RuleError(f"rule {index + 1}: {e}") from None
+    if not specs or specs[0].get("type") != "coerce":
+        steps.insert(0, _coerce())
+    steps = tuple(steps)
+
+    def chain(value):
+        original = value
+        for step in steps:
+            value = step(value)
+        # value 被改变才算修正（round 之后数值不变、23 → 23.0 这样数值相等的不算）
+        return value, value is not original and value != original
+
+    chain.steps = steps
+    return chain
+
+
+class RuleSet:
+    """编译好的规则：metric → chain"""
+
+    def __init__(self, spec: Dict[str, Any]):
+        if not isinstance(spec, dict):
+            raise RuleError("rule file must be a JSON object")
+        unknown = set(spec) - {"metrics", "default"}
+        if unknown:
+            raise RuleError(f"unknown top-level keys: {', '.join(sorted(unknown))}")
+        self.chains: Dict[str, Chain] = {}
+        metrics = spec.get("metrics", {})
+        if not isinstance(metrics, dict):
+            raise RuleError("'metrics' must be an object of metric → rules")
+        for metric, specs in metrics.items():
+            try:
+                self.chains[metric] = compile_chain(specs) if specs is not None else None
+            except RuleError as e:
+                raise RuleError(f"metrics.{metric}: {e}") from None
+        # default 在这里只编译一次用于校验；实际的链按 metric 在 chain_for 中各编译一份
+        self._default_specs = spec.get("default")
+        try:
+            self.default: Optional[Chain] = compile_chain(self._default_specs) if "default" in spec else None
+        except RuleError as e:
+            raise RuleError(f"default: {e}") from None
+        self._lock = threading.Lock()
+        # 列出的 metric 即允许的 metric（为空时沿用 ALLOWED_METRICS）
+        self.metrics = list(metrics)
+
+    def chain_for(self, metric: str) -> Optional[Chain]:
+        """metric 的处理链；为 None 时用内置清洗"""
+        chain = self.chains.get(metric)
+        if chain is not None or self.default is None:
+            return chain
+        with self._lock:
+            chain = self.chains.get(metric)
+            if chain is None:
+                chain = self.chains[metric] = compile_chain(self._default_specs)
+        return chain
+
+    def describe(self) -> Dict[str, int]:
+        """metric → 规则条数（含自动加上的 coerce），用于日志"""
+        out = {metric: len(chain.steps) for metric, chain in self.chains.items() if chain is not None}
+        if self.default is not None:
+            out["default"] = len(self.default.steps)
+        return out
+
+
+def load_rules(path: str) -> RuleSet:
+    """读取并编译规则文件；文件不存在或不合法时抛出 OSError / RuleError"""
+    with open(path, encoding="utf-8") as f:
+        try:
+            spec = json.load(f)
+        except ValueError as e:
+            raise RuleError(f"invalid JSON: {e}") from None
+    return RuleSet(spec)
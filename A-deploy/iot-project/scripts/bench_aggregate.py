@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+边缘预聚合基准：WindowAggregator 每个点的开销，以及聚合 topic 相对原始点的消息数 / 字节数
+
+用法（在 iot-project 目录下）：
+    python3 scripts/bench_aggregate.py
+    python3 scripts/bench_aggregate.py --points 90000 --intervals 1m,1h,1d
+
+工作负载：三个 metric 轮流，每个 metric 的点间隔 10 分钟（与数据集相同），按 ts 顺序到达；
+--null-ratio 比例的点 value 为 null。每组 --intervals 测：
+- add 每个点的耗时（含关闭窗口时的 publish 回调，回调只编码 payload，不含 MQTT 发送）
+- 每个 interval 发布的窗口数与 payload 字节数，和原始点（env/<metric> 的 payload）相比
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "deploy", "proxy", "app")
+sys.path.insert(0, APP_DIR)
+
+from aggregate import WindowAggregator, parse_intervals  # noqa: E402
+
+METRICS = ("temperature", "humidity", "pressure")
+
+
+def make_points(points: int, null_ratio: float, seed: int):
+    rng = random.Random(seed)
+    start = datetime(2014, 2, 13)
+    out = []
+    for i in range(points):
+        metric = METRICS[i % len(METRICS)]
+        ts = (start + timedelta(minutes=10 * (i // len(METRICS)))).strftime("%Y-%m-%dT%H:%M:%S")
+        value = None if rng.random() < null_ratio else round(rng.uniform(-10, 35), 1)
+        out.append((metric, ts, value))
+    return out
+
+
+def run(points, spec: str, lateness: float):
+    """返回 (每点耗时 µs, {interval: [窗口数, 字节数]})"""
+    published = {label: [0, 0] for label in parse_intervals(spec)}
+
+    def publish(label, metric, payload):
+        stats = published[label]
+        stats[0] += 1
+        stats[1] += len(json.dumps(payload, separators=(",", ":")))
+
+    best = None
+    for _ in range(3):
+        for stats in published.values():
+            stats[:] = [0, 0]
+        aggregator = WindowAggregator(parse_intervals(spec), lateness, publish)
+        t0 = time.perf_counter()
+        for metric, ts, value in points:
+            aggregator.add(metric, ts, value)
+        elapsed = time.perf_counter() - t0
+        aggregator.flush()
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(points) * 1e6, published
+
+
+def main():
+    parser = argparse.ArgumentParser(description="边缘预聚合：每点开销与聚合 topic 的流量")
+    parser.add_argument("--points", type=int, default=90000, help="点数（三个 metric 轮流）")
+    parser.add_argument("--intervals", default="1h;1m,1h,1d", help="分号分隔的多组 AGG_INTERVALS")
+    parser.add_argument("--lateness", type=float, default=600, help="AGG_MAX_LATENESS（秒）")
+    parser.add_argument("--null-ratio", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    points = make_points(args.points, args.null_ratio, args.seed)
+    raw_bytes = sum(len(json.dumps({"ts": ts, "value": value}, separators=(",", ":"))) for _, ts, value in points)
+    print(f"{len(points)} raw points, {raw_bytes / 1024:.0f} KB of payload")
+    print(f"{'intervals':>12}{'µs/pt':>7}{'interval':>9}{'windows':>9}{'KB':>8}{'msgs vs raw':>12}{'bytes vs raw':>13}")
+    for spec in args.intervals.split(";"):
+        per_point, published = run(points, spec, args.lateness)
+        for i, (label, (windows, size)) in enumerate(published.items()):
+            cost = f"{per_point:.2f}" if i == 0 else ""
+            print(f"{spec if i == 0 else '':>12}{cost:>7}{label:>9}{windows:>9}"
+                  f"{size / 1024:>8.1f}{windows / len(points):>12.4f}{size / raw_bytes:>13.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+去重存储微基准 - 对比旧版 DedupCache（每条消息全量扫描过期条目）与 dedup.py
+
+用法（在 iot-project 目录下）：
+    python3 scripts/bench_dedup.py
+    python3 scripts/bench_dedup.py --sizes 1000,10000,100000,1000000 --ops 50000
+
+测量内容：
+1. 每条消息的平均耗时（缓存已填满 size 个 key，之后 90% 新 key + 10% 重复 key）
+2. Bloom 层：按设计容量插入后，用从未出现过的 key 实测误判率，以及内存占用
+3. 持久化：开启去重日志后的每条消息耗时，以及重启时重放日志的耗时
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "deploy", "proxy", "app"))
+
+from dedup import DedupCache, GenerationalBloom  # noqa: E402
+
+# 旧版每条消息是 O(size)，大缓存时只跑这么多条
+LEGACY_MAX_WORK = 2 * 10 ** 8
+
+
+class LegacyDedupCache:
+    """改造前的实现（每条消息扫描全部条目清理过期项）"""
+
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cache = OrderedDict()
+
+    def is_duplicate(self, metric: str, ts: str) -> bool:
+        key = f"{metric}:{ts}"
+        current_time = time.time()
+        self._evict_expired(current_time)
+        if key in self.cache:
+            return True
+        self.cache[key] = current_time
+        if len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+        return False
+
+    def _evict_expired(self, current_time: float):
+        keys_to_remove = [
+            key for key, timestamp in self.cache.items()
+            if current_time - timestamp > self.ttl
+        ]
+        for key in keys_to_remove:
+            del self.cache[key]
+
+
+def make_workload(size: int, ops: int, seed: int):
+    """预填充 size 个 key，之后 ops 条消息：90% 新 key，10% 重复最近的 key"""
+    rng = random.Random(seed)
+    prefill = [f"2014-01-01T00:00:{i}" for i in range(size)]
+    messages = []
+    next_id = size
+    for _ in range(ops):
+        if rng.random() < 0.1:
+            messages.append(f"2014-01-01T00:00:{next_id - 1 - rng.randrange(min(size, 100))}")
+        else:
+            messages.append(f"2014-01-01T00:00:{next_id}")
+            next_id += 1
+    return prefill, messages
+
+
+def time_cache(cache, prefill, messages) -> float:
+    """返回每条消息的平均耗时（微秒）"""
+    if isinstance(cache, LegacyDedupCache):
+        # 旧版逐条预填充是 O(size²)，直接写入
+        now = time.time()
+        cache.cache.update((f"temperature:{ts}", now) for ts in prefill)
+    else:
+        for ts in prefill:
+            cache.is_duplicate("temperature", ts)
+    t0 = time.perf_counter()
+    for ts in messages:
+        cache.is_duplicate("temperature", ts)
+    return (time.perf_counter() - t0) / len(messages) * 1e6
+
+
+def bench_sizes(sizes, ops, seed):
+    print(f"{'size':>9} {'legacy us/op':>13} {'new us/op':>10} {'bloom us/op':>12} {'journal us/op':>14}")
+    for size in sizes:
+        prefill, messages = make_workload(size, ops, seed)
+
+        legacy_ops = max(100, min(ops, LEGACY_MAX_WORK // max(size, 1) // 10))
+        legacy = time_cache(LegacyDedupCache(size, 10 ** 9), prefill, messages[:legacy_ops])
+        new = time_cache(DedupCache(size, 10 ** 9), prefill, messages)
+        bloom = time_cache(DedupCache(size, 10 ** 9, bloom_capacity=size + ops), prefill, messages)
+        with tempfile.TemporaryDirectory() as tmp:
+            journal = time_cache(
+                DedupCache(size, 10 ** 9, persist_path=os.path.join(tmp, "dedup.log")), prefill, messages
+            )
+        print(f"{size:>9} {legacy:>13.2f} {new:>10.2f} {bloom:>12.2f} {journal:>14.2f}")
+
+
+def bench_bloom(capacity: int, fp_rate: float, probes: int):
+    """capacity 个 key 均匀分布在一个 TTL 窗口内写入，之后用新 key 测误判率"""
+    ttl = 300
+    bloom = GenerationalBloom(ttl=ttl, capacity=capacity, fp_rate=fp_rate)
+    start = time.time()
+    t0 = time.perf_counter()
+    for i in range(capacity):
+        bloom.add(f"temperature:{i}", start + ttl * i / capacity)
+    insert_us = (time.perf_counter() - t0) / capacity * 1e6
+    now = start + ttl
+    t0 = time.perf_counter()
+    false_positives = sum(bloom.contains(f"humidity:{i}", now) for i in range(probes))
+    probe_us = (time.perf_counter() - t0) / probes * 1e6
+    memory = sum(len(f.bits) for _, f in bloom.filters)
+    print(f"Bloom capacity={capacity}, budget={fp_rate}: measured false-positive rate "
+          f"{false_positives / probes:.5f} ({false_positives}/{probes}), "
+          f"insert {insert_us:.2f} us/key, probe {probe_us:.2f} us/key, "
+          f"{len(bloom.filters)} generations, {memory / 1024 / 1024:.2f} MiB")
+
+
+def bench_restore(size: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "dedup.log")
+        cache = DedupCache(size, 10 ** 9, persist_path=path)
+        for i in range(size):
+            cache.is_duplicate("temperature", f"2014-01-01T00:00:{i}")
+        cache.close()
+        t0 = time.perf_counter()
+        restored = DedupCache(size, 10 ** 9, persist_path=path)
+        elapsed = time.perf_counter() - t0
+        restored.close()
+        print(f"Journal restore: {len(restored)} keys in {elapsed:.2f}s "
+              f"({os.path.getsize(path) / 1024 / 1024:.1f} MiB on disk)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="去重存储微基准")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000", help="逗号分隔的缓存大小")
+    parser.add_argument("--ops", type=int, default=50000, help="每个大小测量的消息数")
+    parser.add_argument("--bloom-capacity", type=int, default=1000000)
+    parser.add_argument("--bloom-fp-rate", type=float, default=0.001)
+    parser.add_argument("--probes", type=int, default=200000, help="测量误判率用的新 key 数")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    bench_sizes(sizes, args.ops, args.seed)
+    print()
+    bench_bloom(args.bloom_capacity, args.bloom_fp_rate, args.probes)
+    bench_restore(max(sizes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+出站流控基准：broker 停止读取时代理的发送积压与内存
+
+用法（在 iot-project 目录下）：
+    python3 scripts/bench_outbound.py
+    python3 scripts/bench_outbound.py --rate 5000 --seconds 10 --stall 2:7 --policies unlimited,drop_oldest,block
+
+不需要 mosquitto：脚本内置一个最小的 MQTT 服务端（只回 CONNACK / SUBACK / PINGRESP），
+按 --rate 向代理发布 ingest/env/<metric> 消息，并读取代理发出的 PUBLISH 计数。
+--stall a:b 指定的时间段内服务端不读 socket，模拟 broker 卡住：代理的 TCP 发送缓冲区写满后，
+paho 内部发送队列开始积压。代理是真实的 MQTTGateway（paho 网络线程、流水线、出站窗口），
+每 50 ms 采样一次 paho 发送队列（client._out_packet）的报文数与字节数、出站窗口的字节数和进程 RSS。
+
+- unlimited：OUTBOUND_MAX_INFLIGHT=0、OUTBOUND_MAX_QUEUED_BYTES=0，相当于不做流控
+- drop_oldest / drop_newest / block：--max-inflight、--max-bytes 生效
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "deploy", "proxy", "app")
+sys.path.insert(0, APP_DIR)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("METRICS_HTTP_PORT", "0")
+os.environ.setdefault("STATS_PUBLISH_INTERVAL", "0")
+os.environ.setdefault("PIPELINE_STATS_INTERVAL", "0")
+
+import main  # noqa: E402
+from main import Config  # noqa: E402
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * PAGE_SIZE
+
+
+# ==================== 最小 MQTT 服务端 ====================
+def encode_length(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, n = n % 128, n // 128
+        out.append(byte | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+
+def encode_publish(topic: str, payload: bytes) -> bytes:
+    topic_bytes = topic.encode()
+    body = len(topic_bytes).to_bytes(2, "big") + topic_bytes + payload
+    return b"\x30" + encode_length(len(body)) + body
+
+
+class FakeBroker:
+    """只服务一个连接：回应 CONNECT / SUBSCRIBE / PINGREQ，统计收到的 PUBLISH"""
+
+    def __init__(self, rcvbuf: int):
+        self.server = socket.socket()
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        self.conn = None
+        self.send_lock = threading.Lock()
+        self.subscribed = threading.Event()
+        self.paused = threading.Event()
+        self.stopping = False
+        self.received = 0
+
+    def start(self):
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def send(self, data: bytes):
+        with self.send_lock:
+            self.conn.sendall(data)
+
+    def _serve(self):
+        self.conn, _ = self.server.accept()
+        buf = b""
+        while not self.stopping:
+            if self.paused.is_set():
+                time.sleep(0.01)
+                continue
+            try:
+                chunk = self.conn.recv(65536)
+            except OSError:
+                return
+            if not chunk:
+                return
+            buf += chunk
+            while True:
+                # 固定头 + 剩余长度
+                if len(buf) < 2:
+                    break
+                length, multiplier, pos = 0, 1, 1
+                while pos < len(buf):
+                    byte = buf[pos]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    pos += 1
+                    if not byte & 0x80:
+                        break
+                else:
+                    break
+                if len(buf) < pos + length:
+                    break
+                packet_type = buf[0] >> 4
+                body = buf[pos:pos + length]
+                buf = buf[pos + length:]
+                if packet_type == 1:        # CONNECT
+                    self.send(b"\x20\x02\x00\x00")
+                elif packet_type == 8:      # SUBSCRIBE
+                    self.send(b"\x90\x03" + body[:2] + b"\x00")
+                    self.subscribed.set()
+                elif packet_type == 12:     # PINGREQ
+                    self.send(b"\xd0\x00")
+                elif packet_type == 3:      # PUBLISH
+                    self.received += 1
+
+    def close(self):
+        self.stopping = True
+        for sock in (self.conn, self.server):
+            try:
+                sock.close()
+            except Exception:
+                pass
+
+
+# ==================== 一轮 ====================
+def run(policy: str, args):
+    broker = FakeBroker(args.rcvbuf)
+    broker.start()
+
+    Config.BROKER_HOST, Config.BROKER_PORT = "127.0.0.1", broker.port
+    if policy == "unlimited":
+        Config.OUTBOUND_MAX_INFLIGHT, Config.OUTBOUND_MAX_QUEUED_BYTES = 0, 0
+        Config.OUTBOUND_FULL_POLICY = "drop_oldest"
+    else:
+        Config.OUTBOUND_MAX_INFLIGHT, Config.OUTBOUND_MAX_QUEUED_BYTES = args.max_inflight, args.max_bytes
+        Config.OUTBOUND_FULL_POLICY = policy
+    Config.DEDUP_ENABLED = False
+
+    gateway = main.MQTTGateway()
+    gateway.setup()
+    network = threading.Thread(target=gateway.connect, daemon=True)
+    network.start()
+    if not broker.subscribed.wait(10):
+        raise RuntimeError("proxy did not subscribe")
+
+    client = gateway.client
+    # 缩小代理端的发送缓冲区，让积压尽快出现在 paho 发送队列中（而不是内核缓冲区里）
+    client.socket().setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, args.sndbuf)
+    stall_start, stall_end = (float(x) for x in args.stall.split(":"))
+    samples = []
+    done = threading.Event()
+    baseline_rss = rss_bytes()
+
+    def sample():
+        t0 = time.perf_counter()
+        while not done.is_set():
+            try:
+                packets = list(client._out_packet)
+            except RuntimeError:
+                # 网络线程正在修改发送队列
+                continue
+            samples.append((
+                time.perf_counter() - t0,
+                len(packets),
+                sum(p["to_process"] for p in packets),
+                gateway.outbound.snapshot()["bytes"],
+                rss_bytes() - baseline_rss,
+            ))
+            time.sleep(0.05)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+
+    # 按速率发布 ingest 消息，--stall 时间段内服务端不读 socket
+    total = int(args.rate * args.seconds)
+    sent = 0
+    t0 = time.perf_counter()
+    for i in range(total):
+        now = time.perf_counter() - t0
+        broker.paused.set() if stall_start <= now < stall_end else broker.paused.clear()
+        delay = i / args.rate - now
+        if delay > 0:
+            time.sleep(delay)
+        metric = Config.ALLOWED_METRICS[i % len(Config.ALLOWED_METRICS)]
+        payload = json.dumps({"ts": f"2014-02-13T00:00:{i % 60:02d}", "value": i}).encode()
+        broker.send(encode_publish(f"{Config.INGEST_PREFIX}{metric}", payload))
+        sent += 1
+    broker.paused.clear()
+    publish_seconds = time.perf_counter() - t0
+    time.sleep(args.drain)
+    done.set()
+    sampler.join()
+
+    outbound = gateway.outbound.snapshot()
+    result = {
+        "policy": policy,
+        "sent": sent,
+        "publish_seconds": round(publish_seconds, 2),
+        "forwarded": gateway.stats["forwarded"],
+        "dropped": gateway.stats["dropped"],
+        "broker_received": broker.received,
+        "peak_paho_packets": max(s[1] for s in samples),
+        "peak_paho_bytes": max(s[2] for s in samples),
+        "peak_window_bytes": max(s[3] for s in samples),
+        "peak_rss_growth": max(s[4] for s in samples),
+        "blocked_seconds": outbound["blocked_seconds"],
+        "dropped_oldest": outbound["dropped_oldest"],
+        "dropped_newest": outbound["dropped_newest"],
+        "backlog": sum(gateway.pipeline.depths().values()) + outbound["pending"],
+    }
+    gateway.should_stop = True
+    gateway.pipeline.stop()
+    gateway.outbound.flush(0)
+    client.disconnect()
+    network.join(5)
+    broker.close()
+    return result
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="broker 卡住时的出站积压与内存")
+    parser.add_argument("--policies", default="unlimited,drop_oldest,drop_newest,block")
+    parser.add_argument("--rate", type=float, default=5000, help="ingest 消息/秒")
+    parser.add_argument("--seconds", type=float, default=8, help="发布时长（秒）")
+    parser.add_argument("--stall", default="1:6", help="服务端不读 socket 的时间段（秒，a:b）")
+    parser.add_argument("--drain", type=float, default=3, help="发布结束后等待的秒数")
+    parser.add_argument("--max-inflight", type=int, default=1000)
+    parser.add_argument("--max-bytes", type=int, default=256 * 1024)
+    parser.add_argument("--rcvbuf", type=int, default=4096, help="服务端 socket 接收缓冲区")
+    parser.add_argument("--sndbuf", type=int, default=4096, help="代理端 socket 发送缓冲区")
+    args = parser.parse_args()
+
+    print(f"{args.rate:g} msg/s for {args.seconds:g}s, broker stalls during {args.stall}s"
+          f" (max in-flight {args.max_inflight}, max bytes {args.max_bytes})")
+    print(f"{'policy':>12}{'forwarded':>10}{'dropped':>9}{'at broker':>10}{'ingest s':>9}"
+          f"{'paho pkts':>10}{'paho KB':>9}{'window KB':>10}{'RSS +KB':>9}{'blocked s':>10}")
+    for policy in args.policies.split(","):
+        r = run(policy, args)
+        print(f"{policy:>12}{r['forwarded']:>10}{r['dropped']:>9}{r['broker_received']:>10}"
+              f"{r['publish_seconds']:>9.2f}{r['peak_paho_packets']:>10}{r['peak_paho_bytes'] / 1024:>9.0f}"
+              f"{r['peak_window_bytes'] / 1024:>10.0f}{r['peak_rss_growth'] / 1024:>9.0f}{r['blocked_seconds']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+代理校验 / 清洗 / 编码路径的吞吐基准（msgs/sec）
+
+用法（在 iot-project 目录下）：
+    python3 scripts/bench_proxy_validate.py
+    python3 scripts/bench_proxy_validate.py --messages 200000
+
+对比三种实现处理同一批 payload（bytes）的吞吐：
+- legacy: 改造前的路径（decode → json.loads → fromisoformat → 两次 json.dumps）
+- json:   PayloadValidator.clean + 一次编码，标准库 json
+- orjson: 同上，orjson 编解码（未安装时跳过）
+
+payload 组合：
+- valid:    规范格式 {"ts":"...","value":4.0}
+- modified: 字符串数值 / 空字符串 / 多余字段，需要清洗
+- invalid:  非法 JSON / 缺字段 / 非法时间戳各占三分之一
+- mixed:    80% valid + 15% modified + 5% invalid
+不含 MQTT 收发与日志输出，只测代理本身的 CPU 开销。
+
+第二张表是批量 ingest：同样的 mixed 数据按 --batch-sizes 打包成 JSON 数组（或 NDJSON），
+经 PayloadValidator.clean_batch 逐元素清洗并逐点编码，给出每秒处理的点数与消息数。
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "deploy", "proxy", "app"))
+
+from main import JsonCodec, PayloadValidator, codec, orjson  # noqa: E402
+
+
+# ==================== 改造前的实现 ====================
+def _legacy_is_valid_iso8601(ts_str):
+    try:
+        datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
+        return True
+    except ValueError:
+        return False
+
+
+def _legacy_clean_value(value):
+    if value is None:
+        return None, False
+    if isinstance(value, (int, float)):
+        return value, False
+    if isinstance(value, str):
+        if value == "":
+            return None, True
+        try:
+            if '.' not in value:
+                return int(value), True
+            return float(value), True
+        except ValueError:
+            return None, True
+    return None, True
+
+
+def _legacy_validate_and_clean(payload_str):
+    try:
+        data = json.loads(payload_str)
+    except json.JSONDecodeError as e:
+        return None, f"Invalid JSON: {str(e)}"
+    if not isinstance(data, dict):
+        return None, "Payload must be a JSON object"
+    if "ts" not in data:
+        return None, "Missing required field: ts"
+    if "value" not in data:
+        return None, "Missing required field: value"
+    ts = data["ts"]
+    if not isinstance(ts, str):
+        return None, "Field 'ts' must be string"
+    if not _legacy_is_valid_iso8601(ts):
+        return None, f"Field 'ts' is not valid ISO8601 format: {ts}"
+    cleaned_value, _ = _legacy_clean_value(data["value"])
+    return {"ts": ts, "value": cleaned_value}, None
+
+
+def legacy_path(raw: bytes):
+    payload = raw.decode('utf-8', errors='ignore')
+    cleaned, error = _legacy_validate_and_clean(payload)
+    if cleaned is None:
+        return None
+    was_modified = json.dumps(cleaned, separators=(',', ':')) != payload
+    return json.dumps(cleaned, separators=(',', ':')), was_modified
+
+
+def make_fast_path(codec: JsonCodec):
+    clean = PayloadValidator.clean
+    loads = codec.loads
+    dumps = codec.dumps
+
+    def fast_path(raw: bytes):
+        cleaned, was_modified, error = clean(raw, loads)
+        if cleaned is None:
+            return None
+        return dumps(cleaned), was_modified
+
+    return fast_path
+
+
+# ==================== payload 生成 ====================
+def make_payloads(kind: str, count: int, seed: int):
+    rng = random.Random(seed)
+    start = datetime(2014, 2, 13)
+    payloads = []
+    for i in range(count):
+        ts = (start + timedelta(minutes=10 * i)).strftime("%Y-%m-%dT%H:%M:%S")
+        value = round(rng.uniform(-10, 35), 1)
+        k = kind
+        if kind == "mixed":
+            r = rng.random()
+            k = "valid" if r < 0.80 else ("modified" if r < 0.95 else "invalid")
+        if k == "valid":
+            body = {"ts": ts, "value": value}
+        elif k == "modified":
+            body = rng.choice([
+                {"ts": ts, "value": str(value)},
+                {"ts": ts, "value": ""},
+                {"ts": ts, "value": value, "device": "sensor-01"},
+            ])
+        else:
+            choice = i % 3
+            if choice == 0:
+                payloads.append(b'{"ts": "' + ts.encode() + b'", "value": ')
+                continue
+            body = {"ts": ts} if choice == 1 else {"ts": ts.replace("T", " at "), "value": value}
+        payloads.append(json.dumps(body, separators=(',', ':')).encode())
+    return payloads
+
+
+def make_batches(points, batch_size: int, ndjson: bool):
+    """把单点 payload 打包成批量 payload（批大小为 1 时保持原样）"""
+    if batch_size == 1:
+        return points
+    sep, head, tail = (b"\n", b"", b"") if ndjson else (b",", b"[", b"]")
+    return [head + sep.join(points[i:i + batch_size]) + tail for i in range(0, len(points), batch_size)]
+
+
+def batch_path(raw: bytes, ndjson: bool):
+    if not PayloadValidator.is_batch(raw, ndjson):
+        cleaned, _, _ = PayloadValidator.clean(raw)
+        return [] if cleaned is None else [codec.dumps(cleaned)]
+    results, _ = PayloadValidator.clean_batch(raw, ndjson=ndjson)
+    dumps = codec.dumps
+    return [dumps(cleaned) for cleaned, _, _ in results or () if cleaned is not None]
+
+
+def measure(func, payloads, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for raw in payloads:
+            func(raw)
+        best = min(best, time.perf_counter() - t0)
+    return len(payloads) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="代理校验/清洗/编码吞吐基准")
+    parser.add_argument("--messages", type=int, default=100000, help="每种组合的消息数")
+    parser.add_argument("--repeat", type=int, default=3, help="重复次数（取最快一次）")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--batch-sizes", default="1,10,100,1000", help="批量 ingest 的批大小（逗号分隔）")
+    args = parser.parse_args()
+
+    impls = [("legacy", legacy_path), ("json", make_fast_path(JsonCodec("json")))]
+    if orjson is not None:
+        impls.append(("orjson", make_fast_path(JsonCodec("orjson"))))
+
+    # 三种实现对同一批 payload 的结果必须一致
+    sample = make_payloads("mixed", 2000, args.seed)
+    for raw in sample:
+        expected = legacy_path(raw)
+        for name, func in impls[1:]:
+            got = func(raw)
+            assert (expected is None) == (got is None), (name, raw)
+            if expected is not None:
+                assert json.loads(expected[0]) == json.loads(got[0]), (name, raw)
+
+    header = f"{'mix':>9}" + "".join(f"{name + ' msg/s':>16}" for name, _ in impls) + f"{'speedup':>9}"
+    print(header)
+    for kind in ("valid", "modified", "invalid", "mixed"):
+        payloads = make_payloads(kind, args.messages, args.seed)
+        rates = [measure(func, payloads, args.repeat) for _, func in impls]
+        print(f"{kind:>9}" + "".join(f"{rate:>16,.0f}" for rate in rates) + f"{max(rates[1:]) / rates[0]:>8.1f}x")
+
+    # 批量 ingest（mixed 数据去掉非法 JSON：数组中有一个元素不是合法 JSON 时整条消息都无法解析）
+    points = [raw for raw in make_payloads("mixed", args.messages, args.seed) if raw.endswith(b"}")]
+    forwarded = sum(len(batch_path(raw, False)) for raw in points)
+    print(f"\nbatch ingest ({codec.name}, mixed)")
+    print(f"{'format':>7}{'batch':>7}{'points/s':>12}{'msgs/s':>10}{'speedup':>9}")
+    base = None
+    for ndjson in (False, True):
+        for size in [int(s) for s in args.batch_sizes.split(",") if s]:
+            if ndjson and size == 1:
+                continue
+            batches = make_batches(points, size, ndjson)
+            got = sum(len(batch_path(raw, ndjson)) for raw in batches)
+            # 逐元素的结果必须与逐条处理一致
+            assert got == forwarded, (size, ndjson, got, forwarded)
+            msg_rate = measure(lambda raw: batch_path(raw, ndjson), batches, args.repeat)
+            point_rate = msg_rate * len(points) / len(batches)
+            base = base or point_rate
+            print(f"{'ndjson' if ndjson else 'array':>7}{size:>7}{point_rate:>12,.0f}{msg_rate:>10,.0f}"
+                  f"{point_rate / base:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
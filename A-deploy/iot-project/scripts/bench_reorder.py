@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+乱序重排基准：ReorderBuffer 的输出顺序、迟到计数、内存与延迟开销
+
+用法（在 iot-project 目录下）：
+    python3 scripts/bench_reorder.py
+    python3 scripts/bench_reorder.py --points 30000 --jitter 3 --late-ratio 0.002 --lateness 0,600,1800,3600
+
+工作负载：三个 metric 轮流，每个 metric 的点间隔 10 分钟（与数据集相同）。模拟并行发布者：
+每个点的到达位置 = 序号 + U(0, --jitter) 个采样间隔，--late-ratio 比例的点再多延迟 --late-delay 个间隔
+（回放脚本重发、某个发布者卡住），按到达位置排序后送入缓冲区。
+
+每个 --lateness（秒，按 ts 计）跑两遍：
+- 不限速：测每个点 add 的耗时（与直接调用 emit 的基线相比），并用 tracemalloc 测缓冲区的内存峰值
+- 按 --rate 条/秒限速：测点在缓冲区中的停留时间（REORDER_MAX_WAIT_MS 为 --max-wait-ms）
+输出中的乱序数 = 相邻两点 ts 倒退的次数（迟到点按 forward 策略立即发出，每个迟到点最多造成一次）。
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "deploy", "proxy", "app")
+sys.path.insert(0, APP_DIR)
+
+from reorder import ReorderBuffer  # noqa: E402
+
+METRICS = ("temperature", "humidity", "pressure")
+
+
+def make_workload(points: int, jitter: float, late_ratio: float, late_delay: int, seed: int):
+    """返回按到达顺序排列的 [(metric, ts, out)]"""
+    rng = random.Random(seed)
+    start = datetime(2014, 2, 13)
+    arrivals = []
+    for i in range(points):
+        metric = METRICS[i % len(METRICS)]
+        sample = i // len(METRICS)
+        ts = (start + timedelta(minutes=10 * sample)).strftime("%Y-%m-%dT%H:%M:%S")
+        position = sample + rng.uniform(0, jitter)
+        if rng.random() < late_ratio:
+            position += late_delay
+        point = {"ts": ts, "value": round(rng.uniform(-10, 35), 1)}
+        arrivals.append((position, i, metric, ts, (f"ingest/env/{metric}", metric, point, False, 0.0)))
+    arrivals.sort()
+    return [(metric, ts, out) for _, _, metric, ts, out in arrivals]
+
+
+def inversions(seq) -> int:
+    return sum(1 for a, b in zip(seq, seq[1:]) if b < a)
+
+
+def by_metric(outs):
+    series = {metric: [] for metric in METRICS}
+    for out in outs:
+        series[out[1]].append(out[2]["ts"])
+    return series
+
+
+def run_cpu(workload, lateness: float, max_held: int):
+    """不限速：返回 (每点耗时 µs, 基线每点耗时 µs, 内存峰值字节, 最大缓存点数, 输出)"""
+    sink = []
+    emit = lambda *out: sink.append(out)  # noqa: E731
+
+    t0 = time.perf_counter()
+    for metric, ts, out in workload:
+        emit(*out)
+    baseline = time.perf_counter() - t0
+
+    sink.clear()
+    buffer = ReorderBuffer(lateness, 0, max_held)
+    t0 = time.perf_counter()
+    for metric, ts, out in workload:
+        buffer.add(metric, ts, out, emit)
+    elapsed = time.perf_counter() - t0
+    buffer.close()
+    outputs = list(sink)
+
+    # 内存：另跑一遍（tracemalloc 会拖慢计时）
+    sink.clear()
+    buffer = ReorderBuffer(lateness, 0, max_held)
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    for metric, ts, out in workload:
+        buffer.add(metric, ts, out, emit)
+        # 输出只为了计数，不计入缓冲区的内存
+        sink.clear()
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    peak_held = sum(stats["peak_held"] for stats in buffer.snapshot().values())
+    buffer.close()
+
+    n = len(workload)
+    return elapsed / n * 1e6, baseline / n * 1e6, peak, peak_held, outputs
+
+
+def run_paced(workload, lateness: float, max_held: int, max_wait_ms: float, rate: float):
+    """按 rate 条/秒送入：返回各 metric 的 snapshot"""
+    buffer = ReorderBuffer(lateness, max_wait_ms, max_held)
+    buffer.start()
+    emit = lambda *out: None  # noqa: E731
+    t0 = time.perf_counter()
+    for i, (metric, ts, out) in enumerate(workload):
+        delay = i / rate - (time.perf_counter() - t0)
+        if delay > 0:
+            time.sleep(delay)
+        buffer.add(metric, ts, out, emit)
+    # 等超时发出剩余的点
+    time.sleep(max_wait_ms / 1000 * 1.5)
+    snapshot = buffer.snapshot()
+    buffer.close()
+    return snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description="乱序重排：输出顺序、迟到计数、内存与延迟开销")
+    parser.add_argument("--points", type=int, default=30000, help="点数（三个 metric 轮流）")
+    parser.add_argument("--jitter", type=float, default=3, help="到达位置的随机延迟上限（采样间隔数）")
+    parser.add_argument("--late-ratio", type=float, default=0.002, help="额外延迟的点的比例")
+    parser.add_argument("--late-delay", type=int, default=20, help="额外延迟（采样间隔数）")
+    parser.add_argument("--lateness", default="0,600,1800,3600", help="逗号分隔的 REORDER_MAX_LATENESS（秒）")
+    parser.add_argument("--max-held", type=int, default=10000)
+    parser.add_argument("--max-wait-ms", type=float, default=2000)
+    parser.add_argument("--rate", type=float, default=3000, help="限速那一遍的条/秒")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    workload = make_workload(args.points, args.jitter, args.late_ratio, args.late_delay, args.seed)
+    inputs = by_metric(out for _, _, out in workload)
+    print(f"{len(workload)} points, jitter {args.jitter:g} samples, {args.late_ratio:g} delayed by "
+          f"{args.late_delay} samples; input inversions: {sum(inversions(s) for s in inputs.values())}")
+    print(f"{'lateness s':>11}{'out inv':>8}{'late':>6}{'µs/pt':>7}{'base µs':>8}{'peak held':>10}"
+          f"{'peak KB':>8}{'B/held':>7}{'avg hold ms':>12}{'max hold ms':>12}{'expired':>8}")
+    for lateness in [float(x) for x in args.lateness.split(",")]:
+        per_point, baseline, peak, peak_held, outputs = run_cpu(workload, lateness, args.max_held)
+        output_inversions = sum(inversions(s) for s in by_metric(outputs).values())
+        snapshot = run_paced(workload, lateness, args.max_held, args.max_wait_ms, args.rate)
+        late = sum(s["late"] for s in snapshot.values())
+        released = sum(s["released"] for s in snapshot.values())
+        avg_hold = sum(s["avg_hold_ms"] * s["released"] for s in snapshot.values()) / max(released, 1)
+        max_hold = max(s["max_hold_ms"] for s in snapshot.values())
+        expired = sum(s["expired"] for s in snapshot.values())
+        print(f"{lateness:>11g}{output_inversions:>8}{late:>6}{per_point:>7.2f}{baseline:>8.2f}{peak_held:>10}"
+              f"{peak / 1024:>8.1f}{peak / max(peak_held, 1):>7.0f}{avg_hold:>12.2f}{max_hold:>12.1f}{expired:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+规则引擎基准：编译后的规则链与内置清洗（PayloadValidator._clean_value）的吞吐对比
+
+用法（在 iot-project 目录下）：
+    python3 scripts/bench_rules.py
+    python3 scripts/bench_rules.py --messages 200000 --rules deploy/proxy/rules.example.json
+
+与 bench_proxy_validate.py 相同的 mixed payload（80% 规范 + 15% 需要清洗 + 5% 非法），
+每条消息 PayloadValidator.clean + 一次编码（安装了 orjson 时用 orjson），不含 MQTT 收发与日志。对比：
+- builtin：不加载规则文件（现在的默认路径）
+- coerce：只有一条 coerce 规则（与内置清洗的行为相同，看规则链本身的开销）
+- example：--rules 指定的规则文件（默认 deploy/proxy/rules.example.json）中 temperature 的链
+- N rules：coerce + 依次循环 range / linear / spike / round / range(clamp) / unit ... 共 N 条
+"""
+
+import argparse
+import os
+import sys
+import time
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, "..", "deploy", "proxy", "app"))
+sys.path.insert(0, SCRIPTS_DIR)
+
+from bench_proxy_validate import make_payloads  # noqa: E402
+from main import PayloadValidator, codec  # noqa: E402
+from rules import compile_chain, load_rules  # noqa: E402
+
+# 生成 N 条规则时轮流使用的规则（数值对 -10 ~ 35 的数据都能通过，不会提前丢弃）
+FILLER_RULES = [
+    {"type": "range", "min": -50, "max": 60},
+    {"type": "linear", "scale": 1.0, "offset": 0.0},
+    {"type": "spike", "max_delta": 100},
+    {"type": "round", "digits": 2},
+    {"type": "range", "min": -100, "max": 100, "action": "clamp"},
+    {"type": "unit", "from": "C", "to": "C"},
+]
+
+
+def make_chain(n: int):
+    specs = [{"type": "coerce", "null_strings": ["", "NaN", "null"]}]
+    while len(specs) < n:
+        specs.append(FILLER_RULES[(len(specs) - 1) % len(FILLER_RULES)])
+    return compile_chain(specs)
+
+
+def measure(payloads, clean_value, repeat: int) -> float:
+    """返回最好一次的 msgs/s"""
+    clean, loads, dumps = PayloadValidator.clean, codec.loads, codec.dumps
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for raw in payloads:
+            cleaned, _, _ = clean(raw, loads, clean_value)
+            if cleaned is not None:
+                dumps(cleaned)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return len(payloads) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="规则链与内置清洗的吞吐对比")
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--rules", default=os.path.join(SCRIPTS_DIR, "..", "deploy", "proxy", "rules.example.json"))
+    parser.add_argument("--counts", default="5,10,15,20", help="逗号分隔的规则条数")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    payloads = make_payloads("mixed", args.messages, args.seed)
+    cases = [("builtin", None), ("coerce", compile_chain([{"type": "coerce"}]))]
+    example = load_rules(args.rules).chain_for("temperature")
+    if example is not None:
+        cases.append((f"example ({len(example.steps)})", example))
+    cases += [(f"{n} rules", make_chain(n)) for n in (int(x) for x in args.counts.split(","))]
+
+    print(f"{len(payloads)} mixed payloads, JSON backend: {codec.name}")
+    print(f"{'chain':>14}{'msgs/s':>11}{'µs/msg':>9}{'vs builtin':>12}")
+    baseline = None
+    for name, chain in cases:
+        rate = measure(payloads, chain, args.repeat)
+        baseline = baseline or rate
+        print(f"{name:>14}{rate:>11,.0f}{1e6 / rate:>9.2f}{rate / baseline:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
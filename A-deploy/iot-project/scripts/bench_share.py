@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+多实例代理基准：1 / 2 / 4 个实例的总转发速率与重复泄漏率
+
+用法（在 iot-project 目录下）：
+    python3 scripts/bench_share.py                                  # 不需要 broker 的模拟
+    python3 scripts/bench_share.py --instances 1,2,4 --points 60000
+    python3 scripts/bench_share.py --broker localhost:1883 --username admin --password admin123
+
+工作负载：三个 metric 共 --points 个不同的点，其中 --dup-ratio 比例的点在稍后（1~50 条消息之后）再发一次。
+重复泄漏率 = (转发条数 - 不同点数) / 重复发送条数，理想值为 0。
+
+三种部署方式：
+- local：$share/proxy/ingest/env/#，只有各实例本地去重（对照组，重复会落到不同实例而漏掉）
+- shared：$share/proxy/ingest/env/#，加 DEDUP_SHARED_PATH 共享去重表（SHARE_MODE=shared）
+- partition：按 metric 分区订阅，本地去重（SHARE_MODE=partition，并行度不超过 metric 数）
+
+默认模式在本机用多进程模拟 broker 的分发：共享订阅按消息轮流分给各实例（mosquitto 的默认策略），
+分区订阅按 metric 分给负责的实例；每个进程跑真实的 PayloadValidator.clean + DedupCache + 编码，
+不含 MQTT 收发。--broker 模式启动 N 个真实的 main.py 进程，经 broker 发布并在 env/# 上统计。
+"""
+
+import argparse
+import heapq
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "deploy", "proxy", "app")
+sys.path.insert(0, APP_DIR)
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from dedup import DedupCache  # noqa: E402
+from main import Config, PayloadValidator, codec, owned_metrics  # noqa: E402
+
+MODES = ("local", "shared", "partition")
+
+
+# ==================== 工作负载 ====================
+def make_workload(points: int, dup_ratio: float, seed: int):
+    """返回 [(metric, payload bytes)]，以及重复发送的条数"""
+    rng = random.Random(seed)
+    start = datetime(2014, 2, 13)
+    messages = []
+    delayed = []  # 小顶堆：(发送位置, 序号, 消息)
+    for i in range(points):
+        metric = Config.ALLOWED_METRICS[i % len(Config.ALLOWED_METRICS)]
+        ts = (start + timedelta(minutes=10 * (i // len(Config.ALLOWED_METRICS)))).strftime("%Y-%m-%dT%H:%M:%S")
+        message = (metric, json.dumps({"ts": ts, "value": round(rng.uniform(-10, 35), 1)}).encode())
+        messages.append(message)
+        if rng.random() < dup_ratio:
+            heapq.heappush(delayed, (len(messages) + rng.randint(1, 50), i, message))
+        while delayed and delayed[0][0] <= len(messages):
+            messages.append(heapq.heappop(delayed)[2])
+    messages.extend(message for _, _, message in sorted(delayed))
+    return messages, len(messages) - points
+
+
+def assign(messages, mode: str, instances: int):
+    """模拟 broker 的分发：共享订阅轮流分配，分区订阅按 metric"""
+    shares = [[] for _ in range(instances)]
+    if mode == "partition":
+        owner = {
+            metric: index for index in range(instances) for metric in owned_metrics(instances, index)
+        }
+        for message in messages:
+            shares[owner[message[0]]].append(message)
+    else:
+        for i, message in enumerate(messages):
+            shares[i % instances].append(message)
+    return shares
+
+
+# ==================== 模拟 ====================
+def _instance(messages, shared_path, ready, go, results):
+    cache = DedupCache(1000, 300, shared_path=shared_path)
+    clean, dumps = PayloadValidator.clean, codec.dumps
+    forwarded = 0
+    ready.wait()
+    go.wait()
+    t0 = time.perf_counter()
+    for metric, raw in messages:
+        cleaned, _, _ = clean(raw)
+        if cleaned is None or cache.is_duplicate(metric, cleaned["ts"]):
+            continue
+        dumps(cleaned)
+        forwarded += 1
+    results.put((forwarded, time.perf_counter() - t0))
+    cache.close()
+
+
+def simulate(messages, mode: str, instances: int):
+    """返回 (转发条数, 墙钟秒数)"""
+    context = multiprocessing.get_context("fork")
+    with tempfile.TemporaryDirectory() as tmp:
+        shared_path = os.path.join(tmp, "dedup.db") if mode == "shared" else None
+        if shared_path:
+            # 先建表，避免各实例同时建表时互相等锁
+            DedupCache(1, 300, shared_path=shared_path).close()
+        ready = context.Barrier(instances + 1)
+        go = context.Event()
+        results = context.Queue()
+        processes = [
+            context.Process(target=_instance, args=(share, shared_path, ready, go, results))
+            for share in assign(messages, mode, instances)
+        ]
+        for process in processes:
+            process.start()
+        ready.wait()
+        t0 = time.perf_counter()
+        go.set()
+        outcomes = [results.get() for _ in processes]
+        elapsed = time.perf_counter() - t0
+        for process in processes:
+            process.join()
+    return sum(forwarded for forwarded, _ in outcomes), elapsed
+
+
+# ==================== 真实 broker ====================
+def run_broker(messages, mode: str, instances: int, args):
+    import paho.mqtt.client as mqtt
+
+    host, _, port = args.broker.partition(":")
+    port = int(port or 1883)
+    tmp = tempfile.TemporaryDirectory()
+    env = dict(
+        os.environ,
+        MQTT_BROKER_HOST=host, MQTT_BROKER_PORT=str(port),
+        LOG_LEVEL="WARNING", PIPELINE_STATS_INTERVAL="0",
+        PROXY_INSTANCES=str(instances), SHARE_GROUP=f"bench{os.getpid()}",
+        SHARE_MODE="shared" if mode in ("local", "shared") else "partition",
+        DEDUP_SHARED_PATH=os.path.join(tmp.name, "dedup.db"),
+    )
+    if args.proxy_username:
+        env.update(MQTT_USERNAME=args.proxy_username, MQTT_PASSWORD=args.proxy_password)
+    procs = []
+    for index in range(instances):
+        instance_env = dict(env, PROXY_INSTANCE_ID=str(index))
+        if mode == "local":
+            # 对照组：共享订阅但不用共享表
+            instance_env["DEDUP_SHARED_PATH"] = ""
+        procs.append(subprocess.Popen(
+            [sys.executable, os.path.join(APP_DIR, "main.py")], env=instance_env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        ))
+
+    received = 0
+    last_received = [0.0]
+    lock = threading.Lock()
+
+    def on_message(client, userdata, msg):
+        nonlocal received
+        if msg.topic.count("/") != 1:
+            return
+        with lock:
+            received += 1
+            last_received[0] = time.perf_counter()
+
+    def make_client(name):
+        client = mqtt.Client(client_id=f"bench-{name}-{os.getpid()}")
+        if args.username:
+            client.username_pw_set(args.username, args.password)
+        client.connect(host, port, 60)
+        client.loop_start()
+        return client
+
+    try:
+        subscriber = make_client("sub")
+        subscriber.on_message = on_message
+        subscriber.subscribe("env/#", qos=0)
+        publisher = make_client("pub")
+        time.sleep(args.startup)
+
+        t0 = time.perf_counter()
+        for metric, raw in messages:
+            publisher.publish(f"{Config.INGEST_PREFIX}{metric}", raw, qos=0)
+        # 直到 2 秒内没有新消息
+        while True:
+            time.sleep(0.5)
+            with lock:
+                if last_received[0] and time.perf_counter() - last_received[0] > 2:
+                    break
+                if not last_received[0] and time.perf_counter() - t0 > 10:
+                    break
+        elapsed = (last_received[0] or time.perf_counter()) - t0
+        for client in (publisher, subscriber):
+            client.loop_stop()
+            client.disconnect()
+        return received, elapsed
+    finally:
+        for proc in procs:
+            proc.terminate()
+        for proc in procs:
+            proc.wait(timeout=10)
+        tmp.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多实例代理：总转发速率与重复泄漏率")
+    parser.add_argument("--instances", default="1,2,4", help="逗号分隔的实例数")
+    parser.add_argument("--modes", default=",".join(MODES), help="逗号分隔：local / shared / partition")
+    parser.add_argument("--points", type=int, default=60000, help="不同点的个数（三个 metric 轮流）")
+    parser.add_argument("--dup-ratio", type=float, default=0.1, help="重复发送的比例")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--broker", default=None, help="host:port，指定时用真实 broker 与 main.py 进程")
+    parser.add_argument("--username", default=None, help="基准发布 / 订阅用的账号（需能写 ingest/env/#、读 env/#）")
+    parser.add_argument("--password", default=None)
+    parser.add_argument("--proxy-username", default=None, help="代理进程的账号（默认用 main.py 的默认值）")
+    parser.add_argument("--proxy-password", default=None)
+    parser.add_argument("--startup", type=float, default=2.0, help="等待代理进程连上 broker 的秒数")
+    args = parser.parse_args()
+
+    messages, duplicates = make_workload(args.points, args.dup_ratio, args.seed)
+    print(f"{len(messages)} messages: {args.points} distinct points + {duplicates} duplicates"
+          f"{'' if args.broker else ' (simulated broker, no MQTT I/O)'}")
+    print(f"{'mode':>10}{'instances':>10}{'forwarded':>11}{'msgs/s':>11}{'leaked':>8}{'leak rate':>11}")
+    for mode in args.modes.split(","):
+        for instances in [int(n) for n in args.instances.split(",")]:
+            if args.broker:
+                forwarded, elapsed = run_broker(messages, mode, instances, args)
+            else:
+                forwarded, elapsed = simulate(messages, mode, instances)
+            leaked = max(forwarded - args.points, 0)
+            print(f"{mode:>10}{instances:>10}{forwarded:>11}{len(messages) / elapsed:>11,.0f}"
+                  f"{leaked:>8}{leaked / max(duplicates, 1):>11.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -78,7 +78,15 @@ def control_loop():
             pause_event.set()
             print("|| stopping", flush=True)
 
-def publish_data(metric,rate=1,start=None,end=None):
+def encode_batch(batch, fmt):
+    """一条消息的 payload：单条为 JSON 对象，多条为 JSON 数组或 NDJSON（每行一个对象）"""
+    if len(batch) == 1:
+        return json.dumps(batch[0])
+    if fmt == "ndjson":
+        return "\n".join(json.dumps(p) for p in batch)
+    return json.dumps(batch)
+
+def publish_data(metric,rate=1,start=None,end=None,batch_size=1,fmt="array"):
     global rate_hz
     rate_hz = float(rate)
 
@@ -123,7 +131,10 @@ def publish_data(metric,rate=1,start=None,end=None):
     i=0
     next_send = time.perf_counter()
     total = len(payloads)
+    batch_size = max(1, batch_size)
     print(f"准备发布 {total} 条数据，速率: {rate_hz} Hz")
+    if batch_size > 1:
+        print(f"批量发布：每条消息最多 {batch_size} 条数据（{fmt}）")
     
     while i<len(payloads) and not stop_event.is_set():
         pause_event.wait()  # 等待运行信号 pause_event=True 时继续
@@ -138,21 +149,22 @@ def publish_data(metric,rate=1,start=None,end=None):
         if next_send > now:
             time.sleep(next_send - now)
 
-        payload = payloads[i]
+        batch = payloads[i:i + batch_size]
+        n = len(batch)
         
         # 每100条或最后一条打印进度
-        if (i + 1) % 100 == 0 or i == total - 1:
-            print(f"[进度] {i+1}/{total} ({100*(i+1)/total:.1f}%) - {payload['ts']}", flush=True)
+        if (i + n) // 100 > i // 100 or i + n == total:
+            print(f"[进度] {i+n}/{total} ({100*(i+n)/total:.1f}%) - {batch[-1]['ts']}", flush=True)
 
         # 发布
-        result = client.publish(topic, json.dumps(payload), qos=0)
+        result = client.publish(topic, encode_batch(batch, fmt), qos=0)
         pending_mids.add(result.mid)
 
-        # 每条间隔秒 支持动态修改 rate_hz
-        interval = 1.0 / max(rate_hz, 0.0001)  
+        # 每条数据间隔 1/rate_hz 秒（一批 n 条则间隔 n 倍），支持动态修改 rate_hz
+        interval = n / max(rate_hz, 0.0001)  
         next_send += interval 
 
-        i+=1
+        i+=n
     
     if stop_event.is_set():
         print(f"发布被停止，已发布 {i}/{total} 条数据", flush=True)
@@ -179,10 +191,14 @@ if __name__ == "__main__":
                         help="起始时间，如 2014-05-30T07:00:00（包含）")
     parser.add_argument("--end", "-e", default=None,
                         help="终止时间，如 2014-05-30T08:00:00（包含）")
+    parser.add_argument("--batch-size", "-b", type=int, default=1,
+                        help="每条消息携带的数据条数（默认 1；大于 1 时发布数组，需代理支持批量 ingest）")
+    parser.add_argument("--format", "-f", choices=["array","ndjson"], default="array",
+                        help="批量 payload 格式：JSON 数组或每行一个 JSON 对象（ndjson 需代理开启 INGEST_NDJSON）")
     args = parser.parse_args()
 
     # 控制线程：读 stdin 可以控制发布的暂停/恢复/修改速率/停止
     t = threading.Thread(target=control_loop, daemon=True)
     t.start()
 
-    publish_data(args.metric, args.rate, args.start, args.end)
\ No newline at end of file
+    publish_data(args.metric, args.rate, args.start, args.end, args.batch_size, args.format)
\ No newline at end of file
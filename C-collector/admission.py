@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+准入控制 - 防止重查询拖慢 collector 写入
+
+SQLite 同一时刻只有一个写者；读事务持续时间越长、读取的页越多，collector 提交时
+等锁和抢磁盘的时间越长。这里在三个层次上限制读负载：
+
+1. 查询代价预估 + 行数预算（API_MAX_ROWS）
+   - /api/history 不分页时，先在 (metric, ts) 覆盖索引上数一下范围内的行数
+     （最多数到预算 + 1 行，代价与预算成正比，不读表页）
+   - 超过预算时自动改为降采样结果：按能让桶数不超过预算的最小“整齐”桶宽取平均值，
+     桶宽是小时的整数倍时直接读 rollups 表（见 aggregate.py），响应附带 "downsampled"
+   - 需要原始数据的客户端请用 page_size 分页（每页本身有上限）
+   - /api/joined、/api/anomalies 的代价同样按行数预估，超过预算返回 400，提示缩小时间范围
+2. 按 endpoint 的并发上限（API_CONCURRENCY_LIMITS）
+   - 每个重查询 endpoint 一个信号量；满了之后最多排队 ADMISSION_QUEUE_TIMEOUT 秒，
+     仍拿不到就返回 429 + Retry-After
+3. 写入延迟过高时卸载负载（ADMISSION_MAX_INGEST_LAG_MS）
+   - collector 在每次提交通知中附带本次写入耗时（lag_ms，含等锁时间），推送中心
+     （stream.py）维护其指数滑动平均
+   - 超过阈值时重查询 endpoint 直接返回 429 + Retry-After，/api/realtime、/api/stream、
+     /api/health 不受影响；共享响应缓存（shared_cache.py）命中的请求也照常返回
+
+并发上限按进程计算，serve.py 多 worker 部署时总并发为 worker 数 × 上限。
+ADMISSION_CONTROL=false 时全部关闭（不注册中间件，history 不做预估）。
+"""
+
+import asyncio
+import math
+import os
+import sqlite3
+from typing import Callable, Dict, Optional, Sequence
+
+from encoding import dumps
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_CONTROL", "true").lower() == "true"
+# 单次查询允许读取的原始行数
+API_MAX_ROWS = int(os.getenv("API_MAX_ROWS", "50000"))
+# 每个 endpoint 的并发上限（每个进程），格式 name=N,name=N
+API_CONCURRENCY_LIMITS = os.getenv(
+    "API_CONCURRENCY_LIMITS",
+    "history=4,stats=8,aggregate=4,joined=2,anomalies=2,forecast=4",
+)
+# 并发已满时最多排队等待的秒数
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "1"))
+# collector 写入耗时（滑动平均，毫秒）超过该值时开始卸载重查询；0 表示不卸载
+ADMISSION_MAX_INGEST_LAG_MS = float(os.getenv("ADMISSION_MAX_INGEST_LAG_MS", "500"))
+# 429 响应的 Retry-After（秒）
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "2"))
+
+# 降采样可选的桶宽（秒），从小到大
+DOWNSAMPLE_STEPS = (60, 300, 600, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400, 7 * 86400, 30 * 86400)
+
+
+def parse_limits(text: str) -> Dict[str, int]:
+    """"history=4,joined=2" → {"/api/history": 4, "/api/joined": 2}；不合法时抛 ValueError"""
+    limits = {}
+    for item in text.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, value = item.partition("=")
+        limit = int(value)
+        if limit <= 0:
+            raise ValueError(item)
+        limits[f"/api/{name.strip()}"] = limit
+    return limits
+
+
+def estimate_rows(conn: sqlite3.Connection, where_sql: str, params: Sequence, cap: int = API_MAX_ROWS) -> int:
+    """
+    满足 where_sql 的行数，最多数到 cap + 1
+
+    只 SELECT 常量且条件只涉及 metric / ts 时，SQLite 只扫描 (metric, ts) 覆盖索引
+    """
+    return conn.execute(
+        f"SELECT COUNT(*) FROM (SELECT 1 FROM measurements WHERE {where_sql} LIMIT ?)",
+        (*params, cap + 1),
+    ).fetchone()[0]
+
+
+def downsample_step(lo_epoch: int, hi_epoch: int, max_points: int = API_MAX_ROWS) -> int:
+    """让 [lo, hi] 的桶数不超过 max_points 的最小桶宽"""
+    span = max(hi_epoch - lo_epoch + 1, 1)
+    for step in DOWNSAMPLE_STEPS:
+        if math.ceil(span / step) <= max_points:
+            return step
+    return math.ceil(span / max_points / DOWNSAMPLE_STEPS[-1]) * DOWNSAMPLE_STEPS[-1]
+
+
+class AdmissionMiddleware:
+    """纯 ASGI 中间件：写入延迟过高时卸载重查询，并限制每个 endpoint 的并发数"""
+
+    def __init__(
+        self,
+        app,
+        ingest_lag: Callable[[], Optional[float]],
+        limits: Optional[Dict[str, int]] = None,
+        max_ingest_lag_ms: float = ADMISSION_MAX_INGEST_LAG_MS,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+    ):
+        self.app = app
+        self.ingest_lag = ingest_lag
+        self.limits = parse_limits(API_CONCURRENCY_LIMITS) if limits is None else limits
+        self.max_ingest_lag_ms = max_ingest_lag_ms
+        self.queue_timeout = queue_timeout
+        # 在第一次请求时创建（绑定到运行中的事件循环）
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.rejected = 0
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if scope["type"] != "http" or path not in self.limits:
+            await self.app(scope, receive, send)
+            return
+
+        if self.max_ingest_lag_ms > 0:
+            lag = self.ingest_lag()
+            if lag is not None and lag > self.max_ingest_lag_ms:
+                await self._reject(send, f"collector 写入延迟 {lag:.0f} ms，暂停处理重查询，请稍后重试")
+                return
+
+        semaphore = self._semaphores.get(path)
+        if semaphore is None:
+            semaphore = self._semaphores[path] = asyncio.Semaphore(self.limits[path])
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            await self._reject(send, f"{path} 并发请求过多（上限 {self.limits[path]}），请稍后重试")
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            semaphore.release()
+
+    async def _reject(self, send, detail: str) -> None:
+        self.rejected += 1
+        body = dumps({"detail": detail})
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(ADMISSION_RETRY_AFTER).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
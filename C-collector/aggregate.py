@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+按时间桶聚合 - /api/aggregate 的实现
+
+一次 SQL 扫描完成所有聚合函数：
+  SELECT CAST(strftime('%s', ts) AS INTEGER) / step * step AS bucket,
+         COUNT(*), AVG(value), MIN(value), MAX(value), agg_first(ts, value), agg_last(ts, value)
+  FROM measurements WHERE metric = ? AND ts BETWEEN ? AND ? GROUP BY bucket
+
+当桶宽是小时的整数倍、且查询范围按桶宽对齐时，改为在 rollups 表上做同样的
+GROUP BY（每小时一行），扫描行数减少为原来的 1/(每小时点数)。
+
+结果为列式数组：{"ts": [桶起点 epoch 秒...], "avg": [...], "min": [...], ...}
+只返回有数据的桶。
+"""
+
+import re
+import sqlite3
+from typing import Dict, List, Optional, Sequence
+
+from rollup import ROLLUP_SECONDS, ensure_rollups, epoch_to_ts, ts_to_epoch
+
+AGGREGATE_FUNCTIONS = ("avg", "min", "max", "count", "first", "last")
+_UNIT_SECONDS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+_INTERVAL_RE = re.compile(r"^(\d+)([smhd])$")
+# 单次请求最多返回的桶数
+MAX_BUCKETS = 100000
+
+
+def parse_interval(text: str) -> int:
+    """10m / 1h / 1d → 秒数；不合法时抛 ValueError"""
+    match = _INTERVAL_RE.match(text.strip().lower())
+    if not match:
+        raise ValueError(text)
+    seconds = int(match.group(1)) * _UNIT_SECONDS[match.group(2)]
+    if seconds <= 0:
+        raise ValueError(text)
+    return seconds
+
+
+def parse_functions(text: Optional[str]) -> List[str]:
+    """"avg,min,max" → ["avg", "min", "max"]；缺省为全部"""
+    if not text:
+        return list(AGGREGATE_FUNCTIONS)
+    fns = []
+    for name in text.split(","):
+        name = name.strip().lower()
+        if name not in AGGREGATE_FUNCTIONS:
+            raise ValueError(name)
+        if name not in fns:
+            fns.append(name)
+    return fns
+
+
+class _First:
+    """桶内 ts 最小的有效值（不依赖扫描顺序）"""
+
+    def __init__(self):
+        self.ts = None
+        self.value = None
+
+    def step(self, ts, value):
+        if value is not None and (self.ts is None or ts < self.ts):
+            self.ts, self.value = ts, value
+
+    def finalize(self):
+        return self.value
+
+
+class _Last(_First):
+    """桶内 ts 最大的有效值"""
+
+    def step(self, ts, value):
+        if value is not None and (self.ts is None or ts > self.ts):
+            self.ts, self.value = ts, value
+
+
+def register_functions(conn: sqlite3.Connection) -> None:
+    conn.create_aggregate("agg_first", 2, _First)
+    conn.create_aggregate("agg_last", 2, _Last)
+
+
+# 原始数据上各聚合函数对应的 SQL 表达式
+_RAW_SQL = {
+    "avg": "AVG(value)",
+    "min": "MIN(value)",
+    "max": "MAX(value)",
+    "count": "COUNT(*)",
+    "first": "agg_first(ts, value)",
+    "last": "agg_last(ts, value)",
+}
+
+# 桶宽正好一小时时，rollups 每行就是一个桶，不需要 GROUP BY
+_ROLLUP_ROW_SQL = {
+    "avg": "sum / NULLIF(non_null, 0)",
+    "min": "min",
+    "max": "max",
+    "count": "count",
+    "first": "first_value",
+    "last": "last_value",
+}
+
+# rollups 表上的等价表达式（avg 由 sum / non_null 得到）
+_ROLLUP_SQL = {
+    "avg": "SUM(sum) / NULLIF(SUM(non_null), 0)",
+    "min": "MIN(min)",
+    "max": "MAX(max)",
+    "count": "SUM(count)",
+    "first": "agg_first(first_ts, first_value)",
+    "last": "agg_last(last_ts, last_value)",
+}
+
+
+def _columns(rows: Sequence[Sequence], fns: List[str]) -> Dict[str, list]:
+    columns: Dict[str, list] = {"ts": [row[0] for row in rows]}
+    for k, name in enumerate(fns, start=1):
+        columns[name] = [row[k] for row in rows]
+    return columns
+
+
+def can_use_rollups(step: int, lo_epoch: int, hi_epoch: int) -> bool:
+    """桶宽为小时整数倍，且 [lo, hi] 恰好覆盖整数个桶时，rollup 的结果与原始数据完全一致"""
+    return (
+        step % ROLLUP_SECONDS == 0
+        and lo_epoch % step == 0
+        and (hi_epoch + 1) % step == 0
+    )
+
+
+def aggregate(
+    conn: sqlite3.Connection,
+    metric: str,
+    lo: str,
+    hi: str,
+    step: int,
+    fns: List[str],
+    use_rollups: bool = True,
+) -> dict:
+    """
+    计算 [lo, hi]（闭区间，YYYY-MM-DDTHH:MM:SS）内按 step 秒分桶的聚合
+
+    返回 {"source": "raw"|"rollup", "ts": [...], <fn>: [...]}
+    """
+    register_functions(conn)
+    lo_epoch, hi_epoch = ts_to_epoch(lo), ts_to_epoch(hi)
+
+    if use_rollups and can_use_rollups(step, lo_epoch, hi_epoch):
+        first_bucket = lo_epoch
+        last_bucket = hi_epoch + 1 - ROLLUP_SECONDS
+        ensure_rollups(conn, metric, first_bucket, last_bucket)
+        if step == ROLLUP_SECONDS:
+            select = ", ".join(_ROLLUP_ROW_SQL[name] for name in fns)
+            rows = conn.execute(
+                f"""
+                SELECT bucket, {select}
+                FROM rollups
+                WHERE metric = ? AND bucket BETWEEN ? AND ? AND count > 0
+                ORDER BY bucket
+                """,
+                (metric, first_bucket, last_bucket),
+            ).fetchall()
+            return {"source": "rollup", **_columns(rows, fns)}
+
+        select = ", ".join(_ROLLUP_SQL[name] for name in fns)
+        rows = conn.execute(
+            f"""
+            SELECT bucket / {step} * {step} AS b, {select}
+            FROM rollups
+            WHERE metric = ? AND bucket BETWEEN ? AND ?
+            GROUP BY b
+            HAVING SUM(count) > 0
+            ORDER BY b
+            """,
+            (metric, first_bucket, last_bucket),
+        ).fetchall()
+        return {"source": "rollup", **_columns(rows, fns)}
+
+    select = ", ".join(_RAW_SQL[name] for name in fns)
+    rows = conn.execute(
+        f"""
+        SELECT CAST(strftime('%s', ts) AS INTEGER) / {step} * {step} AS b, {select}
+        FROM measurements
+        WHERE metric = ? AND ts >= ? AND ts <= ?
+        GROUP BY b
+        ORDER BY b
+        """,
+        (metric, lo, hi),
+    ).fetchall()
+    return {"source": "raw", **_columns(rows, fns)}
+
+
+def align_range(lo: str, hi: str, step: int):
+    """把 [lo, hi] 向外扩展到桶边界，返回新的 (lo, hi)；用于判断能否走 rollup"""
+    lo_epoch = ts_to_epoch(lo) // step * step
+    hi_epoch = ts_to_epoch(hi) // step * step + step - 1
+    return epoch_to_ts(lo_epoch), epoch_to_ts(hi_epoch)
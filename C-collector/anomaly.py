@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+异常检测 - /api/anomalies 与 collector 入库时的增量检测共用
+
+每个点只和它之前的 window 个点比较（尾随窗口，不含自身），所以同一个点无论是
+批量计算还是入库时增量计算，得分都完全相同：
+
+| method | 中心 / 尺度                         | 得分                          | 默认阈值 |
+|--------|-------------------------------------|-------------------------------|----------|
+| zscore | 均值 / 标准差（累加和，O(n)）       | (x - mean) / std              | 3.0      |
+| mad    | 中位数 / 1.4826 × MAD               | (x - median) / scale          | 3.5      |
+| iqr    | Q1、Q3 / IQR                        | 超出 [Q1, Q3] 的距离 / IQR    | 1.5      |
+
+- zscore 用 x 与 x² 的前缀和一次算出所有窗口的均值和方差；mad / iqr 用
+  sliding_window_view 得到 (n, window) 的窗口视图（不复制数据），分块做 nanmedian /
+  nanpercentile，内存占用与数据长度无关
+- 缺失值（NULL）占窗口位置但不参与统计；窗口内有效值少于 max(3, window/2) 时不打分
+- 尺度下限 ANOMALY_MIN_SCALE（默认 0.5，传感器分辨率为 1 个单位的一半）：
+  整数读数常常连续数小时不变，标准差为 0 时任何 1 个单位的变化都会被当成无穷大的尖峰
+- flatline=N：连续 N 个相同的有效值判为“卡死”（N 不能超过 window）
+
+结果缓存：按 UTC 自然日分块缓存每个点的得分（与阈值无关）。只缓存“已结束”的整天
+（之后已有数据）；每块附带指纹（该天及其前 window 个点的行数和最大 id），collector
+补写历史数据会产生新的 id，指纹变化后该天自动重算。
+"""
+
+import os
+import sqlite3
+import warnings
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from rollup import ts_to_epoch
+
+METHODS = ("zscore", "mad", "iqr")
+DEFAULT_THRESHOLDS = {"zscore": 3.0, "mad": 3.5, "iqr": 1.5}
+DEFAULT_WINDOW = 36  # 10 分钟一个点时为 6 小时
+MAX_WINDOW = 5000
+
+ANOMALY_MIN_SCALE = float(os.getenv("ANOMALY_MIN_SCALE", "0.5"))
+# 缓存的天数（每天约 144 个 float64）
+ANOMALY_CACHE_DAYS = int(os.getenv("ANOMALY_CACHE_DAYS", "4096"))
+
+KIND_SPIKE = "spike"
+KIND_FLATLINE = "flatline"
+
+_DAY = 86400
+# mad / iqr 每次处理的窗口行数，限制 (rows, window) 临时数组的大小
+_CHUNK_ROWS = 4096
+_MAD_TO_STD = 1.4826
+
+
+# ==================== 得分计算 ====================
+def _min_periods(window: int) -> int:
+    return max(3, window // 2)
+
+
+def _trailing_counts(valid: np.ndarray, window: int) -> np.ndarray:
+    """每个位置之前 window 个点中的有效值个数"""
+    cn = np.concatenate(([0], np.cumsum(valid)))
+    i = np.arange(len(valid))
+    return cn[i] - cn[np.maximum(i - window, 0)]
+
+
+def _zscore(x: np.ndarray, window: int, min_scale: float) -> np.ndarray:
+    valid = ~np.isnan(x)
+    # 减去一个参考值再累加，避免气压这类大基数在 x² 前缀和中损失精度
+    ref = x[valid][0] if valid.any() else 0.0
+    xv = np.where(valid, x - ref, 0.0)
+    c1 = np.concatenate(([0.0], np.cumsum(xv)))
+    c2 = np.concatenate(([0.0], np.cumsum(xv * xv)))
+    cn = np.concatenate(([0], np.cumsum(valid)))
+    i = np.arange(len(x))
+    start = np.maximum(i - window, 0)
+    n = cn[i] - cn[start]
+    s1 = c1[i] - c1[start]
+    s2 = c2[i] - c2[start]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = s1 / n
+        var = np.maximum((s2 - n * mean * mean) / (n - 1), 0.0)
+        scale = np.maximum(np.sqrt(var), min_scale)
+        score = (x - ref - mean) / scale
+    score[n < _min_periods(window)] = np.nan
+    return score
+
+
+def _windowed(x: np.ndarray, window: int, reducer) -> np.ndarray:
+    """对每个位置之前的 window 个点调用 reducer(windows) → (center, scale) 或 (q1, q3)"""
+    padded = np.concatenate((np.full(window, np.nan), x))
+    # 第 i 行 = x[i - window : i]
+    views = sliding_window_view(padded[:-1], window)
+    first = np.full(len(x), np.nan)
+    second = np.full(len(x), np.nan)
+    with warnings.catch_warnings():
+        # 全为 NaN 的窗口会触发 RuntimeWarning，这些位置稍后按有效值个数置为 NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for lo in range(0, len(x), _CHUNK_ROWS):
+            a, b = reducer(views[lo:lo + _CHUNK_ROWS])
+            first[lo:lo + _CHUNK_ROWS] = a
+            second[lo:lo + _CHUNK_ROWS] = b
+    return first, second
+
+
+def _mad_reducer(windows: np.ndarray):
+    median = np.nanmedian(windows, axis=1)
+    mad = np.nanmedian(np.abs(windows - median[:, None]), axis=1)
+    return median, mad
+
+
+def _iqr_reducer(windows: np.ndarray):
+    q1, q3 = np.nanpercentile(windows, [25, 75], axis=1)
+    return q1, q3
+
+
+def _mad(x: np.ndarray, window: int, min_scale: float) -> np.ndarray:
+    median, mad = _windowed(x, window, _mad_reducer)
+    with np.errstate(invalid="ignore"):
+        score = (x - median) / np.maximum(_MAD_TO_STD * mad, min_scale)
+    score[_trailing_counts(~np.isnan(x), window) < _min_periods(window)] = np.nan
+    return score
+
+
+def _iqr(x: np.ndarray, window: int, min_scale: float) -> np.ndarray:
+    q1, q3 = _windowed(x, window, _iqr_reducer)
+    with np.errstate(invalid="ignore"):
+        iqr = np.maximum(q3 - q1, min_scale)
+        score = np.where(x > q3, (x - q3) / iqr, np.where(x < q1, (x - q1) / iqr, 0.0))
+    score[np.isnan(x)] = np.nan
+    score[_trailing_counts(~np.isnan(x), window) < _min_periods(window)] = np.nan
+    return score
+
+
+_SCORERS = {"zscore": _zscore, "mad": _mad, "iqr": _iqr}
+
+
+def score_series(x: np.ndarray, method: str, window: int, min_scale: float = ANOMALY_MIN_SCALE) -> np.ndarray:
+    """按时间顺序排列的值（NaN 表示缺失）→ 每个点的得分（无法打分为 NaN）"""
+    if len(x) == 0:
+        return np.empty(0)
+    return _SCORERS[method](np.asarray(x, dtype=np.float64), window, min_scale)
+
+
+def run_lengths(x: np.ndarray) -> np.ndarray:
+    """每个点所在的“连续相同有效值”已经持续的点数（含自身；缺失值为 0）"""
+    if len(x) == 0:
+        return np.zeros(0, dtype=np.int64)
+    i = np.arange(len(x))
+    changed = np.ones(len(x), dtype=bool)
+    # NaN != NaN，缺失值总会打断连续段
+    changed[1:] = x[1:] != x[:-1]
+    starts = np.maximum.accumulate(np.where(changed, i, 0))
+    lengths = i - starts + 1
+    lengths[np.isnan(x)] = 0
+    return lengths
+
+
+def classify(scores: np.ndarray, runs: Optional[np.ndarray], threshold: float,
+             flatline: Optional[int]) -> List[Optional[str]]:
+    """得分 / 连续长度 → 每个点的类别（spike / flatline / None）"""
+    with np.errstate(invalid="ignore"):
+        spike = np.abs(scores) >= threshold
+    kinds: List[Optional[str]] = [None] * len(scores)
+    for k in np.flatnonzero(spike).tolist():
+        kinds[k] = KIND_SPIKE
+    if flatline is not None and runs is not None:
+        for k in np.flatnonzero(runs >= flatline).tolist():
+            if kinds[k] is None:
+                kinds[k] = KIND_FLATLINE
+    return kinds
+
+
+# ==================== 批量检测（带按天缓存） ====================
+class ScoreCache:
+    """进程内 LRU：(metric, method, window, min_scale, day) → (指纹, 得分数组)"""
+
+    def __init__(self, max_days: int):
+        self.max_days = max_days
+        self._data: "OrderedDict[tuple, Tuple[tuple, np.ndarray]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple, fingerprint: tuple) -> Optional[np.ndarray]:
+        entry = self._data.get(key)
+        if entry is None or entry[0] != fingerprint:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: tuple, fingerprint: tuple, scores: np.ndarray) -> None:
+        self._data[key] = (fingerprint, scores)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_days:
+            self._data.popitem(last=False)
+
+
+cache = ScoreCache(ANOMALY_CACHE_DAYS)
+
+_SELECT = "SELECT id, CAST(strftime('%s', ts) AS INTEGER), value FROM measurements"
+
+
+def _fetch(conn: sqlite3.Connection, sql: str, params) -> np.ndarray:
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    rows = cursor.execute(sql, params).fetchall()
+    return np.array(rows, dtype=np.float64).reshape(-1, 3)
+
+
+def _load(conn: sqlite3.Connection, metric: str, lo: Optional[str], hi: Optional[str], window: int):
+    """取出 [lo, hi] 内的点，以及 lo 之前的 window 个点（作为第一段的窗口），返回 (矩阵, 预热行数)"""
+    conditions = ["metric = ?"]
+    params: List[object] = [metric]
+    if lo is not None:
+        conditions.append("ts >= ?")
+        params.append(lo)
+    if hi is not None:
+        conditions.append("ts <= ?")
+        params.append(hi)
+    main = _fetch(conn, f"{_SELECT} WHERE {' AND '.join(conditions)} ORDER BY ts ASC", params)
+    if lo is None:
+        return main, 0
+    warm = _fetch(
+        conn,
+        f"{_SELECT} WHERE metric = ? AND ts < ? ORDER BY ts DESC LIMIT ?",
+        (metric, lo, window),
+    )[::-1]
+    return np.concatenate((warm, main)), len(warm)
+
+
+def detect(
+    conn: sqlite3.Connection,
+    metric: str,
+    lo: Optional[str],
+    hi: Optional[str],
+    method: str,
+    window: int,
+    min_scale: float = ANOMALY_MIN_SCALE,
+    use_cache: bool = True,
+) -> dict:
+    """
+    计算 [lo, hi] 内每个点的得分
+
+    返回 {"ts": epoch 数组, "value": 数组, "score": 数组, "runs": 连续长度数组, "cached_days": 命中天数}
+    """
+    data, n_warm = _load(conn, metric, lo, hi, window)
+    ids, ts, values = data[:, 0], data[:, 1].astype(np.int64), data[:, 2]
+    n = len(values)
+    scores = np.full(n, np.nan)
+    done = np.zeros(n, dtype=bool)
+    done[:n_warm] = True
+
+    # 已经结束的整天：之后已有数据，且整天都落在请求范围内
+    cacheable = []
+    cached_days = 0
+    if use_cache and n > n_warm:
+        latest = conn.execute("SELECT MAX(ts) FROM measurements WHERE metric = ?", (metric,)).fetchone()[0]
+        latest_epoch = ts_to_epoch(latest)
+        lo_epoch = ts_to_epoch(lo) if lo is not None else None
+        hi_epoch = ts_to_epoch(hi) if hi is not None else None
+        days = ts[n_warm:] // _DAY
+        boundaries = np.flatnonzero(np.diff(days)) + 1 + n_warm
+        starts = np.concatenate(([n_warm], boundaries))
+        ends = np.concatenate((boundaries, [n]))
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            day = int(ts[start] // _DAY)
+            day_start, day_end = day * _DAY, (day + 1) * _DAY - 1
+            if day_end >= latest_epoch:
+                continue
+            if lo_epoch is not None and day_start < lo_epoch:
+                continue
+            if hi_epoch is not None and day_end > hi_epoch:
+                continue
+            window_start = max(0, start - window)
+            fingerprint = (end - window_start, int(ids[window_start:end].max()))
+            key = (metric, method, window, min_scale, day)
+            hit = cache.get(key, fingerprint)
+            if hit is not None and len(hit) == end - start:
+                scores[start:end] = hit
+                done[start:end] = True
+                cached_days += 1
+            else:
+                cacheable.append((key, fingerprint, start, end))
+
+    # 未命中的连续段各算一次（带上前 window 个点作为窗口）
+    pending = np.flatnonzero(~done)
+    if len(pending):
+        breaks = np.flatnonzero(np.diff(pending) > 1) + 1
+        for segment in np.split(pending, breaks):
+            a, b = int(segment[0]), int(segment[-1]) + 1
+            from_index = max(0, a - window)
+            scores[a:b] = score_series(values[from_index:b], method, window, min_scale)[a - from_index:]
+
+    for key, fingerprint, start, end in cacheable:
+        cache.put(key, fingerprint, scores[start:end].copy())
+
+    return {
+        "ts": ts[n_warm:],
+        "value": values[n_warm:],
+        "score": scores[n_warm:],
+        "runs": run_lengths(values)[n_warm:],
+        "cached_days": cached_days,
+    }
+
+
+# ==================== 入库时增量检测 ====================
+class IncrementalScorer:
+    """
+    collector 使用：每个 metric 保留最近 window 个值，新点到达时只对这一小段打分，
+    结果与批量检测完全一致。时间戳不晚于上一条的点（补写历史）不打分。
+    """
+
+    def __init__(self, method: str, window: int, threshold: Optional[float] = None,
+                 flatline: Optional[int] = None, min_scale: float = ANOMALY_MIN_SCALE):
+        if method not in METHODS:
+            raise ValueError(method)
+        self.method = method
+        self.window = window
+        self.threshold = DEFAULT_THRESHOLDS[method] if threshold is None else threshold
+        self.flatline = flatline
+        self.min_scale = min_scale
+        self._history: Dict[str, Deque[float]] = {}
+        self._last_ts: Dict[str, str] = {}
+        self._run: Dict[str, Tuple[float, int]] = {}
+
+    def seed(self, metric: str, points: List[Tuple[str, Optional[float]]]) -> None:
+        """用数据库中最近的点（按 ts 升序）初始化窗口"""
+        for ts, value in points[-(self.window + 1):]:
+            self.update(metric, ts, value)
+
+    def update(self, metric: str, ts: str, value: Optional[float]) -> Optional[Tuple[str, Optional[float]]]:
+        """加入一个新点；被判为异常时返回 (kind, score)，否则返回 None"""
+        last_ts = self._last_ts.get(metric)
+        if last_ts is not None and ts <= last_ts:
+            return None
+        self._last_ts[metric] = ts
+        history = self._history.get(metric)
+        if history is None:
+            history = self._history[metric] = deque(maxlen=self.window)
+
+        x = np.nan if value is None else float(value)
+        score = score_series(np.array(list(history) + [x]), self.method, self.window, self.min_scale)[-1]
+        history.append(x)
+
+        # 连续相同值的长度（缺失值打断）
+        prev_value, run = self._run.get(metric, (np.nan, 0))
+        run = 0 if value is None else (run + 1 if x == prev_value else 1)
+        self._run[metric] = (x, run)
+
+        if not np.isnan(score) and abs(score) >= self.threshold:
+            return KIND_SPIKE, float(score)
+        if self.flatline is not None and run >= self.flatline:
+            return KIND_FLATLINE, None if np.isnan(score) else float(score)
+        return None
+
+
+def _to_list(column: np.ndarray) -> list:
+    values = column.tolist()
+    for i in np.flatnonzero(np.isnan(column)).tolist():
+        values[i] = None
+    return values
+
+
+def select_points(result: dict, kinds: List[Optional[str]], full: bool) -> Dict[str, list]:
+    """detect() 的结果 → 列式 ts / value / score / kind；full=False 时只保留被判为异常的点"""
+    if full:
+        index = np.arange(len(kinds))
+    else:
+        index = np.array([k for k, kind in enumerate(kinds) if kind is not None], dtype=np.int64)
+    return {
+        "ts": result["ts"][index].tolist(),
+        "value": _to_list(result["value"][index]),
+        "score": _to_list(np.round(result["score"][index], 4)),
+        "kind": [kinds[k] for k in index.tolist()],
+    }
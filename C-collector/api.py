@@ -4,28 +4,103 @@ FastAPI HTTP API for C-collector
 
 提供 3 个只读接口，完全遵守项目契约：
 1) GET /api/realtime?metric=temperature&limit=200
+   增量轮询 ?since=<cursor>，长轮询 ?since=<cursor>&wait=25
 2) GET /api/history?metric=temperature&from=...&to=...
 3) GET /api/stats?metric=temperature&from=...&to=...
+4) GET /api/stream?metric=temperature（SSE）/ WebSocket /api/stream?metric=temperature
+   由 collector 写入路径直接推送新提交的数据点，详见 stream.py
+5) GET /api/aggregate?metric=temperature&from=...&to=...&interval=1h&fn=avg,min,max
+   按时间桶聚合，详见 aggregate.py
+6) GET /api/joined?metrics=temperature,humidity&from=...&to=...&derived=dew_point
+   多指标按 ts 对齐并计算派生量，详见 joined.py
+7) GET /api/anomalies?metric=temperature&from=...&to=...&method=zscore&window=36
+   滚动窗口异常检测（zscore / mad / iqr），详见 anomaly.py
+8) GET /api/forecast?metric=temperature&model=linear&horizon=10
+   趋势预测（linear / holt / ewma），拟合结果按 metric 缓存并增量更新，详见 forecast.py
+9) GET /api/health
+   就绪探针（多进程部署时预热完成前返回 503）
 
 说明：
+- realtime / history 支持内容协商（?format= 或 Accept 头）：
+  json（默认）/ columnar / msgpack / arrow，详见 encoding.py
 - metric 仅允许 temperature / humidity / pressure
 - ts 字段使用 SQLite 中原始的 TEXT 时间戳 (YYYY-MM-DDTHH:MM:SS)
 - NULL 不参与 min/max/mean 统计；missing 单独计数
+- 所有 JSON 响应由 handler 直接编码（orjson），不经过 jsonable_encoder；
+  响应按 Accept-Encoding 协商 br / gzip 压缩，详见 compression.py
+- API_PROFILING=true 时记录每个请求的分阶段耗时（Server-Timing 响应头），
+  慢请求可在 GET /api/debug/slow 查看，详见 profiling.py
+- 生产环境用 serve.py 启动多个 worker 进程（启动前预热、进程间共享响应缓存），
+  详见 serve.py / shared_cache.py
+- 准入控制：重查询有并发上限和行数预算（history 超出时降采样），collector 写入延迟
+  过高时返回 429 + Retry-After，详见 admission.py
 """
 
 from typing import List, Optional, Literal
 
+import asyncio
+import os
 import sqlite3
-from fastapi import FastAPI, HTTPException, Query
+import threading
+import time
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 
 from collector import init_database, DB_PATH  # 复用采集器里的 DB 配置与建表逻辑
+from collector import STREAM_NOTIFY_HOST, STREAM_NOTIFY_PORT
+from compression import CompressionMiddleware
+from admission import (
+    ADMISSION_ENABLED,
+    API_MAX_ROWS,
+    AdmissionMiddleware,
+    downsample_step,
+    estimate_rows,
+)
+from shared_cache import RESPONSE_CACHE_ENABLED, ResponseCacheMiddleware
+from encoding import TS_EPOCH_SQL, FastJSONResponse, negotiate_format, render_points, ts_select_sql
+from profiling import (
+    PROFILING_ENABLED,
+    ProfilingMiddleware,
+    connection_factory,
+    phase,
+    slow_snapshot,
+    start_sampler,
+    stop_sampler,
+)
+from rollup import data_range, epoch_to_ts, parse_quantiles, summarize, ts_to_epoch
+from aggregate import MAX_BUCKETS, aggregate, align_range, parse_functions, parse_interval
+from joined import MAX_TOLERANCE, join_metrics, parse_derived, parse_metrics
+from anomaly import DEFAULT_THRESHOLDS, DEFAULT_WINDOW, MAX_WINDOW, METHODS, classify, detect, select_points
+import forecast as forecasting
+from stream import HEARTBEAT_INTERVAL, VERSION_TTL, StreamHub
 
 
 Metric = Literal["temperature", "humidity", "pressure"]
 
+# /api/history 单页最大点数
+MAX_PAGE_SIZE = 50000
+# /api/realtime 长轮询最长等待秒数
+REALTIME_MAX_WAIT = 30.0
+# 推送中心未在监听时，长轮询查库的间隔（秒）
+REALTIME_POLL_INTERVAL = 0.5
+
 app = FastAPI(title="IoT Collector API", version="1.0.0")
 
+# 按 Accept-Encoding 压缩较大的响应（小响应和 SSE 流不压缩）
+app.add_middleware(CompressionMiddleware)
+
+# 准入控制：并发上限 + collector 写入延迟过高时卸载重查询。放在缓存之内，
+# 命中共享响应缓存的请求不受影响（hub 在下方定义，按需读取）
+if ADMISSION_ENABLED:
+    app.add_middleware(AdmissionMiddleware, ingest_lag=lambda: hub.ingest_lag())
+
+# 跨进程响应缓存（可选）：放在压缩之外，命中时连压缩也省掉；放在 CORS 之内，
+# CORS 响应头仍按每个请求的 Origin 生成
+if RESPONSE_CACHE_ENABLED:
+    app.add_middleware(ResponseCacheMiddleware)
+
 # 如有需要，允许本机或前端跨域访问
 app.add_middleware(
     CORSMiddleware,
@@ -35,101 +110,345 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 请求剖析（可选）：放在最外层，压缩耗时也计入
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+
 
 def get_db_connection() -> sqlite3.Connection:
     """创建一个新的 SQLite 连接（每个请求一个，避免线程问题）"""
-    conn = sqlite3.connect(DB_PATH)
+    with phase("connect"):
+        conn = sqlite3.connect(DB_PATH, factory=connection_factory())
     # 返回 dict-like 行，便于字段访问
     conn.row_factory = sqlite3.Row
     return conn
 
 
+# 实时推送中心（接收 collector 的提交通知并扇出给 /api/stream 的订阅者）
+hub = StreamHub(get_db_connection)
+# 推送中心监听的 UDP 端口；serve.py 多进程模式下每个 worker 监听各自的端口，由主进程转发
+stream_listen_port = STREAM_NOTIFY_PORT
+
+# 就绪状态（GET /api/health）：单进程运行时始终就绪；serve.py 在预热完成前将其置为未就绪
+ready = threading.Event()
+ready.set()
+
+
 @app.on_event("startup")
 def on_startup() -> None:
     """应用启动时确保数据库已初始化"""
     init_database()
 
 
+@app.on_event("startup")
+async def start_stream_hub() -> None:
+    """开始接收 collector 的提交通知"""
+    await hub.start(STREAM_NOTIFY_HOST, stream_listen_port)
+
+
+@app.on_event("startup")
+def start_profiling_sampler() -> None:
+    """PROFILING_STACKS=true 时启动调用栈采样线程"""
+    start_sampler()
+
+
+@app.on_event("shutdown")
+def stop_stream_hub() -> None:
+    hub.stop()
+    stop_sampler()
+
+
+@app.get("/api/health")
+def get_health():
+    """
+    就绪探针：预热完成前返回 503 {"status": "warming"}，之后返回 200 {"status": "ready"}
+    ingest_lag_ms 为 collector 最近的写入耗时（滑动平均，未知时为 null），见 admission.py
+    """
+    status = "ready" if ready.is_set() else "warming"
+    return FastJSONResponse(
+        {"status": status, "pid": os.getpid(), "ingest_lag_ms": hub.ingest_lag()},
+        status_code=200 if ready.is_set() else 503,
+    )
+
+
+def _parse_since(since: str):
+    """since 游标：整数为 measurements.id，否则按 YYYY-MM-DDTHH:MM:SS 时间戳解析；返回 (id, ts)"""
+    if since.isdigit():
+        return int(since), None
+    try:
+        ts_to_epoch(since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"since 必须是整数 id 或 YYYY-MM-DDTHH:MM:SS 时间戳: {since}")
+    return None, since
+
+
+def _query_realtime(metric: str, limit: int, fmt: str, since_id: Optional[int], since_ts: Optional[str]):
+    """查询 /api/realtime 的数据，按时间升序返回 (rows, cursor)；cursor 为查询时刻的最大 id"""
+    # 必须在查询之前取：查询之后提交的数据一定会通知到推送中心
+    listening = hub.listening
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        # 先取当前最大 id（主键 B 树最右端，O(1)），再只查 id 不超过它的数据，
+        # 之后提交的数据都在游标之后，下次 since 请求不会漏掉
+        cursor = cur.execute("SELECT MAX(id) FROM measurements").fetchone()[0] or 0
+        if since_id is not None:
+            # +metric 让 SQLite 不走 (metric, ts) 索引，按 rowid 范围扫描游标之后的少量新行
+            cur.execute(
+                f"""
+                SELECT {ts_select_sql(fmt)}, value
+                FROM measurements
+                WHERE id > ? AND id <= ? AND +metric = ?
+                ORDER BY id DESC
+                LIMIT ?
+                """,
+                (since_id, cursor, metric, limit),
+            )
+        elif since_ts is not None:
+            cur.execute(
+                f"""
+                SELECT {ts_select_sql(fmt)}, value
+                FROM measurements
+                WHERE metric = ? AND ts > ? AND id <= ?
+                ORDER BY ts DESC
+                LIMIT ?
+                """,
+                (metric, since_ts, cursor, limit),
+            )
+        else:
+            cur.execute(
+                f"""
+                SELECT {ts_select_sql(fmt)}, value
+                FROM measurements
+                WHERE metric = ?
+                ORDER BY ts DESC
+                LIMIT ?
+                """,
+                (metric, limit),
+            )
+        rows = cur.fetchall()
+    finally:
+        conn.close()
+
+    if listening:
+        hub.confirm(metric, cursor)
+    # 需要按时间升序返回（按 id 取出的补写数据时间可能更早）
+    if since_id is not None:
+        rows.sort(key=lambda row: row[0])
+    else:
+        rows.reverse()
+    return rows, cursor
+
+
 @app.get("/api/realtime")
-def get_realtime(
+async def get_realtime(
+    request: Request,
     metric: Metric = Query(..., description="metric=temperature|humidity|pressure"),
     limit: int = Query(200, ge=1, le=2000, description="返回的最大点数（默认 200）"),
+    since: Optional[str] = Query(None, description="增量游标：上次响应的 cursor（id），或 YYYY-MM-DDTHH:MM:SS 时间戳"),
+    wait: float = Query(0, ge=0, le=REALTIME_MAX_WAIT, description="长轮询：没有新数据时最多等待的秒数（需配合 since）"),
+    fmt: Optional[str] = Query(None, alias="format", description="json|columnar|msgpack|arrow，缺省按 Accept 协商"),
 ):
     """
     实时数据：按时间倒序取最近 N 条，再按时间正序返回
     响应结构：
     {
       "metric": "temperature",
-      "points": [{"ts": "...", "value": 11.0}, ...]
+      "points": [{"ts": "...", "value": 11.0}, ...],
+      "cursor": 12345
     }
+    列式格式见 encoding.py
+
+    增量轮询：把上次响应的 cursor（同时在 X-Cursor 响应头中）作为 since 传回，只返回
+    之后提交的数据点（包括补写的旧时间戳数据）；新数据超过 limit 条时只返回最新的 limit 条，
+    缺口请用 /api/history 补齐。since 也可以是时间戳，返回 ts 晚于它的数据。
+    没有新数据时由推送中心记录的最新 id 直接回答，不查询数据库。
+    wait > 0 时为长轮询：没有新数据就挂起，直到有新数据提交或等待 wait 秒后返回（可能为空）。
     """
-    conn = get_db_connection()
+    fmt = negotiate_format(request, fmt)
+    since_id, since_ts = _parse_since(since) if since is not None else (None, None)
+    if wait > 0 and since is None:
+        raise HTTPException(status_code=400, detail="wait 需要与 since 一起使用")
+
+    deadline = time.monotonic() + wait
+    subscriber = hub.subscribe(metric) if wait > 0 and hub.listening else None
     try:
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT ts, value
-            FROM measurements
-            WHERE metric = ?
-            ORDER BY ts DESC
-            LIMIT ?
-            """,
-            (metric, limit),
-        )
-        rows = cur.fetchall()
+        while True:
+            known = hub.known_latest(metric) if since_id is not None else None
+            if known is None or since_id < known:
+                rows, cursor = await run_in_threadpool(_query_realtime, metric, limit, fmt, since_id, since_ts)
+                if rows or since is None:
+                    break
+                # 按时间戳查询没有新数据后，改用 id 游标等待
+                since_id, since_ts = max(since_id or 0, cursor), None
+            else:
+                rows, cursor = [], since_id
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if subscriber is not None and not subscriber.closed:
+                # 有新提交时立即醒来；collector 未开启通知时每隔 VERSION_TTL 查一次库
+                await subscriber.wait(min(remaining, VERSION_TTL))
+                subscriber.drain()
+            else:
+                await asyncio.sleep(min(remaining, REALTIME_POLL_INTERVAL))
     finally:
-        conn.close()
+        if subscriber is not None:
+            hub.unsubscribe(subscriber)
 
-    # 需要按时间升序返回
-    points = [
-        {"ts": row["ts"], "value": row["value"]} for row in reversed(rows)
-    ]
+    return render_points(fmt, metric, rows, extra={"cursor": cursor}, headers={"X-Cursor": str(cursor)})
 
-    return {"metric": metric, "points": points}
+
+def _normalize_ts(*values: Optional[str], detail: str = "from / to 必须是 YYYY-MM-DDTHH:MM:SS 格式") -> list:
+    """
+    校验时间参数并统一成 YYYY-MM-DDTHH:MM:SS（只有日期时为当天 00:00:00），格式不对或日期不存在时返回 400。
+    SQL 的字符串比较和按 epoch 计算的路径都用统一后的值，结果不随走哪条路径变化
+    """
+    try:
+        return [epoch_to_ts(ts_to_epoch(ts)) if ts is not None else None for ts in values]
+    except ValueError:
+        raise HTTPException(status_code=400, detail=detail)
+
+
+def _range_where(metric: str, from_ts: Optional[str], to_ts: Optional[str], after_ts: Optional[str] = None):
+    """(metric, ts) 范围条件，返回 (where_sql, params)"""
+    conditions = ["metric = ?"]
+    params: List[object] = [metric]
+
+    if from_ts is not None:
+        conditions.append("ts >= ?")
+        params.append(from_ts)
+    if after_ts is not None:
+        conditions.append("ts > ?")
+        params.append(after_ts)
+    if to_ts is not None:
+        conditions.append("ts <= ?")
+        params.append(to_ts)
+
+    return " AND ".join(conditions), params
+
+
+def _check_row_budget(conn: sqlite3.Connection, metric: str, from_ts: Optional[str], to_ts: Optional[str]) -> None:
+    """范围内超过 API_MAX_ROWS 行时返回 400（这些接口没有等价的降采样结果）"""
+    if not ADMISSION_ENABLED:
+        return
+    where_sql, params = _range_where(metric, from_ts, to_ts)
+    with phase("query"):
+        estimated = estimate_rows(conn, where_sql, params)
+    if estimated > API_MAX_ROWS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"{metric} 在该时间范围内超过 {API_MAX_ROWS} 个点，请缩小时间范围，或用 /api/aggregate 按时间桶查询",
+        )
+
+
+def _downsampled_history(conn, fmt: str, metric: str, from_ts, to_ts, after_ts):
+    """/api/history 超出行数预算时的降采样结果：按桶取平均值，桶宽为小时整数倍时走 rollups"""
+    # 桶宽按实际有数据的范围计算（from=2000-01-01 这类请求不会因此变粗）
+    # from / to / after_ts 已由 get_history 校验并统一格式
+    first_ts, last_ts = data_range(conn, metric)
+    lo_epoch = ts_to_epoch(first_ts)
+    hi_epoch = ts_to_epoch(last_ts)
+    if from_ts is not None:
+        lo_epoch = max(lo_epoch, ts_to_epoch(from_ts))
+    if after_ts is not None:
+        lo_epoch = max(lo_epoch, ts_to_epoch(after_ts) + 1)
+    if to_ts is not None:
+        hi_epoch = min(hi_epoch, ts_to_epoch(to_ts))
+
+    step = downsample_step(lo_epoch, hi_epoch)
+    lo, hi = align_range(epoch_to_ts(lo_epoch), epoch_to_ts(hi_epoch), step)
+    result = aggregate(conn, metric, lo, hi, step, ["avg"])
+
+    with phase("shape"):
+        buckets = result["ts"]
+        if ts_select_sql(fmt) != TS_EPOCH_SQL:
+            buckets = [epoch_to_ts(bucket) for bucket in buckets]
+        rows = list(zip(buckets, result["avg"]))
+    return render_points(fmt, metric, rows, extra={"downsampled": step}, headers={"X-Downsampled": str(step)})
 
 
 @app.get("/api/history")
 def get_history(
+    request: Request,
     metric: Metric = Query(..., description="metric=temperature|humidity|pressure"),
     from_ts: Optional[str] = Query(None, alias="from", description="起始时间（含），YYYY-MM-DDTHH:MM:SS"),
     to_ts: Optional[str] = Query(None, alias="to", description="结束时间（含），YYYY-MM-DDTHH:MM:SS"),
+    after_ts: Optional[str] = Query(None, description="分页游标（不含），取上一页返回的 next_cursor"),
+    page_size: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="每页点数；不传则一次返回整个区间"),
+    fmt: Optional[str] = Query(None, alias="format", description="json|columnar|msgpack|arrow，缺省按 Accept 协商"),
 ):
     """
     历史数据：按时间范围查询并按时间升序返回
     响应结构与 /api/realtime 相同。
+
+    分页（keyset）：传 page_size 后每页最多返回 page_size 个点，并附带
+    "next_cursor"（同时写入 X-Next-Cursor 响应头）。下一页把它作为 after_ts 传回，
+    直到 next_cursor 为 null。每页都是 (metric, ts) 索引上的一次范围查找 + LIMIT，
+    不使用 OFFSET，翻到第几页代价都相同。
+
+    不分页且范围内超过 API_MAX_ROWS 行时，改为返回降采样结果（按桶取平均值，ts 为桶起点），
+    响应附带 "downsampled": 桶宽秒数（同时写入 X-Downsampled 响应头），见 admission.py。
     """
-    if from_ts is None and to_ts is None:
+    if from_ts is None and to_ts is None and after_ts is None:
         raise HTTPException(status_code=400, detail="至少需要提供 from 或 to 参数")
+    # 不论之后是否降采样都先校验并统一格式，同一个请求的结果不随范围内的行数变化
+    from_ts, to_ts, after_ts = _normalize_ts(
+        from_ts, to_ts, after_ts, detail="from / to / after_ts 必须是 YYYY-MM-DDTHH:MM:SS 格式"
+    )
+
+    fmt = negotiate_format(request, fmt)
 
     conn = get_db_connection()
     try:
         cur = conn.cursor()
 
-        conditions = ["metric = ?"]
-        params: List[object] = [metric]
+        where_sql, params = _range_where(metric, from_ts, to_ts, after_ts)
 
-        if from_ts is not None:
-            conditions.append("ts >= ?")
-            params.append(from_ts)
-        if to_ts is not None:
-            conditions.append("ts <= ?")
-            params.append(to_ts)
+        if page_size is None and ADMISSION_ENABLED:
+            with phase("query"):
+                estimated = estimate_rows(conn, where_sql, params)
+            if estimated > API_MAX_ROWS:
+                return _downsampled_history(conn, fmt, metric, from_ts, to_ts, after_ts)
 
-        where_sql = " AND ".join(conditions)
+        # 分页时多取一行用来判断是否还有下一页，并额外取出原始 ts 作为游标
+        cursor_sql = ""
+        limit_sql = ""
+        if page_size is not None:
+            cursor_sql = ", ts"
+            limit_sql = "LIMIT ?"
+            params.append(page_size + 1)
 
         sql = f"""
-            SELECT ts, value
+            SELECT {ts_select_sql(fmt)}, value{cursor_sql}
             FROM measurements
             WHERE {where_sql}
             ORDER BY ts ASC
+            {limit_sql}
         """
         cur.execute(sql, params)
         rows = cur.fetchall()
     finally:
         conn.close()
 
-    points = [{"ts": row["ts"], "value": row["value"]} for row in rows]
-    return {"metric": metric, "points": points}
+    if page_size is None:
+        return render_points(fmt, metric, rows)
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = rows[-1][2]
+
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor is not None else None
+    with phase("shape"):
+        rows = [(row[0], row[1]) for row in rows]
+    return render_points(
+        fmt,
+        metric,
+        rows,
+        extra={"next_cursor": next_cursor},
+        headers=headers,
+    )
 
 
 @app.get("/api/stats")
@@ -137,6 +456,8 @@ def get_stats(
     metric: Metric = Query(..., description="metric=temperature|humidity|pressure"),
     from_ts: Optional[str] = Query(None, alias="from", description="起始时间（含），YYYY-MM-DDTHH:MM:SS"),
     to_ts: Optional[str] = Query(None, alias="to", description="结束时间（含），YYYY-MM-DDTHH:MM:SS"),
+    quantiles: Optional[str] = Query(None, description="分位数，逗号分隔，如 0.5,0.9,0.99"),
+    histogram: Optional[int] = Query(None, ge=1, le=1000, description="等宽直方图的区间数"),
 ):
     """
     统计数据：
@@ -152,7 +473,28 @@ def get_stats(
     规则：
     - NULL 不参与 min/max/mean
     - missing = 总记录数 - 有效值记录数
+
+    传入 quantiles / histogram 时额外返回：
+      "quantiles": {"p50": ..., "p90": ..., "p99": ...},
+      "histogram": {"edges": [...], "counts": [...]},
+      "approximate": true/false, "relative_error": 0.01
+    长区间由按小时预聚合的 DDSketch 合并得到（分位数相对误差 ≤ relative_error），
+    短区间直接精确计算，详见 rollup.py
     """
+    # 两条路径共用同一次校验
+    from_ts, to_ts = _normalize_ts(from_ts, to_ts)
+
+    if quantiles is not None or histogram is not None:
+        try:
+            qs = parse_quantiles(quantiles)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"quantiles 必须是 0~1 之间的数字列表: {quantiles}")
+        conn = get_db_connection()
+        try:
+            return FastJSONResponse(summarize(conn, metric, from_ts, to_ts, qs, histogram))
+        finally:
+            conn.close()
+
     conn = get_db_connection()
     try:
         cur = conn.cursor()
@@ -197,18 +539,382 @@ def get_stats(
     max_val = row["max_val"]
     avg_val = row["avg_val"]
 
-    return {
+    return FastJSONResponse({
         "metric": metric,
         "count": int(total),
         "missing": missing,
         "min": min_val,
         "max": max_val,
         "mean": avg_val,
+    })
+
+
+@app.get("/api/aggregate")
+def get_aggregate(
+    metric: Metric = Query(..., description="metric=temperature|humidity|pressure"),
+    from_ts: Optional[str] = Query(None, alias="from", description="起始时间（含），YYYY-MM-DDTHH:MM:SS"),
+    to_ts: Optional[str] = Query(None, alias="to", description="结束时间（含），YYYY-MM-DDTHH:MM:SS"),
+    interval: str = Query("1h", description="桶宽，如 10m / 1h / 1d（按 UTC 对齐）"),
+    fn: Optional[str] = Query(None, description="avg,min,max,count,first,last 的任意组合，缺省为全部"),
+):
+    """
+    按时间桶聚合，列式返回：
+    {
+      "metric": "temperature",
+      "interval": "1h",
+      "interval_seconds": 3600,
+      "source": "raw" | "rollup",
+      "ts": [1392249600, ...],      # 桶起点 epoch 秒
+      "avg": [...], "min": [...], "max": [...], "count": [...], "first": [...], "last": [...]
+    }
+
+    - avg/min/max/first/last 只基于有效值（NULL 不参与），count 为记录总数（与 /api/stats 一致）
+    - 只返回有数据的桶
+    - 桶宽为小时整数倍且范围按桶对齐时直接从 rollups 表计算（source=rollup）
+    """
+    try:
+        step = parse_interval(interval)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"interval 格式不正确: {interval}（示例: 10m / 1h / 1d）")
+    try:
+        fns = parse_functions(fn)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"不支持的聚合函数: {e}")
+
+    # 先校验原始参数再与数据边界比较："garbage" 这类字符串比任何时间戳都大，不校验会被当成空区间
+    try:
+        for ts in (from_ts, to_ts):
+            if ts is not None:
+                ts_to_epoch(ts)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="from / to 必须是 YYYY-MM-DDTHH:MM:SS 格式")
+
+    conn = get_db_connection()
+    try:
+        first_ts, last_ts = data_range(conn, metric)
+        result = {"metric": metric, "interval": interval, "interval_seconds": step}
+        if first_ts is None:
+            return FastJSONResponse({**result, "source": "raw", "ts": [], **{name: [] for name in fns}})
+
+        # 收窄到数据边界所在的桶：不会多包含或遗漏数据，且对齐的范围仍保持对齐（可以走 rollup）
+        data_lo, data_hi = align_range(first_ts, last_ts, step)
+        lo = max(from_ts, data_lo) if from_ts is not None else data_lo
+        hi = min(to_ts, data_hi) if to_ts is not None else data_hi
+        if lo > hi:
+            return FastJSONResponse({**result, "source": "raw", "ts": [], **{name: [] for name in fns}})
+        span = ts_to_epoch(hi) - ts_to_epoch(lo)
+        if span // step + 1 > MAX_BUCKETS:
+            raise HTTPException(status_code=400, detail=f"桶数超过上限 {MAX_BUCKETS}，请增大 interval")
+
+        return FastJSONResponse({**result, **aggregate(conn, metric, lo, hi, step, fns)})
+    finally:
+        conn.close()
+
+
+@app.get("/api/joined")
+def get_joined(
+    metrics: Optional[str] = Query(None, description="逗号分隔，如 temperature,humidity；缺省为全部"),
+    from_ts: Optional[str] = Query(None, alias="from", description="起始时间（含），YYYY-MM-DDTHH:MM:SS"),
+    to_ts: Optional[str] = Query(None, alias="to", description="结束时间（含），YYYY-MM-DDTHH:MM:SS"),
+    tolerance: int = Query(0, ge=0, le=MAX_TOLERANCE, description="as-of 对齐容差（秒），0 表示精确对齐"),
+    derived: Optional[str] = Query(None, description="派生量：dew_point,heat_index"),
+):
+    """
+    多指标对齐，列式返回：
+    {
+      "metrics": ["temperature", "humidity"],
+      "mode": "exact" | "asof",
+      "tolerance": 0,
+      "ts": [1392249600, ...],              # epoch 秒
+      "temperature": [4.0, ...],            # 缺失为 null
+      "humidity": [93.0, ...],
+      "dew_point": [3.0, ...]               # 传了 derived 时才有
+    }
+
+    - tolerance=0：按 ts 精确外连接（ts 为各 metric 时间戳的并集）
+    - tolerance>0：以 metrics 中第一个为基准，其他 metric 取 [ts - tolerance, ts] 内最近的一条
+    - dew_point / heat_index 需要 metrics 同时包含 temperature 和 humidity，单位 °C
+    """
+    if from_ts is None and to_ts is None:
+        raise HTTPException(status_code=400, detail="至少需要提供 from 或 to 参数")
+    try:
+        names = parse_metrics(metrics)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"不支持的 metric: {e}")
+    try:
+        fields = parse_derived(derived, names)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    conn = get_db_connection()
+    try:
+        for name in names:
+            _check_row_budget(conn, name, from_ts, to_ts)
+        try:
+            result = join_metrics(conn, names, from_ts, to_ts, tolerance, fields)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="from / to 必须是 YYYY-MM-DDTHH:MM:SS 格式")
+    finally:
+        conn.close()
+
+    return FastJSONResponse({
+        "metrics": names,
+        "mode": "asof" if tolerance > 0 else "exact",
+        "tolerance": tolerance,
+        **result,
+    })
+
+
+@app.get("/api/anomalies")
+def get_anomalies(
+    metric: Metric = Query(..., description="metric=temperature|humidity|pressure"),
+    from_ts: Optional[str] = Query(None, alias="from", description="起始时间（含），YYYY-MM-DDTHH:MM:SS"),
+    to_ts: Optional[str] = Query(None, alias="to", description="结束时间（含），YYYY-MM-DDTHH:MM:SS"),
+    method: str = Query("zscore", description="zscore | mad | iqr"),
+    window: int = Query(DEFAULT_WINDOW, ge=3, le=MAX_WINDOW, description="尾随窗口的点数（不含当前点）"),
+    threshold: Optional[float] = Query(None, gt=0, description="|score| 达到该值判为 spike，缺省按 method 取默认值"),
+    flatline: Optional[int] = Query(None, ge=2, description="连续 N 个相同值判为 flatline，缺省不检测"),
+    full: bool = Query(False, description="true 时返回范围内所有点的得分，否则只返回异常点"),
+):
+    """
+    滚动窗口异常检测，列式返回：
+    {
+      "metric": "temperature", "method": "zscore", "window": 36,
+      "threshold": 3.0, "flatline": null,
+      "scored": 52000,              # 范围内的点数
+      "flagged": 120,               # 被判为异常的点数
+      "cached_days": 360,           # 命中得分缓存的天数
+      "ts": [1392249600, ...],      # epoch 秒
+      "value": [...], "score": [...],
+      "kind": ["spike" | "flatline" | null, ...]
+    }
+
+    - 每个点只和它之前的 window 个点比较，与 collector 入库时的增量检测结果一致
+    - 窗口内有效值不足、或当前值缺失时 score 为 null
+    """
+    if from_ts is None and to_ts is None:
+        raise HTTPException(status_code=400, detail="至少需要提供 from 或 to 参数")
+    if method not in METHODS:
+        raise HTTPException(status_code=400, detail=f"不支持的 method: {method}（可选: {', '.join(METHODS)}）")
+    if flatline is not None and flatline > window:
+        raise HTTPException(status_code=400, detail="flatline 不能大于 window")
+    if threshold is None:
+        threshold = DEFAULT_THRESHOLDS[method]
+
+    conn = get_db_connection()
+    try:
+        _check_row_budget(conn, metric, from_ts, to_ts)
+        try:
+            result = detect(conn, metric, from_ts, to_ts, method, window)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="from / to 必须是 YYYY-MM-DDTHH:MM:SS 格式")
+    finally:
+        conn.close()
+
+    with phase("shape"):
+        kinds = classify(result["score"], result["runs"], threshold, flatline)
+        points = select_points(result, kinds, full)
+    return FastJSONResponse({
+        "metric": metric,
+        "method": method,
+        "window": window,
+        "threshold": threshold,
+        "flatline": flatline,
+        "scored": len(kinds),
+        "flagged": sum(kind is not None for kind in kinds),
+        "cached_days": result["cached_days"],
+        **points,
+    })
+
+
+@app.get("/api/forecast")
+def get_forecast(
+    metric: Metric = Query(..., description="metric=temperature|humidity|pressure"),
+    model: str = Query("linear", description="linear | holt | ewma"),
+    horizon: int = Query(forecasting.DEFAULT_HORIZON, ge=1, le=forecasting.MAX_HORIZON, description="预测未来的点数"),
+    window: int = Query(forecasting.DEFAULT_WINDOW, ge=forecasting.MIN_POINTS, le=forecasting.MAX_WINDOW,
+                        description="拟合使用的最近点数"),
+    alpha: float = Query(forecasting.FORECAST_ALPHA, gt=0, lt=1, description="ewma / holt 的水平平滑系数"),
+    beta: float = Query(forecasting.FORECAST_BETA, gt=0, lt=1, description="holt 的趋势平滑系数"),
+    to_ts: Optional[str] = Query(None, alias="to", description="以该时刻为终点拟合（缺省为最新数据，走缓存）"),
+):
+    """
+    趋势预测：
+    {
+      "metric": "temperature", "model": "holt", "window": 100, "horizon": 10,
+      "alpha": 0.3, "beta": 0.1,
+      "source": "cache" | "incremental" | "fit",
+      "valid_points": 100,            # 窗口内有效点数
+      "step_seconds": 600,            # 未来点的间隔
+      "rmse": 0.41,
+      "last_ts": "2015-02-12T23:50:00",
+      "fitted":   {"ts": [...], "value": [...]},    # 窗口内的拟合值，ts 为 epoch 秒
+      "forecast": {"ts": [...], "value": [...]}     # 未来 horizon 个点
     }
 
+    - 有效点少于 10 个时 fitted / forecast 为空
+    - 不带 to 时所有客户端共享同一份拟合，新数据到达后下一次请求只做增量更新
+    """
+    if model not in forecasting.MODELS:
+        raise HTTPException(status_code=400, detail=f"不支持的 model: {model}（可选: {', '.join(forecasting.MODELS)}）")
+    if to_ts is not None:
+        try:
+            ts_to_epoch(to_ts)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"to 必须是 YYYY-MM-DDTHH:MM:SS 格式: {to_ts}")
+    # 模型用不到的参数置空，避免同一个拟合按无关参数重复缓存
+    if model == "linear":
+        alpha = beta = None
+    elif model == "ewma":
+        beta = None
+
+    conn = get_db_connection()
+    try:
+        result, source = forecasting.forecast(
+            conn, metric, model, window, horizon,
+            alpha=alpha, beta=beta, to_ts=to_ts,
+        )
+    finally:
+        conn.close()
+
+    return FastJSONResponse({
+        "metric": metric,
+        "model": model,
+        "window": window,
+        "alpha": alpha,
+        "beta": beta,
+        "source": source,
+        **result,
+    })
+
+
+@app.get("/api/debug/slow")
+def get_debug_slow(limit: int = Query(20, ge=1, le=1000, description="返回最近的慢请求条数")):
+    """
+    最近的慢请求（需 API_PROFILING=true），最新的在前：
+    {
+      "enabled": true, "slow_ms": 200, "ring_size": 100, "stacks": false,
+      "requests": [
+        {"started_at": "...", "method": "GET", "path": "/api/history", "query_string": "...",
+         "status": 200, "total_ms": 250.1,
+         "phases_ms": {"connect": 0.1, "query": 3.2, "fetch": 80.5, "shape": 40.2, "serialize": 20.3},
+         "other_ms": 5.8,
+         "queries": [{"sql": "...", "params": [...], "rows": 50000, "execute_ms": 3.2, "fetch_ms": 80.5}],
+         "stacks": [{"stack": "api.py:get_history;...", "samples": 12}]}
+      ]
+    }
+    """
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="未开启请求剖析（设置环境变量 API_PROFILING=true）")
+    return FastJSONResponse(slow_snapshot(limit))
+
+
+def _parse_last_event_id(value: Optional[str]) -> Optional[int]:
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Last-Event-ID 必须是整数: {value}")
+
+
+async def _sse_stream(subscriber, backlog, last_id):
+    """SSE 输出：先补发 backlog，再持续推送；空闲时发送心跳注释"""
+    try:
+        if backlog:
+            last_id = backlog[-1].id
+        # 告诉浏览器 EventSource 断线后 1 秒重连（会自动带上 Last-Event-ID）
+        yield b"retry: 1000\n\n" + b"".join(event.sse for event in backlog)
+        while True:
+            await subscriber.wait(HEARTBEAT_INTERVAL)
+            events = subscriber.drain()
+            if events:
+                # 补发阶段已经发过的事件不再重复
+                chunk = b"".join(event.sse for event in events if event.id > last_id)
+                last_id = max(last_id, events[-1].id)
+                if chunk:
+                    yield chunk
+            elif subscriber.closed:
+                # 慢消费者被断开：通知客户端，由其携带 Last-Event-ID 重连补齐
+                yield b"event: dropped\ndata: {}\n\n"
+                break
+            else:
+                yield b": keep-alive\n\n"
+    finally:
+        hub.unsubscribe(subscriber)
+
+
+@app.get("/api/stream")
+async def stream_sse(
+    request: Request,
+    metric: Metric = Query(..., description="metric=temperature|humidity|pressure"),
+    last_event_id: Optional[str] = Query(None, description="断线重连游标，等同于 Last-Event-ID 请求头"),
+):
+    """
+    实时推送（Server-Sent Events）
+
+    每条事件：
+        id: <measurements.id>
+        event: point
+        data: {"id": 123, "metric": "temperature", "ts": "...", "value": 11.0}
+
+    断线重连时带上 Last-Event-ID（请求头或 last_event_id 参数），服务端先从环形
+    缓冲区或数据库补发之后提交的数据，再继续推送。
+    """
+    cursor = _parse_last_event_id(request.headers.get("last-event-id") or last_event_id)
+
+    # 先订阅再补发，保证补发和实时推送之间不丢数据（重复的由 id 去掉）
+    subscriber = hub.subscribe(metric)
+    backlog = []
+    if cursor is not None:
+        backlog = await run_in_threadpool(hub.replay, metric, cursor)
+
+    return StreamingResponse(
+        _sse_stream(subscriber, backlog, cursor or 0),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.websocket("/api/stream")
+async def stream_websocket(
+    websocket: WebSocket,
+    metric: Metric = Query(...),
+    last_event_id: Optional[int] = Query(None),
+):
+    """
+    实时推送（WebSocket），每条消息为一个 JSON 事件（结构同 SSE 的 data）
+
+    慢消费者被断开时使用关闭码 1013（Try Again Later），客户端带上最后收到的 id
+    作为 last_event_id 重连即可。
+    """
+    await websocket.accept()
+    subscriber = hub.subscribe(metric)
+    try:
+        last_id = 0
+        if last_event_id is not None:
+            backlog = await run_in_threadpool(hub.replay, metric, last_event_id)
+            for event in backlog:
+                await websocket.send_text(event.json)
+            last_id = backlog[-1].id if backlog else last_event_id
+        while True:
+            await subscriber.wait(HEARTBEAT_INTERVAL)
+            events = subscriber.drain()
+            for event in events:
+                if event.id > last_id:
+                    await websocket.send_text(event.json)
+                    last_id = event.id
+            if not events and subscriber.closed:
+                await websocket.close(code=1013)
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.unsubscribe(subscriber)
+
 
 if __name__ == "__main__":
-    # 方便本地调试：python api.py
+    # 方便本地调试：python api.py（单进程 + 自动重载；生产环境请用 python serve.py --workers N）
     import uvicorn
 
     uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=True)
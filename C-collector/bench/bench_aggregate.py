@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+服务端分桶聚合 vs 客户端聚合
+
+用法（在 C-collector 目录下）：
+    python bench/bench_aggregate.py --days 365 --interval 1h --repeat 5
+
+流程：
+1. 在临时目录中用 collector.init_database 建库，写入 days 天的 temperature 序列
+2. 通过 TestClient 调用 api.app（不经过网络，只比较服务端 + 编解码开销）：
+   - client：GET /api/history 取全部原始点，客户端按桶计算 avg/min/max/count/first/last
+   - raw：GET /api/aggregate，范围不对齐，在原始数据上一次 GROUP BY
+   - rollup(cold)：GET /api/aggregate，范围对齐，先清空 rollups 表（含补算开销）
+   - rollup(warm)：同上，rollups 已就绪
+3. 校验三种方式的结果一致
+"""
+
+import argparse
+import json
+import math
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from series import build_series  # noqa: E402
+
+METRIC = "temperature"
+FUNCTIONS = ["avg", "min", "max", "count", "first", "last"]
+
+
+def seed(db_path: str, days: float) -> list:
+    series = build_series(METRIC, days)
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO measurements (metric, ts, value, received_at) VALUES (?, ?, ?, ?)",
+        [(METRIC, ts, value, ts) for ts, value in series],
+    )
+    conn.commit()
+    conn.close()
+    return series
+
+
+def client_side(client, lo: str, hi: str, step: int) -> dict:
+    """旧方式：拉取全部原始点后在客户端分桶"""
+    from rollup import ts_to_epoch
+
+    body = client.get("/api/history", params={"metric": METRIC, "from": lo, "to": hi}).json()
+    buckets = {}
+    for point in body["points"]:
+        bucket = ts_to_epoch(point["ts"]) // step * step
+        state = buckets.get(bucket)
+        if state is None:
+            state = buckets[bucket] = {"count": 0, "n": 0, "sum": 0.0, "min": None, "max": None,
+                                       "first": None, "last": None}
+        state["count"] += 1
+        value = point["value"]
+        if value is None:
+            continue
+        state["n"] += 1
+        state["sum"] += value
+        state["min"] = value if state["min"] is None else min(state["min"], value)
+        state["max"] = value if state["max"] is None else max(state["max"], value)
+        if state["first"] is None:
+            state["first"] = value
+        state["last"] = value
+
+    result = {"ts": sorted(buckets)}
+    states = [buckets[b] for b in result["ts"]]
+    result["avg"] = [s["sum"] / s["n"] if s["n"] else None for s in states]
+    for name in ("min", "max", "count", "first", "last"):
+        result[name] = [s[name] for s in states]
+    return result
+
+
+def server_side(client, lo: str, hi: str, interval: str):
+    response = client.get("/api/aggregate", params={"metric": METRIC, "from": lo, "to": hi, "interval": interval})
+    response.raise_for_status()
+    return response.json(), len(response.content)
+
+
+def same(a: dict, b: dict) -> bool:
+    if a["ts"] != b["ts"]:
+        return False
+    for name in FUNCTIONS:
+        for x, y in zip(a[name], b[name]):
+            if (x is None) != (y is None):
+                return False
+            if x is not None and not math.isclose(x, y, rel_tol=1e-9, abs_tol=1e-9):
+                return False
+    return True
+
+
+def best_of(repeat, func, *args, setup=None):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/api/aggregate 与客户端聚合的耗时对比")
+    parser.add_argument("--days", type=float, default=365, help="数据跨度（天），默认一年")
+    parser.add_argument("--interval", default="1h", help="桶宽（需为小时整数倍才能对比 rollup），默认 1h")
+    parser.add_argument("--repeat", type=int, default=5, help="每项取最优的重复次数")
+    parser.add_argument("--output", default=None, help="结果另存为 JSON 文件")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_aggregate_")
+    os.chdir(workdir)  # collector.DB_PATH 是相对路径
+
+    import collector
+    from aggregate import parse_interval
+    from api import app
+    from fastapi.testclient import TestClient
+    from rollup import epoch_to_ts, ts_to_epoch
+
+    collector.init_database()
+    series = seed(collector.DB_PATH, args.days)
+    step = parse_interval(args.interval)
+
+    # 对齐范围：覆盖整段数据的整数个桶；不对齐范围：起点错开 1 秒（强制走原始数据）
+    aligned_lo = epoch_to_ts(ts_to_epoch(series[0][0]) // step * step)
+    aligned_hi = epoch_to_ts(ts_to_epoch(series[-1][0]) // step * step + step - 1)
+    shifted_lo = epoch_to_ts(ts_to_epoch(aligned_lo) + 1)
+
+    def clear_rollups():
+        conn = sqlite3.connect(collector.DB_PATH)
+        conn.execute("DELETE FROM rollups")
+        conn.commit()
+        conn.close()
+
+    results = []
+    with TestClient(app) as client:
+        client_s, reference = best_of(args.repeat, client_side, client, aligned_lo, aligned_hi, step)
+        results.append({"mode": "client", "seconds": client_s,
+                        "bytes": len(client.get("/api/history", params={
+                            "metric": METRIC, "from": aligned_lo, "to": aligned_hi}).content)})
+
+        raw_s, (raw, raw_bytes) = best_of(args.repeat, server_side, client, shifted_lo, aligned_hi, args.interval)
+        assert raw["source"] == "raw"
+        results.append({"mode": "raw", "seconds": raw_s, "bytes": raw_bytes})
+
+        cold_s, (cold, cold_bytes) = best_of(args.repeat, server_side, client, aligned_lo, aligned_hi,
+                                             args.interval, setup=clear_rollups)
+        warm_s, (warm, warm_bytes) = best_of(args.repeat, server_side, client, aligned_lo, aligned_hi, args.interval)
+        if cold["source"] == "rollup":
+            results.append({"mode": "rollup(cold)", "seconds": cold_s, "bytes": cold_bytes})
+            results.append({"mode": "rollup(warm)", "seconds": warm_s, "bytes": warm_bytes})
+
+    # 原始数据上的第一个桶少了 1 秒的数据，跳过该桶后比较
+    trimmed = {name: column[1:] for name, column in raw.items() if isinstance(column, list)}
+    ref_trimmed = {name: column[1:] for name, column in reference.items()}
+    assert same(trimmed, ref_trimmed), "raw 结果与客户端聚合不一致"
+    assert same(warm, reference), "rollup 结果与客户端聚合不一致"
+
+    print(f"{len(series)} points, {len(reference['ts'])} buckets of {args.interval}")
+    print(f"{'mode':<14}{'ms':>10}{'bytes':>12}{'speedup':>10}")
+    for r in results:
+        r["ms"] = round(r.pop("seconds") * 1000, 2)
+        r["speedup"] = round(results[0]["ms"] / r["ms"], 1) if r is not results[0] else 1.0
+        print(f"{r['mode']:<14}{r['ms']:>10}{r['bytes']:>12}{r['speedup']:>10}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
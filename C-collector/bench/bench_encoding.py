@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+响应编码对比：payload 大小 / 服务端编码耗时 / 客户端解码耗时
+
+用法（在 C-collector 目录下）：
+    python bench/bench_encoding.py --days 365 --repeat 5
+
+流程：
+1. 用 B-publisher 数据平移出 days 天的序列，写入内存 SQLite
+2. 按 api.py 相同的 SQL 取出 (ts, value) 行
+3. 每种格式：编码为响应 body，再按 D-ui 的方式解码为 NumPy 数组
+   （json: 逐点 dict → 数组；columnar: 两个列表 → 数组；arrow: 直接 to_numpy）
+"""
+
+import argparse
+import json
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import encoding  # noqa: E402
+from series import build_series  # noqa: E402
+
+
+def load_rows(days: float, fmt: str):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE measurements (metric TEXT, ts TEXT, value REAL)")
+    conn.execute("CREATE INDEX idx_metric_ts ON measurements(metric, ts)")
+    conn.executemany(
+        "INSERT INTO measurements VALUES ('temperature', ?, ?)",
+        build_series("temperature", days),
+    )
+    rows = conn.execute(
+        f"SELECT {encoding.ts_select_sql(fmt)} AS ts, value FROM measurements "
+        "WHERE metric = 'temperature' ORDER BY ts"
+    ).fetchall()
+    conn.close()
+    return rows
+
+
+def encode(fmt, rows):
+    return encoding.render_points(fmt, "temperature", rows).body
+
+
+def decode(fmt, body):
+    if fmt == encoding.FORMAT_JSON:
+        points = json.loads(body)["points"]
+        ts = np.array([p["ts"] for p in points], dtype="datetime64[s]").astype("int64")
+        value = np.array([p["value"] for p in points], dtype="float64")
+    elif fmt == encoding.FORMAT_COLUMNAR:
+        data = json.loads(body)
+        ts = np.asarray(data["ts"], dtype="int64")
+        value = np.asarray(data["value"], dtype="float64")
+    elif fmt == encoding.FORMAT_MSGPACK:
+        data = encoding.msgpack.unpackb(body)
+        ts = np.asarray(data["ts"], dtype="int64")
+        value = np.asarray(data["value"], dtype="float64")
+    else:
+        table = encoding.pa.ipc.open_stream(body).read_all()
+        ts = table.column("ts").to_numpy()
+        value = table.column("value").to_numpy(zero_copy_only=False)
+    return ts, value
+
+
+def best_of(repeat, func, *args):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="响应编码 payload 大小与编解码耗时对比")
+    parser.add_argument("--days", type=float, default=365, help="数据跨度（天），默认一年")
+    parser.add_argument("--repeat", type=int, default=5, help="每项取最优的重复次数")
+    parser.add_argument("--output", default=None, help="结果另存为 JSON 文件")
+    args = parser.parse_args()
+
+    formats = [f for f in encoding.MEDIA_TYPES if encoding._is_available(f)]
+    results = []
+    reference = None
+    for fmt in formats:
+        rows = load_rows(args.days, fmt)
+        encode_s, body = best_of(args.repeat, encode, fmt, rows)
+        decode_s, (ts, value) = best_of(args.repeat, decode, fmt, body)
+        if reference is None:
+            reference = (ts, value)
+        else:
+            # 各格式解码结果必须一致
+            assert np.array_equal(ts, reference[0])
+            assert np.allclose(value, reference[1], equal_nan=True)
+        results.append({
+            "format": fmt,
+            "points": len(rows),
+            "bytes": len(body),
+            "encode_ms": round(encode_s * 1000, 2),
+            "decode_ms": round(decode_s * 1000, 2),
+        })
+
+    print(f"{'format':<10}{'points':>9}{'bytes':>12}{'encode ms':>12}{'decode ms':>12}")
+    for r in results:
+        print(f"{r['format']:<10}{r['points']:>9}{r['bytes']:>12}{r['encode_ms']:>12}{r['decode_ms']:>12}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+代理 → collector 写入路径：逐点（env/<metric>）与微批（env/batch/<metric>）的吞吐和端到端延迟
+
+用法（在 C-collector 目录下）：
+    python bench/bench_ingest_batch.py --points 30000
+    python bench/bench_ingest_batch.py --points 6000 --rate 300 --linger-ms 200
+
+在一个进程里串起两端的真实代码：主线程按 --rate 产生原始 payload，走代理的清洗
+（PayloadValidator.clean）后逐点编码，或交给 MicroBatcher 攒批；编码后的消息放入队列，
+collector 线程用 collector.on_message 写入临时数据库（与线上一样每条消息 / 每批一个事务）。
+没有 broker，不含网络与 broker 转发的开销。
+
+- 吞吐：--rate 0（不限速）时，全部点写入数据库所用时间折算的 points/s，以及 collector 收到的消息数 / 秒
+- 延迟：每个点从进入代理到所在事务提交的时间（p50 / p99 / max）；限速时批次多由
+  linger 触发，延迟上限约为 BATCH_LINGER_MS 加一次批量写入
+"""
+
+import argparse
+import json
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+PROXY_APP = ROOT.parent / "A-deploy" / "iot-project" / "deploy" / "proxy" / "app"
+
+# collector 在导入时读取这些配置
+_tmp = tempfile.TemporaryDirectory()
+os.environ["COLLECTOR_DB_PATH"] = os.path.join(_tmp.name, "bench.db")
+os.environ["STREAM_NOTIFY_ENABLED"] = "false"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(PROXY_APP))
+
+import collector  # noqa: E402
+from batcher import MicroBatcher  # noqa: E402
+from main import Config, PayloadValidator, codec  # noqa: E402
+
+METRICS = ["temperature", "humidity", "pressure"]
+
+
+class Message:
+    """与 paho MQTTMessage 相同的 topic / payload 属性"""
+
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+def make_payloads(count):
+    start = datetime(2014, 2, 13)
+    for i in range(count):
+        metric = METRICS[i % len(METRICS)]
+        ts = (start + timedelta(minutes=10 * (i // len(METRICS)))).strftime("%Y-%m-%dT%H:%M:%S")
+        yield metric, json.dumps({"ts": ts, "value": round(20 + (i % 97) / 10, 1)}).encode()
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def run(mode, points, rate, batch_size, linger_ms):
+    # 每轮使用新表
+    conn = collector.sqlite3.connect(collector.DB_PATH)
+    conn.execute("DROP TABLE IF EXISTS measurements")
+    conn.commit()
+    conn.close()
+    collector.init_database()
+
+    inbox = queue.Queue()
+    latencies = []
+    messages = 0
+
+    def consume():
+        nonlocal messages
+        while True:
+            item = inbox.get()
+            if item is None:
+                return
+            msg, arrivals = item
+            collector.on_message(None, None, msg)
+            done = time.perf_counter()
+            latencies.extend(done - t for t in arrivals)
+            messages += 1
+
+    # 批次中每个点的进入时间，与点一起攒批，发布时随批次一起交给 collector 线程
+    def publish_batch(metric, batch):
+        inbox.put((
+            Message(f"{Config.BATCH_PREFIX}{metric}", codec.dumps([point for point, _ in batch])),
+            [arrived for _, arrived in batch],
+        ))
+
+    batcher = None
+    if mode == "batch":
+        batcher = MicroBatcher(batch_size, linger_ms, publish_batch)
+        batcher.start()
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+
+    interval = 1 / rate if rate > 0 else 0
+    t0 = time.perf_counter()
+    for i, (metric, raw) in enumerate(make_payloads(points)):
+        if interval:
+            delay = t0 + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        arrived = time.perf_counter()
+        cleaned, _, _ = PayloadValidator.clean(raw)
+        if batcher is not None:
+            batcher.add(metric, (cleaned, arrived))
+        else:
+            inbox.put((Message(f"{Config.OUTPUT_PREFIX}{metric}", codec.dumps(cleaned)), [arrived]))
+
+    if batcher is not None:
+        batcher.close()
+    inbox.put(None)
+    consumer.join()
+    elapsed = time.perf_counter() - t0
+
+    conn = collector.sqlite3.connect(collector.DB_PATH)
+    stored = conn.execute("SELECT COUNT(*) FROM measurements").fetchone()[0]
+    conn.close()
+    assert stored == points, (mode, stored, points)
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "points": points,
+        "messages": messages,
+        "seconds": round(elapsed, 3),
+        "points_per_s": round(points / elapsed),
+        "messages_per_s": round(messages / elapsed),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="逐点 / 微批写入的吞吐与端到端延迟")
+    parser.add_argument("--points", type=int, default=30000, help="总点数（三个 metric 轮流）")
+    parser.add_argument("--rate", type=float, default=0, help="输入速率（点/秒），0 表示不限速")
+    parser.add_argument("--batch-size", type=int, default=Config.BATCH_MAX_SIZE)
+    parser.add_argument("--linger-ms", type=float, default=Config.BATCH_LINGER_MS)
+    parser.add_argument("--modes", default="stream,batch", help="逗号分隔：stream / batch")
+    parser.add_argument("--output", default=None, help="结果 JSON 文件路径")
+    args = parser.parse_args()
+
+    collector.VERBOSE = False
+    results = []
+    print(f"{'mode':>7}{'points':>8}{'msgs':>8}{'seconds':>9}{'points/s':>10}{'msgs/s':>9}"
+          f"{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for mode in args.modes.split(","):
+        result = run(mode, args.points, args.rate, args.batch_size, args.linger_ms)
+        results.append(result)
+        print(f"{mode:>7}{result['points']:>8}{result['messages']:>8}{result['seconds']:>9.2f}"
+              f"{result['points_per_s']:>10,}{result['messages_per_s']:>9,}"
+              f"{result['p50_ms']:>9.2f}{result['p99_ms']:>9.2f}{result['max_ms']:>9.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+JSON 序列化与响应压缩：改造前后对比
+
+用法（在 C-collector 目录下）：
+    python bench/bench_serialization.py --points 50000 --repeat 5
+
+两部分：
+1. 序列化阶段（进程内）：同一份 50k 点的 /api/history 结果
+   - before：返回 dict，由 FastAPI jsonable_encoder 逐元素转换后再用标准库 json 编码
+   - after：encoding.render_points 直接 orjson 编码为 bytes
+   以及 gzip / br 压缩的耗时与体积
+2. 端到端（TestClient，不含网络）：
+   - before：在同一个 app 上挂一个按旧方式返回 dict 的路由，不压缩
+   - after：GET /api/history，分别以 identity / gzip / br 协商
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from series import build_series  # noqa: E402
+
+METRIC = "temperature"
+
+
+def best_of(repeat, func, *args):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON 序列化与响应压缩的前后对比")
+    parser.add_argument("--points", type=int, default=50000, help="history 返回的点数，默认 50000")
+    parser.add_argument("--repeat", type=int, default=5, help="每项取最优的重复次数")
+    parser.add_argument("--output", default=None, help="结果另存为 JSON 文件")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_serialization_")
+    os.chdir(workdir)  # collector.DB_PATH 是相对路径
+
+    import collector
+    import compression
+    import encoding
+    from api import app, get_db_connection
+    from fastapi import Query
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.testclient import TestClient
+
+    # 按点数反推需要的天数（一年约 25876 点），多生成一些再截断
+    series = build_series(METRIC, args.points / 25876 * 365 + 30)[:args.points]
+    collector.init_database()
+    conn = sqlite3.connect(collector.DB_PATH)
+    conn.executemany(
+        "INSERT INTO measurements (metric, ts, value, received_at) VALUES (?, ?, ?, ?)",
+        [(METRIC, ts, value, ts) for ts, value in series],
+    )
+    conn.commit()
+    conn.close()
+    lo, hi = series[0][0], series[-1][0]
+
+    @app.get("/bench/history_legacy")
+    def history_legacy(metric: str = Query(...), from_ts: str = Query(..., alias="from"),
+                       to_ts: str = Query(..., alias="to")):
+        """改造前的 /api/history：返回 dict，由 FastAPI 负责编码"""
+        db = get_db_connection()
+        try:
+            rows = db.execute(
+                "SELECT ts, value FROM measurements WHERE metric = ? AND ts >= ? AND ts <= ? ORDER BY ts ASC",
+                (metric, from_ts, to_ts),
+            ).fetchall()
+        finally:
+            db.close()
+        return {"metric": metric, "points": [{"ts": ts, "value": value} for ts, value in rows]}
+
+    rows = [(ts, value) for ts, value in series]
+
+    # ---- 1. 序列化阶段 ----
+    def before_encode():
+        content = {"metric": METRIC, "points": [{"ts": ts, "value": value} for ts, value in rows]}
+        return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False,
+                          indent=None, separators=(",", ":")).encode("utf-8")
+
+    def after_encode():
+        return encoding.render_points(encoding.FORMAT_JSON, METRIC, rows).body
+
+    stage = []
+    before_s, before_body = best_of(args.repeat, before_encode)
+    after_s, after_body = best_of(args.repeat, after_encode)
+    assert json.loads(before_body) == json.loads(after_body)
+    stage.append({"step": "encode (jsonable_encoder + json)", "ms": before_s * 1000, "bytes": len(before_body)})
+    stage.append({"step": f"encode ({'orjson' if encoding.ORJSON_AVAILABLE else 'json'}, pre-encoded)",
+                  "ms": after_s * 1000, "bytes": len(after_body)})
+    for coding in compression._supported():
+        s, body = best_of(args.repeat, compression.compress, after_body, coding)
+        stage.append({"step": f"compress {coding}", "ms": s * 1000, "bytes": len(body)})
+
+    # ---- 2. 端到端 ----
+    params = {"metric": METRIC, "from": lo, "to": hi}
+    end_to_end = []
+    with TestClient(app) as client:
+        def fetch(path, accept_encoding):
+            response = client.get(path, params=params, headers={"Accept-Encoding": accept_encoding})
+            response.raise_for_status()
+            # httpx 会自动解压，这里取响应头中的传输体积
+            return len(response.json()["points"]), int(response.headers["content-length"])
+
+        cases = [("before", "/bench/history_legacy", "identity"),
+                 ("after", "/api/history", "identity"),
+                 ("after", "/api/history", "gzip")]
+        if compression.BROTLI_AVAILABLE:
+            cases.append(("after", "/api/history", "br"))
+        for label, path, accept_encoding in cases:
+            s, (points, size) = best_of(args.repeat, fetch, path, accept_encoding)
+            assert points == len(rows)
+            end_to_end.append({"case": f"{label} ({accept_encoding})", "ms": s * 1000, "bytes": size})
+
+    print(f"{len(rows)} points")
+    print(f"{'serialization step':<40}{'ms':>10}{'bytes':>12}")
+    for r in stage:
+        r["ms"] = round(r["ms"], 2)
+        print(f"{r['step']:<40}{r['ms']:>10}{r['bytes']:>12}")
+    print(f"\n{'GET /api/history':<40}{'ms':>10}{'bytes':>12}")
+    for r in end_to_end:
+        r["ms"] = round(r["ms"], 2)
+        print(f"{r['case']:<40}{r['ms']:>10}{r['bytes']:>12}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"points": len(rows), "serialization": stage, "end_to_end": end_to_end}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
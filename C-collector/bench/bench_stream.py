@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+/api/stream 扇出压测：N 个并发 SSE 订阅者，测量从 collector 提交到客户端收到的延迟
+
+用法（先启动 api.py，且本机 UDP 通知端口可用）：
+    python bench/bench_stream.py --clients 2000 --events 50 --rate 20
+
+事件由本脚本模拟 collector 发出（与 collector.notify_committed 相同的 UDP 报文），
+data 中的 ts 字段携带发送时刻，用于计算端到端延迟。
+"""
+
+import argparse
+import asyncio
+import json
+import socket
+import statistics
+import time
+
+
+async def sse_client(host, port, metric, expected, latencies, ready):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(
+        f"GET /api/stream?metric={metric} HTTP/1.1\r\nHost: {host}\r\n"
+        "Accept: text/event-stream\r\n\r\n".encode()
+    )
+    await writer.drain()
+    # 跳过响应头
+    while (await reader.readline()) not in (b"\r\n", b""):
+        pass
+    ready.release()
+    received = 0
+    while received < expected:
+        line = await reader.readline()
+        if not line:
+            break
+        # chunked 编码下 data 行前后会夹着长度行，按前缀识别即可
+        if line.startswith(b"data: {"):
+            payload = json.loads(line[6:])
+            latencies.append(time.time() - float(payload["ts"]))
+            received += 1
+    writer.close()
+    return received
+
+
+async def main_async(args):
+    latencies = []
+    ready = asyncio.Semaphore(0)
+    tasks = [
+        asyncio.create_task(sse_client(args.host, args.port, args.metric, args.events, latencies, ready))
+        for _ in range(args.clients)
+    ]
+    for _ in range(args.clients):
+        await ready.acquire()
+    print(f"{args.clients} 个订阅者已连接，开始发送 {args.events} 个事件 @ {args.rate}/s")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    base_id = int(time.time() * 1000)
+    for i in range(args.events):
+        message = {"id": base_id + i, "metric": args.metric, "ts": repr(time.time()), "value": float(i)}
+        sock.sendto(json.dumps(message).encode(), (args.notify_host, args.notify_port))
+        await asyncio.sleep(1.0 / args.rate)
+
+    received = await asyncio.wait_for(asyncio.gather(*tasks, return_exceptions=True), timeout=60)
+    delivered = sum(r for r in received if isinstance(r, int))
+    latencies.sort()
+    print(f"送达: {delivered}/{args.clients * args.events}")
+    if latencies:
+        q = statistics.quantiles(latencies, n=100)
+        print(f"延迟 ms: p50={q[49]*1000:.1f} p95={q[94]*1000:.1f} p99={q[98]*1000:.1f} max={latencies[-1]*1000:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SSE 扇出压测")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--notify-host", default="127.0.0.1")
+    parser.add_argument("--notify-port", type=int, default=8766)
+    parser.add_argument("--metric", default="temperature")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=20, help="每秒事件数")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,551 @@
+#!/usr/bin/env python3
+"""
+HTTP API 压测：并发 / 固定到达率下各接口的吞吐与延迟分位数
+
+用法（在 C-collector 目录下）：
+    # 固定并发（闭环）：32 个连接各自不停地发请求，持续 30 秒
+    python bench/loadtest.py --days 365 --concurrency 32 --duration 30 --output bench/results/base.json
+
+    # 固定到达率（开环）：每秒 200 个请求（泊松到达），最多 64 个连接
+    python bench/loadtest.py --days 365 --rate 200 --max-connections 64 --duration 30
+
+    # 压测已经在运行的 API（不建库、不启动服务）
+    python bench/loadtest.py --url http://127.0.0.1:8000 --concurrency 16
+
+    # 用 serve.py 启动 4 个 worker（预热 + 共享响应缓存）
+    python bench/loadtest.py --server serve --workers 4 --concurrency 32
+
+流程：
+1. 用 B-publisher 数据按时间平移生成 days 天的三个 metric，写入独立的 SQLite 文件
+   （--db 指定的文件已存在且规模一致时直接复用）
+2. 以 COLLECTOR_DB_PATH 指向该文件，用 uvicorn（或 serve.py）在本机启动 api:app，
+   等 /api/health 返回就绪后开始
+3. 按 --mix 的权重随机发出 realtime / history / stats（可选 aggregate）请求，
+   history / stats 的时间窗口在数据范围内随机选取
+4. 输出每个接口的请求数、错误数、吞吐量与 p50/p95/p99/p99.9 延迟（JSON），便于不同版本之间对比
+
+说明：
+- 客户端是基于 asyncio 的最小 HTTP/1.1 keep-alive 实现（不依赖第三方库），单进程可以
+  维持数百个连接；接近客户端 CPU 上限时会在输出中给出提示
+- 开环模式的延迟从“计划发送时刻”算起，包含等待空闲连接的时间，避免协调遗漏
+  （coordinated omission）把排队时间藏起来
+- 默认发送 Accept-Encoding: gzip, deflate（与 requests 库一致）
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+C_COLLECTOR_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(C_COLLECTOR_DIR))
+
+from series import METRICS, build_series  # noqa: E402
+from rollup import epoch_to_ts, quantile_key  # noqa: E402
+from sketch import exact_quantiles  # noqa: E402
+
+PERCENTILES = [0.5, 0.95, 0.99, 0.999]
+ENDPOINTS = ("realtime", "history", "stats", "aggregate")
+
+
+# ==================== 建库 ====================
+def seed_database(path: str, days: float) -> int:
+    """生成 days 天的三个 metric 写入 path，返回总行数；已有同规模的库直接复用"""
+    import collector
+
+    marker = f"days={days:g}"
+    if os.path.exists(path):
+        conn = sqlite3.connect(path)
+        try:
+            row = conn.execute("SELECT value FROM loadtest_meta WHERE key = 'size'").fetchone()
+            if row is not None and row[0] == marker:
+                return conn.execute("SELECT COUNT(*) FROM measurements").fetchone()[0]
+        except sqlite3.OperationalError:
+            pass
+        finally:
+            conn.close()
+        os.remove(path)
+
+    collector.DB_PATH = path
+    collector.init_database()
+    conn = sqlite3.connect(path)
+    total = 0
+    for metric in METRICS:
+        series = build_series(metric, days)
+        conn.executemany(
+            "INSERT INTO measurements (metric, ts, value, received_at) VALUES (?, ?, ?, ?)",
+            [(metric, ts, value, ts) for ts, value in series],
+        )
+        total += len(series)
+    conn.execute("CREATE TABLE loadtest_meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("INSERT INTO loadtest_meta VALUES ('size', ?)", (marker,))
+    conn.commit()
+    conn.close()
+    return total
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_api(db_path: str, port: int, workers: int, server: str = "uvicorn",
+              cache: bool = True) -> subprocess.Popen:
+    """
+    server="uvicorn"：uvicorn --workers（不预热，默认不开共享响应缓存）
+    server="serve"：serve.py（预热 + 共享响应缓存，cache=False 时关闭缓存）
+    """
+    env = dict(os.environ)
+    env["COLLECTOR_DB_PATH"] = os.path.abspath(db_path)
+    # 避免与本机正在运行的 API 抢同一个推送通知端口（serve.py 还会占用其后 workers 个端口）
+    env["STREAM_NOTIFY_PORT"] = str(_free_port())
+    # 每次压测从空的响应缓存开始
+    env["RESPONSE_CACHE_PATH"] = os.path.abspath(db_path) + f".{port}.cache"
+    if server == "serve":
+        cmd = [
+            sys.executable, str(C_COLLECTOR_DIR / "serve.py"),
+            "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(workers),
+        ]
+        if not cache:
+            cmd.append("--no-cache")
+    else:
+        cmd = [
+            sys.executable, "-m", "uvicorn", "api:app",
+            "--app-dir", str(C_COLLECTOR_DIR),
+            "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(workers),
+            "--log-level", "warning", "--no-access-log",
+        ]
+    return subprocess.Popen(cmd, env=env, cwd=str(C_COLLECTOR_DIR))
+
+
+def remove_cache_files(db_path: str, port: int) -> None:
+    for suffix in ("", "-wal", "-shm"):
+        path = os.path.abspath(db_path) + f".{port}.cache{suffix}"
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# ==================== 最小 HTTP/1.1 客户端 ====================
+class Connection:
+    """单个 keep-alive 连接，顺序发送 GET 请求"""
+
+    def __init__(self, host: str, port: int, headers: Dict[str, str]):
+        self.host = host
+        self.port = port
+        self.extra_headers = "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def _connect(self) -> None:
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def get(self, target: str) -> Tuple[int, bytes]:
+        """发送 GET，返回 (状态码, body)；连接断开时重连一次"""
+        for attempt in (0, 1):
+            if self.writer is None:
+                await self._connect()
+            try:
+                self.writer.write(
+                    f"GET {target} HTTP/1.1\r\nHost: {self.host}\r\n{self.extra_headers}\r\n".encode()
+                )
+                return await self._read_response()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close()
+                if attempt:
+                    raise
+        raise ConnectionError("unreachable")
+
+    async def _read_response(self) -> Tuple[int, bytes]:
+        status_line = await self.reader.readuntil(b"\r\n")
+        status = int(status_line.split(b" ", 2)[1])
+        length = 0
+        chunked = False
+        keep_alive = True
+        while True:
+            line = await self.reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.partition(b":")
+            name = name.strip().lower()
+            if name == b"content-length":
+                length = int(value)
+            elif name == b"transfer-encoding" and b"chunked" in value.lower():
+                chunked = True
+            elif name == b"connection" and b"close" in value.lower():
+                keep_alive = False
+
+        if chunked:
+            chunks = []
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                chunks.append((await self.reader.readexactly(size + 2))[:-2])
+                if size == 0:
+                    break
+            body = b"".join(chunks)
+        else:
+            body = await self.reader.readexactly(length)
+        if not keep_alive:
+            self.close()
+        return status, body
+
+
+# ==================== 请求生成 ====================
+class RequestFactory:
+    """按权重随机生成请求路径，时间窗口在数据范围内随机"""
+
+    def __init__(self, args, data_range: Dict[str, Tuple[int, int]], rng: random.Random):
+        self.args = args
+        self.range = data_range
+        self.rng = rng
+        self.names: List[str] = []
+        self.weights: List[float] = []
+        for name, weight in args.mix.items():
+            self.names.append(name)
+            self.weights.append(weight)
+
+    def _window(self, metric: str, seconds: int) -> Tuple[str, str]:
+        first, last = self.range[metric]
+        start = self.rng.randint(first, max(first, last - seconds))
+        if self.args.align:
+            # 仪表盘式的对齐窗口：同一时间段的请求参数完全相同
+            start -= start % self.args.align
+        return epoch_to_ts(start), epoch_to_ts(start + seconds)
+
+    def next(self) -> Tuple[str, str]:
+        name = self.rng.choices(self.names, self.weights)[0]
+        metric = self.rng.choice(METRICS)
+        params = {"metric": metric}
+        if name == "realtime":
+            params["limit"] = self.args.realtime_limit
+        elif name == "history":
+            params["from"], params["to"] = self._window(metric, int(self.args.history_hours * 3600))
+        elif name == "stats":
+            params["from"], params["to"] = self._window(metric, int(self.args.stats_days * 86400))
+        elif name == "aggregate":
+            params["from"], params["to"] = self._window(metric, int(self.args.stats_days * 86400))
+            params["interval"] = "1h"
+        if name != "stats" and name != "aggregate" and self.args.format:
+            params["format"] = self.args.format
+        return name, f"/api/{name}?{urlencode(params)}"
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {name: [] for name in ENDPOINTS}
+        self.errors: Dict[str, int] = {name: 0 for name in ENDPOINTS}
+        self.bytes: Dict[str, int] = {name: 0 for name in ENDPOINTS}
+        self.recording = False
+
+    def record(self, name: str, seconds: float, status: Optional[int], size: int) -> None:
+        if not self.recording:
+            return
+        if status != 200:
+            self.errors[name] += 1
+            return
+        self.latencies[name].append(seconds)
+        self.bytes[name] += size
+
+
+async def _send(conn: Connection, name: str, target: str, started: float, recorder: Recorder) -> None:
+    try:
+        status, body = await conn.get(target)
+    except (OSError, asyncio.IncompleteReadError, ValueError):
+        status, body = None, b""
+    recorder.record(name, time.perf_counter() - started, status, len(body))
+
+
+async def run_closed_loop(args, host, port, headers, factory, recorder, deadline):
+    """固定并发：每个连接发完一个请求立即发下一个"""
+
+    async def worker():
+        conn = Connection(host, port, headers)
+        try:
+            while time.perf_counter() < deadline:
+                name, target = factory.next()
+                await _send(conn, name, target, time.perf_counter(), recorder)
+        finally:
+            conn.close()
+
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+
+
+async def run_open_loop(args, host, port, headers, factory, recorder, deadline):
+    """固定到达率：按计划时刻发请求，延迟从计划时刻算起（含等待空闲连接的时间）"""
+    idle: asyncio.Queue = asyncio.Queue()
+    for _ in range(args.max_connections):
+        idle.put_nowait(Connection(host, port, headers))
+    rng = random.Random(args.seed + 1)
+    pending = set()
+    lagging = 0
+
+    async def one(name, target, scheduled):
+        conn = await idle.get()
+        try:
+            await _send(conn, name, target, scheduled, recorder)
+        finally:
+            idle.put_nowait(conn)
+
+    scheduled = time.perf_counter()
+    while scheduled < deadline:
+        interval = rng.expovariate(args.rate) if args.arrival == "poisson" else 1.0 / args.rate
+        scheduled += interval
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        elif delay < -0.1:
+            lagging += 1
+        name, target = factory.next()
+        task = asyncio.create_task(one(name, target, scheduled))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
+    if pending:
+        await asyncio.wait(pending)
+    while not idle.empty():
+        idle.get_nowait().close()
+    if lagging:
+        print(f"⚠ {lagging} 个请求的发出时刻落后计划 100 ms 以上，压测客户端可能已达到 CPU 上限")
+
+
+async def discover_range(host, port) -> Dict[str, Tuple[int, int]]:
+    """通过 API 取得每个 metric 的数据起止时间（epoch 秒）"""
+    conn = Connection(host, port, {})
+    result = {}
+    try:
+        for metric in METRICS:
+            bounds = []
+            for endpoint, params in (
+                ("history", {"metric": metric, "from": "0000-01-01T00:00:00", "page_size": 1}),
+                ("realtime", {"metric": metric, "limit": 1}),
+            ):
+                status, body = await conn.get(f"/api/{endpoint}?{urlencode({**params, 'format': 'columnar'})}")
+                ts = json.loads(body)["ts"] if status == 200 else []
+                if not ts:
+                    raise SystemExit(f"数据库中没有 {metric} 的数据")
+                bounds.append(ts[0])
+            result[metric] = (bounds[0], bounds[1])
+    finally:
+        conn.close()
+    return result
+
+
+async def wait_until_ready(host, port, proc, timeout=120.0) -> None:
+    """等到 /api/health 返回 200（serve.py 预热完成后才就绪）"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if proc is not None and proc.poll() is not None:
+            raise SystemExit("API 进程启动失败")
+        conn = Connection(host, port, {})
+        try:
+            status, _ = await conn.get("/api/health")
+            if status == 200:
+                return
+        except OSError:
+            pass
+        finally:
+            conn.close()
+        await asyncio.sleep(0.2)
+    raise SystemExit("等待 API 启动超时")
+
+
+def summarize(recorder: Recorder, elapsed: float) -> dict:
+    def describe(latencies, errors, size):
+        latencies = sorted(latencies)
+        entry = {
+            "requests": len(latencies),
+            "errors": errors,
+            "throughput_rps": round(len(latencies) / elapsed, 2),
+            "bytes_per_request": round(size / len(latencies)) if latencies else 0,
+            "latency_ms": {"mean": None, **{quantile_key(q): None for q in PERCENTILES}, "max": None},
+        }
+        if latencies:
+            estimates = exact_quantiles(latencies, PERCENTILES)
+            entry["latency_ms"] = {
+                "mean": round(sum(latencies) / len(latencies) * 1000, 3),
+                **{quantile_key(q): round(v * 1000, 3) for q, v in zip(PERCENTILES, estimates)},
+                "max": round(latencies[-1] * 1000, 3),
+            }
+        return entry
+
+    endpoints = {
+        name: describe(recorder.latencies[name], recorder.errors[name], recorder.bytes[name])
+        for name in ENDPOINTS
+        if recorder.latencies[name] or recorder.errors[name]
+    }
+    everything = [x for name in ENDPOINTS for x in recorder.latencies[name]]
+    total = describe(everything, sum(recorder.errors.values()), sum(recorder.bytes.values()))
+    return {"endpoints": endpoints, "total": total}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=C_COLLECTOR_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """"realtime=60,history=30,stats=10" → {"realtime": 60.0, ...}"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"未知接口: {name}（可选: {', '.join(ENDPOINTS)}）")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def main_async(args) -> dict:
+    proc = None
+    if args.url:
+        parts = urlsplit(args.url)
+        host, port = parts.hostname, parts.port or 80
+        rows = None
+    else:
+        db_path = args.db or os.path.join(tempfile.gettempdir(), f"loadtest_{args.days:g}d.db")
+        t0 = time.perf_counter()
+        rows = seed_database(db_path, args.days)
+        print(f"✓ 数据库: {db_path}（{rows} 行，{time.perf_counter() - t0:.1f}s）")
+        host, port = "127.0.0.1", args.port or _free_port()
+        proc = start_api(db_path, port, args.workers, args.server, not args.no_cache)
+
+    try:
+        await wait_until_ready(host, port, proc)
+        data_range = await discover_range(host, port)
+        factory = RequestFactory(args, data_range, random.Random(args.seed))
+        recorder = Recorder()
+        headers = {"Accept-Encoding": args.accept_encoding} if args.accept_encoding else {}
+
+        mode = f"rate={args.rate}/s ({args.arrival})" if args.rate else f"concurrency={args.concurrency}"
+        print(f"▶ {mode}, mix={args.mix}, warmup={args.warmup}s, duration={args.duration}s")
+
+        start = time.perf_counter()
+        deadline = start + args.warmup + args.duration
+
+        async def start_recording():
+            await asyncio.sleep(args.warmup)
+            recorder.recording = True
+
+        switch = asyncio.create_task(start_recording())
+        runner = run_open_loop if args.rate else run_closed_loop
+        await runner(args, host, port, headers, factory, recorder, deadline)
+        await switch
+        elapsed = time.perf_counter() - start - args.warmup
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+            remove_cache_files(db_path, port)
+
+    result = {
+        "config": {
+            "mode": "open" if args.rate else "closed",
+            "concurrency": None if args.rate else args.concurrency,
+            "rate": args.rate,
+            "arrival": args.arrival if args.rate else None,
+            "max_connections": args.max_connections if args.rate else None,
+            "mix": args.mix,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "days": None if args.url else args.days,
+            "rows": rows,
+            "workers": None if args.url else args.workers,
+            "server": None if args.url else args.server,
+            "response_cache": None if args.url else (args.server == "serve" and not args.no_cache),
+            "align_s": args.align,
+            "format": args.format,
+            "accept_encoding": args.accept_encoding,
+            "seed": args.seed,
+            "git_commit": _git_commit(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "elapsed_s": round(elapsed, 3),
+        **summarize(recorder, elapsed),
+    }
+    return result
+
+
+def print_table(result: dict) -> None:
+    keys = ["p50", "p95", "p99", "p99.9"]
+    print(f"{'endpoint':<11}{'requests':>9}{'errors':>8}{'rps':>10}" + "".join(f"{k + ' ms':>11}" for k in keys))
+    rows = list(result["endpoints"].items()) + [("total", result["total"])]
+    for name, entry in rows:
+        latency = entry["latency_ms"]
+        print(
+            f"{name:<11}{entry['requests']:>9}{entry['errors']:>8}{entry['throughput_rps']:>10}"
+            + "".join(f"{latency[k] if latency[k] is not None else '-':>11}" for k in keys)
+        )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="collector HTTP API 压测")
+    target = parser.add_argument_group("被测服务")
+    target.add_argument("--url", default=None, help="压测已运行的 API（如 http://127.0.0.1:8000），不再建库和启动服务")
+    target.add_argument("--db", default=None, help="压测数据库路径，默认放在系统临时目录")
+    target.add_argument("--days", type=float, default=365, help="每个 metric 生成的数据跨度（天）")
+    target.add_argument("--port", type=int, default=None, help="启动 API 的端口，默认随机")
+    target.add_argument("--workers", type=int, default=1, help="worker 进程数")
+    target.add_argument("--server", choices=["uvicorn", "serve"], default="uvicorn",
+                        help="启动方式：uvicorn --workers，或 serve.py（预热 + 共享响应缓存）")
+    target.add_argument("--no-cache", action="store_true", help="serve.py 关闭共享响应缓存")
+
+    load = parser.add_argument_group("负载")
+    load.add_argument("--concurrency", type=int, default=16, help="闭环模式的并发连接数")
+    load.add_argument("--rate", type=float, default=None, help="开环模式的到达率（请求/秒），指定后忽略 --concurrency")
+    load.add_argument("--arrival", choices=["poisson", "uniform"], default="poisson", help="开环模式的到达过程")
+    load.add_argument("--max-connections", type=int, default=64, help="开环模式的最大连接数")
+    load.add_argument("--duration", type=float, default=30, help="计入结果的压测时长（秒）")
+    load.add_argument("--warmup", type=float, default=3, help="预热时长（秒），不计入结果")
+    load.add_argument("--mix", type=parse_mix, default=parse_mix("realtime=60,history=30,stats=10"),
+                      help="接口权重，如 realtime=60,history=30,stats=10（可加 aggregate）")
+    load.add_argument("--seed", type=int, default=1, help="随机种子（请求序列可复现）")
+
+    shape = parser.add_argument_group("请求形态")
+    shape.add_argument("--realtime-limit", type=int, default=200, help="realtime 的 limit")
+    shape.add_argument("--history-hours", type=float, default=24, help="history 时间窗口（小时）")
+    shape.add_argument("--stats-days", type=float, default=30, help="stats / aggregate 时间窗口（天）")
+    shape.add_argument("--format", default=None, help="realtime / history 的 format 参数（默认 json）")
+    shape.add_argument("--accept-encoding", default="gzip, deflate", help="Accept-Encoding 请求头，传空串表示不压缩")
+
+    shape.add_argument("--align", type=int, default=0,
+                       help="history / stats / aggregate 窗口起点按该秒数对齐（0 为不对齐），模拟仪表盘的重复查询")
+    parser.add_argument("--output", default=None, help="结果 JSON 文件路径")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+
+    result = asyncio.run(main_async(args))
+    print_table(result)
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+        print(f"✓ 结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
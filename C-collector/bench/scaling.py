@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+多进程吞吐扩展性：worker 数 × 共享响应缓存开 / 关，各跑一轮 loadtest
+
+用法（在 C-collector 目录下）：
+    python bench/scaling.py --workers 1,2,4 --concurrency 32 --duration 20 --output bench/results/scaling.json
+
+其余参数（--mix / --align / --days 等）原样传给 loadtest.py，见 `python bench/loadtest.py -h`。
+每一轮都用 serve.py 重新启动服务（预热后才开始计时），缓存文件每轮清空。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import build_parser, main_async  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多 worker 吞吐扩展性", add_help=False)
+    parser.add_argument("--workers", default="1,2,4", help="逗号分隔的 worker 数")
+    parser.add_argument("--cache", choices=["on", "off", "both"], default="both", help="共享响应缓存")
+    parser.add_argument("--output", default=None, help="结果 JSON 文件路径")
+    args, rest = parser.parse_known_args()
+
+    runs = []
+    cache_modes = {"on": [True], "off": [False], "both": [False, True]}[args.cache]
+    for workers in [int(w) for w in args.workers.split(",")]:
+        for cache in cache_modes:
+            argv = rest + ["--server", "serve", "--workers", str(workers)] + ([] if cache else ["--no-cache"])
+            print(f"\n===== workers={workers}, cache={'on' if cache else 'off'} =====")
+            result = asyncio.run(main_async(build_parser().parse_args(argv)))
+            runs.append({"workers": workers, "cache": cache, "result": result})
+
+    base = {cache: None for cache in cache_modes}
+    print(f"\n{'workers':>8}{'cache':>7}{'rps':>10}{'speedup':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for run in runs:
+        total = run["result"]["total"]
+        rps = total["throughput_rps"]
+        if base[run["cache"]] is None:
+            base[run["cache"]] = rps
+        speedup = rps / base[run["cache"]] if base[run["cache"]] else 0.0
+        run["speedup"] = round(speedup, 2)
+        latency = total["latency_ms"]
+        print(f"{run['workers']:>8}{'on' if run['cache'] else 'off':>7}{rps:>10}{speedup:>9.2f}"
+              f"{latency['p50']:>9}{latency['p99']:>9}{total['errors']:>8}")
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump({"cpu_count": os.cpu_count(), "runs": runs}, f, indent=2, ensure_ascii=False)
+        print(f"✓ 结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+基准测试用的数据源：读取 B-publisher/data 下的原始数据，并按需时间平移扩充
+
+原始数据只覆盖约 4 个月（2014-02-13 ~ 2014-06-08），为了得到“一年”或更长
+的数据量，把整段数据按其跨度向后平移若干次拼接起来，时间戳保持
+YYYY-MM-DDTHH:MM:SS 格式，与 collector 写入的数据完全一致。
+"""
+
+import json
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+PUBLISHER_DATA_DIR = Path(__file__).resolve().parents[2] / "B-publisher" / "data"
+METRICS = ["temperature", "humidity", "pressure"]
+TS_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def load_publisher_series(metric: str) -> List[Tuple[str, Optional[float]]]:
+    """读取单个 metric 的原始数据，返回按 ts 升序的 [(ts, value), ...]"""
+    points = []
+    with open(PUBLISHER_DATA_DIR / f"{metric}.txt", "r") as f:
+        for line in f:
+            for ts, value in json.loads(line).items():
+                points.append((ts, None if value == "" else float(value)))
+    points.sort(key=lambda p: p[0])
+    return points
+
+
+def build_series(metric: str, days: float) -> List[Tuple[str, Optional[float]]]:
+    """
+    生成覆盖 days 天的序列：原始数据循环平移，直到覆盖目标跨度
+
+    每一轮的平移量 = 原始跨度 + 一个采样间隔，保证 ts 严格递增且不重复
+    """
+    base = [(datetime.strptime(ts, TS_FORMAT), value) for ts, value in load_publisher_series(metric)]
+    first, last = base[0][0], base[-1][0]
+    period = (last - first) + (base[1][0] - base[0][0])
+    end = first + timedelta(days=days)
+
+    series = []
+    shift = timedelta(0)
+    while True:
+        for dt, value in base:
+            shifted = dt + shift
+            if shifted >= end:
+                return series
+            series.append((shifted.strftime(TS_FORMAT), value))
+        shift += period
@@ -2,9 +2,11 @@
 """
 IoT数据采集器 - Collector模块
 订阅MQTT主题 env/# 并将数据存储到SQLite数据库
+单点消息 env/<metric> 逐条写入；代理攒批发布的 env/batch/<metric> 一批一个事务批量写入
 """
 
 import json
+import socket
 import sqlite3
 import sys
 import time
@@ -20,13 +22,34 @@ BROKER_PORT = int(os.getenv("MQTT_BROKER_PORT", "1883"))
 USERNAME = os.getenv("MQTT_USERNAME", "collector")  # collector用户只能订阅 env/#
 PASSWORD = os.getenv("MQTT_PASSWORD", "col123")
 SUBSCRIBE_TOPIC = "env/#"
+BATCH_TOPIC_PREFIX = "env/batch/"
+# 代理的滚动窗口聚合（env/agg/<interval>/<metric>）不是测量值，不写入数据库
+AGG_TOPIC_PREFIX = "env/agg/"
+# 处理哪种输入：all（单点与批次都写入）/ stream（只处理 env/<metric>）/ batch（只处理 env/batch/<metric>）
+# 代理 OUTPUT_MODE=both 时两种 topic 各有一份相同的数据，应只选其一
+COLLECTOR_INPUT = os.getenv("COLLECTOR_INPUT", "all").lower()
 
-# 数据库配置
-DB_PATH = "data/measurements.db"
+# 数据库配置（可用环境变量指定，例如压测时使用单独的数据库）
+DB_PATH = os.getenv("COLLECTOR_DB_PATH", "data/measurements.db")
 
 # 日志配置
 VERBOSE = True  # 是否打印详细日志
 
+# 实时推送配置：每条数据提交后通过本机 UDP 通知 api.py 的推送中心（/api/stream）
+# 发送是非阻塞的 fire-and-forget，API 未启动时不影响写入
+STREAM_NOTIFY_ENABLED = os.getenv("STREAM_NOTIFY_ENABLED", "true").lower() == "true"
+STREAM_NOTIFY_HOST = os.getenv("STREAM_NOTIFY_HOST", "127.0.0.1")
+STREAM_NOTIFY_PORT = int(os.getenv("STREAM_NOTIFY_PORT", "8766"))
+
+# 入库时异常检测（见 anomaly.py）：每条新数据与该 metric 之前 ANOMALY_WINDOW 个点比较，
+# 判为异常的点写入 anomalies 表，结果与 /api/anomalies 的批量检测一致
+ANOMALY_DETECT_ENABLED = os.getenv("ANOMALY_DETECT_ENABLED", "false").lower() == "true"
+ANOMALY_METHOD = os.getenv("ANOMALY_METHOD", "zscore")
+ANOMALY_WINDOW = int(os.getenv("ANOMALY_WINDOW", "36"))
+ANOMALY_THRESHOLD = float(os.getenv("ANOMALY_THRESHOLD")) if os.getenv("ANOMALY_THRESHOLD") else None
+# 连续 N 个相同值判为卡死，0 表示不检测
+ANOMALY_FLATLINE = int(os.getenv("ANOMALY_FLATLINE", "0"))
+
 # ==================== 数据库初始化 ====================
 def init_database():
     """初始化SQLite数据库和表结构"""
@@ -59,11 +82,104 @@ def init_database():
         ON measurements(received_at)
     ''')
     
+    # 按小时预聚合表（由 api.py 按需补算，见 rollup.py）
+    # bucket 为整点小时的 epoch 秒；sketch 为该小时有效值的 DDSketch
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rollups (
+            metric TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            non_null INTEGER NOT NULL,
+            sum REAL,
+            min REAL,
+            max REAL,
+            first_ts TEXT,
+            first_value REAL,
+            last_ts TEXT,
+            last_value REAL,
+            sketch BLOB,
+            PRIMARY KEY (metric, bucket)
+        )
+    ''')
+    
+    # 入库时检测出的异常点（ANOMALY_DETECT_ENABLED=true 时写入）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS anomalies (
+            metric TEXT NOT NULL,
+            ts TEXT NOT NULL,
+            method TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            score REAL,
+            detected_at TEXT NOT NULL,
+            PRIMARY KEY (metric, ts, method)
+        )
+    ''')
+    
+    # 每个 metric 的数据版本（shared_cache.py 据此判断缓存的响应是否过期），由触发器在每次写入时更新：
+    # version 为最近一次写入的 id，latest_ts 为最大的 ts，
+    # backfill 为最近一次 ts 不晚于当时 latest_ts 的写入（补写 / 覆盖）的 id
+    has_versions = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'data_versions'"
+    ).fetchone()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            metric TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            latest_ts TEXT NOT NULL,
+            backfill INTEGER NOT NULL
+        )
+    ''')
+    if not has_versions:
+        # 已有数据的数据库：按现有数据补一份（backfill 取最大 id，之前缓存的响应全部视为过期）
+        cursor.execute('''
+            INSERT OR IGNORE INTO data_versions (metric, version, latest_ts, backfill)
+            SELECT metric, MAX(id), MAX(ts), MAX(id) FROM measurements GROUP BY metric
+        ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_data_versions AFTER INSERT ON measurements
+        BEGIN
+            INSERT INTO data_versions (metric, version, latest_ts, backfill)
+            VALUES (NEW.metric, NEW.id, NEW.ts, 0)
+            ON CONFLICT(metric) DO UPDATE SET
+                version = excluded.version,
+                backfill = CASE WHEN excluded.latest_ts <= latest_ts THEN excluded.version ELSE backfill END,
+                latest_ts = max(latest_ts, excluded.latest_ts);
+        END
+    ''')
+    
     conn.commit()
     conn.close()
     
     print(f"✓ 数据库已初始化: {DB_PATH}")
 
+# ==================== 实时推送通知 ====================
+_notify_sock = None
+
+
+def notify_committed(row_id, metric, ts, value, lag_ms=None):
+    """
+    把刚提交的数据点发给 API 进程的推送中心
+
+    row_id 是 measurements.id（自增），作为推送事件 ID，客户端断线重连时
+    用它（Last-Event-ID）从环形缓冲区或数据库补发
+    lag_ms 是本次写入耗时（含等待数据库锁），API 据此判断是否需要卸载重查询（见 admission.py）
+    """
+    global _notify_sock
+    if not STREAM_NOTIFY_ENABLED:
+        return
+    try:
+        if _notify_sock is None:
+            _notify_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            _notify_sock.setblocking(False)
+        message = {"id": row_id, "metric": metric, "ts": ts, "value": value}
+        if lag_ms is not None:
+            message["lag_ms"] = round(lag_ms, 3)
+        message = json.dumps(message, separators=(',', ':'))
+        _notify_sock.sendto(message.encode('utf-8'), (STREAM_NOTIFY_HOST, STREAM_NOTIFY_PORT))
+    except OSError:
+        # 推送是尽力而为的，丢失的事件可由客户端通过 Last-Event-ID 从数据库补回
+        pass
+
 # ==================== 数据存储 ====================
 def save_measurement(metric, ts, value):
     """
@@ -78,6 +194,7 @@ def save_measurement(metric, ts, value):
         bool: 是否保存成功
     """
     try:
+        t0 = time.perf_counter()
         conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
         
@@ -88,15 +205,127 @@ def save_measurement(metric, ts, value):
             INSERT OR REPLACE INTO measurements (metric, ts, value, received_at)
             VALUES (?, ?, ?, ?)
         ''', (metric, ts, value, received_at))
+        row_id = cursor.lastrowid
+        
+        # 该小时的预聚合已过期，删除后由 API 下次查询时重新补算
+        cursor.execute('''
+            DELETE FROM rollups
+            WHERE metric = ? AND bucket = CAST(strftime('%s', ?) AS INTEGER) / 3600 * 3600
+        ''', (metric, ts))
         
         conn.commit()
         conn.close()
         
+        notify_committed(row_id, metric, ts, value, (time.perf_counter() - t0) * 1000)
         return True
     except Exception as e:
         print(f"✗ 数据库写入失败: {e}")
         return False
 
+def save_batch(metric, points):
+    """
+    一个事务批量写入一批数据点（代理发布到 env/batch/<metric> 的批次）
+
+    Args:
+        metric: 指标类型
+        points: [(ts, value), ...]，同一 ts 只保留最后一个
+
+    Returns:
+        list: 实际写入的 [(ts, value), ...]（写入失败时为空列表）
+    """
+    rows = list(dict(points).items())
+    if not rows:
+        return []
+    try:
+        t0 = time.perf_counter()
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+
+        received_at = datetime.now().isoformat()
+        cursor.executemany('''
+            INSERT OR REPLACE INTO measurements (metric, ts, value, received_at)
+            VALUES (?, ?, ?, ?)
+        ''', [(metric, ts, value, received_at) for ts, value in rows])
+        # 同一事务中只有本连接在写，AUTOINCREMENT 分配的 id 连续，由最后一行的 id 倒推每行的 id
+        first_id = cursor.execute('SELECT last_insert_rowid()').fetchone()[0] - len(rows) + 1
+
+        # 每个涉及的小时删一次预聚合（YYYY-MM-DDTHH:MM:SS 的前 13 个字符即所在小时；
+        # 带时区等其他格式逐条删除）
+        hours = {ts[:13] if len(ts) == 19 else ts: ts for ts, _ in rows}
+        cursor.executemany('''
+            DELETE FROM rollups
+            WHERE metric = ? AND bucket = CAST(strftime('%s', ?) AS INTEGER) / 3600 * 3600
+        ''', [(metric, ts) for ts in hours.values()])
+
+        conn.commit()
+        conn.close()
+
+        lag_ms = (time.perf_counter() - t0) * 1000
+        last = len(rows) - 1
+        for offset, (ts, value) in enumerate(rows):
+            # 写入耗时每批只报一次，避免批次越大在滑动平均中权重越高
+            notify_committed(first_id + offset, metric, ts, value, lag_ms if offset == last else None)
+        return rows
+    except Exception as e:
+        print(f"✗ 批量写入失败 ({metric}, {len(rows)} 条): {e}")
+        return []
+
+# ==================== 异常检测 ====================
+_scorer = None
+
+
+def init_anomaly_scorer():
+    """用数据库中每个 metric 最近的点初始化增量检测器"""
+    global _scorer
+    if not ANOMALY_DETECT_ENABLED:
+        return
+    # 只有开启检测时才需要 numpy
+    from anomaly import IncrementalScorer
+    
+    _scorer = IncrementalScorer(
+        ANOMALY_METHOD,
+        ANOMALY_WINDOW,
+        threshold=ANOMALY_THRESHOLD,
+        flatline=ANOMALY_FLATLINE or None,
+    )
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        for (metric,) in conn.execute('SELECT DISTINCT metric FROM measurements').fetchall():
+            rows = conn.execute('''
+                SELECT ts, value FROM measurements
+                WHERE metric = ?
+                ORDER BY ts DESC
+                LIMIT ?
+            ''', (metric, ANOMALY_WINDOW + 1)).fetchall()
+            _scorer.seed(metric, rows[::-1])
+    finally:
+        conn.close()
+    print(f"✓ 入库异常检测已开启: method={ANOMALY_METHOD}, window={ANOMALY_WINDOW}, "
+          f"threshold={_scorer.threshold}, flatline={_scorer.flatline}")
+
+
+def check_anomaly(metric, ts, value):
+    """对刚写入的点做增量检测，异常时记录到 anomalies 表"""
+    if _scorer is None:
+        return
+    flagged = _scorer.update(metric, ts, value)
+    if flagged is None:
+        return
+    kind, score = flagged
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute('''
+            INSERT OR REPLACE INTO anomalies (metric, ts, method, kind, score, detected_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (metric, ts, _scorer.method, kind, score, datetime.now().isoformat()))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"✗ 异常记录写入失败: {e}")
+        return
+    score_str = f"{score:.2f}" if score is not None else "-"
+    print(f"⚠ [{metric}] ts={ts}, value={value}, {kind} (score={score_str})")
+
 # ==================== MQTT回调函数 ====================
 def on_connect(client, userdata, flags, rc):
     """MQTT连接回调"""
@@ -110,6 +339,14 @@ def on_connect(client, userdata, flags, rc):
 
 def on_message(client, userdata, msg):
     """MQTT消息回调"""
+    if msg.topic.startswith(AGG_TOPIC_PREFIX):
+        return
+    if msg.topic.startswith(BATCH_TOPIC_PREFIX):
+        if COLLECTOR_INPUT != "stream":
+            on_batch_message(msg)
+        return
+    if COLLECTOR_INPUT == "batch":
+        return
     try:
         # 解析topic获取metric类型
         topic = msg.topic
@@ -132,12 +369,43 @@ def on_message(client, userdata, msg):
             if VERBOSE:
                 value_str = f"{value}" if value is not None else "NULL"
                 print(f"📊 [{metric}] ts={ts}, value={value_str}")
+            check_anomaly(metric, ts, value)
         
     except json.JSONDecodeError as e:
         print(f"✗ JSON解析失败: {msg.payload.decode('utf-8', errors='ignore')}")
     except Exception as e:
         print(f"✗ 处理消息失败: {e}")
 
+def on_batch_message(msg):
+    """批次消息回调：payload 是 [{"ts": ..., "value": ...}, ...]"""
+    metric = msg.topic[len(BATCH_TOPIC_PREFIX):]
+    try:
+        batch = json.loads(msg.payload.decode('utf-8'))
+        if not isinstance(batch, list):
+            print(f"✗ 批次不是 JSON 数组: {msg.topic}")
+            return
+
+        points = [
+            (point.get('ts'), point.get('value'))
+            for point in batch
+            if isinstance(point, dict) and isinstance(point.get('ts'), str) and point['ts']
+        ]
+        if len(points) < len(batch):
+            print(f"✗ 批次中 {len(batch) - len(points)} 条缺少时间戳或格式不对，已跳过")
+
+        t0 = time.perf_counter()
+        saved = save_batch(metric, points)
+        if saved and VERBOSE:
+            print(f"📦 [{metric}] {len(saved)} 条, ts={saved[0][0]} ~ {saved[-1][0]}, "
+                  f"写入 {(time.perf_counter() - t0) * 1000:.1f} ms")
+        for ts, value in saved:
+            check_anomaly(metric, ts, value)
+
+    except json.JSONDecodeError:
+        print(f"✗ 批次 JSON 解析失败: {msg.payload[:100].decode('utf-8', errors='ignore')}")
+    except Exception as e:
+        print(f"✗ 处理批次失败: {e}")
+
 def on_subscribe(client, userdata, mid, granted_qos):
     """订阅成功回调"""
     print(f"✓ 订阅成功! 等待消息...")
@@ -205,6 +473,7 @@ def main():
     
     # 初始化数据库
     init_database()
+    init_anomaly_scorer()
     
     # 创建MQTT客户端
     client = mqtt.Client(client_id="collector_" + str(int(time.time())))
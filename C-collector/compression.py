@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+响应压缩中间件 - 按 Accept-Encoding 协商 br / gzip
+
+规则：
+- 只压缩一次性发送完整 body 的响应；流式响应（SSE 等）原样透传
+- body 小于 COMPRESSION_MIN_SIZE 字节、已带 Content-Encoding、或不是可压缩类型
+  （JSON / 文本 / msgpack / arrow）时不压缩
+- 客户端同时接受 br 和 gzip（q 值相同）时优先 br；brotli 为可选依赖，未安装只用 gzip
+- 压缩在线程池中执行（zlib / brotli 压缩期间释放 GIL），不阻塞事件循环
+- 可压缩类型的响应都会带上 Vary: Accept-Encoding，方便中间缓存区分
+"""
+
+import gzip
+import os
+from typing import List, Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+
+from profiling import phase
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    brotli = None
+    BROTLI_AVAILABLE = False
+
+# 小于该字节数的响应不压缩（压缩收益抵不上 CPU 和头部开销）
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# gzip 压缩级别 1~9
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+# brotli quality 0~11；11 压缩率最高但比 4 慢一个数量级，不适合在线压缩
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+ENCODING_BR = "br"
+ENCODING_GZIP = "gzip"
+
+_COMPRESSIBLE_PREFIXES = (
+    "application/json",
+    "application/vnd.iot.columnar+json",
+    "application/msgpack",
+    "application/vnd.apache.arrow.stream",
+    "text/",
+)
+_NOT_COMPRESSIBLE = ("text/event-stream",)
+
+
+def _supported() -> List[str]:
+    return [ENCODING_BR, ENCODING_GZIP] if BROTLI_AVAILABLE else [ENCODING_GZIP]
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """按 Accept-Encoding 选择压缩算法；不需要压缩时返回 None"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        fields = [f.strip() for f in part.split(";")]
+        coding = fields[0].lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        weights[coding] = q
+
+    candidates: List[Tuple[float, int, str]] = []
+    for rank, coding in enumerate(_supported()):
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > 0:
+            candidates.append((-q, rank, coding))
+    if not candidates:
+        return None
+    return min(candidates)[2]
+
+
+def is_compressible(content_type: str) -> bool:
+    content_type = content_type.lower()
+    if content_type.startswith(_NOT_COMPRESSIBLE):
+        return False
+    return content_type.startswith(_COMPRESSIBLE_PREFIXES)
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == ENCODING_BR:
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """纯 ASGI 中间件：缓存首个 body 消息，完整响应才压缩，流式响应透传"""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        responder = _Responder(send, encoding, self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+
+class _Responder:
+    def __init__(self, send, encoding: Optional[str], minimum_size: int):
+        self._send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start_message = None
+        self.passthrough = False
+
+    async def send(self, message) -> None:
+        if message["type"] == "http.response.start":
+            # 等到第一个 body 消息才能决定是否压缩
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+
+        self.passthrough = True
+        start = self.start_message
+        headers = MutableHeaders(raw=start["headers"])
+        body = message.get("body", b"")
+        compressible = "content-encoding" not in headers and is_compressible(headers.get("content-type", ""))
+
+        if not compressible or message.get("more_body", False):
+            # 不可压缩或流式响应：原样发送
+            await self._send(start)
+            await self._send(message)
+            return
+
+        headers.add_vary_header("Accept-Encoding")
+        if self.encoding is not None and len(body) >= self.minimum_size:
+            with phase("compress"):
+                body = await anyio.to_thread.run_sync(compress, body, self.encoding)
+            headers["Content-Encoding"] = self.encoding
+            headers["Content-Length"] = str(len(body))
+            message = {**message, "body": body}
+        await self._send(start)
+        await self._send(message)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+响应编码与内容协商 - 供 api.py 使用
+
+支持的格式（按 ?format= 参数优先，其次按 Accept 请求头协商）：
+
+| format   | Content-Type                              | 结构 |
+|----------|-------------------------------------------|------|
+| json     | application/json                          | {"metric", "points": [{"ts": "...", "value": ...}]}（原契约，默认） |
+| columnar | application/vnd.iot.columnar+json         | {"metric", "ts": [epoch...], "value": [...]} |
+| msgpack  | application/msgpack                       | 与 columnar 相同的结构，MessagePack 编码 |
+| arrow    | application/vnd.apache.arrow.stream       | Arrow IPC stream，列 ts(int64) / value(float64, 可空) |
+
+说明：
+- 列式格式中的 ts 为 epoch 秒（整数），由 SQLite strftime('%s', ts) 直接算出，
+  数据库中的时间戳按 UTC 解释（与原始 TEXT 时间戳一一对应）
+- msgpack / pyarrow 为可选依赖，未安装时请求对应格式返回 406
+- JSON 响应一律在这里编码成 bytes（FastJSONResponse），不经过 FastAPI 的
+  jsonable_encoder 逐元素转换；安装了 orjson 时用 orjson，否则回落到标准库 json
+"""
+
+import json
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+
+from profiling import phase
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    msgpack = None
+    MSGPACK_AVAILABLE = False
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    orjson = None
+    ORJSON_AVAILABLE = False
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc  # noqa: F401  确保 pa.ipc 可用
+    ARROW_AVAILABLE = True
+except ImportError:
+    pa = None
+    ARROW_AVAILABLE = False
+
+
+FORMAT_JSON = "json"
+FORMAT_COLUMNAR = "columnar"
+FORMAT_MSGPACK = "msgpack"
+FORMAT_ARROW = "arrow"
+
+MEDIA_TYPES = {
+    FORMAT_JSON: "application/json",
+    FORMAT_COLUMNAR: "application/vnd.iot.columnar+json",
+    FORMAT_MSGPACK: "application/msgpack",
+    FORMAT_ARROW: "application/vnd.apache.arrow.stream",
+}
+
+# Accept 头中可识别的媒体类型 → 格式
+_ACCEPT_MAP = {
+    "application/json": FORMAT_JSON,
+    "application/*": FORMAT_JSON,
+    "*/*": FORMAT_JSON,
+    "application/vnd.iot.columnar+json": FORMAT_COLUMNAR,
+    "application/msgpack": FORMAT_MSGPACK,
+    "application/x-msgpack": FORMAT_MSGPACK,
+    "application/vnd.apache.arrow.stream": FORMAT_ARROW,
+}
+
+# 列式格式在 SQL 中直接把 TEXT 时间戳转换成 epoch 秒，避免 Python 侧逐条解析
+TS_TEXT_SQL = "ts"
+TS_EPOCH_SQL = "CAST(strftime('%s', ts) AS INTEGER)"
+
+
+def dumps(content: Any) -> bytes:
+    """紧凑 JSON 编码（UTF-8 bytes）"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """直接编码的 JSON 响应：handler 返回它时 FastAPI 不再调用 jsonable_encoder"""
+
+    def render(self, content: Any) -> bytes:
+        with phase("serialize"):
+            return dumps(content)
+
+
+def _is_available(fmt: str) -> bool:
+    if fmt == FORMAT_MSGPACK:
+        return MSGPACK_AVAILABLE
+    if fmt == FORMAT_ARROW:
+        return ARROW_AVAILABLE
+    return True
+
+
+def _parse_accept(accept: str) -> List[str]:
+    """解析 Accept 头，按 q 值降序返回媒体类型（q 相同保持原顺序）"""
+    entries: List[Tuple[float, int, str]] = []
+    for index, part in enumerate(accept.split(",")):
+        fields = [f.strip() for f in part.split(";")]
+        media_type = fields[0].lower()
+        if not media_type:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            entries.append((-q, index, media_type))
+    entries.sort()
+    return [media_type for _, _, media_type in entries]
+
+
+def negotiate_format(request: Request, fmt: Optional[str]) -> str:
+    """
+    确定响应格式
+
+    - 显式 ?format= 优先；不支持或依赖缺失时返回 400 / 406
+    - 否则按 Accept 头选择第一个可用的格式
+    - 都不匹配时回落到 json，保持旧客户端行为不变
+    """
+    if fmt is not None:
+        fmt = fmt.lower()
+        if fmt not in MEDIA_TYPES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"不支持的 format: {fmt}（可选: {', '.join(MEDIA_TYPES)}）",
+            )
+        if not _is_available(fmt):
+            raise HTTPException(status_code=406, detail=f"服务端未安装 {fmt} 编码依赖")
+        return fmt
+
+    accept = request.headers.get("accept")
+    if not accept:
+        return FORMAT_JSON
+
+    for media_type in _parse_accept(accept):
+        candidate = _ACCEPT_MAP.get(media_type)
+        if candidate is not None and _is_available(candidate):
+            return candidate
+    return FORMAT_JSON
+
+
+def ts_select_sql(fmt: str) -> str:
+    """返回该格式下 SELECT 子句中 ts 列的表达式"""
+    return TS_TEXT_SQL if fmt == FORMAT_JSON else TS_EPOCH_SQL
+
+
+def _split_columns(rows: Sequence[Sequence]) -> Tuple[list, list]:
+    """把 [(ts, value), ...] 拆成两列"""
+    if not rows:
+        return [], []
+    ts_col, value_col = zip(*rows)
+    return list(ts_col), list(value_col)
+
+
+def encode_arrow(
+    metric: str,
+    ts_col: Iterable[int],
+    value_col: Iterable[Optional[float]],
+    extra: Optional[Dict[str, Any]] = None,
+) -> bytes:
+    """编码为 Arrow IPC stream（单个 record batch），extra 写入 schema metadata"""
+    metadata = {"metric": metric}
+    for key, value in (extra or {}).items():
+        metadata[key] = "" if value is None else str(value)
+    schema = pa.schema(
+        [("ts", pa.int64()), ("value", pa.float64())],
+        metadata=metadata,
+    )
+    batch = pa.record_batch(
+        [pa.array(ts_col, type=pa.int64()), pa.array(value_col, type=pa.float64())],
+        schema=schema,
+    )
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
+def render_points(
+    fmt: str,
+    metric: str,
+    rows: Sequence[Sequence],
+    extra: Optional[Dict[str, Any]] = None,
+    headers: Optional[Dict[str, str]] = None,
+):
+    """
+    把 (ts, value) 行按协商好的格式编码为响应
+
+    始终返回已编码好的 Response 对象。
+    rows 必须已按时间升序排列；ts 列需与 ts_select_sql(fmt) 对应
+    extra: 附加到响应体顶层的字段（如分页游标），arrow 格式写入 schema metadata
+    headers: 附加的响应头
+    """
+    extra = extra or {}
+
+    if fmt == FORMAT_JSON:
+        with phase("shape"):
+            points = [{"ts": ts, "value": value} for ts, value in rows]
+        return FastJSONResponse({"metric": metric, "points": points, **extra}, headers=headers)
+
+    with phase("shape"):
+        ts_col, value_col = _split_columns(rows)
+
+    if fmt == FORMAT_COLUMNAR:
+        return FastJSONResponse(
+            {"metric": metric, "ts": ts_col, "value": value_col, **extra},
+            media_type=MEDIA_TYPES[FORMAT_COLUMNAR],
+            headers=headers,
+        )
+
+    if fmt == FORMAT_MSGPACK:
+        with phase("serialize"):
+            body = msgpack.packb({"metric": metric, "ts": ts_col, "value": value_col, **extra})
+        return Response(content=body, media_type=MEDIA_TYPES[FORMAT_MSGPACK], headers=headers)
+
+    if fmt == FORMAT_ARROW:
+        with phase("serialize"):
+            body = encode_arrow(metric, ts_col, value_col, extra)
+        return Response(content=body, media_type=MEDIA_TYPES[FORMAT_ARROW], headers=headers)
+
+    raise HTTPException(status_code=400, detail=f"不支持的 format: {fmt}")
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+趋势预测 - /api/forecast 的实现
+
+在每个 metric 最近 window 个点上拟合模型，返回拟合值和未来 horizon 个点：
+
+| model  | 说明                                                             | 参数          |
+|--------|------------------------------------------------------------------|---------------|
+| linear | 加权移动平均平滑后做加权最小二乘直线（越新的点权重越大，与 D 端原来的算法一致） | -  |
+| ewma   | 指数加权移动平均，未来为水平线                                   | alpha         |
+| holt   | Holt 线性趋势（水平 + 趋势两个指数平滑）                         | alpha, beta   |
+
+- linear 的回归、ewma 的递推都在整列上用 NumPy 完成（ewma 分块展开成前缀和，
+  块长保证 (1-alpha)^-块长 不溢出）；holt 的两个状态相互依赖，只能逐点递推
+- 缺失值（NULL）不参与拟合，拟合值沿用上一个点
+- 未来点的间隔为窗口内相邻点间隔的中位数；预测值限制在窗口数据范围 ± max(20% 极差, 1.0) 内
+- rmse：linear 为拟合直线相对原始值的残差，ewma / holt 为窗口内的一步预测误差
+
+拟合状态按 (metric, model, window, alpha, beta) 缓存在进程内。每次请求只查询
+id 大于上次所见最大 id 的新行：没有新行直接返回缓存结果；新行都比窗口内最后一个点新时
+逐点更新（ewma / holt 为 O(1) 递推）；有补写的历史数据时整体重新拟合。
+ewma / holt 增量更新与在新窗口上重新拟合的差别只在初值，其影响按 (1-alpha)^window 衰减。
+"""
+
+import math
+import os
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+from typing import Deque, Optional, Tuple
+
+import numpy as np
+
+from rollup import epoch_to_ts
+
+MODELS = ("linear", "holt", "ewma")
+DEFAULT_WINDOW = 100
+MAX_WINDOW = 5000
+DEFAULT_HORIZON = 10
+MAX_HORIZON = 1000
+# 少于该有效点数时不拟合
+MIN_POINTS = 10
+
+FORECAST_ALPHA = float(os.getenv("FORECAST_ALPHA", "0.3"))
+FORECAST_BETA = float(os.getenv("FORECAST_BETA", "0.1"))
+# 缓存的拟合状态个数（每个 metric × 模型 × 参数组合一个）
+FORECAST_CACHE_SIZE = int(os.getenv("FORECAST_CACHE_SIZE", "64"))
+
+_SELECT = "SELECT id, CAST(strftime('%s', ts) AS INTEGER), value FROM measurements"
+
+
+# ==================== 模型 ====================
+def ewma_levels(y: np.ndarray, alpha: float, level0: float) -> np.ndarray:
+    """
+    l[t] = (1 - alpha) * l[t-1] + alpha * y[t] 的整列计算（y 不含 NaN）
+
+    块内展开为 l[j] = d^(j+1) * (s + alpha * Σ y[i] * d^-(i+1))，d = 1 - alpha，
+    s 为块起点前的水平值
+    """
+    d = 1.0 - alpha
+    block = max(1, int(250 / -math.log10(d))) if d > 0 else 1
+    out = np.empty(len(y))
+    state = level0
+    for lo in range(0, len(y), block):
+        chunk = y[lo:lo + block]
+        k = np.arange(1, len(chunk) + 1)
+        if d > 0:
+            decay = d ** k
+            out[lo:lo + len(chunk)] = decay * (state + alpha * np.cumsum(chunk / decay))
+        else:
+            out[lo:lo + len(chunk)] = chunk
+        state = out[lo + len(chunk) - 1]
+    return out
+
+
+def holt_step(level: float, trend: float, y: float, alpha: float, beta: float) -> Tuple[float, float, float]:
+    """Holt 递推一步，返回 (新水平, 新趋势, 一步预测误差)"""
+    expected = level + trend
+    new_level = alpha * y + (1.0 - alpha) * expected
+    trend = beta * (new_level - level) + (1.0 - beta) * trend
+    return new_level, trend, y - expected
+
+
+def wma_smooth(y: np.ndarray, span: int) -> np.ndarray:
+    """
+    尾随加权移动平均：第 i 个点取最近 k = min(span, i+1) 个点，越新的点权重越大（k, k-1, ..., 1）
+    """
+    k = np.minimum(np.arange(1, len(y) + 1), span)
+    num = np.zeros(len(y))
+    for lag in range(span):
+        weight = np.clip(k[lag:] - lag, 0, None)
+        num[lag:] += weight * y[:len(y) - lag]
+    return num / (k * (k + 1) / 2)
+
+
+def linear_fit(t: np.ndarray, y: np.ndarray) -> Tuple[float, float]:
+    """加权最小二乘直线 y = intercept + slope * t，第 k 个点的权重为 (k+1)/n"""
+    w = np.arange(1, len(t) + 1) / len(t)
+    tm = np.dot(w, t) / w.sum()
+    ym = np.dot(w, y) / w.sum()
+    den = np.dot(w, (t - tm) ** 2)
+    slope = np.dot(w, (t - tm) * (y - ym)) / den if den > 0 else 0.0
+    return ym - slope * tm, slope
+
+
+# ==================== 拟合状态 ====================
+class ForecastState:
+    """一个 (metric, model, window, alpha, beta) 的拟合状态"""
+
+    def __init__(self, model: str, window: int, alpha: Optional[float], beta: Optional[float]):
+        self.model = model
+        self.window = window
+        self.alpha = alpha
+        self.beta = beta
+        self.ts: Deque[int] = deque(maxlen=window)
+        self.values: Deque[float] = deque(maxlen=window)
+        # ewma / holt：每个点更新后的水平值，以及一步预测误差的平方
+        self.fitted: Deque[float] = deque(maxlen=window)
+        self.errors: Deque[float] = deque(maxlen=window)
+        self.level = math.nan
+        self.trend = 0.0
+        self.last_id = 0
+        self.result: Optional[dict] = None
+
+    @property
+    def last_ts(self) -> Optional[int]:
+        return self.ts[-1] if self.ts else None
+
+    def fit(self, ts: np.ndarray, values: np.ndarray) -> None:
+        """在按 ts 升序的窗口上从头拟合"""
+        self.ts.clear()
+        self.values.clear()
+        self.fitted.clear()
+        self.errors.clear()
+        self.level = math.nan
+        self.trend = 0.0
+        self.ts.extend(ts.tolist())
+        self.values.extend(values.tolist())
+        if self.model == "linear":
+            return
+
+        valid = ~np.isnan(values)
+        y = values[valid]
+        if len(y) == 0:
+            self.fitted.extend([math.nan] * len(values))
+            return
+        if self.model == "ewma":
+            levels = ewma_levels(y[1:], self.alpha, y[0])
+            levels = np.concatenate(([y[0]], levels))
+            errors = y[1:] - levels[:-1]
+            self.level = float(levels[-1])
+        else:
+            levels = np.empty(len(y))
+            errors = np.empty(len(y) - 1)
+            level, trend = float(y[0]), 0.0
+            levels[0] = level
+            for k, v in enumerate(y[1:].tolist(), 1):
+                level, trend, errors[k - 1] = holt_step(level, trend, v, self.alpha, self.beta)
+                levels[k] = level
+            self.level, self.trend = level, trend
+        # 缺失值位置沿用上一个有效点的水平值
+        index = np.cumsum(valid) - 1
+        fitted = np.where(index >= 0, levels[np.maximum(index, 0)], np.nan)
+        self.fitted.extend(fitted.tolist())
+        self.errors.extend((errors * errors).tolist())
+
+    def update(self, ts: int, value: Optional[float]) -> None:
+        """追加一个比窗口内所有点都新的点"""
+        self.ts.append(ts)
+        x = math.nan if value is None else float(value)
+        self.values.append(x)
+        if self.model == "linear":
+            return
+        if not math.isnan(x):
+            if math.isnan(self.level):
+                self.level = x
+            elif self.model == "ewma":
+                error = x - self.level
+                self.level += self.alpha * error
+                self.errors.append(error * error)
+            else:
+                self.level, self.trend, error = holt_step(self.level, self.trend, x, self.alpha, self.beta)
+                self.errors.append(error * error)
+        self.fitted.append(self.level)
+
+    def forecast(self, horizon: int) -> dict:
+        """当前窗口的拟合值与未来 horizon 个点（列式，ts 为 epoch 秒）"""
+        ts = np.array(self.ts, dtype=np.int64)
+        values = np.array(self.values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        empty = {"valid_points": int(valid.sum()), "step_seconds": None, "rmse": None,
+                 "last_ts": epoch_to_ts(int(ts[-1])) if len(ts) else None,
+                 "fitted": {"ts": [], "value": []}, "forecast": {"ts": [], "value": []}}
+        if valid.sum() < MIN_POINTS:
+            return empty
+        diffs = np.diff(ts)
+        diffs = diffs[diffs > 0]
+        if len(diffs) == 0:
+            return empty
+        step = int(np.median(diffs))
+        last = int(ts[-1])
+        steps = np.arange(1, horizon + 1)
+
+        if self.model == "linear":
+            t = (ts - last).astype(np.float64)
+            # 先做加权移动平均再回归（平滑窗口约为有效点数的 1/4，最多 5 个点）
+            smoothed = wma_smooth(values[valid], max(1, min(5, int(valid.sum()) // 4)))
+            intercept, slope = linear_fit(t[valid], smoothed)
+            fitted = intercept + slope * t
+            future = intercept + slope * (steps * step)
+            residuals = values[valid] - fitted[valid]
+            rmse = float(np.sqrt(np.mean(residuals * residuals)))
+        else:
+            fitted = np.array(self.fitted, dtype=np.float64)
+            future = self.level + self.trend * steps
+            rmse = float(np.sqrt(np.mean(self.errors))) if self.errors else None
+
+        lo, hi = values[valid].min(), values[valid].max()
+        margin = max(0.2 * (hi - lo), 1.0)
+        future = np.clip(future, lo - margin, hi + margin)
+
+        fitted_valid = ~np.isnan(fitted)
+        return {
+            **empty,
+            "step_seconds": step,
+            "rmse": None if rmse is None else round(rmse, 4),
+            "fitted": {"ts": ts[fitted_valid].tolist(), "value": np.round(fitted[fitted_valid], 4).tolist()},
+            "forecast": {"ts": (last + steps * step).tolist(), "value": np.round(future, 4).tolist()},
+        }
+
+
+# ==================== 查询与缓存 ====================
+def _fetch(conn: sqlite3.Connection, sql: str, params) -> np.ndarray:
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    rows = cursor.execute(sql, params).fetchall()
+    return np.array(rows, dtype=np.float64).reshape(-1, 3)
+
+
+def _load_window(conn: sqlite3.Connection, metric: str, window: int, to_ts: Optional[str]) -> np.ndarray:
+    """截至 to_ts（缺省为最新）的最近 window 个点，按 ts 升序"""
+    if to_ts is None:
+        data = _fetch(conn, f"{_SELECT} WHERE metric = ? ORDER BY ts DESC LIMIT ?", (metric, window))
+    else:
+        data = _fetch(conn, f"{_SELECT} WHERE metric = ? AND ts <= ? ORDER BY ts DESC LIMIT ?",
+                      (metric, to_ts, window))
+    return data[::-1]
+
+
+class ForecastCache:
+    """进程内 LRU：(metric, model, window, alpha, beta) → ForecastState"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._states: "OrderedDict[tuple, ForecastState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._states.clear()
+
+    def get(self, conn: sqlite3.Connection, metric: str, model: str, window: int,
+            alpha: Optional[float], beta: Optional[float], horizon: int) -> Tuple[dict, str]:
+        """返回 (结果, 来源)，来源为 cache / incremental / fit"""
+        key = (metric, model, window, alpha, beta)
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                state = self._states[key] = ForecastState(model, window, alpha, beta)
+                while len(self._states) > self.max_entries:
+                    self._states.popitem(last=False)
+            self._states.move_to_end(key)
+
+            if state.result is not None:
+                # +metric 让 SQLite 走主键范围扫描（只读新行），而不是 (metric, ts) 索引扫描整个 metric
+                new = _fetch(conn, f"{_SELECT} WHERE id > ? AND +metric = ? ORDER BY id", (state.last_id, metric))
+                if len(new) == 0:
+                    source = "cache"
+                elif state.last_ts is None or new[:, 1].min() > state.last_ts:
+                    new = new[np.argsort(new[:, 1], kind="stable")]
+                    for _, ts, value in new.tolist():
+                        state.update(int(ts), None if math.isnan(value) else value)
+                    state.last_id = int(new[:, 0].max())
+                    state.result = None
+                    source = "incremental"
+                else:
+                    state.result = None
+                    source = "fit"
+            else:
+                source = "fit"
+
+            if source == "fit":
+                # 先取全表最大 id：之后写入的行下次请求时会被当作新行处理
+                state.last_id = conn.execute("SELECT MAX(id) FROM measurements").fetchone()[0] or 0
+                data = _load_window(conn, metric, window, None)
+                state.fit(data[:, 1].astype(np.int64), data[:, 2])
+            if state.result is None or state.result["horizon"] != horizon:
+                state.result = {"horizon": horizon, **state.forecast(horizon)}
+            return state.result, source
+
+
+cache = ForecastCache(FORECAST_CACHE_SIZE)
+
+
+def forecast(
+    conn: sqlite3.Connection,
+    metric: str,
+    model: str,
+    window: int = DEFAULT_WINDOW,
+    horizon: int = DEFAULT_HORIZON,
+    alpha: Optional[float] = FORECAST_ALPHA,
+    beta: Optional[float] = FORECAST_BETA,
+    to_ts: Optional[str] = None,
+) -> Tuple[dict, str]:
+    """
+    返回 (结果, 来源)
+
+    alpha / beta 只对用到它们的模型有意义（linear 两者都传 None，ewma 的 beta 传 None）。
+    to_ts 缺省时以最新数据为终点并使用缓存；指定 to_ts（回看历史时刻的预测）时每次重新拟合
+    """
+    if to_ts is None:
+        return cache.get(conn, metric, model, window, alpha, beta, horizon)
+    state = ForecastState(model, window, alpha, beta)
+    data = _load_window(conn, metric, window, to_ts)
+    state.fit(data[:, 1].astype(np.int64), data[:, 2])
+    return {"horizon": horizon, **state.forecast(horizon)}, "fit"
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+多指标对齐 - /api/joined 的实现
+
+三个 metric 由 publisher 按相同的 ts 网格分别发布，但各自偶有缺失。这里用一次查询
+取出所有请求的 metric（metric IN (...) 走 (metric, ts) 索引，按 metric, ts 有序返回），
+再用 NumPy 在整列上对齐：
+
+- exact（tolerance=0）：外连接，ts 为所有 metric 时间戳的并集，某个 metric 在该时刻
+  没有数据时为 null
+- as-of（tolerance>0）：以第一个 metric 的时间戳为基准，其他 metric 取
+  [ts - tolerance, ts] 内最近的一条（与 pandas.merge_asof(direction="backward") 相同）
+
+派生量（同样整列计算）：
+- dew_point：露点（°C），Magnus 公式（Sonntag 1990 系数），需要 temperature + humidity
+- heat_index：体感温度（°C），NOAA Rothfusz 回归（含低湿 / 高湿修正），需要 temperature + humidity
+"""
+
+from typing import Dict, List, Optional, Sequence
+
+import sqlite3
+
+import numpy as np
+
+from rollup import epoch_to_ts, ts_to_epoch
+
+METRICS = ("temperature", "humidity", "pressure")
+DERIVED_FIELDS = {
+    "dew_point": ("temperature", "humidity"),
+    "heat_index": ("temperature", "humidity"),
+}
+# as-of 模式允许的最大容差（秒）
+MAX_TOLERANCE = 86400
+
+# Magnus 公式系数（-45 ~ 60 °C）
+_MAGNUS_A = 17.62
+_MAGNUS_B = 243.12
+
+
+def parse_metrics(text: Optional[str]) -> List[str]:
+    """"temperature,humidity" → ["temperature", "humidity"]；缺省为全部，保持给定顺序"""
+    if not text:
+        return list(METRICS)
+    metrics = []
+    for name in text.split(","):
+        name = name.strip().lower()
+        if name not in METRICS:
+            raise ValueError(name)
+        if name not in metrics:
+            metrics.append(name)
+    if not metrics:
+        raise ValueError(text)
+    return metrics
+
+
+def parse_derived(text: Optional[str], metrics: Sequence[str]) -> List[str]:
+    """解析派生量列表，并检查所需的 metric 都在 metrics 中"""
+    if not text:
+        return []
+    derived = []
+    for name in text.split(","):
+        name = name.strip().lower()
+        if name not in DERIVED_FIELDS:
+            raise ValueError(f"不支持的派生量: {name}（可选: {', '.join(DERIVED_FIELDS)}）")
+        missing = [m for m in DERIVED_FIELDS[name] if m not in metrics]
+        if missing:
+            raise ValueError(f"{name} 需要 metrics 中包含 {', '.join(missing)}")
+        if name not in derived:
+            derived.append(name)
+    return derived
+
+
+# ==================== 派生量 ====================
+def dew_point(temperature: np.ndarray, humidity: np.ndarray) -> np.ndarray:
+    """露点（°C）；相对湿度 <= 0 或缺失时为 NaN"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rh = np.where(humidity > 0, humidity, np.nan)
+        gamma = np.log(rh / 100.0) + _MAGNUS_A * temperature / (_MAGNUS_B + temperature)
+        return _MAGNUS_B * gamma / (_MAGNUS_A - gamma)
+
+
+def heat_index(temperature: np.ndarray, humidity: np.ndarray) -> np.ndarray:
+    """
+    体感温度（°C），按 NOAA/NWS 算法：
+
+    先用简化公式估算，结果 >= 80 °F 时改用 Rothfusz 回归，并对低湿（RH < 13%，80~112 °F）
+    和高湿（RH > 85%，80~87 °F）做修正。低温时约等于气温本身。
+    """
+    t = temperature * 9.0 / 5.0 + 32.0
+    rh = humidity
+    simple = 0.5 * (t + 61.0 + (t - 68.0) * 1.2 + rh * 0.094)
+    estimate = (simple + t) / 2.0
+
+    rothfusz = (
+        -42.379 + 2.04901523 * t + 10.14333127 * rh
+        - 0.22475541 * t * rh - 0.00683783 * t * t
+        - 0.05481717 * rh * rh + 0.00122874 * t * t * rh
+        + 0.00085282 * t * rh * rh - 0.00000199 * t * t * rh * rh
+    )
+    with np.errstate(invalid="ignore"):
+        low_rh = (rh < 13) & (t >= 80) & (t <= 112)
+        adjust_low = ((13 - rh) / 4.0) * np.sqrt(np.clip((17 - np.abs(t - 95.0)) / 17.0, 0, None))
+        high_rh = (rh > 85) & (t >= 80) & (t <= 87)
+        adjust_high = ((rh - 85) / 10.0) * ((87 - t) / 5.0)
+        rothfusz = np.where(low_rh, rothfusz - adjust_low, rothfusz)
+        rothfusz = np.where(high_rh, rothfusz + adjust_high, rothfusz)
+        hi = np.where(estimate >= 80.0, rothfusz, simple)
+    return (hi - 32.0) * 5.0 / 9.0
+
+
+_DERIVED_FUNCS = {"dew_point": dew_point, "heat_index": heat_index}
+
+
+# ==================== 对齐 ====================
+def _load(conn: sqlite3.Connection, metrics: Sequence[str], lo: Optional[str], hi: Optional[str]):
+    """一次查询取出所有 metric，返回 {metric: (ts 数组, value 数组)}"""
+    # metric 在 SQL 中换成下标，整批行可以一次性转换成 float64 矩阵（None → NaN）
+    index_sql = " ".join(f"WHEN ? THEN {k}" for k in range(len(metrics)))
+    conditions = [f"metric IN ({', '.join('?' for _ in metrics)})"]
+    params: List[object] = list(metrics) + list(metrics)
+    if lo is not None:
+        conditions.append("ts >= ?")
+        params.append(lo)
+    if hi is not None:
+        conditions.append("ts <= ?")
+        params.append(hi)
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    rows = cursor.execute(
+        f"""
+        SELECT CASE metric {index_sql} END, CAST(strftime('%s', ts) AS INTEGER), value
+        FROM measurements
+        WHERE {' AND '.join(conditions)}
+        ORDER BY metric, ts
+        """,
+        params,
+    ).fetchall()
+
+    matrix = np.array(rows, dtype=np.float64).reshape(-1, 3)
+    series = {}
+    for k, metric in enumerate(metrics):
+        # 每个 metric 内部已按 ts 有序，按下标拆分即可
+        part = matrix[matrix[:, 0] == k]
+        series[metric] = (part[:, 1].astype(np.int64), part[:, 2])
+    return series
+
+
+def _align_exact(grid: np.ndarray, ts: np.ndarray, values: np.ndarray) -> np.ndarray:
+    out = np.full(len(grid), np.nan)
+    if len(ts):
+        idx = np.searchsorted(grid, ts)
+        out[idx] = values
+    return out
+
+
+def _align_asof(grid: np.ndarray, ts: np.ndarray, values: np.ndarray, tolerance: int) -> np.ndarray:
+    out = np.full(len(grid), np.nan)
+    if len(ts) == 0:
+        return out
+    # ts <= grid 的最后一条
+    idx = np.searchsorted(ts, grid, side="right") - 1
+    valid = idx >= 0
+    matched = np.where(valid, idx, 0)
+    valid &= (grid - ts[matched]) <= tolerance
+    out[valid] = values[matched[valid]]
+    return out
+
+
+def _to_list(column: np.ndarray) -> list:
+    """float64 数组 → list，NaN 转为 None"""
+    values = column.tolist()
+    nan_positions = np.flatnonzero(np.isnan(column))
+    for i in nan_positions.tolist():
+        values[i] = None
+    return values
+
+
+def join_metrics(
+    conn: sqlite3.Connection,
+    metrics: Sequence[str],
+    lo: Optional[str],
+    hi: Optional[str],
+    tolerance: int = 0,
+    derived: Sequence[str] = (),
+) -> Dict[str, list]:
+    """
+    返回列式结果 {"ts": [epoch...], <metric>: [...], <derived>: [...]}
+
+    tolerance=0 为精确外连接；tolerance>0 为以 metrics[0] 为基准的 as-of 连接
+    """
+    if tolerance > 0 and lo is not None:
+        # as-of 需要基准起点之前 tolerance 秒内的数据
+        load_lo = epoch_to_ts(ts_to_epoch(lo) - tolerance)
+    else:
+        load_lo = lo
+    series = _load(conn, metrics, load_lo, hi)
+
+    if tolerance > 0:
+        grid = series[metrics[0]][0]
+        if load_lo != lo:
+            grid = grid[grid >= ts_to_epoch(lo)]
+        columns = {m: _align_asof(grid, *series[m], tolerance) for m in metrics}
+    else:
+        grid = np.unique(np.concatenate([series[m][0] for m in metrics]))
+        columns = {m: _align_exact(grid, *series[m]) for m in metrics}
+
+    for name in derived:
+        columns[name] = _DERIVED_FUNCS[name](*(columns[m] for m in DERIVED_FIELDS[name]))
+
+    result = {"ts": grid.tolist()}
+    for name, column in columns.items():
+        result[name] = _to_list(column)
+    return result
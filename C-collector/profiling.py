@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+请求级性能剖析（可选，默认关闭）- 定位慢请求的时间花在哪里
+
+开启：环境变量 API_PROFILING=true。开启后：
+- 每个请求记录各阶段耗时（毫秒）：
+    connect    打开 SQLite 连接
+    query      cursor.execute（SQLite 编译并执行到第一行结果）
+    fetch      fetchall / fetchone / 逐行迭代（取出剩余行并转换成 Python 对象）
+    shape      行 → 响应结构（points 字典 / 列拆分）
+    serialize  编码为响应 body（JSON / msgpack / arrow）
+    compress   响应压缩
+    app        请求总耗时（从进入中间件到响应头发出）
+  以 Server-Timing 响应头返回，浏览器开发者工具可以直接显示
+- 同时记录每条 SQL 的文本、参数、返回行数和耗时
+- 总耗时超过 PROFILING_SLOW_MS 的请求放入有界环形缓冲区（PROFILING_RING_SIZE），
+  通过 GET /api/debug/slow 查看
+- PROFILING_STACKS=true 时另起一个采样线程，每 PROFILING_SAMPLE_INTERVAL_MS 毫秒
+  抓取一次处理请求的工作线程的调用栈，慢请求附带按出现次数排序的折叠栈
+  （file:function;file:function 格式，可直接喂给 flamegraph.pl）
+
+未开启时 phase() 只做一次 ContextVar 读取，数据库连接也是普通的 sqlite3.Connection。
+"""
+
+import asyncio
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Optional, Set
+
+PROFILING_ENABLED = os.getenv("API_PROFILING", "false").lower() == "true"
+# 超过该耗时（毫秒）的请求进入慢请求环形缓冲区
+PROFILING_SLOW_MS = float(os.getenv("PROFILING_SLOW_MS", "200"))
+PROFILING_RING_SIZE = int(os.getenv("PROFILING_RING_SIZE", "100"))
+# 采样调用栈（有额外开销，只在排查问题时打开）
+PROFILING_STACKS = os.getenv("PROFILING_STACKS", "false").lower() == "true"
+PROFILING_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILING_SAMPLE_INTERVAL_MS", "5"))
+# 每个慢请求最多保留的 SQL 条数 / 调用栈条数
+MAX_QUERIES_PER_REQUEST = 50
+MAX_STACKS_PER_REQUEST = 20
+
+PHASES = ("connect", "query", "fetch", "shape", "serialize", "compress")
+
+
+class RequestProfile:
+    """单个请求的剖析数据（由中间件创建，在请求的上下文中传递）"""
+
+    __slots__ = ("method", "path", "query_string", "started_at", "phases", "queries",
+                 "threads", "samples", "status", "total")
+
+    def __init__(self, method: str, path: str, query_string: str):
+        self.method = method
+        self.path = path
+        self.query_string = query_string
+        self.started_at = time.time()
+        self.phases: Dict[str, float] = {}
+        self.queries: List[dict] = []
+        # 处理过该请求的线程（同步 handler 在线程池中执行），供采样线程归属调用栈
+        self.threads: Set[int] = set()
+        self.samples: Counter = Counter()
+        self.status: Optional[int] = None
+        self.total = 0.0
+
+    def add(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def register_thread(self) -> None:
+        """记录当前线程；事件循环线程由所有请求共享，不参与调用栈归属"""
+        if asyncio._get_running_loop() is None:
+            self.threads.add(threading.get_ident())
+
+    def server_timing(self) -> str:
+        parts = [f"{name};dur={self.phases[name] * 1000:.2f}" for name in PHASES if name in self.phases]
+        parts.append(f"app;dur={self.total * 1000:.2f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> dict:
+        record = {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "method": self.method,
+            "path": self.path,
+            "query_string": self.query_string,
+            "status": self.status,
+            "total_ms": round(self.total * 1000, 3),
+            "phases_ms": {name: round(self.phases[name] * 1000, 3) for name in PHASES if name in self.phases},
+            # 未归入任何阶段的时间：handler 中的 Python 计算（如草图合并）、框架开销等
+            "other_ms": round((self.total - sum(self.phases.values())) * 1000, 3),
+            "queries": self.queries,
+        }
+        if self.samples:
+            record["stacks"] = [
+                {"stack": stack, "samples": n}
+                for stack, n in self.samples.most_common(MAX_STACKS_PER_REQUEST)
+            ]
+        return record
+
+
+_current: ContextVar[Optional[RequestProfile]] = ContextVar("request_profile", default=None)
+_active: Set[RequestProfile] = set()
+slow_requests: Deque[dict] = deque(maxlen=PROFILING_RING_SIZE)
+
+
+@contextmanager
+def phase(name: str):
+    """把代码块的耗时计入当前请求的 name 阶段；没有正在剖析的请求时什么都不做"""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    profile.register_thread()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - t0)
+
+
+# ==================== SQLite 计时 ====================
+def _normalize_sql(sql: str) -> str:
+    return " ".join(sql.split())
+
+
+class ProfiledCursor(sqlite3.Cursor):
+    """记录 execute / fetch 耗时与返回行数的游标"""
+
+    _record: Optional[dict] = None
+
+    def _begin(self, sql: str, params) -> None:
+        profile = _current.get()
+        self._record = None
+        if profile is None:
+            return
+        profile.register_thread()
+        if len(profile.queries) < MAX_QUERIES_PER_REQUEST:
+            self._record = {
+                "sql": _normalize_sql(sql),
+                "params": [p if isinstance(p, (int, float, str)) or p is None else repr(p) for p in params][:20]
+                if isinstance(params, (list, tuple)) else repr(params),
+                "rows": 0,
+                "execute_ms": 0.0,
+                "fetch_ms": 0.0,
+            }
+            profile.queries.append(self._record)
+
+    def _account(self, key: str, phase_name: str, seconds: float, rows: int = 0) -> None:
+        profile = _current.get()
+        if profile is None:
+            return
+        profile.add(phase_name, seconds)
+        if self._record is not None:
+            self._record[key] = round(self._record[key] + seconds * 1000, 3)
+            self._record["rows"] += rows
+
+    def execute(self, sql, parameters=()):
+        self._begin(sql, parameters)
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._account("execute_ms", "query", time.perf_counter() - t0)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._begin(sql, ())
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._account("execute_ms", "query", time.perf_counter() - t0)
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        rows = super().fetchall()
+        self._account("fetch_ms", "fetch", time.perf_counter() - t0, len(rows))
+        return rows
+
+    def fetchmany(self, size=None):
+        t0 = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._account("fetch_ms", "fetch", time.perf_counter() - t0, len(rows))
+        return rows
+
+    def fetchone(self):
+        t0 = time.perf_counter()
+        row = super().fetchone()
+        self._account("fetch_ms", "fetch", time.perf_counter() - t0, 0 if row is None else 1)
+        return row
+
+    def __next__(self):
+        t0 = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._account("fetch_ms", "fetch", time.perf_counter() - t0)
+            raise
+        self._account("fetch_ms", "fetch", time.perf_counter() - t0, 1)
+        return row
+
+
+class ProfiledConnection(sqlite3.Connection):
+    """cursor() / execute() / executemany() 都使用 ProfiledCursor"""
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connection_factory():
+    """sqlite3.connect(factory=...) 使用的连接类；未开启剖析时为普通连接"""
+    return ProfiledConnection if PROFILING_ENABLED else sqlite3.Connection
+
+
+# ==================== 调用栈采样 ====================
+def _collapse(frame) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class StackSampler(threading.Thread):
+    """定时抓取正在处理请求的线程的调用栈，计入对应请求"""
+
+    def __init__(self, interval: float):
+        super().__init__(name="profiling-sampler", daemon=True)
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            if not _active:
+                continue
+            frames = sys._current_frames()
+            for profile in list(_active):
+                for ident in list(profile.threads):
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        profile.samples[_collapse(frame)] += 1
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+
+_sampler: Optional[StackSampler] = None
+
+
+def start_sampler() -> None:
+    global _sampler
+    if PROFILING_ENABLED and PROFILING_STACKS and _sampler is None:
+        _sampler = StackSampler(PROFILING_SAMPLE_INTERVAL_MS / 1000)
+        _sampler.start()
+
+
+def stop_sampler() -> None:
+    global _sampler
+    if _sampler is not None:
+        _sampler.stop()
+        _sampler = None
+
+
+# ==================== 中间件 ====================
+class ProfilingMiddleware:
+    """纯 ASGI 中间件：为每个 HTTP 请求建立 RequestProfile，响应头附加 Server-Timing"""
+
+    def __init__(self, app, slow_ms: float = PROFILING_SLOW_MS):
+        self.app = app
+        self.slow_seconds = slow_ms / 1000
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith("/api/debug/"):
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(
+            scope["method"], scope["path"], scope.get("query_string", b"").decode("latin-1")
+        )
+        token = _current.set(profile)
+        _active.add(profile)
+        t0 = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                profile.total = time.perf_counter() - t0
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", profile.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _active.discard(profile)
+            _current.reset(token)
+            # 流式响应（SSE）的总耗时以响应头发出为准，不计入连接保持的时间
+            if profile.total == 0.0:
+                profile.total = time.perf_counter() - t0
+            if profile.total >= self.slow_seconds:
+                slow_requests.append(profile.to_dict())
+
+
+def slow_snapshot(limit: int) -> dict:
+    """/api/debug/slow 的响应体：最近的慢请求，最新的在前"""
+    records = list(slow_requests)[-limit:]
+    records.reverse()
+    return {
+        "enabled": PROFILING_ENABLED,
+        "slow_ms": PROFILING_SLOW_MS,
+        "ring_size": PROFILING_RING_SIZE,
+        "stacks": PROFILING_STACKS,
+        "requests": records,
+    }
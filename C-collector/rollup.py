@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+按小时预聚合（rollup）- 为 /api/stats 的分位数 / 直方图提供数据
+
+rollups 表（由 collector.init_database 创建）每行对应 (metric, 整点小时)：
+  count / non_null / sum / min / max / first_* / last_*（第一个 / 最后一个有效值）/ sketch(DDSketch)
+
+维护方式：
+- collector 每写入一条数据，就删除它所在小时的 rollup 行（同一事务内，代价是一次主键删除）
+- API 查询时发现范围内缺少某些小时，就从原始数据补算这些小时并写回（包括没有数据的小时，
+  写入 count=0 的空行，避免反复补算）；补算在 BEGIN IMMEDIATE 事务中完成，
+  保证不会把 collector 并发写入前的旧结果写回去
+
+查询方式：
+- 范围内完整覆盖的小时直接读 rollup 并合并草图，首尾不满一小时的部分从原始数据精确计算
+- 完整小时数少于 SKETCH_MIN_BUCKETS 时直接全部精确计算（排序求分位数）
+"""
+
+import calendar
+import math
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional, Sequence
+
+from sketch import (
+    RELATIVE_ACCURACY,
+    DDSketch,
+    equal_width_edges,
+    exact_histogram,
+    exact_quantiles,
+)
+
+ROLLUP_SECONDS = 3600
+# 完整小时数少于该值时不用草图，直接精确计算
+SKETCH_MIN_BUCKETS = int(os.getenv("SKETCH_MIN_BUCKETS", "24"))
+
+TS_FORMAT = "%Y-%m-%dT%H:%M:%S"
+BUCKET_SQL = f"CAST(strftime('%s', ts) AS INTEGER) / {ROLLUP_SECONDS} * {ROLLUP_SECONDS}"
+
+
+def ts_to_epoch(ts: str) -> int:
+    """
+    YYYY-MM-DDTHH:MM:SS（按 UTC 解释）→ epoch 秒，与 SQLite strftime('%s') 一致；
+    只有日期的 YYYY-MM-DD 按当天 00:00:00 解释。格式不对或日期不存在时抛出 ValueError
+    """
+    if len(ts) == 10:
+        ts += "T00:00:00"
+    return calendar.timegm(time.strptime(ts[:19], TS_FORMAT))
+
+
+def epoch_to_ts(epoch: int) -> str:
+    return time.strftime(TS_FORMAT, time.gmtime(epoch))
+
+
+class _Accumulator:
+    """一段数据（一个小时或首尾零散部分）的聚合状态"""
+
+    __slots__ = ("count", "non_null", "sum", "min", "max",
+                 "first_ts", "first_value", "last_ts", "last_value", "sketch")
+
+    def __init__(self):
+        self.count = 0
+        self.non_null = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+        self.first_ts: Optional[str] = None
+        self.first_value: Optional[float] = None
+        self.last_ts: Optional[str] = None
+        self.last_value: Optional[float] = None
+        self.sketch = DDSketch()
+
+    def add(self, ts: str, value: Optional[float]) -> None:
+        """按 ts 升序逐条加入；first / last 记录的是第一个 / 最后一个有效值"""
+        self.count += 1
+        if value is None:
+            return
+        if self.first_ts is None:
+            self.first_ts, self.first_value = ts, value
+        self.last_ts, self.last_value = ts, value
+        self.non_null += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.sketch.add(value)
+
+
+def _build_run(conn: sqlite3.Connection, metric: str, first_bucket: int, last_bucket: int) -> None:
+    """从原始数据补算 [first_bucket, last_bucket] 这一段连续小时的 rollup"""
+    accumulators: Dict[int, _Accumulator] = {
+        bucket: _Accumulator()
+        for bucket in range(first_bucket, last_bucket + ROLLUP_SECONDS, ROLLUP_SECONDS)
+    }
+    rows = conn.execute(
+        f"""
+        SELECT {BUCKET_SQL}, ts, value
+        FROM measurements
+        WHERE metric = ? AND ts >= ? AND ts < ?
+        ORDER BY ts ASC
+        """,
+        (metric, epoch_to_ts(first_bucket), epoch_to_ts(last_bucket + ROLLUP_SECONDS)),
+    )
+    for bucket, ts, value in rows:
+        accumulators[bucket].add(ts, value)
+
+    conn.executemany(
+        """
+        INSERT OR REPLACE INTO rollups
+            (metric, bucket, count, non_null, sum, min, max,
+             first_ts, first_value, last_ts, last_value, sketch)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (metric, bucket, acc.count, acc.non_null, acc.sum, acc.min, acc.max,
+             acc.first_ts, acc.first_value, acc.last_ts, acc.last_value,
+             acc.sketch.to_bytes() if acc.non_null else None)
+            for bucket, acc in accumulators.items()
+        ],
+    )
+
+
+def _missing_runs(present, first_bucket: int, last_bucket: int) -> List[tuple]:
+    """找出 [first_bucket, last_bucket] 中不在 present 里的小时，合并为连续段"""
+    runs = []
+    run_start = prev = None
+    for bucket in range(first_bucket, last_bucket + ROLLUP_SECONDS, ROLLUP_SECONDS):
+        if bucket in present:
+            continue
+        if run_start is None:
+            run_start = bucket
+        elif bucket != prev + ROLLUP_SECONDS:
+            runs.append((run_start, prev))
+            run_start = bucket
+        prev = bucket
+    if run_start is not None:
+        runs.append((run_start, prev))
+    return runs
+
+
+def ensure_rollups(conn: sqlite3.Connection, metric: str, first_bucket: int, last_bucket: int, present=None) -> int:
+    """补齐 [first_bucket, last_bucket] 范围内缺失的 rollup，返回补算的段数"""
+    if last_bucket < first_bucket:
+        return 0
+    if present is None:
+        present = {
+            row[0]
+            for row in conn.execute(
+                "SELECT bucket FROM rollups WHERE metric = ? AND bucket BETWEEN ? AND ?",
+                (metric, first_bucket, last_bucket),
+            )
+        }
+    runs = _missing_runs(present, first_bucket, last_bucket)
+    if not runs:
+        return 0
+
+    # 每段连续缺失的小时一次范围查询
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for start, end in runs:
+            _build_run(conn, metric, start, end)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(runs)
+
+
+_LOAD_SQL = """
+    SELECT bucket, count, non_null, sum, min, max,
+           first_ts, first_value, last_ts, last_value, sketch
+    FROM rollups
+    WHERE metric = ? AND bucket BETWEEN ? AND ?
+    ORDER BY bucket ASC
+"""
+
+
+def load_rollups(conn: sqlite3.Connection, metric: str, first_bucket: int, last_bucket: int) -> list:
+    """读取范围内的 rollup 行（按 bucket 升序）；有缺失时先补算再重新读取"""
+    params = (metric, first_bucket, last_bucket)
+    rows = conn.execute(_LOAD_SQL, params).fetchall()
+    expected = (last_bucket - first_bucket) // ROLLUP_SECONDS + 1
+    if len(rows) < expected:
+        ensure_rollups(conn, metric, first_bucket, last_bucket, {row[0] for row in rows})
+        rows = conn.execute(_LOAD_SQL, params).fetchall()
+    return rows
+
+
+def data_range(conn: sqlite3.Connection, metric: str):
+    """该 metric 的最早 / 最晚时间戳（各自走一次索引查找）"""
+    row = conn.execute(
+        """
+        SELECT (SELECT MIN(ts) FROM measurements WHERE metric = ?),
+               (SELECT MAX(ts) FROM measurements WHERE metric = ?)
+        """,
+        (metric, metric),
+    ).fetchone()
+    return row[0], row[1]
+
+
+def _raw_values(conn: sqlite3.Connection, metric: str, lo: str, hi: str, hi_inclusive: bool):
+    op = "<=" if hi_inclusive else "<"
+    return conn.execute(
+        f"""
+        SELECT ts, value
+        FROM measurements
+        WHERE metric = ? AND ts >= ? AND ts {op} ?
+        ORDER BY ts ASC
+        """,
+        (metric, lo, hi),
+    ).fetchall()
+
+
+def quantile_key(q: float) -> str:
+    """0.5 → p50，0.999 → p99.9"""
+    return f"p{q * 100:g}"
+
+
+def summarize(
+    conn: sqlite3.Connection,
+    metric: str,
+    from_ts: Optional[str],
+    to_ts: Optional[str],
+    quantiles: Sequence[float],
+    hist_bins: Optional[int],
+) -> dict:
+    """
+    计算 count / missing / min / max / mean，以及分位数和等宽直方图
+
+    返回字段 approximate 表示分位数 / 直方图是否来自草图；为 True 时 relative_error
+    给出分位数估计值的相对误差上界（直方图按草图桶代表值归属，边界附近的值可能
+    被计入相邻区间）。count / missing / min / max / mean 始终是精确值。
+
+    from_ts / to_ts 不是合法时间时抛出 ValueError
+    """
+    # 先校验再与数据边界比较："garbage" 这类字符串比任何时间戳都大，不校验会被当成空区间
+    for ts in (from_ts, to_ts):
+        if ts is not None:
+            ts_to_epoch(ts)
+    first_ts, last_ts = data_range(conn, metric)
+    result = {
+        "metric": metric,
+        "count": 0,
+        "missing": 0,
+        "min": None,
+        "max": None,
+        "mean": None,
+        "approximate": False,
+        "relative_error": 0.0,
+    }
+    if quantiles:
+        result["quantiles"] = {quantile_key(q): None for q in quantiles}
+    if hist_bins:
+        result["histogram"] = {"edges": [], "counts": []}
+    if first_ts is None:
+        return result
+
+    lo = max(from_ts, first_ts) if from_ts is not None else first_ts
+    hi = min(to_ts, last_ts) if to_ts is not None else last_ts
+    if lo > hi:
+        return result
+
+    lo_epoch, hi_epoch = ts_to_epoch(lo), ts_to_epoch(hi)
+    # 完整落在 [lo, hi] 内的小时
+    first_full = -(-lo_epoch // ROLLUP_SECONDS) * ROLLUP_SECONDS
+    last_full = (hi_epoch + 1) // ROLLUP_SECONDS * ROLLUP_SECONDS - ROLLUP_SECONDS
+    full_buckets = (last_full - first_full) // ROLLUP_SECONDS + 1 if last_full >= first_full else 0
+
+    total = _Accumulator()
+    values: List[float] = []
+    use_sketch = full_buckets >= SKETCH_MIN_BUCKETS
+
+    if use_sketch:
+        for row in load_rollups(conn, metric, first_full, last_full):
+            total.count += row["count"]
+            total.non_null += row["non_null"]
+            if row["non_null"]:
+                total.sum += row["sum"]
+                total.min = row["min"] if total.min is None else min(total.min, row["min"])
+                total.max = row["max"] if total.max is None else max(total.max, row["max"])
+                total.sketch.merge(DDSketch.from_bytes(row["sketch"]))
+        # 首尾不满一小时的部分
+        edges = []
+        if lo_epoch < first_full:
+            edges.extend(_raw_values(conn, metric, lo, epoch_to_ts(first_full), False))
+        if last_full + ROLLUP_SECONDS <= hi_epoch:
+            edges.extend(_raw_values(conn, metric, epoch_to_ts(last_full + ROLLUP_SECONDS), hi, True))
+        for ts, value in edges:
+            total.add(ts, value)
+    else:
+        for ts, value in _raw_values(conn, metric, lo, hi, True):
+            total.add(ts, value)
+            if value is not None:
+                values.append(value)
+
+    result["count"] = total.count
+    result["missing"] = total.count - total.non_null
+    if total.non_null == 0:
+        return result
+
+    result["min"] = total.min
+    result["max"] = total.max
+    result["mean"] = total.sum / total.non_null
+    result["approximate"] = use_sketch
+    result["relative_error"] = RELATIVE_ACCURACY if use_sketch else 0.0
+
+    if quantiles:
+        if use_sketch:
+            estimates = total.sketch.quantiles(quantiles)
+        else:
+            values.sort()
+            estimates = exact_quantiles(values, quantiles)
+        result["quantiles"] = {quantile_key(q): v for q, v in zip(quantiles, estimates)}
+
+    if hist_bins:
+        edges = equal_width_edges(total.min, total.max, hist_bins)
+        counts = total.sketch.histogram(edges) if use_sketch else exact_histogram(values, edges)
+        result["histogram"] = {"edges": edges, "counts": counts}
+
+    return result
+
+
+def parse_quantiles(text: Optional[str]) -> List[float]:
+    """解析 "0.5,0.9,0.99"；取值必须在 [0, 1]"""
+    if not text:
+        return []
+    qs = []
+    for part in text.split(","):
+        q = float(part)
+        if not 0.0 <= q <= 1.0 or math.isnan(q):
+            raise ValueError(part)
+        qs.append(q)
+    return qs
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+生产环境启动 API：多 worker 进程 + 启动前预热 + 进程间共享响应缓存
+
+用法（在 C-collector 目录下）：
+    python serve.py --workers 4 --host 0.0.0.0 --port 8000
+
+与 `uvicorn api:app --reload` 的区别：
+1. 预热（fork 之前，在主进程中完成）：
+   - 导入 api 及 numpy 等依赖，worker 由 fork 产生，共享这些只读内存页
+   - 扫描每个 metric 的 (metric, ts) 索引和最近的数据页，把热点页读入操作系统页缓存
+   - 补齐所有 rollup（/api/stats 分位数、/api/aggregate 依赖的按小时预聚合）
+2. 主进程绑定监听 socket 后 fork 出 N 个 worker，共享同一个 socket 接受连接
+3. worker 启动后，主进程请求一遍常用查询（各 metric 的 /api/stats 等），结果写入
+   共享响应缓存（见 shared_cache.py），之后才把 /api/health 置为就绪并打印“已就绪”
+4. 主进程负责：
+   - 转发 collector 的 UDP 提交通知：主进程监听 STREAM_NOTIFY_PORT，逐条转发给每个 worker
+     各自的端口（STREAM_NOTIFY_PORT + 1 + 编号），每个 worker 的 /api/stream 都能收到全部事件
+   - worker 意外退出时重新 fork；收到 SIGINT / SIGTERM 时通知所有 worker 退出
+
+未设置 RESPONSE_CACHE 环境变量时默认开启共享响应缓存（--no-cache 关闭）。
+"""
+
+import argparse
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import sqlite3
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List
+
+# 必须在导入 api 之前设置，shared_cache 在导入时读取
+if "--no-cache" in sys.argv:
+    os.environ["RESPONSE_CACHE"] = "false"
+else:
+    os.environ.setdefault("RESPONSE_CACHE", "true")
+
+import uvicorn  # noqa: E402
+
+import api  # noqa: E402
+from collector import DB_PATH, STREAM_NOTIFY_HOST, STREAM_NOTIFY_PORT, init_database  # noqa: E402
+from joined import METRICS  # noqa: E402
+from rollup import ROLLUP_SECONDS, data_range, ensure_rollups, ts_to_epoch  # noqa: E402
+
+# 预热时读取的最近数据行数（每个 metric），覆盖 /api/realtime 和近期 /api/history
+WARM_RECENT_ROWS = int(os.getenv("WARM_RECENT_ROWS", "20000"))
+# worker 启动后预先请求的查询（结果进入共享响应缓存）。缓存键包含协商出的压缩方式，
+# 按 requests 库（D 端）的默认 Accept-Encoding 请求
+WARM_ACCEPT_ENCODING = "gzip, deflate"
+WARM_QUERIES = [
+    f"/api/stats?metric={metric}" for metric in METRICS
+] + [
+    f"/api/stats?metric={metric}&quantiles=0.5,0.9,0.99" for metric in METRICS
+]
+
+
+# ==================== 预热 ====================
+def warm_database(db_path: str = DB_PATH) -> Dict[str, float]:
+    """把热点索引页和数据页读入页缓存，并补齐 rollup；返回各步骤耗时（秒）"""
+    timings = {}
+    conn = sqlite3.connect(db_path)
+    try:
+        t0 = time.perf_counter()
+        for metric in METRICS:
+            # 覆盖索引扫描：读入该 metric 在 (metric, ts) 索引中的全部页
+            conn.execute("SELECT COUNT(ts) FROM measurements WHERE metric = ?", (metric,)).fetchone()
+            # 最近的数据行（表页）
+            conn.execute(
+                """
+                SELECT COUNT(value) FROM (
+                    SELECT value FROM measurements WHERE metric = ? ORDER BY ts DESC LIMIT ?
+                )
+                """,
+                (metric, WARM_RECENT_ROWS),
+            ).fetchone()
+        timings["pages"] = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        built = 0
+        for metric in METRICS:
+            first_ts, last_ts = data_range(conn, metric)
+            if first_ts is None:
+                continue
+            first_bucket = ts_to_epoch(first_ts) // ROLLUP_SECONDS * ROLLUP_SECONDS
+            last_bucket = ts_to_epoch(last_ts) // ROLLUP_SECONDS * ROLLUP_SECONDS
+            built += ensure_rollups(conn, metric, first_bucket, last_bucket)
+        timings["rollups"] = time.perf_counter() - t0
+        timings["rollup_runs"] = built
+    finally:
+        conn.close()
+    return timings
+
+
+def warm_queries(base_url: str, queries: List[str], timeout: float = 60.0) -> int:
+    """依次请求 queries（写入共享响应缓存），返回成功的个数"""
+    ok = 0
+    for query in queries:
+        try:
+            request = urllib.request.Request(base_url + query, headers={"Accept-Encoding": WARM_ACCEPT_ENCODING})
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                response.read()
+                ok += response.status == 200
+        except (urllib.error.URLError, OSError) as e:
+            print(f"⚠ 预热请求失败: {query}: {e}")
+    return ok
+
+
+def wait_for_server(base_url: str, timeout: float = 60.0) -> None:
+    """等到任意一个 worker 开始响应（/api/health 返回 200 或 503 都算）"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(base_url + "/api/health", timeout=2):
+                return
+        except urllib.error.HTTPError:
+            return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.1)
+    raise RuntimeError("等待 worker 启动超时")
+
+
+# ==================== worker 管理 ====================
+def _run_worker(config: uvicorn.Config, sock: socket.socket, relay: socket.socket, stream_port: int) -> None:
+    relay.close()
+    api.stream_listen_port = stream_port
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+class Supervisor:
+    def __init__(self, args):
+        self.args = args
+        self.context = multiprocessing.get_context("fork")
+        self.workers: Dict[int, multiprocessing.Process] = {}
+        self.stopping = False
+        self.config = uvicorn.Config(
+            api.app,
+            host=args.host,
+            port=args.port,
+            log_level=args.log_level,
+            access_log=args.access_log,
+        )
+        self.sock = self.config.bind_socket()
+        # 接收 collector 通知并转发给各 worker
+        self.relay = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.relay.bind((STREAM_NOTIFY_HOST, STREAM_NOTIFY_PORT))
+        self.worker_ports = [STREAM_NOTIFY_PORT + 1 + i for i in range(args.workers)]
+
+    def spawn(self, index: int) -> None:
+        process = self.context.Process(
+            target=_run_worker,
+            args=(self.config, self.sock, self.relay, self.worker_ports[index]),
+            name=f"api-worker-{index}",
+        )
+        process.start()
+        self.workers[index] = process
+
+    def stop(self, *_) -> None:
+        self.stopping = True
+
+    def run(self) -> None:
+        base_url = f"http://{'127.0.0.1' if self.args.host in ('0.0.0.0', '') else self.args.host}:{self.args.port}"
+        for index in range(self.args.workers):
+            self.spawn(index)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        if not self.args.no_warmup:
+            wait_for_server(base_url)
+            t0 = time.perf_counter()
+            ok = warm_queries(base_url, WARM_QUERIES)
+            print(f"✓ 预热查询 {ok}/{len(WARM_QUERIES)}（{time.perf_counter() - t0:.2f}s）")
+        api.ready.set()
+        print(f"✓ 已就绪: {base_url}（{self.args.workers} 个 worker，"
+              f"共享响应缓存{'开启' if api.RESPONSE_CACHE_ENABLED else '关闭'}）")
+        if self.args.ready_file:
+            with open(self.args.ready_file, "w") as f:
+                f.write(str(os.getpid()))
+
+        try:
+            while not self.stopping:
+                try:
+                    readable, _, _ = select.select([self.relay], [], [], 0.5)
+                except InterruptedError:
+                    continue
+                if readable:
+                    self._forward()
+                for index, process in list(self.workers.items()):
+                    if not process.is_alive() and not self.stopping:
+                        print(f"⚠ worker {index}（pid {process.pid}）退出，重新启动")
+                        self.spawn(index)
+        finally:
+            self.shutdown()
+
+    def _forward(self) -> None:
+        """把 collector 的通知逐条转发给所有 worker（每次最多处理 256 条，避免饿死其他工作）"""
+        for _ in range(256):
+            try:
+                data = self.relay.recv(65535, socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                return
+            for port in self.worker_ports:
+                try:
+                    self.relay.sendto(data, ("127.0.0.1", port))
+                except OSError:
+                    pass
+
+    def shutdown(self) -> None:
+        for process in self.workers.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+        for process in self.workers.values():
+            process.join(timeout=10)
+            if process.is_alive():
+                process.kill()
+        self.sock.close()
+        self.relay.close()
+        if self.args.ready_file and os.path.exists(self.args.ready_file):
+            os.remove(self.args.ready_file)
+        print("✓ 所有 worker 已退出")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多进程启动 collector HTTP API")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker 进程数（默认 CPU 核数）")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--no-warmup", action="store_true", help="跳过预热")
+    parser.add_argument("--no-cache", action="store_true", help="关闭共享响应缓存")
+    parser.add_argument("--ready-file", default=None, help="就绪后写入主进程 pid 的文件，退出时删除")
+    parser.add_argument("--log-level", default="warning")
+    parser.add_argument("--access-log", action="store_true", help="打印访问日志")
+    args = parser.parse_args()
+
+    init_database()
+    # api.ready 是 threading.Event，fork 后各进程各有一份；换成进程间共享的 Event（初始为未就绪）
+    api.ready = multiprocessing.get_context("fork").Event()
+    if not args.no_warmup:
+        timings = warm_database()
+        print(f"✓ 预热数据库: 索引/数据页 {timings['pages']:.2f}s，"
+              f"rollup {timings['rollups']:.2f}s（补算 {timings['rollup_runs']} 段）")
+    Supervisor(args).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+跨进程响应缓存（可选，默认关闭）- 多 worker 部署时各进程共享计算结果
+
+开启：环境变量 RESPONSE_CACHE=true（serve.py 多进程模式默认开启）。
+
+- 存储：本地 SQLite 文件（RESPONSE_CACHE_PATH，默认与数据库同目录的 response_cache.db），
+  WAL 模式，所有 worker 读写同一个文件；命中时只读一行 BLOB，走操作系统页缓存
+- 只缓存 CACHED_PATHS 中的 GET 请求：纯 JSON、结果只取决于查询参数和数据本身；
+  只保存状态码 200 的完整响应，单条不超过 RESPONSE_CACHE_MAX_BODY 字节
+- 键：路径 + 按名称排序的查询参数 + 协商出的 Content-Encoding。中间件放在压缩之外，
+  缓存的是压缩后的 body，命中时查询、编码、压缩都省掉了
+- 失效：每条记录附带写入时它所依赖数据的版本，取自 data_versions 表（collector.init_database 建的
+  触发器在每次写入时更新，每个 metric 一行，读取为 O(1)）：
+  - 只看请求涉及的 metric（metric / metrics 参数，缺省为全部）：写入一个 metric 不会让其他 metric 的响应失效
+  - to 早于该 metric 最新的 ts 时，范围内的数据只会被补写（INSERT OR REPLACE 旧 ts）改变，
+    版本取最近一次补写的 id；实时写入的新点不会让这类历史范围的响应失效
+  - 否则取该 metric 最近一次写入的 id
+  没有 data_versions 表时（旧数据库）退回 measurements 的最大 id，任何写入都会让所有记录失效
+- 条目数超过 RESPONSE_CACHE_MAX_ENTRIES 时删除最早写入的记录
+- 响应头 X-Cache: hit / miss
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+import anyio
+from starlette.datastructures import Headers
+
+from collector import DB_PATH
+from compression import choose_encoding
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "false").lower() == "true"
+RESPONSE_CACHE_PATH = os.getenv(
+    "RESPONSE_CACHE_PATH", os.path.join(os.path.dirname(DB_PATH) or ".", "response_cache.db")
+)
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+RESPONSE_CACHE_MAX_BODY = int(os.getenv("RESPONSE_CACHE_MAX_BODY", str(4 * 1024 * 1024)))
+
+CACHED_PATHS = (
+    "/api/stats",
+    "/api/aggregate",
+    "/api/joined",
+    "/api/anomalies",
+    "/api/forecast",
+)
+
+# 不随缓存保存的响应头（由服务器或中间件按本次请求重新生成）
+_SKIP_HEADERS = {b"content-length", b"date", b"server", b"server-timing"}
+# 每写入多少条检查一次条目上限
+_PRUNE_EVERY = 64
+
+
+def cache_key(scope) -> Tuple[str, Optional[List[str]], Optional[str]]:
+    """返回 (键, 响应依赖的 metric 列表（None 为全部）, to 参数)"""
+    query = parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True)
+    encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", "")) or "identity"
+    metrics = [value for name, value in query if name == "metric"]
+    for name, value in query:
+        if name == "metrics" and value:
+            metrics.extend(part.strip() for part in value.split(","))
+    to_ts = next((value for name, value in query if name == "to"), None)
+    return f"{scope['path']}?{urlencode(sorted(query))}|{encoding}", metrics or None, to_ts
+
+
+class SharedCache:
+    """SQLite 文件实现的键值缓存；每个线程一个连接（API 的同步部分在线程池中执行）"""
+
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, db_path: str = DB_PATH,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._puts = 0
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _init(self) -> None:
+        with self._init_lock:
+            if self._initialized:
+                return
+            conn = sqlite3.connect(self.path, timeout=1.0)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS entries (
+                        key TEXT PRIMARY KEY,
+                        version TEXT NOT NULL,
+                        headers TEXT NOT NULL,
+                        body BLOB NOT NULL,
+                        stored_at REAL NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_stored_at ON entries(stored_at)")
+                conn.commit()
+            finally:
+                conn.close()
+            self._initialized = True
+
+    def _connections(self) -> Tuple[sqlite3.Connection, sqlite3.Connection]:
+        conns = getattr(self._local, "conns", None)
+        if conns is None:
+            if not self._initialized:
+                self._init()
+            cache = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            # 缓存丢了可以重算，不必等落盘
+            cache.execute("PRAGMA synchronous=OFF")
+            data = sqlite3.connect(self.db_path, timeout=1.0)
+            conns = self._local.conns = (cache, data)
+        return conns
+
+    def data_version(self, metrics: Optional[List[str]] = None, to_ts: Optional[str] = None) -> str:
+        """metrics（None 为全部）在 to_ts 之前（None 为不限）的数据版本，见模块说明"""
+        _, data = self._connections()
+        try:
+            rows = data.execute("SELECT metric, version, latest_ts, backfill FROM data_versions").fetchall()
+        except sqlite3.OperationalError:
+            latest_id = data.execute("SELECT MAX(id) FROM measurements").fetchone()[0] or 0
+            return f"*:{latest_id}"
+        versions = {metric: (version, latest_ts, backfill) for metric, version, latest_ts, backfill in rows}
+        parts = []
+        for metric in sorted(set(metrics) if metrics is not None else versions):
+            version, latest_ts, backfill = versions.get(metric, (0, None, 0))
+            if to_ts is not None and latest_ts is not None and to_ts < latest_ts:
+                # 前缀 b 区分两种版本：存入时范围尚未封闭、之后才封闭的记录不会被误判为命中
+                parts.append(f"{metric}:b{backfill}")
+            else:
+                parts.append(f"{metric}:{version}")
+        return ",".join(parts)
+
+    def lookup(self, key: str, metrics: Optional[List[str]] = None,
+               to_ts: Optional[str] = None) -> Tuple[str, Optional[Tuple[List[Tuple[bytes, bytes]], bytes]]]:
+        """返回 (当前数据版本, (headers, body) 或 None)"""
+        cache, _ = self._connections()
+        version = self.data_version(metrics, to_ts)
+        row = cache.execute("SELECT version, headers, body FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None or row[0] != version:
+            return version, None
+        headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in json.loads(row[1])]
+        return version, (headers, row[2])
+
+    def store(self, key: str, version: str, headers: List[Tuple[bytes, bytes]], body: bytes) -> None:
+        cache, _ = self._connections()
+        encoded = json.dumps([(k.decode("latin-1"), v.decode("latin-1")) for k, v in headers])
+        try:
+            cache.execute(
+                "INSERT OR REPLACE INTO entries (key, version, headers, body, stored_at) VALUES (?, ?, ?, ?, ?)",
+                (key, version, encoded, body, time.time()),
+            )
+            self._puts += 1
+            if self._puts % _PRUNE_EVERY == 0:
+                cache.execute(
+                    """
+                    DELETE FROM entries WHERE key IN (
+                        SELECT key FROM entries ORDER BY stored_at ASC
+                        LIMIT max(0, (SELECT COUNT(*) FROM entries) - ?)
+                    )
+                    """,
+                    (self.max_entries,),
+                )
+        except sqlite3.OperationalError:
+            # 其他进程正在写（超过 busy timeout）：本次不缓存即可
+            pass
+
+    def clear(self) -> None:
+        cache, _ = self._connections()
+        cache.execute("DELETE FROM entries")
+
+
+class ResponseCacheMiddleware:
+    """纯 ASGI 中间件：CACHED_PATHS 的 GET 请求先查共享缓存，未命中时保存完整的 200 响应"""
+
+    def __init__(self, app, cache: Optional[SharedCache] = None):
+        self.app = app
+        self.cache = cache or SharedCache()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or scope["path"] not in CACHED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        key, metrics, to_ts = cache_key(scope)
+        # SQLite 读写可能等锁，放到线程池中执行，不阻塞事件循环
+        version, hit = await anyio.to_thread.run_sync(self.cache.lookup, key, metrics, to_ts)
+        if hit is not None:
+            headers, body = hit
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": headers + [(b"content-length", str(len(body)).encode()), (b"x-cache", b"hit")],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        start_message = None
+        cacheable = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, cacheable
+            if message["type"] == "http.response.start":
+                start_message = message
+                cacheable = message["status"] == 200
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-cache", b"miss")]}
+            elif message["type"] == "http.response.body" and cacheable:
+                cacheable = False
+                body = message.get("body", b"")
+                if not message.get("more_body", False) and len(body) <= RESPONSE_CACHE_MAX_BODY:
+                    await send(message)
+                    headers = [(k, v) for k, v in start_message.get("headers", []) if k.lower() not in _SKIP_HEADERS]
+                    await anyio.to_thread.run_sync(self.cache.store, key, version, headers, body)
+                    return
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+DDSketch - 可合并的分位数草图（纯 Python 实现）
+
+原理：把 |x| 映射到对数桶 index = ceil(log_gamma(|x|))，gamma = (1 + α) / (1 - α)，
+每个桶只记计数。任意分位数的估计值与真实值的相对误差不超过 α，
+两个草图合并只需把同 index 的计数相加，因此可以按小时预先算好、查询时再合并。
+
+- α = 0.1%（RELATIVE_ACCURACY）：气压这类“基数大、波动小”的指标（~1000 hPa）
+  也能保证 ±1 hPa 以内；修改 α 会使已存储的草图失效，需清空 rollups 表
+- 正数、负数分别存放，|x| < MIN_INDEXABLE 的值计入 zero_count
+- 另外精确记录 min / max，分位数结果会被夹在 [min, max] 之内
+"""
+
+import math
+import struct
+from typing import Dict, Iterable, List, Optional, Tuple
+
+RELATIVE_ACCURACY = 0.001
+MIN_INDEXABLE = 1e-9
+
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+
+# 序列化头：count, zero_count, min, max, 正数桶个数, 负数桶个数
+_HEADER = struct.Struct("<QQddII")
+_BIN = struct.Struct("<iI")
+
+
+def _index(abs_value: float) -> int:
+    return int(math.ceil(math.log(abs_value) / _LOG_GAMMA))
+
+
+def _bin_value(index: int) -> float:
+    """桶的代表值：使桶内任意值的相对误差不超过 α"""
+    return 2.0 * _GAMMA ** index / (_GAMMA + 1)
+
+
+class DDSketch:
+    """可合并的分位数草图"""
+
+    __slots__ = ("count", "zero_count", "min", "max", "positive", "negative")
+
+    def __init__(self):
+        self.count = 0
+        self.zero_count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.positive: Dict[int, int] = {}
+        self.negative: Dict[int, int] = {}
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value > MIN_INDEXABLE:
+            index = _index(value)
+            self.positive[index] = self.positive.get(index, 0) + 1
+        elif value < -MIN_INDEXABLE:
+            index = _index(-value)
+            self.negative[index] = self.negative.get(index, 0) + 1
+        else:
+            self.zero_count += 1
+
+    def update(self, values: Iterable[float]) -> "DDSketch":
+        for value in values:
+            self.add(value)
+        return self
+
+    def merge(self, other: "DDSketch") -> "DDSketch":
+        """把 other 合并进来（原地修改并返回自身）"""
+        if other.count == 0:
+            return self
+        self.count += other.count
+        self.zero_count += other.zero_count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for index, n in other.positive.items():
+            self.positive[index] = self.positive.get(index, 0) + n
+        for index, n in other.negative.items():
+            self.negative[index] = self.negative.get(index, 0) + n
+        return self
+
+    def _ascending_bins(self) -> List[Tuple[float, int]]:
+        """按数值升序返回 (代表值, 计数)"""
+        bins = [(-_bin_value(i), self.negative[i]) for i in sorted(self.negative, reverse=True)]
+        if self.zero_count:
+            bins.append((0.0, self.zero_count))
+        bins.extend((_bin_value(i), self.positive[i]) for i in sorted(self.positive))
+        return bins
+
+    def quantiles(self, qs: Iterable[float]) -> List[Optional[float]]:
+        """一次遍历求多个分位数（qs 取值 0~1），空草图返回 None"""
+        qs = list(qs)
+        if self.count == 0:
+            return [None] * len(qs)
+        order = sorted(range(len(qs)), key=lambda k: qs[k])
+        results: List[Optional[float]] = [None] * len(qs)
+        bins = self._ascending_bins()
+        cumulative = 0
+        b = 0
+        for k in order:
+            # 两端直接返回精确的 min / max
+            if qs[k] <= 0.0:
+                results[k] = self.min
+                continue
+            if qs[k] >= 1.0:
+                results[k] = self.max
+                continue
+            rank = qs[k] * (self.count - 1)
+            while b < len(bins) - 1 and cumulative + bins[b][1] <= rank:
+                cumulative += bins[b][1]
+                b += 1
+            results[k] = min(max(bins[b][0], self.min), self.max)
+        return results
+
+    def histogram(self, edges: List[float]) -> List[int]:
+        """按固定边界统计各区间计数（最后一个区间包含右端点），按桶代表值归属"""
+        counts = [0] * (len(edges) - 1)
+        if not counts:
+            return counts
+        last = len(counts) - 1
+        lo, hi = edges[0], edges[-1]
+        for value, n in self._ascending_bins():
+            value = min(max(value, self.min), self.max)
+            if value < lo or value > hi:
+                continue
+            counts[min(_bucket_of(value, edges), last)] += n
+        return counts
+
+    def to_bytes(self) -> bytes:
+        parts = [_HEADER.pack(self.count, self.zero_count, self.min, self.max,
+                              len(self.positive), len(self.negative))]
+        parts.extend(_BIN.pack(i, n) for i, n in self.positive.items())
+        parts.extend(_BIN.pack(i, n) for i, n in self.negative.items())
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "DDSketch":
+        sketch = cls()
+        (sketch.count, sketch.zero_count, sketch.min, sketch.max,
+         n_pos, n_neg) = _HEADER.unpack_from(data, 0)
+        offset = _HEADER.size
+        for _ in range(n_pos):
+            i, n = _BIN.unpack_from(data, offset)
+            sketch.positive[i] = n
+            offset += _BIN.size
+        for _ in range(n_neg):
+            i, n = _BIN.unpack_from(data, offset)
+            sketch.negative[i] = n
+            offset += _BIN.size
+        return sketch
+
+
+def _bucket_of(value: float, edges: List[float]) -> int:
+    """二分查找 value 所在的区间下标"""
+    lo, hi = 0, len(edges) - 1
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if value >= edges[mid]:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+def equal_width_edges(lo: float, hi: float, bins: int) -> List[float]:
+    """[lo, hi] 等宽切分为 bins 个区间的边界"""
+    if hi <= lo:
+        # 所有值相同：以该值为起点给一个单位宽度，避免零宽区间
+        hi = lo + 1.0
+    width = (hi - lo) / bins
+    return [lo + k * width for k in range(bins)] + [hi]
+
+
+def exact_quantiles(sorted_values: List[float], qs: Iterable[float]) -> List[Optional[float]]:
+    """精确分位数（线性插值，与 numpy.quantile 默认方法一致）"""
+    n = len(sorted_values)
+    results: List[Optional[float]] = []
+    for q in qs:
+        if n == 0:
+            results.append(None)
+            continue
+        pos = q * (n - 1)
+        low = int(math.floor(pos))
+        high = min(low + 1, n - 1)
+        frac = pos - low
+        results.append(sorted_values[low] + (sorted_values[high] - sorted_values[low]) * frac)
+    return results
+
+
+def exact_histogram(values: Iterable[float], edges: List[float]) -> List[int]:
+    counts = [0] * (len(edges) - 1)
+    if not counts:
+        return counts
+    last = len(counts) - 1
+    lo, hi = edges[0], edges[-1]
+    for value in values:
+        if lo <= value <= hi:
+            counts[min(_bucket_of(value, edges), last)] += 1
+    return counts
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+实时推送中心 - 为 /api/stream（SSE / WebSocket）提供数据
+
+数据流：
+  collector.py 每提交一条数据 → UDP 数据报（本机）→ StreamHub → 各订阅者的有界缓冲区
+
+设计要点：
+- 每个事件只编码一次（SSE 文本 / JSON 文本），所有订阅者共享同一份 bytes
+- 每个订阅者一个有界 deque；缓冲区满说明客户端跟不上，直接断开该订阅者，
+  客户端用 Last-Event-ID 重连即可补齐，不会拖慢其他订阅者
+- 每个 metric 保留最近 RING_SIZE 条事件的环形缓冲区；重连时 Last-Event-ID 仍在
+  缓冲区内就直接补发，否则回落到数据库按 id 补发
+- 扇出只是在事件循环里遍历订阅者并 append，一个 asyncio worker 可承载数千个连接
+- 同时记录每个 metric 已知的最新 id，/api/realtime?since= 据此在内存中判断“没有新数据”，
+  不必查询数据库（见 known_latest）
+- 通知中附带的 collector 写入耗时（lag_ms）汇总为滑动平均，供准入控制使用（见 admission.py）
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Set
+
+# 每个 metric 环形缓冲区保留的事件数
+RING_SIZE = int(os.getenv("STREAM_RING_SIZE", "1024"))
+# 每个订阅者最多积压的事件数，超过即视为慢消费者并断开
+SUBSCRIBER_BUFFER = int(os.getenv("STREAM_SUBSCRIBER_BUFFER", "256"))
+# 从数据库补发的最大事件数（超过的部分请改用 /api/history）
+DB_REPLAY_LIMIT = int(os.getenv("STREAM_DB_REPLAY_LIMIT", "5000"))
+# SSE 心跳间隔（秒），防止代理/浏览器因空闲断开
+HEARTBEAT_INTERVAL = float(os.getenv("STREAM_HEARTBEAT_INTERVAL", "15"))
+# 已知最新 id 的有效期（秒）：超过这么久没有收到该 metric 的通知、也没有查库确认，
+# 就不再信任内存中的值（collector 关闭通知或 UDP 丢包时，最多延迟这么久）
+VERSION_TTL = float(os.getenv("STREAM_VERSION_TTL", "5"))
+# collector 写入耗时的滑动平均系数，以及多久没有新样本就视为未知（秒）
+INGEST_LAG_ALPHA = 0.2
+INGEST_LAG_WINDOW = 10.0
+
+
+class StreamEvent:
+    """一条已提交的数据点，编码结果懒加载并在订阅者之间共享"""
+
+    __slots__ = ("id", "metric", "ts", "value", "_json", "_sse")
+
+    def __init__(self, event_id: int, metric: str, ts: str, value: Optional[float]):
+        self.id = event_id
+        self.metric = metric
+        self.ts = ts
+        self.value = value
+        self._json: Optional[str] = None
+        self._sse: Optional[bytes] = None
+
+    @property
+    def json(self) -> str:
+        if self._json is None:
+            self._json = json.dumps(
+                {"id": self.id, "metric": self.metric, "ts": self.ts, "value": self.value},
+                separators=(",", ":"),
+            )
+        return self._json
+
+    @property
+    def sse(self) -> bytes:
+        if self._sse is None:
+            self._sse = f"id: {self.id}\nevent: point\ndata: {self.json}\n\n".encode("utf-8")
+        return self._sse
+
+
+class Subscriber:
+    """单个客户端连接的有界缓冲区"""
+
+    __slots__ = ("metric", "buffer", "closed", "_wakeup", "_maxlen")
+
+    def __init__(self, metric: str, maxlen: int):
+        self.metric = metric
+        self.buffer: Deque[StreamEvent] = deque()
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        self._maxlen = maxlen
+
+    def push(self, event: StreamEvent) -> bool:
+        """放入事件；缓冲区已满返回 False（由 hub 断开该订阅者）"""
+        if len(self.buffer) >= self._maxlen:
+            return False
+        self.buffer.append(event)
+        self._wakeup.set()
+        return True
+
+    def close(self) -> None:
+        self.closed = True
+        self._wakeup.set()
+
+    async def wait(self, timeout: Optional[float] = None) -> None:
+        """等待新事件或关闭；超时直接返回（用于心跳）"""
+        if self.buffer or self.closed:
+            return
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def drain(self) -> List[StreamEvent]:
+        events = list(self.buffer)
+        self.buffer.clear()
+        return events
+
+
+class _NotifyProtocol(asyncio.DatagramProtocol):
+    def __init__(self, hub: "StreamHub"):
+        self.hub = hub
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        try:
+            message = json.loads(data)
+            event = StreamEvent(int(message["id"]), message["metric"], message["ts"], message.get("value"))
+            lag_ms = message.get("lag_ms")
+            if lag_ms is not None:
+                self.hub.record_ingest_lag(float(lag_ms))
+        except (ValueError, KeyError, TypeError):
+            return
+        self.hub.publish(event)
+
+
+class StreamHub:
+    """进程内扇出中心：环形缓冲区 + 订阅者集合"""
+
+    def __init__(self, db_connect: Callable[[], sqlite3.Connection]):
+        self._db_connect = db_connect
+        self.rings: Dict[str, Deque[StreamEvent]] = {}
+        self.subscribers: Dict[str, Set[Subscriber]] = {}
+        self.latest_id: Dict[str, int] = {}
+        # 每个 metric 的 latest_id 最近一次被通知或查库确认的时间（time.monotonic）
+        self.confirmed_at: Dict[str, float] = {}
+        self.dropped_subscribers = 0
+        self._ingest_lag_ms: Optional[float] = None
+        self._ingest_lag_at = 0.0
+        self._transport = None
+
+    async def start(self, host: str, port: int) -> None:
+        """开始监听 collector 的 UDP 通知"""
+        loop = asyncio.get_running_loop()
+        try:
+            self._transport, _ = await loop.create_datagram_endpoint(
+                lambda: _NotifyProtocol(self), local_addr=(host, port)
+            )
+            print(f"✓ 实时推送已启动，监听 collector 通知: udp://{host}:{port}")
+        except OSError as e:
+            # 端口被占用（例如多进程部署时只有一个进程能监听）时不影响其他接口
+            print(f"⚠ 实时推送监听失败: {e}")
+
+    @property
+    def listening(self) -> bool:
+        return self._transport is not None
+
+    def stop(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        for subscribers in self.subscribers.values():
+            for subscriber in subscribers:
+                subscriber.close()
+
+    def publish(self, event: StreamEvent) -> None:
+        """把事件写入环形缓冲区并扇出给该 metric 的所有订阅者"""
+        ring = self.rings.get(event.metric)
+        if ring is None:
+            ring = self.rings[event.metric] = deque(maxlen=RING_SIZE)
+        ring.append(event)
+        if event.id > self.latest_id.get(event.metric, 0):
+            self.latest_id[event.metric] = event.id
+        self.confirmed_at[event.metric] = time.monotonic()
+
+        subscribers = self.subscribers.get(event.metric)
+        if not subscribers:
+            return
+        slow = [s for s in subscribers if not s.push(event)]
+        for subscriber in slow:
+            self._drop(subscriber)
+
+    def confirm(self, metric: str, event_id: int) -> None:
+        """
+        查库确认：数据库中该 metric 没有 id > event_id 的数据（除了已经通知过的）
+
+        只能在查询开始前推送中心就已在监听时调用，这样查询之后提交的数据一定会收到通知。
+        """
+        if not self.listening:
+            return
+        if event_id > self.latest_id.get(metric, 0):
+            self.latest_id[metric] = event_id
+        self.confirmed_at[metric] = time.monotonic()
+
+    def known_latest(self, metric: str) -> Optional[int]:
+        """
+        该 metric 已知的最新 id：数据库中不存在比它更大、且尚未通知到的数据
+
+        未在监听、从未确认过或确认已超过 VERSION_TTL 时返回 None（调用方应查库）。
+        """
+        if not self.listening:
+            return None
+        confirmed_at = self.confirmed_at.get(metric)
+        if confirmed_at is None or time.monotonic() - confirmed_at > VERSION_TTL:
+            return None
+        return self.latest_id.get(metric)
+
+    def record_ingest_lag(self, lag_ms: float) -> None:
+        now = time.monotonic()
+        if self._ingest_lag_ms is None or now - self._ingest_lag_at > INGEST_LAG_WINDOW:
+            self._ingest_lag_ms = lag_ms
+        else:
+            self._ingest_lag_ms += INGEST_LAG_ALPHA * (lag_ms - self._ingest_lag_ms)
+        self._ingest_lag_at = now
+
+    def ingest_lag(self) -> Optional[float]:
+        """collector 最近的写入耗时（毫秒，滑动平均）；INGEST_LAG_WINDOW 秒内没有通知时返回 None"""
+        if self._ingest_lag_ms is None or time.monotonic() - self._ingest_lag_at > INGEST_LAG_WINDOW:
+            return None
+        return self._ingest_lag_ms
+
+    def subscribe(self, metric: str) -> Subscriber:
+        subscriber = Subscriber(metric, SUBSCRIBER_BUFFER)
+        self.subscribers.setdefault(metric, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        subscribers = self.subscribers.get(subscriber.metric)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+
+    def _drop(self, subscriber: Subscriber) -> None:
+        self.dropped_subscribers += 1
+        self.unsubscribe(subscriber)
+        subscriber.close()
+
+    def subscriber_count(self) -> int:
+        return sum(len(s) for s in self.subscribers.values())
+
+    def replay(self, metric: str, last_event_id: int) -> List[StreamEvent]:
+        """
+        取出 id > last_event_id 的事件用于断线重连补发
+
+        环形缓冲区覆盖得到（最旧事件不晚于游标）就直接用；否则从数据库按 id 顺序
+        读取（最多 DB_REPLAY_LIMIT 条）。id 在各 metric 之间共享自增序列，所以
+        不能用“游标 + 1”判断连续性。
+        """
+        ring = self.rings.get(metric)
+        if ring and ring[0].id <= last_event_id:
+            return [event for event in ring if event.id > last_event_id]
+
+        conn = self._db_connect()
+        try:
+            rows = conn.execute(
+                """
+                SELECT id, ts, value
+                FROM measurements
+                WHERE id > ? AND metric = ?
+                ORDER BY id ASC
+                LIMIT ?
+                """,
+                (last_event_id, metric, DB_REPLAY_LIMIT),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [StreamEvent(row[0], metric, row[1], row[2]) for row in rows]
@@ -32,6 +32,9 @@ class Config:
     MQTT_USE_WEBSOCKETS: bool = False  # 使用TCP连接（1883端口）
     MQTT_WS_PATH: str = "/mqtt"  # WebSocket路径（如果使用WebSocket）
     
+    # C-collector HTTP API 地址
+    API_BASE_URL: str = "http://127.0.0.1:8000"
+    
     # 项目根目录（loT目录）- 使用__file__的绝对路径
     PROJECT_ROOT: Path = Path(__file__).resolve().parent.parent  # D-ui -> loT
     
@@ -1,7 +1,7 @@
 """
 数据查看页面模块
 """
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from PyQt5.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLabel,
     QGroupBox, QTableWidget, QTableWidgetItem, QTabWidget, QMessageBox
@@ -20,6 +20,7 @@ try:
 except:
     pass
 from config import config
+from workers.http_worker import HttpWorker
 try:
     from workers.mqtt_worker import MQTTSubscriber
     MQTT_AVAILABLE = True
@@ -43,6 +44,10 @@ class SubscriptionWidget(QWidget):
         self._historical_fit_points = []  # 存储历史拟合数据点 [(datetime, value), ...]，固定不变
         self._prediction_start_time = None  # 记录开始预测的时间（第10个数据点的时间）
         self._prediction_window = 100  # 预测时使用的最近数据点个数（增加窗口以改善拟合）
+        self._forecast_model = "linear"  # 服务端预测模型：linear / holt / ewma
+        self._forecast_points = []  # 服务端最近一次返回的拟合点 + 预测点 [(datetime, value), ...]
+        self._forecast_requested_count = 0  # 上次请求预测时的数据点个数
+        self._forecast_worker = None
         self._redraw_timer = QTimer()  # 用于防抖，避免频繁重绘
         self._redraw_timer.setSingleShot(True)
         self._redraw_timer.timeout.connect(self.redraw_chart)
@@ -88,7 +93,7 @@ class SubscriptionWidget(QWidget):
 
         # 预测说明标签
         self.prediction_label = QLabel(
-            f"预测说明：当收到10个实时数据点后，将使用最近最多 {self._prediction_window} 个数据点的加权移动平均/线性趋势外推未来走势。"
+            f"预测说明：当收到10个实时数据点后，由服务端（/api/forecast）使用最近最多 {self._prediction_window} 个数据点的加权线性趋势外推未来走势。"
         )
         self.prediction_label.setWordWrap(True)
         self.prediction_label.setStyleSheet("color: #7f8c8d; font-size: 12px;")
@@ -211,6 +216,8 @@ class SubscriptionWidget(QWidget):
         self._prediction_points = []
         self._historical_fit_points = []
         self._prediction_start_time = None  # 重置预测开始时间
+        self._forecast_points = []
+        self._forecast_requested_count = 0
         
         # 清空图表显示
         self.ax.clear()
@@ -385,130 +392,45 @@ class SubscriptionWidget(QWidget):
         except Exception as e:
             pass
         
-    def _compute_linear_prediction(self, times, values):
+    def _request_forecast(self):
         """
-        使用最近 self._prediction_window 个点做加权移动平均+线性回归，外推未来一小段时间。
-        同时生成历史拟合点，确保预测曲线与历史数据高度拟合。
-        返回预测点的 (pred_times, pred_values) 列表。
-        """
-        try:
-            n = len(times)
-            if n < 10:
-                # 数据点太少，不做预测
-                return [], []
-
-            window = min(self._prediction_window, n)
-            recent_times = times[-window:]
-            recent_values = values[-window:]
-
-            # 使用移动平均平滑数据，提高拟合效果
-            # 使用加权移动平均，给最近的数据更高权重
-            smoothed_values = []
-            ma_window = min(5, window // 4)  # 移动平均窗口，约为总窗口的1/4
-            if ma_window < 1:
-                ma_window = 1
-            
-            for i in range(len(recent_values)):
-                # 计算加权移动平均
-                start_idx = max(0, i - ma_window + 1)
-                end_idx = i + 1
-                weights = []
-                weighted_sum = 0
-                weight_sum = 0
-                for j in range(start_idx, end_idx):
-                    # 越近的数据权重越大
-                    weight = (j - start_idx + 1) / (end_idx - start_idx)
-                    weights.append(weight)
-                    weighted_sum += recent_values[j] * weight
-                    weight_sum += weight
-                if weight_sum > 0:
-                    smoothed_values.append(weighted_sum / weight_sum)
-                else:
-                    smoothed_values.append(recent_values[i])
-
-            # 将时间转换为数值（天数）
-            x = [mdates.date2num(t) for t in recent_times]
-            y = smoothed_values  # 使用平滑后的数据
-
-            # 使用加权线性回归，给最近的数据点更高权重
-            x_mean = sum(x) / window
-            y_mean = sum(y) / window
-
-            # 计算加权协方差和方差
-            num = 0
-            den = 0
-            for i, (xi, yi) in enumerate(zip(x, y)):
-                # 权重：越近的数据权重越大
-                weight = (i + 1) / window
-                num += weight * (xi - x_mean) * (yi - y_mean)
-                den += weight * (xi - x_mean) ** 2
-            
-            if den == 0:
-                return [], []
-            
-            slope = num / den
-            intercept = y_mean - slope * x_mean
-
-            # 估算时间步长：使用窗口内跨度 / (window-1)
-            if window >= 2:
-                total_span = x[-1] - x[0]
-                step = total_span / (window - 1) if total_span > 0 else 1.0 / (24 * 60)
-            else:
-                step = 1.0 / (24 * 60)  # 兜底：约 1 分钟
-
-            future_points = 10  # 预测未来 10 个点
-            start_x = x[-1]
-
-            pred_times = []
-            pred_values = []
-
-            # 不仅预测未来，还要生成历史拟合点（从窗口开始到结束）
-            # 这样可以确保预测曲线与历史数据高度拟合
-            historical_pred_times = []
-            historical_pred_values = []
-            
-            # 生成历史拟合点（从窗口的第一个点开始）
-            for i, xi in enumerate(x):
-                yi = slope * xi + intercept
-                t = mdates.num2date(xi)
-                if getattr(t, "tzinfo", None) is not None:
-                    t = t.replace(tzinfo=None)
-                historical_pred_times.append(t)
-                historical_pred_values.append(yi)
-
-            # 生成未来预测点
-            for i in range(1, future_points + 1):
-                xi = start_x + i * step
-                yi = slope * xi + intercept
-                
-                # 限制预测值在合理范围内（基于历史数据的范围）
-                min_y = min(recent_values)
-                max_y = max(recent_values)
-                data_range = max_y - min_y
-                margin = max(0.2 * data_range, 1.0)  # 允许20%的波动范围
-                low = min_y - margin
-                high = max_y + margin
-                
-                if yi < low:
-                    yi = low
-                elif yi > high:
-                    yi = high
+        向 C 端 /api/forecast 请求拟合值与未来预测点（后台线程，不阻塞界面）
 
-                t = mdates.num2date(xi)
-                if getattr(t, "tzinfo", None) is not None:
-                    t = t.replace(tzinfo=None)
+        拟合在服务端按 metric 缓存、随新数据增量更新，所有客户端共享同一份计算；
+        结果到达后由 _on_forecast_received 保存并触发重绘。
+        """
+        if self._forecast_worker is not None and self._forecast_worker.isRunning():
+            return
+        self._forecast_requested_count = len(self._chart_data)
+        self._forecast_worker = HttpWorker(
+            f"{config.API_BASE_URL.rstrip('/')}/api/forecast",
+            {
+                "metric": self.metric,
+                "model": self._forecast_model,
+                "window": self._prediction_window,
+                "horizon": 10,  # 预测未来 10 个点
+            },
+            parent=self,
+        )
+        self._forecast_worker.finished.connect(self._on_forecast_received)
+        self._forecast_worker.error.connect(self._on_forecast_error)
+        self._forecast_worker.start()
 
-                pred_times.append(t)
-                pred_values.append(yi)
+    def _on_forecast_received(self, data: dict):
+        """保存服务端返回的历史拟合点 + 未来预测点（epoch 秒 → 本地无时区 datetime，与图表数据一致）"""
+        def to_points(series):
+            return [
+                (datetime.fromtimestamp(t, timezone.utc).replace(tzinfo=None), v)
+                for t, v in zip(series.get("ts", []), series.get("value", []))
+            ]
 
-            # 返回历史拟合点 + 未来预测点
-            # 历史拟合点用于显示红色点，未来预测点用于显示红色虚线
-            all_pred_times = historical_pred_times + pred_times
-            all_pred_values = historical_pred_values + pred_values
+        self._forecast_points = to_points(data.get("fitted", {})) + to_points(data.get("forecast", {}))
+        if not self._redraw_timer.isActive():
+            self._redraw_timer.start(0)
 
-            return all_pred_times, all_pred_values
-        except Exception:
-            return [], []
+    def _on_forecast_error(self, error_msg: str):
+        """预测请求失败只打印日志，图表照常显示实时数据"""
+        print(f"[订阅端-{self.metric}] 预测请求失败: {error_msg}")
 
     def redraw_chart(self):
         """重新绘制图表（必须在主线程中调用）"""
@@ -571,10 +493,9 @@ class SubscriptionWidget(QWidget):
                     label=f"{self.get_metric_name()}历史数据",
                 )
         
-                # 计算新的预测点（使用完整的 _chart_data 进行预测，而不是只使用显示的数据）
-                # 这样可以获得更准确的预测
+                # 预测由服务端基于已入库的数据计算，这里用完整的 _chart_data 判断
+                # 是否有新数据、以及哪些预测点已经被真实数据覆盖
                 full_times = [item[0] for item in self._chart_data]
-                full_values = [item[1] for item in self._chart_data]
                 last_real_time = full_times[-1] if full_times else None
                 
                 # 获取已有真实数据的时间点集合（用于过滤已实现的预测点）
@@ -590,12 +511,12 @@ class SubscriptionWidget(QWidget):
                     if self._prediction_start_time is None:
                         self._prediction_start_time = full_times[min_points_for_fit - 1]  # 第10个数据点（索引9）
                     
-                    # 使用最新的数据进行预测（最多使用 _prediction_window 个点）
-                    fit_window = min(self._prediction_window, len(full_times))
-                    pred_times, pred_values = self._compute_linear_prediction(
-                        full_times[-fit_window:], 
-                        full_values[-fit_window:]
-                    )
+                    # 有新数据时向服务端请求最新预测（最多使用 _prediction_window 个点），
+                    # 本次先用上一次返回的结果绘制
+                    if len(self._chart_data) != self._forecast_requested_count:
+                        self._request_forecast()
+                    pred_times = [t for t, v in self._forecast_points]
+                    pred_values = [v for t, v in self._forecast_points]
                     
                     if pred_times and pred_values and last_real_time and self._prediction_start_time:
                         # 分离历史拟合点和未来预测点
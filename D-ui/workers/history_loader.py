@@ -0,0 +1,121 @@
+"""
+历史数据分片并行加载模块
+
+把 [start, end] 切成若干个互不重叠的时间片，每个时间片在线程池中独立地
+按 keyset 游标（after_ts / next_cursor）逐页拉取 /api/history，最后按时间片
+顺序拼接成完整的列式数组。
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import numpy as np
+import requests
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from workers.http_worker import ACCEPT_HEADERS, ARROW_AVAILABLE, decode_arrow
+
+TS_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+def split_time_range(start: str, end: str, slices: int):
+    """
+    把闭区间 [start, end] 切成 slices 段闭区间
+
+    相邻两段以 1 秒错开（时间戳精度为秒），保证不重叠、不遗漏。
+    """
+    t0 = datetime.strptime(start, TS_FORMAT)
+    t1 = datetime.strptime(end, TS_FORMAT)
+    total = int((t1 - t0).total_seconds())
+    slices = max(1, min(slices, total))
+    bounds = [t0 + timedelta(seconds=total * i // slices) for i in range(slices + 1)]
+    ranges = []
+    for i in range(slices):
+        lo = bounds[i]
+        hi = bounds[i + 1] - timedelta(seconds=1) if i < slices - 1 else t1
+        ranges.append((lo.strftime(TS_FORMAT), hi.strftime(TS_FORMAT)))
+    return ranges
+
+
+class HistoryLoader(QThread):
+    """
+    历史数据加载线程
+
+    finished 发出 {"metric", "ts": ndarray[int64 epoch 秒], "value": ndarray[float64]}
+    progress 发出 (已完成页数, 已完成时间片数)
+    """
+    finished = pyqtSignal(dict)
+    progress = pyqtSignal(int, int)
+    error = pyqtSignal(str)
+
+    def __init__(self, base_url, metric, start_ts, end_ts, slices=4, page_size=10000, parent=None):
+        super().__init__(parent)
+        self.url = f"{base_url.rstrip('/')}/api/history"
+        self.metric = metric
+        self.start_ts = start_ts
+        self.end_ts = end_ts
+        self.slices = slices
+        self.page_size = page_size
+        self.fmt = "arrow" if ARROW_AVAILABLE else "columnar"
+
+    def _fetch_page(self, session, lo, hi, cursor):
+        params = {"metric": self.metric, "to": hi, "page_size": self.page_size}
+        if cursor is None:
+            params["from"] = lo
+        else:
+            params["after_ts"] = cursor
+        response = session.get(
+            self.url, params=params, headers={"Accept": ACCEPT_HEADERS[self.fmt]}, timeout=10
+        )
+        response.raise_for_status()
+        next_cursor = response.headers.get("X-Next-Cursor")
+        if self.fmt == "arrow":
+            data = decode_arrow(response.content)
+            return data["ts"], data["value"], next_cursor
+        data = response.json()
+        return (
+            np.asarray(data["ts"], dtype="int64"),
+            np.asarray(data["value"], dtype="float64"),
+            next_cursor,
+        )
+
+    def _fetch_slice(self, lo, hi):
+        """顺序拉取一个时间片内的所有页（在线程池中执行，不修改共享状态），返回 (ts 列表, value 列表)"""
+        ts_parts, value_parts = [], []
+        cursor = None
+        with requests.Session() as session:
+            while True:
+                ts, value, cursor = self._fetch_page(session, lo, hi, cursor)
+                ts_parts.append(ts)
+                value_parts.append(value)
+                if cursor is None:
+                    break
+        return ts_parts, value_parts
+
+    def run(self):
+        """并行拉取所有时间片；页数统计和 progress 信号都在本线程中完成"""
+        try:
+            ranges = split_time_range(self.start_ts, self.end_ts, self.slices)
+            print(f"[History Loader] {self.metric}: {len(ranges)} 个时间片, page_size={self.page_size}")
+            results = [None] * len(ranges)
+            pages = 0
+            with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+                futures = {pool.submit(self._fetch_slice, lo, hi): i for i, (lo, hi) in enumerate(ranges)}
+                for done, future in enumerate(as_completed(futures), 1):
+                    results[futures[future]] = future.result()
+                    pages += len(results[futures[future]][0])
+                    self.progress.emit(pages, done)
+            ts_parts = [part for ts_list, _ in results for part in ts_list]
+            value_parts = [part for _, value_list in results for part in value_list]
+            data = {
+                "metric": self.metric,
+                "ts": np.concatenate(ts_parts) if ts_parts else np.empty(0, dtype="int64"),
+                "value": np.concatenate(value_parts) if value_parts else np.empty(0, dtype="float64"),
+            }
+            print(f"[History Loader] 完成: {len(data['ts'])} 个数据点, {pages} 页")
+            self.finished.emit(data)
+        except requests.exceptions.RequestException as e:
+            print(f"[History Loader] 请求失败: {e}")
+            self.error.emit(f"历史数据加载失败: {e}")
+        except Exception as e:
+            print(f"[History Loader] 未知错误: {e}")
+            self.error.emit(f"未知错误: {e}")
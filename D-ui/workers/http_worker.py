@@ -3,27 +3,80 @@ HTTP 请求工作线程模块
 """
 import json
 import requests
+import numpy as np
 from PyQt5.QtCore import QThread, pyqtSignal
+try:
+    import pyarrow as pa
+    import pyarrow.ipc  # noqa: F401
+    ARROW_AVAILABLE = True
+except ImportError:
+    ARROW_AVAILABLE = False
+
+
+# 与 C-collector/encoding.py 中的媒体类型保持一致
+ACCEPT_HEADERS = {
+    "json": "application/json",
+    "columnar": "application/vnd.iot.columnar+json",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def decode_arrow(content: bytes) -> dict:
+    """
+    把 Arrow IPC stream 直接解码为 NumPy 数组（不构造逐点的 Python 对象）
+
+    返回: {"metric": str, "ts": ndarray[int64 epoch 秒], "value": ndarray[float64, 缺失为 NaN]}
+    """
+    reader = pa.ipc.open_stream(content)
+    table = reader.read_all()
+    metadata = table.schema.metadata or {}
+    metric = metadata.get(b"metric", b"").decode("utf-8")
+    ts = table.column("ts").to_numpy()
+    # 含 NULL 的 float64 列无法零拷贝，NULL 会转为 NaN
+    value = table.column("value").to_numpy(zero_copy_only=False)
+    return {"metric": metric, "ts": ts, "value": value}
 
 
 class HttpWorker(QThread):
-    """HTTP请求工作线程"""
+    """
+    HTTP请求工作线程
+
+    fmt:
+        - "json"（默认）：原契约 {"metric", "points": [...]}
+        - "columnar"：{"metric", "ts": [...], "value": [...]}
+        - "arrow"：Arrow IPC，解码为 NumPy 数组后以 dict 发出；
+          本地未安装 pyarrow 时自动退回 columnar 并转换为 NumPy 数组
+    """
     finished = pyqtSignal(dict)
     error = pyqtSignal(str)
-    
-    def __init__(self, url, params, parent=None):
+
+    def __init__(self, url, params, fmt="json", parent=None):
         super().__init__(parent)
         self.url = url
         self.params = params
-    
+        self.fmt = fmt
+
     def run(self):
         """执行HTTP请求"""
         try:
-            print(f"[HTTP Worker] 请求: {self.url}, 参数: {self.params}")
-            response = requests.get(self.url, params=self.params, timeout=5)
+            fmt = self.fmt
+            if fmt == "arrow" and not ARROW_AVAILABLE:
+                fmt = "columnar"
+            headers = {"Accept": ACCEPT_HEADERS.get(fmt, ACCEPT_HEADERS["json"])}
+            print(f"[HTTP Worker] 请求: {self.url}, 参数: {self.params}, 格式: {fmt}")
+            response = requests.get(self.url, params=self.params, headers=headers, timeout=5)
             response.raise_for_status()
-            data = response.json()
-            print(f"[HTTP Worker] 响应成功: 收到 {len(data.get('points', []))} 个数据点")
+            content_type = response.headers.get("content-type", "")
+            if content_type.startswith(ACCEPT_HEADERS["arrow"]):
+                data = decode_arrow(response.content)
+            else:
+                data = response.json()
+                if self.fmt == "arrow" and "ts" in data:
+                    # 回退路径：保持与 arrow 相同的输出类型（None → NaN）
+                    data["ts"] = np.asarray(data["ts"], dtype="int64")
+                    data["value"] = np.asarray(data["value"], dtype="float64")
+            count = len(data["ts"]) if "ts" in data else len(data.get("points", []))
+            print(f"[HTTP Worker] 响应成功: 收到 {count} 个数据点")
             self.finished.emit(data)
         except requests.exceptions.Timeout:
             print(f"[HTTP Worker] 请求超时: {self.url}")
@@ -40,4 +93,3 @@ class HttpWorker(QThread):
         except Exception as e:
             print(f"[HTTP Worker] 未知错误: {e}")
             self.error.emit(f"未知错误: {e}")
-